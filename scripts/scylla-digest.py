@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2024-present ScyllaDB
+#
+
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+
+# Queries the digests written by the `scylla digest` command of scylla-gdb.py,
+# without gdb.
+#
+# A digest is a gzipped JSON document. Its "tables" hold one table per walked
+# structure (tables, sstables, memtables, lsa_regions, task_queues,
+# reader_permits, size_classes, alloc_sites), each stored column by column,
+# so it can also be loaded into pandas directly:
+#
+#   digest = load('core.digest')
+#   sstables = pandas.DataFrame(digest['tables']['sstables'])
+#
+# Examples:
+#
+#   scylla-digest.py info core.digest
+#   scylla-digest.py show core.digest sstables --where keyspace=ks --sort=-data_file_size --limit 10
+#   scylla-digest.py show core.digest memtables --group-by shard
+#   scylla-digest.py compare before.digest after.digest sstables --group-by keyspace,table
+
+import argparse
+import gzip
+import json
+import sys
+
+FORMAT = 'scylla-digest'
+VERSION = 1
+# Numeric columns which identify rather than measure, they are not summed up
+IDENTIFIERS = ('shard', 'id', 'address', 'object_size')
+
+
+def load(path):
+    with gzip.open(path, 'rt') as f:
+        digest = json.load(f)
+    if digest.get('format') != FORMAT:
+        raise ValueError('{} is not a scylla digest'.format(path))
+    if digest['version'] > VERSION:
+        raise ValueError('{} has digest version {}, only up to {} is supported'.format(path, digest['version'], VERSION))
+    return digest
+
+
+def rows(table):
+    """The rows of a columnar table, as dicts"""
+    columns = list(table)
+    return [dict(zip(columns, values)) for values in zip(*(table[column] for column in columns))]
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def parse_value(value):
+    for parse in (int, float):
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+    return {'true': True, 'false': False}.get(value.lower(), value)
+
+
+def parse_where(conditions):
+    """column=value conditions -> (column, value) pairs"""
+    result = []
+    for condition in conditions:
+        column, sep, value = condition.partition('=')
+        if not sep:
+            raise ValueError('invalid condition {!r}, expected column=value'.format(condition))
+        result.append((column, parse_value(value)))
+    return result
+
+
+def select(table_rows, where):
+    return [row for row in table_rows if all(row.get(column) == value for column, value in where)]
+
+
+def group(table_rows, keys):
+    """Groups the rows by the key columns, summing up the numeric columns and counting the rows of each group"""
+    groups = {}
+    for column in keys:
+        if table_rows and column not in table_rows[0]:
+            raise ValueError('no column {!r} to group by, choose from: {}'.format(column, ', '.join(table_rows[0])))
+    for row in table_rows:
+        key = tuple(row[k] for k in keys)
+        grouped = groups.get(key)
+        if grouped is None:
+            grouped = dict(zip(keys, key))
+            grouped['rows'] = 0
+            groups[key] = grouped
+        grouped['rows'] += 1
+        for column, value in row.items():
+            if column not in keys and column not in IDENTIFIERS and is_number(value):
+                grouped[column] = grouped.get(column, 0) + value
+    return list(groups.values())
+
+
+def sort(table_rows, column):
+    reverse = column.startswith('-')
+    column = column.lstrip('-')
+    return sorted(table_rows, key=lambda row: (row.get(column) is None, row.get(column)), reverse=reverse)
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return '{:.2f}'.format(value)
+    if isinstance(value, list):
+        return ';'.join(str(v) for v in value)
+    return str(value)
+
+
+def print_rows(table_rows, columns=None):
+    if not table_rows:
+        print('(no rows)')
+        return
+    if columns is None:
+        columns = list(table_rows[0])
+    lines = [columns] + [[format_value(row.get(column, '')) for column in columns] for row in table_rows]
+    widths = [max(len(line[i]) for line in lines) for i in range(len(columns))]
+    for line in lines:
+        print(' '.join(value.rjust(width) if i < len(columns) - 1 else value
+                       for i, (value, width) in enumerate(zip(line, widths))))
+
+
+def get_table(digest, name):
+    tables = digest['tables']
+    if name not in tables:
+        raise ValueError('no table {!r} in the digest, choose from: {}'.format(name, ', '.join(tables)))
+    return rows(tables[name])
+
+
+def query(digest, args):
+    table_rows = select(get_table(digest, args.table), parse_where(args.where))
+    if args.group_by:
+        table_rows = group(table_rows, args.group_by.split(','))
+    if args.sort:
+        table_rows = sort(table_rows, args.sort)
+    if args.limit:
+        table_rows = table_rows[:args.limit]
+    return table_rows
+
+
+def info(args):
+    digest = load(args.digest)
+    print('core:       {}'.format(digest['core']))
+    print('executable: {}'.format(digest['executable']))
+    print('created:    {}'.format(digest['created']))
+    print('shards:     {}'.format(digest['shards']))
+    print()
+    print_rows([{'table': name, 'rows': len(table['shard']), 'columns': ','.join(table)}
+                for name, table in digest['tables'].items()])
+    if digest['errors']:
+        print()
+        print('skipped walks:')
+        print_rows(digest['errors'], ['shard', 'walk', 'error'])
+
+
+def show(args):
+    digest = load(args.digest)
+    table_rows = query(digest, args)
+    print_rows(table_rows, args.columns.split(',') if args.columns else None)
+
+
+def compare(args):
+    keys = args.group_by.split(',')
+    before = {tuple(row[k] for k in keys): row for row in group(select(get_table(load(args.before), args.table), parse_where(args.where)), keys)}
+    after = {tuple(row[k] for k in keys): row for row in group(select(get_table(load(args.after), args.table), parse_where(args.where)), keys)}
+    columns = args.columns.split(',') if args.columns else None
+    if columns is None:
+        columns = ['rows'] + sorted({c for row in list(before.values()) + list(after.values()) for c in row if c not in keys and c != 'rows'})
+    result = []
+    for key in set(before) | set(after):
+        row = dict(zip(keys, key))
+        for column in columns:
+            old = before.get(key, {}).get(column, 0)
+            new = after.get(key, {}).get(column, 0)
+            row[column] = new
+            row[column + '_delta'] = new - old
+        result.append(row)
+    sort_column = args.sort or '-{}_delta'.format(columns[0])
+    # The largest changes first, whichever their direction
+    if sort_column.startswith('-') and sort_column.endswith('_delta'):
+        result.sort(key=lambda row: abs(row[sort_column[1:]]), reverse=True)
+    else:
+        result = sort(result, sort_column)
+    if args.limit:
+        result = result[:args.limit]
+    print_rows(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the digests written by the `scylla digest` gdb command.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    info_parser = subparsers.add_parser('info', help='Summarize a digest')
+    info_parser.add_argument('digest', help='The digest file')
+    info_parser.set_defaults(func=info)
+
+    def add_query_arguments(p):
+        p.add_argument('table', help='The table to query, e.g. sstables')
+        p.add_argument('--where', action='append', default=[], metavar='COLUMN=VALUE',
+                       help='Only consider the rows where the column has the value, can be repeated')
+        p.add_argument('--columns', help='The comma separated columns to print')
+        p.add_argument('--sort', help='The column to sort by, e.g. --sort=-memory to sort in descending order')
+        p.add_argument('--limit', type=int, help='Print only the first LIMIT rows')
+
+    show_parser = subparsers.add_parser('show', help='Print a table of a digest')
+    show_parser.add_argument('digest', help='The digest file')
+    add_query_arguments(show_parser)
+    show_parser.add_argument('--group-by', help='Sum up the numeric columns of the rows with the same values of these comma separated columns')
+    show_parser.set_defaults(func=show)
+
+    compare_parser = subparsers.add_parser('compare', help='Compare a table of two digests, e.g. of two cores')
+    compare_parser.add_argument('before', help='The first digest file')
+    compare_parser.add_argument('after', help='The second digest file')
+    add_query_arguments(compare_parser)
+    compare_parser.add_argument('--group-by', default='keyspace,table',
+                                help='The comma separated columns to compare the digests by. Defaults to keyspace,table.')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    except (OSError, ValueError, KeyError) as e:
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,14 +18,24 @@
 #
 #   ssh -L *:9042:127.0.0.1:9042 -N <remote-host>
 #
+# To record the changes of tablet state without displaying them, e.g. during
+# a rebalance, and to analyze them later:
+#
+#   ./tablet-mon.py --record rebalance.rec --duration 600
+#   ./tablet-mon.py --replay rebalance.rec --speed 10
+#   ./tablet-mon.py --report rebalance.rec
+#
 
+import argparse
+import gzip
+import json
 import math
+import queue
+import sys
 import threading
 import time
 import logging
-import pygame
-
-from cassandra.cluster import Cluster
+from collections import Counter, defaultdict
 
 # Layout settings
 tablet_size = 60
@@ -58,6 +68,8 @@ trace_lines_pool = list()
 
 cql_update_timeout_ms = 800
 cql_update_period = 0.2
+cql_page_size = 5000
+cql_scan_timeout = 30
 
 
 class Node(object):
@@ -362,51 +374,180 @@ tablet_colors = {
 # Avoid redrawing if nothing changed
 changed = False
 
-cluster = Cluster(['127.0.0.1'])
-session = cluster.connect()
-topo_query = session.prepare("SELECT host_id, shard_count FROM system.topology")
-tablets_query = session.prepare("SELECT * FROM system.tablets")
-
 data_source_alive = False
 
-def update_from_cql(initial=False):
+
+class PollStats(object):
+    """
+    The cost of a poll of the data source, and how much it changed
     """
-    Updates objects using CQL queries of system state
 
-    :param initial: When True, disables animations which indicate changes.
-                    We don't want initial state to appear as if everything suddenly changed.
+    def __init__(self, duration_ms=0, pages=0, rows=0, changed=0):
+        self.duration_ms = duration_ms
+        self.pages = pages
+        self.rows = rows
+        self.changed = changed
+
+    def __str__(self):
+        return 'poll: {:.0f} ms, {} pages, {} rows, {} changed'.format(self.duration_ms, self.pages, self.rows, self.changed)
+
+
+class Changes(object):
+    """
+    Changes of the cluster state between two polls of the data source, handed to the renderer
+
+    :param topology: host_id -> shard count of all nodes, or None if the topology didn't change
+    :param tablets: (table_id, last_token) -> (replicas, new_replicas, stage) of changed tablets,
+                    None for removed tablets
+    """
+
+    def __init__(self, topology, tablets, stats):
+        self.topology = topology
+        self.tablets = tablets
+        self.stats = stats
+
+
+class TabletScan(object):
+    """
+    Pages through system.tablets asynchronously, diffing each page against
+    the tablets of the previous poll while the next page is fetched
+    """
+
+    def __init__(self, future, tablets):
+        self.future = future
+        self.tablets = tablets
+        self.changes = {}
+        self.seen = set()
+        self.pages = 0
+        self.rows = 0
+        self.error = None
+        self.done = threading.Event()
+        future.add_callbacks(callback=self.on_page, errback=self.on_error)
+
+    def on_page(self, rows):
+        try:
+            more = self.future.has_more_pages
+            if more:
+                self.future.start_fetching_next_page()
+            self.pages += 1
+            for tablet in rows:
+                id = (tablet.table_id, tablet.last_token)
+                row = (tuple((r[0], r[1]) for r in tablet.replicas),
+                       tuple((r[0], r[1]) for r in tablet.new_replicas) if tablet.new_replicas else None,
+                       tablet.stage)
+                self.seen.add(id)
+                if self.tablets.get(id) != row:
+                    self.changes[id] = row
+            self.rows += len(rows)
+        except Exception as e:
+            self.on_error(e)
+            return
+        if not more:
+            self.done.set()
+
+    def on_error(self, e):
+        self.error = e
+        self.done.set()
+
+    def wait(self, timeout):
+        if not self.done.wait(timeout):
+            raise TimeoutError('timed out reading system.tablets after {} pages'.format(self.pages))
+        if self.error:
+            raise self.error
+
+
+class CqlSource(object):
+    """
+    Polls the state of tablets and topology using CQL queries of system tables
+
+    The tablets of the previous poll are kept keyed by (table_id, last_token),
+    so only tablets which changed since then are passed on.
     """
 
+    def __init__(self, session):
+        self.session = session
+        self.topo_query = session.prepare("SELECT host_id, shard_count FROM system.topology")
+        self.tablets_query = session.prepare("SELECT table_id, last_token, replicas, new_replicas, stage FROM system.tablets")
+        self.tablets_query.fetch_size = cql_page_size
+        self.topology = None
+        self.tablets = {}
+
+    def poll(self):
+        start = time.time()
+        topology = {host.host_id: host.shard_count for host in self.session.execute(self.topo_query)}
+        scan = TabletScan(self.session.execute_async(self.tablets_query), self.tablets)
+        scan.wait(cql_scan_timeout)
+
+        tablet_changes = scan.changes
+        for id in self.tablets.keys() - scan.seen:
+            tablet_changes[id] = None
+        for id, row in tablet_changes.items():
+            if row is None:
+                del self.tablets[id]
+            else:
+                self.tablets[id] = row
+
+        topology_changes = None
+        if topology != self.topology:
+            self.topology = topology
+            topology_changes = topology
+
+        stats = PollStats((time.time() - start) * 1000, scan.pages, scan.rows, len(tablet_changes))
+        return Changes(topology_changes, tablet_changes, stats)
+
+
+# Changes polled from the data source, waiting to be applied by the render thread
+pending_changes = queue.Queue()
+
+# (table_id, last_token) -> (replicas, new_replicas, stage) of displayed tablets
+tablet_rows = {}
+
+poll_stats = PollStats()
+
+
+def apply_topology(topology):
     global changed
-    global data_source_alive
 
-    all_host_ids = set()
-    for host in session.execute(topo_query):
-        id = host.host_id
-        all_host_ids.add(id)
+    for id, shard_count in topology.items():
         if id not in nodes_by_id:
             n = Node(id)
             nodes.append(n)
             nodes_by_id[id] = n
             changed = True
         n = nodes_by_id[id]
-        if len(n.shards) > host.shard_count:
-            n.shards = n.shards[:host.shard_count]
-        while len(n.shards) < host.shard_count:
+        if len(n.shards) > shard_count:
+            n.shards = n.shards[:shard_count]
+            changed = True
+        while len(n.shards) < shard_count:
             n.shards.append(Shard())
 
-
-    for id in nodes_by_id:
-        if id not in all_host_ids:
+    for id in list(nodes_by_id):
+        if id not in topology:
             nodes.remove(nodes_by_id[id])
             del nodes_by_id[id]
             changed = True
 
-    tablets_by_shard = set()
-    for tablet in session.execute(tablets_query):
-        id = (tablet.table_id, tablet.last_token)
-        replicas = set(tablet.replicas)
-        new_replicas = set(tablet.new_replicas) if tablet.new_replicas else replicas
+
+def has_shard(host, shard):
+    return host in nodes_by_id and shard < len(nodes_by_id[host].shards)
+
+
+def update_tablet(id, old, new, initial):
+    """
+    Updates the displayed replicas of a tablet whose state changed from old to new
+
+    :param old: (replicas, new_replicas, stage) the tablet was displayed with, None if it wasn't
+    :param new: (replicas, new_replicas, stage) of the tablet, None if it was removed
+    :param initial: When True, disables animations which indicate changes.
+    """
+
+    global changed
+
+    placed = set()
+    if new is not None:
+        replica_list, new_replica_list, stage = new
+        replicas = set(replica_list)
+        new_replicas = set(new_replica_list) if new_replica_list else replicas
 
         leaving = replicas - new_replicas
         joining = new_replicas - replicas
@@ -417,15 +558,15 @@ def update_from_cql(initial=False):
             host = replica[0]
             shard = replica[1]
 
-            if host not in nodes_by_id:
+            if not has_shard(host, shard):
                 continue
 
-            tablets_by_shard.add((host, shard, id))
+            placed.add(replica)
 
             if replica in joining:
-                state = (Tablet.STATE_JOINING, tablet.stage)
+                state = (Tablet.STATE_JOINING, stage)
             elif replica in leaving:
-                state = (Tablet.STATE_LEAVING, tablet.stage)
+                state = (Tablet.STATE_LEAVING, stage)
             else:
                 state = (Tablet.STATE_NORMAL, None)
 
@@ -441,7 +582,7 @@ def update_from_cql(initial=False):
                 stage_change = True
                 changed = True
                 if not initial and t.streaming:
-                    if tablet.stage != "streaming" and tablet.stage != "write_both_read_old":
+                    if stage != "streaming" and stage != "write_both_read_old":
                         dst = t.streaming
                         t.streaming = None
                         fire_tracer(id, replica, dst, light_purple, light_yellow, tablet_h * 0.7,
@@ -450,31 +591,316 @@ def update_from_cql(initial=False):
         if not initial and stage_change and len(leaving) == 1 and len(joining) == 1:
             src = leaving.pop()
             dst = joining.pop()
-            src_tablet = nodes_by_id[src[0]].shards[src[1]].tablets[id]
-            if inserted:
+            if inserted and src in placed:
+                src_tablet = nodes_by_id[src[0]].shards[src[1]].tablets[id]
                 src_tablet.streaming = dst
                 fire_tracer(id, src, dst, light_red, light_green, tablet_h,
                             streaming_trace_decay_ms, streaming_trace_duration_ms)
 
-    for n in nodes:
-        for s_idx, s in enumerate(n.shards):
-            for t in list(s.tablets.keys()):
-                if (n.id, s_idx, t) not in tablets_by_shard:
-                    del s.tablets[t]
+    if old is not None:
+        replica_list, new_replica_list, stage = old
+        for replica in set(replica_list).union(new_replica_list or ()) - placed:
+            if has_shard(replica[0], replica[1]):
+                if nodes_by_id[replica[0]].shards[replica[1]].tablets.pop(id, None):
                     changed = True
 
 
-def cql_updater():
+def apply_changes(changes, initial=False):
+    """
+    Updates displayed objects with changes polled from the data source
+
+    :param initial: When True, disables animations which indicate changes.
+                    We don't want initial state to appear as if everything suddenly changed.
+    """
+
+    global poll_stats
+
+    if changes.topology is not None:
+        apply_topology(changes.topology)
+        # Replicas on nodes or shards which were not known yet were skipped
+        for id, row in tablet_rows.items():
+            if id not in changes.tablets:
+                update_tablet(id, row, row, initial=True)
+
+    for id, row in changes.tablets.items():
+        update_tablet(id, tablet_rows.get(id), row, initial)
+        if row is None:
+            tablet_rows.pop(id, None)
+        else:
+            tablet_rows[id] = row
+
+    poll_stats = changes.stats
+
+
+def apply_pending_changes():
+    while True:
+        try:
+            changes = pending_changes.get_nowait()
+        except queue.Empty:
+            return
+        apply_changes(changes)
+
+
+def cql_updater(source):
     global data_source_alive
     while True:
         try:
-            update_from_cql()
+            pending_changes.put(source.poll())
             data_source_alive = True
         except Exception as e:
             print(e)
         time.sleep(cql_update_period)
 
 
+# Recordings are gzipped JSON lines: a header, followed by a line for
+# each poll which changed anything (the first one holds the whole state)
+recording_format = 'tablet-mon recording'
+recording_version = 1
+
+
+def encode_changes(t, changes):
+    def replica_list(replicas):
+        return [[str(host), shard] for host, shard in replicas] if replicas else None
+
+    record = {'t': round(t, 3),
+              'poll': [round(changes.stats.duration_ms, 1), changes.stats.pages, changes.stats.rows]}
+    if changes.topology is not None:
+        record['topology'] = {str(id): shard_count for id, shard_count in changes.topology.items()}
+    tablets = []
+    for (table_id, last_token), row in changes.tablets.items():
+        if row is None:
+            tablets.append([str(table_id), last_token])
+        else:
+            tablets.append([str(table_id), last_token, replica_list(row[0]), replica_list(row[1]), row[2]])
+    record['tablets'] = tablets
+    return record
+
+
+def decode_changes(record):
+    def replica_tuple(replicas):
+        return tuple((host, shard) for host, shard in replicas) if replicas else None
+
+    tablets = {}
+    for tablet in record['tablets']:
+        id = (tablet[0], tablet[1])
+        if len(tablet) == 2:
+            tablets[id] = None
+        else:
+            tablets[id] = (replica_tuple(tablet[2]), replica_tuple(tablet[3]), tablet[4])
+    duration_ms, pages, rows = record['poll']
+    return record['t'], Changes(record.get('topology'), tablets, PollStats(duration_ms, pages, rows, len(tablets)))
+
+
+def read_recording(path):
+    """
+    Yields (time since the start of the recording, changes) of a recording
+    """
+    with gzip.open(path, 'rt') as f:
+        header = json.loads(f.readline() or '{}')
+        if header.get('format') != recording_format:
+            raise ValueError('{} is not a tablet-mon recording'.format(path))
+        if header['version'] > recording_version:
+            raise ValueError('{} has recording version {}, only up to {} is supported'.format(
+                path, header['version'], recording_version))
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print('{} is truncated'.format(path))
+                return
+            yield decode_changes(record)
+
+
+def record(source, path, duration=None):
+    """
+    Polls the source and writes the changes to a recording, without displaying them
+
+    :param duration: Stop after this many seconds, None to record until interrupted
+    """
+
+    start = time.time()
+    records = 0
+    with gzip.open(path, 'wt') as out:
+        out.write(json.dumps({'format': recording_format, 'version': recording_version, 'start': start}) + '\n')
+        while duration is None or time.time() - start < duration:
+            poll_start = time.time()
+            try:
+                changes = source.poll()
+            except Exception as e:
+                print(e)
+                time.sleep(cql_update_period)
+                continue
+            if changes.topology is not None or changes.tablets:
+                out.write(json.dumps(encode_changes(poll_start - start, changes)) + '\n')
+                # A recording cut short is readable up to here
+                out.flush()
+                records += 1
+                print('{:.1f}s {}'.format(poll_start - start, changes.stats))
+            time.sleep(cql_update_period)
+    print('Recorded {} changes in {:.1f}s to {}'.format(records, time.time() - start, path))
+
+
+class ReplaySource(object):
+    """
+    Plays a recording back, handing its changes to the renderer at the
+    times they were recorded, scaled by speed
+    """
+
+    def __init__(self, path, speed):
+        self.speed = speed
+        self.records = read_recording(path)
+
+    def initial(self):
+        """
+        The changes of the first poll, which hold the whole initial state,
+        or None if the recording has no changes (e.g. --record was interrupted
+        before the first poll completed)
+        """
+        try:
+            self.start, changes = next(self.records)
+        except StopIteration:
+            return None
+        return changes
+
+    def run(self):
+        global data_source_alive
+        replay_start = time.time()
+        for t, changes in self.records:
+            due = replay_start + (t - self.start) / self.speed
+            while True:
+                # Gaps between recorded changes are not outages
+                data_source_alive = True
+                time_left = due - time.time()
+                if time_left <= 0:
+                    break
+                time.sleep(min(time_left, cql_update_period))
+            pending_changes.put(changes)
+        print('Replay finished')
+        while True:
+            data_source_alive = True
+            time.sleep(cql_update_period)
+
+
+def print_table(rows):
+    widths = [max(len(str(row[i])) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print('  '.join(str(value).rjust(width) for value, width in zip(row, widths)))
+
+
+def report(path, interval):
+    """
+    Prints a summary of a recording: migrations per second, time spent in
+    each stage, and the number of tablet replicas of each node over time
+    """
+
+    tablets = {}
+    stage_start = {}  # tablet id -> when it entered its current stage
+    stage_times = defaultdict(list)
+    node_replicas = Counter()
+    hosts = []
+    started = 0
+    finished = 0
+    timeline = [['time', 'migrations', 'per_second']]
+    timeline_replicas = []
+    interval_finished = 0
+    interval_end = interval
+    first = True
+    t = 0
+
+    def end_interval(end):
+        # The last interval ends with the recording, and can be shorter
+        length = end - (interval_end - interval)
+        timeline.append(['{:.1f}s'.format(end), interval_finished, '{:.2f}'.format(interval_finished / length)])
+        timeline_replicas.append(dict(node_replicas))
+
+    # Changes at the end of an interval belong to it, so a recording which
+    # ends on an interval boundary has no empty interval after it
+    for t, changes in read_recording(path):
+        while t > interval_end:
+            end_interval(interval_end)
+            interval_finished = 0
+            interval_end += interval
+        if changes.topology is not None:
+            hosts.extend(host for host in changes.topology if host not in hosts)
+        for id, row in changes.tablets.items():
+            old = tablets.get(id)
+            if old is not None:
+                node_replicas.subtract(host for host, shard in old[0])
+            if row is not None:
+                node_replicas.update(host for host, shard in row[0])
+
+            old_stage = old[2] if old else None
+            new_stage = row[2] if row else None
+            if old_stage != new_stage:
+                # Stages which started before the recording have no start time
+                if old_stage is not None and id in stage_start:
+                    stage_times[old_stage].append(t - stage_start[id])
+                stage_start.pop(id, None)
+                if new_stage is not None and not first:
+                    stage_start[id] = t
+
+            was_migrating = old is not None and old[1] is not None
+            is_migrating = row is not None and row[1] is not None
+            if is_migrating and not was_migrating and not first:
+                started += 1
+            if was_migrating and not is_migrating:
+                finished += 1
+                interval_finished += 1
+
+            if row is None:
+                tablets.pop(id, None)
+            else:
+                tablets[id] = row
+        first = False
+    if t > interval_end - interval:
+        end_interval(t)
+
+    duration = t
+    print('Recording: {}, {:.1f}s, {} tablets at the end'.format(path, duration, len(tablets)))
+    print('Migrations: {} started, {} finished, {:.2f} finished per second'.format(
+        started, finished, finished / duration if duration else 0))
+    print()
+
+    rows = [['stage', 'count', 'mean', 'p50', 'max']]
+    for stage, times in sorted(stage_times.items()):
+        times.sort()
+        rows.append([stage, len(times), '{:.2f}s'.format(sum(times) / len(times)),
+                     '{:.2f}s'.format(times[len(times) // 2]), '{:.2f}s'.format(times[-1])])
+    print('Time per stage:')
+    print_table(rows)
+    print()
+
+    # Host ids are shortened, they usually differ in their first characters
+    timeline[0].extend(str(host)[:8] for host in hosts)
+    for row, replicas in zip(timeline[1:], timeline_replicas):
+        row.extend(replicas.get(host, 0) for host in hosts)
+    print('Finished migrations and tablet replicas per node, every {:g}s:'.format(interval))
+    print_table(timeline)
+
+
+parser = argparse.ArgumentParser(description='Live-monitor the state of tablets and load balancing in a Scylla cluster.')
+mode = parser.add_mutually_exclusive_group()
+mode.add_argument('--record', metavar='FILE',
+                  help='Record the changes of tablet state to FILE, without displaying them')
+mode.add_argument('--replay', metavar='FILE',
+                  help='Display the changes recorded in FILE instead of the live state')
+mode.add_argument('--report', metavar='FILE',
+                  help='Print a summary of the changes recorded in FILE')
+parser.add_argument('--duration', type=float,
+                    help='With --record, stop after this many seconds instead of when interrupted')
+parser.add_argument('--speed', type=float, default=1.0,
+                    help='With --replay, the speed of the replay relative to the recording (default: 1)')
+parser.add_argument('--interval', type=float, default=10,
+                    help='With --report, the length of the time line intervals in seconds (default: 10)')
+args = parser.parse_args()
+
+if args.speed <= 0 or args.interval <= 0:
+    parser.error('--speed and --interval must be positive')
+
+if args.report:
+    report(args.report, args.interval)
+    sys.exit(0)
+
 # Set the logging level to DEBUG for the Cassandra driver
 cassandra_logger = logging.getLogger('cassandra')
 cassandra_logger.setLevel(logging.DEBUG)
@@ -484,11 +910,38 @@ console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.DEBUG)
 cassandra_logger.addHandler(console_handler)
 
-update_from_cql(initial=True)
+# pygame is needed only for display, and cassandra only to connect to a cluster
+if args.replay:
+    replay_source = ReplaySource(args.replay, args.speed)
+    initial_changes = replay_source.initial()
+    if initial_changes is None:
+        sys.exit('{} holds no recorded changes'.format(args.replay))
+
+    import pygame
+
+    apply_changes(initial_changes, initial=True)
+    data_source_thread = threading.Thread(target=replay_source.run)
+else:
+    from cassandra.cluster import Cluster
+
+    cluster = Cluster(['127.0.0.1'])
+    session = cluster.connect()
+    cql_source = CqlSource(session)
+
+    if args.record:
+        try:
+            record(cql_source, args.record, args.duration)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    import pygame
 
-cassandra_thread = threading.Thread(target=cql_updater)
-cassandra_thread.daemon = True
-cassandra_thread.start()
+    apply_changes(cql_source.poll(), initial=True)
+    data_source_thread = threading.Thread(target=cql_updater, args=(cql_source,))
+
+data_source_thread.daemon = True
+data_source_thread.start()
 
 pygame.init()
 clock = pygame.time.Clock()
@@ -601,6 +1054,18 @@ def redraw():
 
         node_x += node_frame_size
 
+
+stats_font = pygame.font.Font(None, 20)
+
+def draw_stats():
+    """
+    Shows the cost of the last poll of the data source above the nodes.
+    Drawn on every frame, so that it doesn't cause a redraw.
+    """
+    text = stats_font.render(str(poll_stats), True, GRAY, WHITE)
+    window.fill(WHITE, (0, 0, window.get_size()[0], frame_size))
+    window.blit(text, (frame_size, (frame_size - text.get_height()) // 2))
+
 redraw()
 
 last_update = pygame.time.get_ticks()
@@ -615,6 +1080,8 @@ while running:
             window_width, window_height = event.w, event.h
             changed = True
 
+    apply_pending_changes()
+
     now = float(pygame.time.get_ticks())
 
     animate(now)
@@ -626,6 +1093,7 @@ while running:
     now = pygame.time.get_ticks()
     move_tracers(now)
     draw_trace_lines(trace_lines, now)
+    draw_stats()
 
     # Check connectivity with data source
     # and display a pane while reconnecting
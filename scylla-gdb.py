@@ -8,7 +8,7 @@ import argparse
 import datetime
 import re
 from operator import attrgetter
-from collections import defaultdict
+from collections import defaultdict, Counter
 import sys
 import struct
 import random
@@ -18,6 +18,15 @@ import subprocess
 import time
 import socket
 import string
+import array
+import hashlib
+import json
+import gzip
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 def align_up(ptr, alignment):
@@ -655,16 +664,19 @@ class static_vector:
     def __len__(self):
         return int(self.ref['m_holder']['m_size'])
 
-    def __iter__(self):
+    def data(self):
         t = self.ref.type.strip_typedefs()
         value_type = t.template_argument(0)
         try:
-            data = self.ref['m_holder']['storage']['data'].cast(value_type.pointer())
+            return self.ref['m_holder']['storage']['data'].cast(value_type.pointer())
         except:
             try:
-                data = self.ref['m_holder']['storage']['dummy']['dummy'].cast(value_type.pointer()) # Scylla 3.1 compatibility
+                return self.ref['m_holder']['storage']['dummy']['dummy'].cast(value_type.pointer()) # Scylla 3.1 compatibility
             except gdb.error:
-                data = self.ref['m_holder']['storage']['dummy'].cast(value_type.pointer()) # Scylla 3.0 compatibility
+                return self.ref['m_holder']['storage']['dummy'].cast(value_type.pointer()) # Scylla 3.0 compatibility
+
+    def __iter__(self):
+        data = self.data()
         for i in range(self.__len__()):
             yield data[i]
 
@@ -1229,7 +1241,23 @@ def lookup_type(type_names):
     raise gdb.error('none of the types found')
 
 
+_text_ranges = None  # cached result of get_text_ranges()
+
+
 def get_text_ranges():
+    """
+    The (start, end) address ranges of the sections which contain vtables.
+
+    The sections don't change while debugging the same executable, so they are
+    looked up once and cached, until new object files are loaded.
+    """
+    global _text_ranges
+    if _text_ranges is None:
+        _text_ranges = _find_text_ranges()
+    return _text_ranges
+
+
+def _find_text_ranges():
     try:
         vptr_type = gdb.lookup_type('uintptr_t').pointer()
         reactor_backend = gdb.parse_and_eval('seastar::local_engine->_backend')
@@ -1265,12 +1293,14 @@ def get_text_ranges():
 
     if len(ret) == 0:
         raise Exception("Failed to find plausible text sections")
-    return ret
+    return sorted(ret)
 
 
 def addr_in_ranges(ranges, addr):
-    for r in ranges:
-        if addr >= r[0] and addr <= r[1]:
+    # Compare plain ints, comparing a gdb.Value costs a round trip each
+    addr = int(addr)
+    for start, end in ranges:
+        if start <= addr <= end:
             return True
     return False
 
@@ -1692,35 +1722,363 @@ class scylla_task_histogram(gdb.Command):
         h.print_to_console()
 
 
-def find_vptrs():
-    cpu_mem = gdb.parse_and_eval('\'seastar::memory::cpu_mem\'')
-    page_size = int(gdb.parse_and_eval('\'seastar::memory::page_size\''))
-    mem_start = cpu_mem['memory']
-    vptr_type = gdb.lookup_type('uintptr_t').pointer()
-    pages = cpu_mem['pages']
-    nr_pages = int(cpu_mem['nr_pages'])
+class page_table(object):
+    """
+    Bulk reader of the `seastar::memory::cpu_mem.pages` array of the current shard.
 
-    text_ranges = get_text_ranges()
-    def is_vptr(addr):
-        return addr_in_ranges(text_ranges, addr)
+    The fields of `seastar::memory::page` are decoded from raw memory, read
+    in large chunks, instead of being read through a gdb value each.
+    """
+    chunk_pages = 64 * 1024
 
-    idx = 0
-    while idx < nr_pages:
-        if pages[idx]['free']:
-            idx += pages[idx]['span_size']
-            continue
-        pool = pages[idx]['pool']
-        if not pool or pages[idx]['offset_in_span'] != 0:
-            idx += 1
-            continue
-        objsize = int(pool.dereference()['_object_size'])
-        span_size = pages[idx]['span_size'] * page_size
-        for idx2 in range(0, int(span_size / objsize) + 1):
-            obj_addr = mem_start + idx * page_size + idx2 * objsize
-            vptr = obj_addr.reinterpret_cast(vptr_type).dereference()
-            if is_vptr(vptr):
-                yield obj_addr, vptr
-        idx += pages[idx]['span_size']
+    def __init__(self, layout=None, memory=None):
+        """
+        :param layout: the layout() of the page table, defaults to that of the current shard
+        :param memory: object whose read_memory() reads the pages, defaults to the selected inferior
+        """
+        if layout is None:
+            layout = page_table.layout()
+        self.page_size, self.mem_start, self.nr_pages, self._pages, self._sizeof_page, self._fields = layout
+        self._inf = gdb.selected_inferior() if memory is None else memory
+        self._chunk_start = 0
+        self._chunk = b''
+
+    @staticmethod
+    def layout():
+        """The address and the field layout of the page table of the current shard, as plain values"""
+        cpu_mem = gdb.parse_and_eval('\'seastar::memory::cpu_mem\'')
+        page_type = gdb.lookup_type('seastar::memory::page')
+        fields = {}
+        for field in page_type.fields():
+            if field.name in ('free', 'offset_in_span', 'span_size', 'pool', 'freelist'):
+                if field.bitsize:
+                    raise ValueError("seastar::memory::page::{} is a bit field".format(field.name))
+                fields[field.name] = (int(field.bitpos / 8), field.type.sizeof)
+        return (int(gdb.parse_and_eval('\'seastar::memory::page_size\'')), int(cpu_mem['memory']), int(cpu_mem['nr_pages']),
+                int(cpu_mem['pages']), page_type.sizeof, fields)
+
+    def field(self, idx, name):
+        offset, size = self._fields[name]
+        pos = (idx - self._chunk_start) * self._sizeof_page
+        if idx < self._chunk_start or pos >= len(self._chunk):
+            count = min(self.chunk_pages, self.nr_pages - idx)
+            self._chunk = bytes(self._inf.read_memory(self._pages + idx * self._sizeof_page, count * self._sizeof_page))
+            self._chunk_start = idx
+            pos = 0
+        return int.from_bytes(self._chunk[pos + offset:pos + offset + size], 'little')
+
+    def spans(self):
+        """Yields (index of the first page, span size in pages) of the spans, like spans()"""
+        idx = 1
+        while idx < self.nr_pages:
+            span_size = self.field(idx, 'span_size')
+            if span_size == 0:
+                idx += 1
+                continue
+            yield idx, span_size
+            idx += span_size
+
+    def used_span_size(self, first):
+        """Like span.used_span_size(), for the span whose first page is first"""
+        if self.field(first, 'free'):
+            return 0
+        pool = self.field(first, 'pool')
+        span_size = self.field(first, 'span_size')
+        if not pool:
+            return span_size
+        used = 0
+        while (used < span_size and first + used < self.nr_pages and self.field(first + used, 'pool') == pool
+               and self.field(first + used, 'offset_in_span') == used):
+            used += 1
+        return used
+
+    def small_spans(self):
+        """
+        Yields (start address, used size in bytes, small_pool address) of the small-pool spans.
+
+        Like span.used_span_size(), the pages at the end of the span which
+        aren't used by the pool are excluded.
+        """
+        idx = 0
+        while idx < self.nr_pages:
+            span_size = max(self.field(idx, 'span_size'), 1)
+            if self.field(idx, 'free'):
+                idx += span_size
+                continue
+            pool = self.field(idx, 'pool')
+            if not pool or self.field(idx, 'offset_in_span') != 0:
+                idx += 1
+                continue
+            used = 1
+            while (used < span_size and idx + used < self.nr_pages and self.field(idx + used, 'pool') == pool
+                   and self.field(idx + used, 'offset_in_span') == used):
+                used += 1
+            yield self.mem_start + idx * self.page_size, used * self.page_size, pool
+            idx += span_size
+
+
+def core_file_path():
+    """The path of the core file being debugged, None if debugging a live process"""
+    m = re.search(r"Local core dump file:\s*`([^']+)'", gdb.execute('info files', False, True))
+    if m is None:
+        return None
+    return m.group(1)
+
+
+class heap_index(object):
+    """
+    Index of the virtual objects in the small pools of a shard.
+
+    Holds the address and the vtable pointer of every small-pool object whose
+    first word points into the text sections, like find_vptrs() used to find
+    by walking the heap. The heap is scanned once per shard, with one large
+    read per run of adjacent spans, and the index is kept in memory. When
+    debugging a core file, the index is also saved next to the other indexes
+    of the core in the cache directory ($SCYLLA_GDB_CACHE_DIR, defaults to
+    ~/.cache/scylla-gdb), so it survives gdb restarts.
+
+    The vtable symbol of each distinct vtable pointer is resolved at most once
+    and cached with the index, so type queries don't run `info symbol` per object.
+    """
+    _magic = b'scylla-gdb heap index 1\n'
+    _max_read = 4 << 20
+    _indexes = {}  # shard -> heap_index, of the current inferior
+    _names = None  # vtable pointer (int) -> symbol name (str) or None
+    _names_dirty = False
+
+    def __init__(self, addrs, vptrs):
+        self.addrs = addrs
+        self.vptrs = vptrs
+
+    def __len__(self):
+        return len(self.addrs)
+
+    def __iter__(self):
+        return zip(self.addrs, self.vptrs)
+
+    @staticmethod
+    def _cache_prefix():
+        core = core_file_path()
+        if core is None:
+            return None
+        st = os.stat(core)
+        key = hashlib.sha1('{}:{}:{}'.format(os.path.realpath(core), st.st_size, st.st_mtime_ns).encode()).hexdigest()
+        cache_dir = os.environ.get('SCYLLA_GDB_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'scylla-gdb'))
+        return os.path.join(cache_dir, key)
+
+    @classmethod
+    def get(cls, rebuild=False):
+        """The index of the current shard, built on first use"""
+        shard = current_shard()
+        if not rebuild and shard in cls._indexes:
+            return cls._indexes[shard]
+        prefix = cls._cache_prefix()
+        path = None if prefix is None else '{}.shard{}.vptrs'.format(prefix, shard)
+        index = None
+        if path and not rebuild:
+            index = cls._load(path)
+        if index is None:
+            start = time.time()
+            index = cls._scan()
+            gdb.write('Indexed {} virtual objects of shard {} in {:.1f}s\n'.format(len(index), shard, time.time() - start))
+            if path:
+                index._save(path)
+        cls._indexes[shard] = index
+        return index
+
+    @classmethod
+    def invalidate(cls, event=None):
+        cls._indexes = {}
+
+    @classmethod
+    def _scan(cls):
+        small_pool_ptr = gdb.lookup_type('seastar::memory::small_pool').pointer()
+        return cls.scan(page_table(), gdb.selected_inferior(), get_text_ranges(),
+                        lambda pool: int(gdb.Value(pool).cast(small_pool_ptr).dereference()['_object_size']))
+
+    @classmethod
+    def scan(cls, pages, memory, text_ranges, object_size):
+        """
+        Scans the small-pool spans of pages for virtual objects.
+
+        Works on raw memory only, read with memory.read_memory(), so it can
+        also run outside of gdb. object_size maps a small_pool address to the
+        size of its objects.
+        """
+        object_sizes = {}  # small_pool address -> object size
+        addrs = array.array('Q')
+        vptrs = array.array('Q')
+        starts, ends = cls._merge_ranges(text_ranges)
+        if numpy is not None:
+            starts = numpy.array(starts, dtype=numpy.uint64)
+            ends = numpy.array(ends, dtype=numpy.uint64)
+
+        def scan_run(run):
+            first = run[0][0]
+            data = bytes(memory.read_memory(first, run[-1][0] + run[-1][1] - first))
+            for start, size, objsize in run:
+                offset = start - first
+                words = heap_index._first_words(data[offset:offset + size], objsize)
+                hits = heap_index._in_ranges(words, starts, ends)
+                addrs.extend(start + i * objsize for i in hits)
+                vptrs.extend(words[i] for i in hits)
+
+        run = []
+        run_size = 0
+        for start, size, pool in pages.small_spans():
+            objsize = object_sizes.get(pool)
+            if objsize is None:
+                objsize = object_size(pool)
+                object_sizes[pool] = objsize
+            if run and (run[-1][0] + run[-1][1] != start or run_size + size > cls._max_read):
+                scan_run(run)
+                run = []
+                run_size = 0
+            run.append((start, size, objsize))
+            run_size += size
+        if run:
+            scan_run(run)
+        return heap_index(addrs, vptrs)
+
+    @staticmethod
+    def _merge_ranges(ranges):
+        """The (starts, ends) of the inclusive address ranges, sorted and merged so they don't overlap"""
+        starts = []
+        ends = []
+        for lo, hi in sorted(ranges):
+            if ends and lo <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], hi)
+            else:
+                starts.append(lo)
+                ends.append(hi)
+        return starts, ends
+
+    @staticmethod
+    def _in_ranges(words, starts, ends):
+        """The indexes of the words which fall into one of the merged ranges"""
+        if not len(starts):
+            return []
+        if numpy is not None:
+            values = numpy.array(words, dtype=numpy.uint64)
+            idx = numpy.searchsorted(starts, values, side='right') - 1
+            return numpy.flatnonzero((idx >= 0) & (values <= ends[idx])).tolist()
+        hits = []
+        for i, word in enumerate(words):
+            idx = bisect.bisect_right(starts, word) - 1
+            if idx >= 0 and word <= ends[idx]:
+                hits.append(i)
+        return hits
+
+    @staticmethod
+    def _first_words(data, objsize):
+        """The first 8-byte word of each object of objsize bytes in data"""
+        count = len(data) // objsize
+        if objsize % 8 == 0:
+            return memoryview(data[:count * objsize]).cast('Q')[::objsize // 8].tolist()
+        return [int.from_bytes(data[i * objsize:i * objsize + 8], 'little') for i in range(count) if i * objsize + 8 <= len(data)]
+
+    @classmethod
+    def _load(cls, path):
+        try:
+            with open(path, 'rb') as f:
+                if f.read(len(cls._magic)) != cls._magic:
+                    return None
+                count, = struct.unpack('<Q', f.read(8))
+                addrs = array.array('Q')
+                addrs.fromfile(f, count)
+                vptrs = array.array('Q')
+                vptrs.fromfile(f, count)
+        except (OSError, EOFError, struct.error):
+            return None
+        return heap_index(addrs, vptrs)
+
+    def _save(self, path):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(self._magic)
+                f.write(struct.pack('<Q', len(self.addrs)))
+                self.addrs.tofile(f)
+                self.vptrs.tofile(f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            gdb.write('Failed to save the heap index to {}: {}\n'.format(path, e))
+
+    @classmethod
+    def _names_path(cls):
+        prefix = cls._cache_prefix()
+        return None if prefix is None else prefix + '.vtables.json'
+
+    @classmethod
+    def vtable_name(cls, vptr):
+        """The symbol of the vtable pointer, e.g. `vtable for foo + 16 `, None if it has none"""
+        cls._load_names()
+        if vptr not in cls._names:
+            cls._names[vptr] = resolve(vptr, startswith='vtable for ')
+            cls._names_dirty = True
+        return cls._names[vptr]
+
+    @classmethod
+    def vtable_names(cls, vptrs):
+        """The symbols of all vtable pointers in vptrs, resolving the missing ones in one batch"""
+        cls._load_names()
+        missing = [vptr for vptr in vptrs if vptr not in cls._names]
+        if missing:
+            cls._names.update(resolve_many(missing, startswith='vtable for '))
+            cls._names_dirty = True
+        return {vptr: cls._names[vptr] for vptr in vptrs}
+
+    @classmethod
+    def _load_names(cls):
+        if cls._names is None:
+            cls._names = {}
+            path = cls._names_path()
+            if path:
+                try:
+                    with open(path, 'r') as f:
+                        cls._names = {int(k): v for k, v in json.load(f).items()}
+                except (OSError, ValueError):
+                    pass
+
+    @classmethod
+    def save_names(cls):
+        path = cls._names_path()
+        if not cls._names_dirty or not path:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'w') as f:
+                json.dump({str(k): v for k, v in cls._names.items()}, f)
+            os.replace(path + '.tmp', path)
+            cls._names_dirty = False
+        except OSError as e:
+            gdb.write('Failed to save vtable names to {}: {}\n'.format(path, e))
+
+    def vtable_counts(self):
+        """Number of objects by vtable pointer"""
+        return Counter(self.vptrs)
+
+    def find(self, name_predicate, vptr=None):
+        """Yields (address, vtable pointer, vtable symbol) of the objects whose vtable symbol satisfies name_predicate"""
+        wanted = {}
+        for v, name in self.vtable_names(set(self.vptrs) if vptr is None else {int(vptr)}).items():
+            if name is not None and name_predicate(name):
+                wanted[v] = name
+        self.save_names()
+        for addr, v in zip(self.addrs, self.vptrs):
+            if v in wanted:
+                yield addr, v, wanted[v]
+
+
+gdb.events.cont.connect(heap_index.invalidate)
+
+
+def find_vptrs():
+    """Yields (object address, vtable pointer) of the virtual objects in the small pools of the current shard"""
+    char_ptr = gdb.lookup_type('char').pointer()
+    uintptr = gdb.lookup_type('uintptr_t')
+    for obj_addr, vptr in heap_index.get():
+        yield gdb.Value(obj_addr).cast(char_ptr), gdb.Value(vptr).cast(uintptr)
 
 
 def find_vptrs_of_type(vptr=None, typename=None):
@@ -1728,12 +2086,10 @@ def find_vptrs_of_type(vptr=None, typename=None):
     Return virtual objects whose vtable pointer equals vptr and/or matches typename.
     typename has to be a prefix of the fully qualified name of the type
     """
-    for obj_addr, vtable_addr in find_vptrs():
-        if vptr is not None and vtable_addr != vptr:
-            continue
-        symbol_name = resolve(vtable_addr, startswith=typename)
-        if symbol_name is not None:
-            yield obj_addr, vtable_addr, symbol_name
+    char_ptr = gdb.lookup_type('char').pointer()
+    uintptr = gdb.lookup_type('uintptr_t')
+    for obj_addr, vtable_addr, symbol_name in heap_index.get().find(lambda name: not typename or name.startswith(typename), vptr):
+        yield gdb.Value(obj_addr).cast(char_ptr), gdb.Value(vtable_addr).cast(uintptr), symbol_name
 
 
 def find_single_sstable_readers():
@@ -1758,20 +2114,16 @@ def find_single_sstable_readers():
                      _lookup_type(['sstables::kl::sstable_mutation_reader'])]
 
 
-    def _lookup_obj(obj_addr, vtable_addr):
-        vtable_pfx = 'vtable for '
-        name = resolve(vtable_addr, startswith=vtable_pfx)
-        if not name:
-            return None
+    vtable_pfx = 'vtable for '
+
+    def _ptr_type(name):
         name = name[len(vtable_pfx):]
         for type_name, ptr_type in types:
             if name.startswith(type_name):
-                return obj_addr.reinterpret_cast(ptr_type)
+                return ptr_type
 
-    for obj_addr, vtable_addr in find_vptrs():
-        obj = _lookup_obj(obj_addr, vtable_addr)
-        if obj:
-            yield obj
+    for obj_addr, vtable_addr, name in heap_index.get().find(lambda name: _ptr_type(name) is not None):
+        yield gdb.Value(obj_addr).cast(_ptr_type(name))
 
 def find_active_sstables():
     """ Yields sstable* once for each active sstable reader. """
@@ -1804,6 +2156,63 @@ class schema_ptr:
         return self.ks_name in ["system", "system_schema", "system_distributed", "system_traces", "system_auth", "audit"]
 
 
+class scylla_heap_index(gdb.Command):
+    """Build, cache and query the index of virtual objects of the shard's small pools.
+
+    Commands which look for objects by their dynamic type, e.g.
+    `scylla active-sstables`, use this index instead of walking the heap
+    each time. The index is built on first use and, when debugging a
+    core file, saved to the cache directory ($SCYLLA_GDB_CACHE_DIR,
+    ~/.cache/scylla-gdb by default), so later gdb sessions on the same
+    core load it instantly. See heap_index for more details.
+
+    Without options, (re)builds the index of the current shard if needed
+    and prints its size.
+
+    Example:
+    (gdb) scylla heap-index --types 3
+    Index of shard 0: 1530241 virtual objects, 2113 distinct vtables
+         count vtable
+        311273 0x6bd1a48 vtable for seastar::continuation<...> + 16
+        ...
+    (gdb) scylla heap-index --type sstables::mx::mx_sstable_mutation_reader
+    0x60000c1d2000 0x6ab7f10 vtable for sstables::mx::mx_sstable_mutation_reader + 16
+    """
+    def __init__(self):
+        gdb.Command.__init__(self, 'scylla heap-index', gdb.COMMAND_USER, gdb.COMPLETE_COMMAND)
+
+    def invoke(self, arg, from_tty):
+        parser = argparse.ArgumentParser(description="scylla heap-index")
+        parser.add_argument("--rebuild", action="store_true", default=False,
+                help="Scan the heap again, even if the index is cached.")
+        parser.add_argument("--types", action="store", type=int, default=None, metavar="N",
+                help="Print the N vtables with the most objects. Set to 0 to print all.")
+        parser.add_argument("--type", action="store", default=None, metavar="NAME",
+                help="Print the objects whose dynamic type name starts with NAME.")
+
+        try:
+            args = parser.parse_args(arg.split())
+        except SystemExit:
+            return
+
+        index = heap_index.get(rebuild=args.rebuild)
+        counts = index.vtable_counts()
+        gdb.write('Index of shard {}: {} virtual objects, {} distinct vtables\n'.format(current_shard(), len(index), len(counts)))
+
+        if args.types is not None:
+            top = counts.most_common(args.types or None)
+            vtable_names = heap_index.vtable_names([vptr for vptr, count in top])
+            gdb.write('{:>10} {}\n'.format('count', 'vtable'))
+            for vptr, count in top:
+                gdb.write('{:>10} 0x{:x} {}\n'.format(count, vptr, vtable_names[vptr]))
+            heap_index.save_names()
+
+        if args.type is not None:
+            prefix = 'vtable for ' + args.type
+            for obj_addr, vptr, name in index.find(lambda name: name.startswith(prefix)):
+                gdb.write('0x{:x} 0x{:x} {}\n'.format(obj_addr, vptr, name))
+
+
 class scylla_active_sstables(gdb.Command):
     def __init__(self):
         gdb.Command.__init__(self, 'scylla active-sstables', gdb.COMMAND_USER, gdb.COMPLETE_COMMAND)
@@ -1944,10 +2353,8 @@ def find_instances(type_name):
     """
     ptr_type = gdb.lookup_type(type_name).pointer()
     vtable_name = 'vtable for %s ' % type_name
-    for obj_addr, vtable_addr in find_vptrs():
-        name = resolve(vtable_addr, startswith=vtable_name)
-        if name:
-            yield gdb.Value(obj_addr).cast(ptr_type)
+    for obj_addr, vtable_addr, name in heap_index.get().find(lambda name: name.startswith(vtable_name)):
+        yield gdb.Value(obj_addr).cast(ptr_type)
 
 
 class span(object):
@@ -2440,10 +2847,174 @@ def print_tree(root_node,
         print_node(root_node, [])
 
 
+class alloc_site_layout(object):
+    """
+    The offsets of the fields of seastar::memory::allocation_site which
+    alloc_sites() reads, taken from the given (first) allocation site.
+    """
+    def __init__(self, site):
+        base = int(site)
+        site = site.dereference()
+
+        def offset(value):
+            return int(value.address) - base
+
+        self.size = site.type.sizeof
+        self.fields = {name: (offset(site[name]), site[name].type.sizeof) for name in ('size', 'count', 'next')}
+        frames = site['backtrace']['_main']['_frames']
+        self.nr_frames = (offset(frames['m_holder']['m_size']), frames['m_holder']['m_size'].type.sizeof)
+        frame_type = frames.type.strip_typedefs().template_argument(0)
+        self.frames = int(static_vector(frames).data()) - base
+        self.frame_size = frame_type.sizeof
+        self.frame_addr = get_field_offset(frame_type, 'addr')
+        self.max_frames = (self.size - self.frames) // self.frame_size
+
+    def field(self, data, name):
+        offset, size = self.fields[name]
+        return int.from_bytes(data[offset:offset + size], 'little')
+
+    def addresses(self, data):
+        offset, size = self.nr_frames
+        nr_frames = min(int.from_bytes(data[offset:offset + size], 'little'), self.max_frames)
+        frames = self.frames + self.frame_addr
+        return [int.from_bytes(data[frames + i * self.frame_size:frames + i * self.frame_size + 8], 'little')
+                for i in range(nr_frames)]
+
+
+def alloc_sites():
+    """Yields (size, count, backtrace addresses) of the allocation sites recorded by the heap profiler of the current shard
+
+    Each allocation site, together with its backtrace, is read from memory
+    with a single read, instead of field by field through gdb values.
+    """
+    cpu_mem = gdb.parse_and_eval('\'seastar::memory::cpu_mem\'')
+    site = cpu_mem['alloc_site_list_head']
+    if not site:
+        return
+
+    layout = alloc_site_layout(site)
+    inf = gdb.selected_inferior()
+    addr = int(site)
+    while addr:
+        data = bytes(inf.read_memory(addr, layout.size))
+        size = layout.field(data, 'size')
+        if size:
+            addresses = layout.addresses(data)
+            addresses = addresses[1:]  # drop memory::get_backtrace()
+            yield size, layout.field(data, 'count'), addresses
+        addr = layout.field(data, 'next')
+
+
+class pprof_profile(object):
+    """
+    A profile in the pprof format (profile.proto), encoded by hand, so it
+    doesn't need the protobuf package.
+
+    Samples are a list of (addresses, values), where addresses are the
+    backtrace of the sample, innermost frame first, and values are in the
+    order of sample_types. Each address becomes a location, and the
+    locations of the same function (the name without the offset) share it.
+    """
+    def __init__(self, sample_types, executable):
+        self._strings = {'': 0}
+        self._sample_types = [(self._string(name), self._string(unit)) for name, unit in sample_types]
+        self._executable = self._string(executable)
+        self._samples = []
+        self._locations = {}  # address -> (location id, function id)
+        self._functions = {}  # name -> function id
+
+    def _string(self, s):
+        return self._strings.setdefault(s, len(self._strings))
+
+    def add_sample(self, addresses, values, names):
+        """Names maps the addresses to their symbols (with offset), or None"""
+        location_ids = []
+        for addr in addresses:
+            location = self._locations.get(addr)
+            if location is None:
+                name = names.get(addr)
+                name = re.sub(r' \+ \d+$', '', name.strip()) if name else '0x{:x}'.format(addr)
+                function_id = self._functions.setdefault(name, len(self._functions) + 1)
+                location = (len(self._locations) + 1, function_id)
+                self._locations[addr] = location
+            location_ids.append(location[0])
+        self._samples.append((location_ids, values))
+
+    @staticmethod
+    def _varint(value):
+        value &= (1 << 64) - 1
+        out = bytearray()
+        while value >= 0x80:
+            out.append((value & 0x7f) | 0x80)
+            value >>= 7
+        out.append(value)
+        return bytes(out)
+
+    @staticmethod
+    def _int_field(number, value):
+        return pprof_profile._varint(number << 3) + pprof_profile._varint(value)
+
+    @staticmethod
+    def _bytes_field(number, data):
+        return pprof_profile._varint((number << 3) | 2) + pprof_profile._varint(len(data)) + data
+
+    @staticmethod
+    def _packed_field(number, values):
+        return pprof_profile._bytes_field(number, b''.join(pprof_profile._varint(v) for v in values))
+
+    def encode(self):
+        f = pprof_profile
+        out = []
+        for name, unit in self._sample_types:
+            out.append(f._bytes_field(1, f._int_field(1, name) + f._int_field(2, unit)))
+        for location_ids, values in self._samples:
+            out.append(f._bytes_field(2, f._packed_field(1, location_ids) + f._packed_field(2, values)))
+        # A single mapping, with has_functions set, so pprof doesn't try to symbolize the addresses again
+        out.append(f._bytes_field(3, f._int_field(1, 1) + f._int_field(3, (1 << 64) - 1)
+                                  + f._int_field(5, self._executable) + f._int_field(7, 1)))
+        for addr, (location_id, function_id) in self._locations.items():
+            out.append(f._bytes_field(4, f._int_field(1, location_id) + f._int_field(2, 1) + f._int_field(3, addr)
+                                      + f._bytes_field(4, f._int_field(1, function_id))))
+        for name, function_id in self._functions.items():
+            name_idx = self._string(name)
+            out.append(f._bytes_field(5, f._int_field(1, function_id) + f._int_field(2, name_idx) + f._int_field(3, name_idx)))
+        # The string table goes last, as _string() may add to it up to here
+        for s in self._strings:
+            out.append(f._bytes_field(6, s.encode('utf-8')))
+        return b''.join(out)
+
+    def write(self, path):
+        with gzip.open(path, 'wb') as out:
+            out.write(self.encode())
+
+
 class scylla_heapprof(gdb.Command):
+    """Print the heap profile of the current shard, as collected by seastar's heap profiler.
+
+    The allocation sites with identical backtraces are merged, and the
+    addresses of all backtraces are deduplicated and resolved to symbols in
+    one batch. Besides printing the profile as a tree, the command can write
+    it as folded stacks (--folded), which flamegraph.pl and speedscope can
+    read, and in the pprof format (--pprof), which `pprof` can read, e.g.:
+
+        pprof -http=:8080 heapprof.pb.gz
+
+    Folded stacks are caller-first, with the symbols of the frames without
+    their offsets, and the bytes allocated at the site as the value. pprof
+    profiles have both the live objects (inuse_objects) and their bytes
+    (inuse_space) as values.
+    """
     def __init__(self):
         gdb.Command.__init__(self, 'scylla heapprof', gdb.COMMAND_USER, gdb.COMPLETE_COMMAND)
 
+    @staticmethod
+    def _folded_frame(addr, names):
+        name = names.get(addr)
+        if not name:
+            return '0x%x' % addr
+        # ';' separates the frames of a folded stack
+        return re.sub(r' \+ \d+$', '', name.strip()).replace(';', ':')
+
     def invoke(self, arg, from_tty):
         parser = argparse.ArgumentParser(description="scylla heapprof")
         parser.add_argument("-G", "--inverted", action="store_true",
@@ -2454,6 +3025,10 @@ class scylla_heapprof(gdb.Command):
                             help="Show only raw addresses")
         parser.add_argument("--flame", action="store_true",
                             help="Write flamegraph data to heapprof.stacks instead of showing the profile")
+        parser.add_argument("--folded", action="store", metavar="FILE",
+                            help="Write the profile as folded stacks to FILE instead of showing it")
+        parser.add_argument("--pprof", action="store", metavar="FILE",
+                            help="Write the profile in the gzipped pprof format to FILE instead of showing it")
         parser.add_argument("--min", action="store", type=int, default=0,
                             help="Drop branches allocating less than given amount")
         try:
@@ -2461,36 +3036,54 @@ class scylla_heapprof(gdb.Command):
         except SystemExit:
             return
 
+        # backtrace -> [size, count]
+        sites = defaultdict(lambda: [0, 0])
+        for size, count, addresses in alloc_sites():
+            site = sites[tuple(addresses)]
+            site[0] += size
+            site[1] += count
+
+        if args.no_symbols:
+            names = {}
+        else:
+            names = resolve_many({addr for addresses in sites for addr in addresses})
+
+        if args.folded or args.pprof:
+            if args.folded:
+                with open(args.folded, 'w') as out:
+                    for addresses, (size, count) in sites.items():
+                        out.write('%s %d\n' % (';'.join(self._folded_frame(addr, names) for addr in reversed(addresses)), size))
+                gdb.write('Wrote %d stacks to %s\n' % (len(sites), args.folded))
+            if args.pprof:
+                profile = pprof_profile([('inuse_objects', 'count'), ('inuse_space', 'bytes')],
+                                        gdb.current_progspace().filename or '')
+                for addresses, (size, count) in sites.items():
+                    profile.add_sample(addresses, [count, size], names)
+                profile.write(args.pprof)
+                gdb.write('Wrote %d samples to %s\n' % (len(sites), args.pprof))
+            return
+
         root = ProfNode(None)
-        cpu_mem = gdb.parse_and_eval('\'seastar::memory::cpu_mem\'')
-        site = cpu_mem['alloc_site_list_head']
 
-        while site:
-            size = int(site['size'])
-            count = int(site['count'])
-            if size:
-                n = root
+        for addresses, (size, count) in sites.items():
+            n = root
+            n.size += size
+            n.count += count
+            if args.inverted:
+                seq = reversed(addresses)
+            else:
+                seq = addresses
+            for addr in seq:
+                n = n.get_or_add(addr)
                 n.size += size
                 n.count += count
-                bt = site['backtrace']['_main']
-                addresses = list(int(f['addr']) for f in static_vector(bt['_frames']))
-                addresses.pop(0)  # drop memory::get_backtrace()
-                if args.inverted:
-                    seq = reversed(addresses)
-                else:
-                    seq = addresses
-                for addr in seq:
-                    n = n.get_or_add(addr)
-                    n.size += size
-                    n.count += count
-            site = site['next']
 
         def resolver(addr):
             if args.no_symbols:
                 return '0x%x' % addr
             if args.addresses:
-                return '0x%x %s' % (addr, resolve(addr) or '')
-            return resolve(addr) or ('0x%x' % addr)
+                return '0x%x %s' % (addr, names[addr] or '')
+            return names[addr] or ('0x%x' % addr)
 
         if args.flame:
             file_name = 'heapprof.stacks'
@@ -2629,6 +3222,145 @@ def get_segment_base(segment_pool):
         return int(segment_pool["_segments_base"])
 
 
+def read_word(memory, addr):
+    """The 8-byte word at addr, read with memory.read_memory()"""
+    return int.from_bytes(bytes(memory.read_memory(addr, 8)), 'little')
+
+
+def read_free_list(memory, head):
+    """The objects of the free list starting at head, read with memory.read_memory()"""
+    free = set()
+    while head and head not in free:
+        free.add(head)
+        head = read_word(memory, head)
+    return free
+
+
+class pointer_analyzer(object):
+    """
+    Analyzes pointers into the seastar heap of the current shard, like `scylla ptr`.
+
+    The page table is read in bulk, and the free lists of pools and spans are
+    walked once and kept as sets, so analyzing many pointers, e.g. all the
+    hits of `scylla find`, costs almost no gdb round trips per pointer. The
+    analyzer of a shard is kept until the inferior is continued.
+    """
+    _analyzers = {}  # shard -> pointer_analyzer
+    _memory_layout = None
+
+    def __init__(self):
+        self._page_table = page_table()
+        self._page_size = self._page_table.page_size
+        self._mem_start = self._page_table.mem_start
+        self._inf = gdb.selected_inferior()
+        self._span_starts = None  # page index of the first page of each span
+        self._object_sizes = {}  # small_pool address -> object size
+        self._free_in_pool = {}  # small_pool address -> free objects
+        self._free_in_span = {}  # page index -> free objects
+        self._segments = None
+        self._segment_is_lsa = {}  # segment index -> bool
+
+    @classmethod
+    def get(cls):
+        """The analyzer of the current shard"""
+        shard = current_shard()
+        analyzer = cls._analyzers.get(shard)
+        if analyzer is None:
+            analyzer = pointer_analyzer()
+            cls._analyzers[shard] = analyzer
+        return analyzer
+
+    @classmethod
+    def memory_layout(cls):
+        """seastar_memory_layout(), looked up once"""
+        if cls._memory_layout is None:
+            cls._memory_layout = seastar_memory_layout()
+        return cls._memory_layout
+
+    @classmethod
+    def invalidate(cls, event=None):
+        cls._analyzers = {}
+        cls._memory_layout = None
+
+    def _read_word(self, addr):
+        return read_word(self._inf, addr)
+
+    def _span(self, page_idx):
+        """Page index of the first page of the span containing page_idx, None if there is none"""
+        pages = self._page_table
+        if self._span_starts is None:
+            self._span_starts = array.array('Q', (first for first, span_size in pages.spans()))
+        i = bisect.bisect_right(self._span_starts, page_idx) - 1
+        if i < 0:
+            return None
+        first = self._span_starts[i]
+        if page_idx >= first + pages.field(first, 'span_size'):
+            return None
+        return first
+
+    def _is_free_object(self, pool, first, obj):
+        if pool not in self._free_in_pool:
+            small_pool = gdb.Value(pool).cast(gdb.lookup_type('seastar::memory::small_pool').pointer()).dereference()
+            self._free_in_pool[pool] = read_free_list(self._inf, int(small_pool['_free']))
+        if first not in self._free_in_span:
+            self._free_in_span[first] = read_free_list(self._inf, self._page_table.field(first, 'freelist'))
+        return obj in self._free_in_pool[pool] or obj in self._free_in_span[first]
+
+    def _object_size(self, pool):
+        size = self._object_sizes.get(pool)
+        if size is None:
+            small_pool = gdb.Value(pool).cast(gdb.lookup_type('seastar::memory::small_pool').pointer()).dereference()
+            size = int(small_pool['_object_size'])
+            self._object_sizes[pool] = size
+        return size
+
+    def _is_lsa(self, ptr):
+        # FIXME: handle debug-mode build
+        if self._segments is None:
+            segment_pool = get_lsa_segment_pool()
+            desc = std_vector(segment_pool["_segments"])[0]
+            self._segments = (get_segment_base(segment_pool),
+                              int(gdb.parse_and_eval('\'logalloc::segment\'::size')),
+                              int(desc.address),
+                              desc.type.sizeof,
+                              int(desc['_region'].address) - int(desc.address))
+        base, segment_size, descs, desc_size, region_offset = self._segments
+        index = int((ptr - base) / segment_size)
+        is_lsa = self._segment_is_lsa.get(index)
+        if is_lsa is None:
+            is_lsa = bool(self._read_word(descs + index * desc_size + region_offset))
+            self._segment_is_lsa[index] = is_lsa
+        return is_lsa
+
+    def analyze(self, ptr, thread):
+        """The pointer_metadata of ptr, which points into the memory of the current shard, owned by thread"""
+        pages = self._page_table
+        ptr_meta = pointer_metadata(ptr, thread)
+        first = self._span(int((ptr - self._mem_start) / self._page_size))
+        span_start = None if first is None else self._mem_start + first * self._page_size
+        if first is None or ptr - span_start >= pages.used_span_size(first) * self._page_size:
+            ptr_meta.mark_free()
+        elif pages.field(first, 'pool'):
+            pool = pages.field(first, 'pool')
+            object_size = self._object_size(pool)
+            ptr_meta.size = object_size
+            ptr_meta.is_small = True
+            ptr_meta.offset_in_object = (ptr - span_start) % object_size
+            ptr_meta.is_live = not self._is_free_object(pool, first, ptr - ptr_meta.offset_in_object)
+        else:
+            ptr_meta.is_small = False
+            ptr_meta.is_live = not pages.field(first, 'free')
+            ptr_meta.size = pages.field(first, 'span_size') * self._page_size
+            ptr_meta.offset_in_object = ptr - span_start
+
+        ptr_meta.is_lsa = self._is_lsa(ptr)
+
+        return ptr_meta
+
+
+gdb.events.cont.connect(pointer_analyzer.invalidate)
+
+
 class scylla_ptr(gdb.Command):
     _is_seastar_allocator_used = None
 
@@ -2651,71 +3383,17 @@ class scylla_ptr(gdb.Command):
     @staticmethod
     def _do_analyze(ptr):
         owning_thread = None
-        for t, start, size in seastar_memory_layout():
+        for t, start, size in pointer_analyzer.memory_layout():
             if ptr >= start and ptr < start + size:
                 owning_thread = t
                 break
 
-        ptr_meta = pointer_metadata(ptr, owning_thread)
-
         if not owning_thread:
-            return ptr_meta
+            return pointer_metadata(ptr, owning_thread)
 
         owning_thread.switch()
 
-        cpu_mem = gdb.parse_and_eval('\'seastar::memory::cpu_mem\'')
-        page_size = int(gdb.parse_and_eval('\'seastar::memory::page_size\''))
-        offset = ptr - int(cpu_mem['memory'])
-        ptr_page_idx = offset / page_size
-        pages = cpu_mem['pages']
-        page = pages[ptr_page_idx]
-
-        span = span_checker().get_span(ptr)
-        offset_in_span = ptr - span.start
-        if offset_in_span >= span.used_span_size() * page_size:
-            ptr_meta.mark_free()
-        elif span.is_small():
-            pool = span.pool()
-            object_size = int(pool['_object_size'])
-            ptr_meta.size = object_size
-            ptr_meta.is_small = True
-            offset_in_object = offset_in_span % object_size
-            free_object_ptr = gdb.lookup_type('void').pointer().pointer()
-            char_ptr = gdb.lookup_type('char').pointer()
-            # pool's free list
-            next_free = pool['_free']
-            free = False
-            while next_free:
-                if ptr >= next_free and ptr < next_free.reinterpret_cast(char_ptr) + object_size:
-                    free = True
-                    break
-                next_free = next_free.reinterpret_cast(free_object_ptr).dereference()
-            if not free:
-                # span's free list
-                first_page_in_span = span.page
-                next_free = first_page_in_span['freelist']
-                while next_free:
-                    if ptr >= next_free and ptr < next_free.reinterpret_cast(char_ptr) + object_size:
-                        free = True
-                        break
-                    next_free = next_free.reinterpret_cast(free_object_ptr).dereference()
-            ptr_meta.offset_in_object = offset_in_object
-            ptr_meta.is_live = not free
-        else:
-            ptr_meta.is_small = False
-            ptr_meta.is_live = not span.is_free()
-            ptr_meta.size = span.size() * page_size
-            ptr_meta.offset_in_object = ptr - span.start
-
-        # FIXME: handle debug-mode build
-        segment_pool = get_lsa_segment_pool()
-        segments_base = get_segment_base(segment_pool)
-        segment_size = int(gdb.parse_and_eval('\'logalloc::segment\'::size'))
-        index = int((int(ptr) - segments_base) / segment_size)
-        desc = std_vector(segment_pool["_segments"])[index]
-        ptr_meta.is_lsa = bool(desc['_region'])
-
-        return ptr_meta
+        return pointer_analyzer.get().analyze(ptr, owning_thread)
 
     @staticmethod
     def analyze(ptr):
@@ -2877,18 +3555,192 @@ class scylla_lsa(gdb.Command):
                               r_unused=int(region['_closed_occupancy']['_free_space'])))
 
 
+class symbol_table(object):
+    """
+    The ELF symbol table of the executable, as a sorted array of address ranges.
+
+    The function and object symbols are read from the executable (or from its
+    separate debug file) once, and looked up with bisect, so resolving an
+    address doesn't run `info symbol`. The load bias of position independent
+    executables is derived from the address of the .text section. Names are
+    demangled in batches, with c++filt when it is available, falling back to
+    gdb's `demangle` command.
+
+    Addresses outside of the executable, e.g. in shared libraries, are not
+    covered and are left to `info symbol`.
+    """
+    _ehdr = struct.Struct('<16sHHIQQQIHHHHHH')
+    _shdr = struct.Struct('<IIQQQQIIQQ')
+    _sym = struct.Struct('<IBBHQQ')
+    _sht_symtab = 2
+    _symbol_types = (1, 2, 10)  # STT_OBJECT, STT_FUNC, STT_GNU_IFUNC
+    _stb_local = 0
+    _shn_loreserve = 0xff00
+    _table = None
+    _loaded = False
+    _demangled = {}  # mangled name -> demangled name
+
+    def __init__(self, starts, ends, name_offsets, strtab):
+        self._starts = starts
+        self._ends = ends
+        self._name_offsets = name_offsets
+        self._strtab = strtab
+        self.start = starts[0]
+        self.end = max(ends)
+
+    def __len__(self):
+        return len(self._starts)
+
+    @classmethod
+    def get(cls):
+        """The symbol table of the executable, None if it has no usable one"""
+        if not cls._loaded:
+            cls._loaded = True
+            start = time.time()
+            try:
+                cls._table = cls._load()
+            except (OSError, ValueError, struct.error) as e:
+                gdb.write('Failed to load the symbol table, falling back to `info symbol`: {}\n'.format(e))
+            if cls._table is not None:
+                gdb.write('Loaded {} symbols in {:.1f}s\n'.format(len(cls._table), time.time() - start))
+        return cls._table
+
+    @classmethod
+    def invalidate(cls, event=None):
+        cls._table = None
+        cls._loaded = False
+
+    @classmethod
+    def _load(cls):
+        executable = gdb.current_progspace().filename
+        if not executable:
+            return None
+        text_start = None
+        for line in gdb.execute('info files', False, True).split('\n'):
+            # Sections of shared libraries end with "in <library path>"
+            if line.endswith(' is .text'):
+                text_start = int(line.split()[0], 16)
+                break
+        paths = [executable] + [o.filename for o in gdb.objfiles()
+                                if getattr(o, 'owner', None) is not None and o.owner.filename == executable]
+        for path in paths:
+            symbols = cls._read_symbols(path)
+            if symbols is None:
+                continue
+            elf_text_start, symbols, strtab = symbols
+            bias = 0 if text_start is None or elf_text_start is None else text_start - elf_text_start
+            # At equal addresses prefer the largest, then the global symbol
+            symbols.sort()
+            starts = array.array('Q')
+            ends = array.array('Q')
+            name_offsets = array.array('Q')
+            for value, neg_size, local, name in symbols:
+                if starts and starts[-1] == value + bias:
+                    continue
+                starts.append(value + bias)
+                ends.append(value + bias - neg_size)
+                name_offsets.append(name)
+            return symbol_table(starts, ends, name_offsets, strtab)
+        return None
+
+    @classmethod
+    def _read_symbols(cls, path):
+        """(.text address, [(address, -size, is local, name offset)], string table) of the ELF file at path"""
+        with open(path, 'rb') as f:
+            ehdr = cls._ehdr.unpack(f.read(cls._ehdr.size))
+            ident, shoff, shentsize, shnum, shstrndx = ehdr[0], ehdr[6], ehdr[11], ehdr[12], ehdr[13]
+            if ident[:4] != b'\x7fELF' or ident[4] != 2 or ident[5] != 1:
+                raise ValueError('{} is not a 64-bit little-endian ELF file'.format(path))
+            f.seek(shoff)
+            table = f.read(shentsize * shnum)
+            headers = [cls._shdr.unpack_from(table, i * shentsize) for i in range(shnum)]
+
+            def section_data(header):
+                f.seek(header[4])
+                return f.read(header[5])
+
+            shstrtab = section_data(headers[shstrndx])
+            text_start = None
+            symtab = None
+            for header in headers:
+                if shstrtab[header[0]:shstrtab.index(b'\0', header[0])] == b'.text':
+                    text_start = header[3]
+                if header[1] == cls._sht_symtab:
+                    symtab = header
+            if symtab is None or not symtab[5]:
+                return None
+            data = section_data(symtab)
+            strtab = section_data(headers[symtab[6]])
+        symbols = [(value, -size, (info >> 4) == cls._stb_local, name)
+                   for name, info, other, shndx, value, size in cls._sym.iter_unpack(data)
+                   if name and (info & 0xf) in cls._symbol_types and 0 < shndx < cls._shn_loreserve]
+        return text_start, symbols, strtab
+
+    def covers(self, addr):
+        return self.start <= addr < self.end
+
+    def lookup(self, addr):
+        """(mangled name, offset) of the symbol containing addr, None if there is none"""
+        idx = bisect.bisect_right(self._starts, addr) - 1
+        if idx < 0:
+            return None
+        start = self._starts[idx]
+        if addr >= self._ends[idx] and addr != start:
+            return None
+        offset = self._name_offsets[idx]
+        return self._strtab[offset:self._strtab.index(b'\0', offset)].decode('utf-8', 'replace'), addr - start
+
+    @classmethod
+    def demangle(cls, names):
+        """Demangles all names, returns a dict mapping them to their demangled form"""
+        missing = [name for name in set(names) if name not in cls._demangled]
+        mangled = [name for name in missing if name.startswith('_Z')]
+        for name in missing:
+            cls._demangled[name] = name
+        if mangled:
+            try:
+                demangled = subprocess.run(['c++filt'], input='\n'.join(mangled), capture_output=True, text=True,
+                                           check=True).stdout.split('\n')[:len(mangled)]
+                if len(demangled) != len(mangled):
+                    raise ValueError('c++filt returned {} names instead of {}'.format(len(demangled), len(mangled)))
+                cls._demangled.update(zip(mangled, demangled))
+            except (OSError, ValueError, subprocess.CalledProcessError):
+                for name in mangled:
+                    try:
+                        cls._demangled[name] = gdb.execute('demangle -- {}'.format(name), False, True).strip()
+                    except gdb.error:
+                        pass
+        return {name: cls._demangled[name] for name in names}
+
+
 names = {}  # addr (int) -> name (str)
 
 
+def _format_symbol(name, offset):
+    # The format of `info symbol`, without the section
+    if offset:
+        return '{} + {} '.format(name, offset)
+    return '{} '.format(name)
+
+
 def resolve(addr, cache=True, startswith=None):
+    addr = int(addr)
     if addr in names:
         return names[addr]
 
-    infosym = gdb.execute('info symbol 0x%x' % (addr), False, True)
-    if infosym.startswith('No symbol'):
-        return None
+    symbols = symbol_table.get()
+    if symbols is not None and symbols.covers(addr):
+        symbol = symbols.lookup(addr)
+        if symbol is None:
+            return None
+        mangled, offset = symbol
+        name = _format_symbol(symbol_table.demangle([mangled])[mangled], offset)
+    else:
+        infosym = gdb.execute('info symbol 0x%x' % (addr), False, True)
+        if infosym.startswith('No symbol'):
+            return None
+        name = infosym[:infosym.find('in section')]
 
-    name = infosym[:infosym.find('in section')]
     if startswith and not name.startswith(startswith):
         return None
     if cache:
@@ -2896,6 +3748,50 @@ def resolve(addr, cache=True, startswith=None):
     return name
 
 
+def resolve_many(addrs, startswith=None):
+    """
+    Resolves addrs like resolve(), returns a dict mapping each address to its name or None.
+
+    The names of the addresses covered by the symbol table are demangled in one batch.
+    """
+    addrs = set(int(addr) for addr in addrs)
+    result = {}
+    symbols = symbol_table.get()
+    found = {}
+    for addr in addrs:
+        if addr in names:
+            result[addr] = names[addr]
+        elif symbols is not None and symbols.covers(addr):
+            symbol = symbols.lookup(addr)
+            result[addr] = None
+            if symbol is not None:
+                found[addr] = symbol
+        else:
+            result[addr] = resolve(addr, startswith=startswith)
+    demangled = symbol_table.demangle([mangled for mangled, offset in found.values()])
+    for addr, (mangled, offset) in found.items():
+        result[addr] = _format_symbol(demangled[mangled], offset)
+    for addr, name in result.items():
+        if name is None:
+            continue
+        if startswith and not name.startswith(startswith):
+            result[addr] = None
+        else:
+            names[addr] = name
+    return result
+
+
+def invalidate_symbols(event=None):
+    global _text_ranges
+    _text_ranges = None
+    names.clear()
+    symbol_table.invalidate()
+
+
+gdb.events.new_objfile.connect(invalidate_symbols)
+gdb.events.clear_objfiles.connect(invalidate_symbols)
+
+
 class lsa_regions(object):
     def __init__(self):
         lsa_tracker = std_unique_ptr(gdb.parse_and_eval('\'logalloc::tracker_instance\'._impl'))
@@ -3989,12 +4885,91 @@ class scylla_fiber(gdb.Command):
             return
 
 
+def read_memory_chunks(start, size, chunk_size=16 << 20, overlap=0):
+    """
+    Yields (address, data) of the readable parts of [start, start + size), in chunks of at most chunk_size bytes.
+
+    Each chunk is followed by the first overlap bytes of the next one, if
+    they are readable, so that values which span chunk boundaries are found
+    by searching the chunks. Chunks which can't be read are split in halves,
+    down to pages, and the unreadable pages are skipped.
+    """
+    inf = gdb.selected_inferior()
+    end = start + size
+    page_size = 4096
+
+    def read(addr, n):
+        for length in (n + min(overlap, end - addr - n), n):
+            try:
+                return bytes(inf.read_memory(addr, length))
+            except gdb.MemoryError:
+                pass
+        return None
+
+    def chunks(addr, n):
+        data = read(addr, n)
+        if data is not None:
+            yield addr, data
+        elif n > page_size:
+            half = max(page_size, (n // 2) & ~(page_size - 1))
+            yield from chunks(addr, half)
+            yield from chunks(addr + half, n - half)
+
+    addr = start
+    while addr < end:
+        n = min(chunk_size, end - addr)
+        yield from chunks(addr, n)
+        addr += n
+
+
+def search_memory(start, size, first, last, value_size, step=1):
+    """
+    Yields (address, value) of the values found in [start, start + size), in address order.
+
+    Searches for the value_size-byte little-endian values in [first, last]
+    which differ from first by a multiple of step, at any alignment, like
+    gdb's `find`. The memory is read in large chunks, which are searched with
+    bytes.find() for the high bytes common to all searched values, and only
+    the candidates are decoded. When those are all zero, the exact values are
+    searched for instead.
+    """
+    last = min(last, (1 << (8 * value_size)) - 1)
+    first_bytes = first.to_bytes(value_size, 'little')
+    last_bytes = last.to_bytes(value_size, 'little')
+    low_bytes = value_size
+    while low_bytes and first_bytes[low_bytes - 1] == last_bytes[low_bytes - 1]:
+        low_bytes -= 1
+    if low_bytes < value_size and any(first_bytes[low_bytes:]):
+        needles = [first_bytes[low_bytes:]]
+    else:
+        # No byte in common, or only zero bytes, which are everywhere in
+        # memory and would make every position a candidate: search for each value
+        low_bytes = 0
+        needles = [value.to_bytes(value_size, 'little') for value in range(first, last + 1, step)]
+
+    for addr, data in read_memory_chunks(start, size, overlap=value_size - 1):
+        hits = []
+        for needle in needles:
+            pos = data.find(needle, low_bytes)
+            while pos != -1:
+                offset = pos - low_bytes
+                value = int.from_bytes(data[offset:offset + value_size], 'little')
+                if first <= value <= last and (value - first) % step == 0:
+                    hits.append((addr + offset, value))
+                pos = data.find(needle, pos + 1)
+        if len(needles) > 1:
+            hits.sort()
+        yield from hits
+
+
 def find_objects(mem_start, mem_size, value, size_selector='g', only_live=True):
-    for line in gdb.execute("find/%s 0x%x, +0x%x, 0x%x" % (size_selector, mem_start, mem_size, value), to_string=True).split('\n'):
-        if line.startswith('0x'):
-            ptr_meta = scylla_ptr.analyze(int(line, base=16))
-            if not only_live or ptr_meta.is_live:
-                yield ptr_meta
+    value_size = scylla_find._size_char_to_size[size_selector] // 8
+    analyzer = pointer_analyzer.get()
+    thread = gdb.selected_thread()
+    for ptr, _ in search_memory(mem_start, mem_size, value, value, value_size):
+        ptr_meta = analyzer.analyze(ptr, thread)
+        if not only_live or ptr_meta.is_live:
+            yield ptr_meta
 
 
 class scylla_find(gdb.Command):
@@ -4023,27 +4998,30 @@ class scylla_find(gdb.Command):
     @staticmethod
     def find(value, size_selector='g', value_range=0, find_all=False, only_live=True):
         step = int(scylla_find._size_char_to_size[size_selector] / 8)
-        offset = 0
+        value &= (1 << (8 * step)) - 1
+        # The last value searched is the first at or after value + value_range.
+        last = value + -(-value_range // step) * step
         mem_start, mem_size = get_seastar_memory_start_and_size()
-        it = iter(find_objects(mem_start, mem_size, value, size_selector, only_live))
-
-        # Find the first value in the range for which the search has results.
-        while offset < value_range:
-            try:
-                yield next(it), offset
-                if not find_all:
-                    break
-            except StopIteration:
-                offset += step
-                it = iter(find_objects(mem_start, mem_size, value + offset, size_selector, only_live))
-
-        # List the rest of the results for value.
-        try:
-            while True:
-                yield next(it), offset
-        except StopIteration:
-            pass
 
+        # Search for all values of the range in a single pass over the memory.
+        hits = defaultdict(list) # offset -> addresses
+        for addr, found in search_memory(mem_start, mem_size, value, last, step, step):
+            hits[found - value].append(addr)
+
+        analyzer = pointer_analyzer.get()
+        thread = gdb.selected_thread()
+
+        # Yield the results of the first offset for which the search has
+        # results, or of all offsets, in order, with find_all.
+        for offset in range(0, last - value + 1, step):
+            found = False
+            for addr in hits.get(offset, []):
+                ptr_meta = analyzer.analyze(addr, thread)
+                if not only_live or ptr_meta.is_live:
+                    found = True
+                    yield ptr_meta, offset
+            if found and not find_all:
+                break
 
     def invoke(self, arg, for_tty):
         parser = argparse.ArgumentParser(description="scylla find")
@@ -4323,7 +5301,6 @@ class scylla_sstables(gdb.Command):
         except SystemExit:
             return
 
-        filter_type = gdb.lookup_type('utils::filter::murmur3_bloom_filter')
         cpu_id = current_shard()
         total_size = 0 # in memory
         total_on_disk_size = 0
@@ -4333,46 +5310,12 @@ class scylla_sstables(gdb.Command):
         sstable_histogram = histogram(print_indicators=False)
 
         for sst in sstable_generator():
-            try:
-                is_open = sst['_open']
-            except gdb.error:
-                is_open = bool(std_optional(sst['_open_mode']))
-            if not is_open:
+            if not scylla_sstables.is_open(sst):
                 continue
 
             count += 1
-            size = 0
-
-            sc = seastar_lw_shared_ptr(sst['_components']['_value']).get()
             local = sst['_components']['_cpu'] == cpu_id
-            size += sc.dereference().type.sizeof
-
-            bf = std_unique_ptr(sc['filter']).get().cast(filter_type.pointer())
-            bf_size = bf.dereference().type.sizeof + chunked_vector(bf['_bitset']['_storage']).external_memory_footprint()
-            size += bf_size
-
-            summary_size = std_vector(sc['summary']['_summary_data']).external_memory_footprint()
-            summary_size += chunked_vector(sc['summary']['entries']).external_memory_footprint()
-            summary_size += chunked_vector(sc['summary']['positions']).external_memory_footprint()
-            for e in std_vector(sc['summary']['_summary_data']):
-                summary_size += e['_size'] + e.type.sizeof
-            # FIXME: include external memory footprint of summary entries
-            size += summary_size
-
-            sm_size = 0
-            sm = std_optional(sc['scylla_metadata'])
-            if sm:
-                for tag, value in unordered_map(sm.get()['data']['data']):
-                    bv = boost_variant(value)
-                    # FIXME: only gdb.Type.template_argument(0) works for boost::variant<>
-                    if bv.which() != 0:
-                        continue
-                    val = bv.get()['value']
-                    if str(val.type) == 'sstables::sharding_metadata':
-                        sm_size += chunked_vector(val['token_ranges']['elements']).external_memory_footprint()
-            size += sm_size
-
-            # FIXME: Include compression info
+            size, bf_size, summary_size, sm_size = scylla_sstables.memory_footprint(sst)
 
             data_file_size = sst['_data_file_size']
             schema = schema_ptr(sst['_schema'])
@@ -4391,6 +5334,51 @@ class scylla_sstables(gdb.Command):
 
         gdb.write('total (shard-local): count=%d, data_file=%d, in_memory=%d\n' % (count, total_on_disk_size, total_size))
 
+    @staticmethod
+    def is_open(sst):
+        try:
+            return bool(sst['_open'])
+        except gdb.error:
+            return bool(std_optional(sst['_open_mode']))
+
+    @staticmethod
+    def memory_footprint(sst):
+        """The in-memory size of the components of the sstable: (total, bloom filter, summary, scylla metadata)"""
+        filter_type = gdb.lookup_type('utils::filter::murmur3_bloom_filter')
+        size = 0
+
+        sc = seastar_lw_shared_ptr(sst['_components']['_value']).get()
+        size += sc.dereference().type.sizeof
+
+        bf = std_unique_ptr(sc['filter']).get().cast(filter_type.pointer())
+        bf_size = bf.dereference().type.sizeof + chunked_vector(bf['_bitset']['_storage']).external_memory_footprint()
+        size += bf_size
+
+        summary_size = std_vector(sc['summary']['_summary_data']).external_memory_footprint()
+        summary_size += chunked_vector(sc['summary']['entries']).external_memory_footprint()
+        summary_size += chunked_vector(sc['summary']['positions']).external_memory_footprint()
+        for e in std_vector(sc['summary']['_summary_data']):
+            summary_size += e['_size'] + e.type.sizeof
+        # FIXME: include external memory footprint of summary entries
+        size += summary_size
+
+        sm_size = 0
+        sm = std_optional(sc['scylla_metadata'])
+        if sm:
+            for tag, value in unordered_map(sm.get()['data']['data']):
+                bv = boost_variant(value)
+                # FIXME: only gdb.Type.template_argument(0) works for boost::variant<>
+                if bv.which() != 0:
+                    continue
+                val = bv.get()['value']
+                if str(val.type) == 'sstables::sharding_metadata':
+                    sm_size += chunked_vector(val['token_ranges']['elements']).external_memory_footprint()
+        size += sm_size
+
+        # FIXME: Include compression info
+
+        return size, bf_size, summary_size, sm_size
+
 
 class scylla_memtables(gdb.Command):
     """Lists basic information about all memtable objects on current shard."""
@@ -4410,25 +5398,511 @@ class scylla_memtables(gdb.Command):
     def dump_compaction_group_memtables(compaction_group):
         scylla_memtables.dump_memtable_list(seastar_lw_shared_ptr(compaction_group['_memtables']).get())
 
-    def invoke(self, arg, from_tty):
-        for table in for_each_table():
-            gdb.write('table %s:\n' % schema_ptr(table['_schema']).table_name())
+    @staticmethod
+    def memtable_lists(table):
+        """The memtable lists of all compaction groups of the table"""
+        def of(compaction_groups):
+            return [seastar_lw_shared_ptr(cg['_memtables']).get() for cg in compaction_groups]
+
+        try:
             try:
-                try:
-                    for cg in intrusive_list(table["_compaction_groups"], link='_list_hook'):
-                        scylla_memtables.dump_compaction_group_memtables(cg)
-                except gdb.error:
-                    for cg_ptr in chunked_vector(table["_compaction_groups"]):
-                        scylla_memtables.dump_compaction_group_memtables(std_unique_ptr(cg_ptr).get())
+                return of(intrusive_list(table["_compaction_groups"], link='_list_hook'))
+            except gdb.error:
+                return of(std_unique_ptr(cg_ptr).get() for cg_ptr in chunked_vector(table["_compaction_groups"]))
+        except gdb.error:
+            try:
+                return of(std_unique_ptr(cg_ptr).get() for cg_ptr in std_vector(table["_compaction_groups"]))
             except gdb.error:
                 try:
-                    for cg_ptr in std_vector(table["_compaction_groups"]):
-                        scylla_memtables.dump_compaction_group_memtables(std_unique_ptr(cg_ptr).get())
+                    return of([std_unique_ptr(table["_compaction_group"]).get()])
                 except gdb.error:
-                    try:
-                        scylla_memtables.dump_compaction_group_memtables(std_unique_ptr(table["_compaction_group"]).get())
-                    except gdb.error:
-                        scylla_memtables.dump_memtable_list(seastar_lw_shared_ptr(table['_memtables']).get()) # Scylla 5.1 compatibility
+                    return [seastar_lw_shared_ptr(table['_memtables']).get()] # Scylla 5.1 compatibility
+
+    @staticmethod
+    def memtables(table):
+        """Yields the memtables of the table"""
+        for memtable_list in scylla_memtables.memtable_lists(table):
+            for mt_ptr in std_vector(memtable_list['_memtables']):
+                yield seastar_lw_shared_ptr(mt_ptr).get()
+
+    def invoke(self, arg, from_tty):
+        for table in for_each_table():
+            gdb.write('table %s:\n' % schema_ptr(table['_schema']).table_name())
+            for memtable_list in scylla_memtables.memtable_lists(table):
+                scylla_memtables.dump_memtable_list(memtable_list)
+
+class core_memory(object):
+    """
+    Reads the memory of the debugged process from its core file, without gdb.
+
+    Memory which is not in the core, e.g. because it was excluded from the
+    dump, reads as zeros. Used by the worker processes of `scylla all-shards`,
+    which can't use gdb.
+    """
+    _ehdr = struct.Struct('<16sHHIQQQIHHHHHH')
+    _phdr = struct.Struct('<IIQQQQQQ')
+    _pt_load = 1
+
+    def __init__(self, path):
+        self._fd = os.open(path, os.O_RDONLY)
+        ehdr = self._ehdr.unpack(os.pread(self._fd, self._ehdr.size, 0))
+        phoff, phentsize, phnum = ehdr[5], ehdr[9], ehdr[10]
+        table = os.pread(self._fd, phentsize * phnum, phoff)
+        self._segments = []  # (address, size in memory, file offset, size in file)
+        for i in range(phnum):
+            p_type, flags, offset, vaddr, paddr, filesz, memsz, align = self._phdr.unpack_from(table, i * phentsize)
+            if p_type == self._pt_load and memsz:
+                self._segments.append((vaddr, memsz, offset, min(filesz, memsz)))
+        self._segments.sort()
+        self._starts = [segment[0] for segment in self._segments]
+
+    def read_memory(self, addr, size):
+        data = bytearray(size)
+        end = addr + size
+        idx = max(bisect.bisect_right(self._starts, addr) - 1, 0)
+        while idx < len(self._segments) and self._segments[idx][0] < end:
+            vaddr, memsz, offset, filesz = self._segments[idx]
+            lo = max(addr, vaddr)
+            hi = min(end, vaddr + filesz)
+            if lo < hi:
+                data[lo - addr:hi - addr] = os.pread(self._fd, hi - lo, offset + lo - vaddr)
+            idx += 1
+        return bytes(data)
+
+
+def _field_layout(gdb_type, names):
+    """name -> (offset, size) of the given fields of gdb_type"""
+    return {f.name: (int(f.bitpos / 8), f.type.sizeof) for f in gdb_type.fields() if f.name in names}
+
+
+class shard_regions(object):
+    """
+    What the `scylla all-shards` analyses of the current shard need, extracted with gdb.
+
+    Holds plain values only, so it can be passed to worker processes: the
+    addresses and the layouts of the raw memory regions to analyze, like the
+    page table and the sstable lists, and the few counters which are cheaper
+    to read with gdb than to find in raw memory.
+    """
+    def __init__(self, analyses):
+        self.shard = current_shard()
+        self.analyses = analyses
+        self.pages = page_table.layout()
+        small_pool = gdb.lookup_type('seastar::memory::small_pool')
+        self.small_pool = _field_layout(small_pool, ('_object_size', '_free'))
+        self.text_ranges = get_text_ranges() if 'task-histogram' in analyses else None
+        self.counters = {}
+        if 'memory' in analyses:
+            self._extract_memory()
+        if 'memtables' in analyses:
+            self._extract_memtables()
+        self.sstable_lists = []  # (list root, offset of the list hook in sstable, offset of next_ in hook)
+        self.sstable = {}  # field layout of sstables::sstable
+        if 'sstables' in analyses:
+            self._extract_sstables()
+
+    def _extract_memory(self):
+        cpu_mem = gdb.parse_and_eval('\'seastar::memory::cpu_mem\'')
+        page_size = self.pages[0]
+        self.counters['total'] = int(cpu_mem['nr_pages']) * page_size
+        self.counters['free'] = int(cpu_mem['nr_free_pages']) * page_size
+        lsa = get_lsa_segment_pool()
+        segment_size = int(gdb.parse_and_eval('\'logalloc::segment::size\''))
+        self.counters['lsa'] = ((int(lsa['_free_segments']) + int(lsa['_segments_in_use'])) * segment_size
+                                + int(lsa['_non_lsa_memory_in_use']))
+
+    def _extract_memtables(self):
+        # Like `scylla memory`
+        lsa = get_lsa_segment_pool()
+        segment_size = int(gdb.parse_and_eval('\'logalloc::segment::size\''))
+        lsa_allocated = ((int(lsa['_free_segments']) + int(lsa['_segments_in_use'])) * segment_size
+                         + int(lsa['_non_lsa_memory_in_use']))
+        db = find_db()
+        cache = lsa_region(db['_row_cache_tracker']['_region']).total()
+        self.counters['cache'] = cache
+        self.counters['memtables'] = lsa_allocated - cache
+        self.counters['dirty'] = (dirty_mem_mgr(db['_dirty_memory_manager']).real_dirty()
+                                  + dirty_mem_mgr(db['_system_dirty_memory_manager']).real_dirty())
+
+    def _extract_sstables(self):
+        # Like find_sstables()
+        lists = []
+        try:
+            db = find_db(current_shard())
+            for manager_name in ('_user_sstables_manager', '_system_sstables_manager'):
+                manager = std_unique_ptr(db[manager_name]).get()
+                for list_name in ('_active', '_undergoing_close'):
+                    lists.append(intrusive_list(manager[list_name], link='_manager_link'))
+        except gdb.error:
+            # Scylla Enterprise 2020.1 compatibility
+            lists = [intrusive_list(gdb.parse_and_eval('sstables::tracker._sstables'), link='_tracker_link')]
+        for lst in lists:
+            self.sstable_lists.append((int(lst.root.address), int(lst.link_offset), get_field_offset(lst.root.type, 'next_')))
+        self.sstable = _field_layout(lists[0].node_type, ('_data_file_size', '_open'))
+
+
+def analyze_shard(regions, memory):
+    """
+    The results of the `scylla all-shards` analyses of a shard, as a dict.
+
+    Works on raw memory only, read with memory.read_memory(), the regions to
+    read are described by regions, a shard_regions.
+    """
+    result = dict(regions.counters)
+    result['shard'] = regions.shard
+    pages = page_table(regions.pages, memory)
+    page_size = pages.page_size
+
+    def field(addr, layout, name):
+        offset, size = layout[name]
+        return int.from_bytes(memory.read_memory(addr + offset, size), 'little')
+
+    if 'memory' in regions.analyses or 'small-objects' in regions.analyses:
+        small = 0
+        large = 0
+        pools = defaultdict(list)  # small_pool address -> first pages of its spans
+        for first, span_size in pages.spans():
+            if pages.field(first, 'free'):
+                continue
+            pool = pages.field(first, 'pool')
+            if pool:
+                small += span_size * page_size
+                pools[pool].append(first)
+            else:
+                large += span_size * page_size
+        result['small'] = small
+        result['large'] = large
+
+        if 'small-objects' in regions.analyses:
+            # object size -> [live objects, free objects, memory]
+            size_classes = defaultdict(lambda: [0, 0, 0])
+            for pool, firsts in pools.items():
+                object_size = field(pool, regions.small_pool, '_object_size')
+                if object_size == 0:
+                    continue
+                capacity = sum(pages.used_span_size(first) * page_size // object_size for first in firsts)
+                free = len(read_free_list(memory, field(pool, regions.small_pool, '_free')))
+                free += sum(len(read_free_list(memory, pages.field(first, 'freelist'))) for first in firsts)
+                size_class = size_classes[object_size]
+                size_class[0] += capacity - free
+                size_class[1] += free
+                size_class[2] += sum(pages.field(first, 'span_size') for first in firsts) * page_size
+            result['size_classes'] = dict(size_classes)
+
+    if 'task-histogram' in regions.analyses:
+        index = heap_index.scan(pages, memory, regions.text_ranges, lambda pool: field(pool, regions.small_pool, '_object_size'))
+        result['vtables'] = index.vtable_counts()
+
+    if 'sstables' in regions.analyses:
+        count = 0
+        data_file_size = 0
+        for root, link_offset, next_offset in regions.sstable_lists:
+            seen = set()
+            hook = read_word(memory, root + next_offset)
+            while hook and hook != root and hook not in seen:
+                seen.add(hook)
+                sst = hook - link_offset
+                if '_open' not in regions.sstable or field(sst, regions.sstable, '_open'):
+                    count += 1
+                    data_file_size += field(sst, regions.sstable, '_data_file_size')
+                hook = read_word(memory, hook + next_offset)
+        result['sstables'] = count
+        result['data_file_size'] = data_file_size
+
+    return result
+
+
+_worker_core = None  # the core_memory of a worker process
+
+
+def _analyze_shard_in_worker(core, regions):
+    global _worker_core
+    if _worker_core is None:
+        _worker_core = core_memory(core)
+    return analyze_shard(regions, _worker_core)
+
+
+class scylla_all_shards(gdb.Command):
+    """Analyze all shards at once and print the results in a table, one row per shard.
+
+    Answers node-wide questions, like which shard holds the most LSA memory
+    or sstables, in one go. With gdb, only the addresses of the raw memory
+    regions to analyze (e.g. the page tables and the sstable lists) and a few
+    counters are extracted from each shard. The regions themselves are
+    analyzed by worker processes, which read them directly from the core file.
+    When debugging a live process, the shards are analyzed one after the
+    other instead.
+
+    Analyses:
+    * memory: total, free, small-pool, large and LSA memory, see `scylla memory`.
+    * memtables: memtable and cache memory, real dirty memory, see `scylla memory`.
+    * sstables: the number of open sstables and the total size of their data files.
+    * small-objects: the live and free objects of all small pools, and the size class using the most memory.
+    * task-histogram: the number of objects of the most common virtual types.
+
+    Example:
+    (gdb) scylla all-shards memory sstables
+    Extracted the regions of 2 shards in 0.4s
+    Analyzed 2 shards in 2.1s
+
+    shard       total       free      small     large         lsa sstables   data_file
+        0  8589934592 1073741824 2147483648 268435456  5100273664       95 12884901888
+        1  8589934592  943718400 2181038080 402653184  5062524928      102 14495514624
+    total 17179869184 2017460224 4328521728 671088640 10162798592      197 27380416512
+    """
+    _analyses = ('memory', 'memtables', 'sstables', 'small-objects', 'task-histogram')
+
+    def __init__(self):
+        gdb.Command.__init__(self, 'scylla all-shards', gdb.COMMAND_USER, gdb.COMPLETE_COMMAND)
+
+    def invoke(self, arg, from_tty):
+        parser = argparse.ArgumentParser(description="scylla all-shards")
+        parser.add_argument("-j", "--jobs", action="store", type=int, default=os.cpu_count(),
+                help="The number of worker processes. Defaults to the number of CPUs. With 1, shards are analyzed by gdb itself.")
+        parser.add_argument("-t", "--top", action="store", type=int, default=5,
+                help="The number of virtual types to show with task-histogram. Defaults to 5.")
+        parser.add_argument("analyses", action="store", nargs="*", metavar="ANALYSIS",
+                help="The analyses to run: {}. Defaults to all of them.".format(', '.join(self._analyses)))
+
+        try:
+            args = parser.parse_args(arg.split())
+        except SystemExit:
+            return
+
+        unknown = set(args.analyses) - set(self._analyses)
+        if unknown:
+            gdb.write('Unknown analyses: {}, choose from: {}\n'.format(', '.join(sorted(unknown)), ', '.join(self._analyses)))
+            return
+        analyses = tuple(args.analyses) or self._analyses
+
+        start = time.time()
+        all_regions = []
+        orig = gdb.selected_thread()
+        try:
+            for r in reactors():
+                all_regions.append(shard_regions(analyses))
+        finally:
+            orig.switch()
+        gdb.write('Extracted the regions of {} shards in {:.1f}s\n'.format(len(all_regions), time.time() - start))
+
+        core = core_file_path()
+        jobs = min(args.jobs, len(all_regions))
+        if core is not None and jobs > 1:
+            import multiprocessing
+            # Workers are forked, so they inherit this module, but they only touch the core file.
+            with multiprocessing.get_context('fork').Pool(jobs) as pool:
+                results = pool.starmap(_analyze_shard_in_worker, [(core, regions) for regions in all_regions])
+        else:
+            inf = gdb.selected_inferior()
+            results = [analyze_shard(regions, inf) for regions in all_regions]
+        results.sort(key=lambda result: result['shard'])
+        gdb.write('Analyzed {} shards in {:.1f}s\n\n'.format(len(results), time.time() - start))
+
+        self._print_table(results, analyses, args.top)
+
+    @staticmethod
+    def _row(result, analyses, vptrs):
+        """(heading, value) of the columns of the row of a shard"""
+        row = []
+        if 'memory' in analyses:
+            row += [(name, result[name]) for name in ('total', 'free', 'small', 'large', 'lsa')]
+        if 'memtables' in analyses:
+            row += [(name, result[name]) for name in ('memtables', 'cache', 'dirty')]
+        if 'sstables' in analyses:
+            row += [('sstables', result['sstables']), ('data_file', result['data_file_size'])]
+        if 'small-objects' in analyses:
+            size_classes = result['size_classes']
+            row += [('live_objs', sum(c[0] for c in size_classes.values())),
+                    ('free_objs', sum(c[1] for c in size_classes.values())),
+                    ('top_objsz', max(size_classes, key=lambda size: size_classes[size][2], default=0))]
+        for i, vptr in enumerate(vptrs):
+            row.append(('#{}'.format(i + 1), result['vtables'].get(vptr, 0)))
+        return row
+
+    @staticmethod
+    def _print_table(results, analyses, top):
+        vptrs = []
+        if 'task-histogram' in analyses:
+            vtables = Counter()
+            for result in results:
+                vtables.update(result['vtables'])
+            vptrs = [vptr for vptr, count in vtables.most_common(top)]
+
+        rows = [scylla_all_shards._row(result, analyses, vptrs) for result in results]
+        headings = ['shard'] + [heading for heading, value in rows[0]] if rows else ['shard']
+        # The total of a size class is meaningless
+        totals = ['total'] + [sum(column) if heading != 'top_objsz' else ''
+                              for heading, column in zip(headings[1:], zip(*[[value for heading, value in row] for row in rows]))]
+        lines = [headings] + [[result['shard']] + [value for heading, value in row] for result, row in zip(results, rows)] + [totals]
+        widths = [max(len(str(line[i])) for line in lines) for i in range(len(headings))]
+        for line in lines:
+            gdb.write('{}\n'.format(' '.join('{:>{}}'.format(value, width) for value, width in zip(line, widths))))
+
+        if vptrs:
+            names = resolve_many(vptrs)
+            gdb.write('\n')
+            for i, vptr in enumerate(vptrs):
+                gdb.write('{:>4} 0x{:x} {}\n'.format('#{}'.format(i + 1), vptr, names[vptr]))
+
+
+class scylla_digest(gdb.Command):
+    """Walk all shards once and write a columnar snapshot of the main Scylla structures to a file.
+
+    The digest holds the tables, sstables, memtables, LSA regions, task queues
+    and reader permits of all shards, the memory of the small pools by size
+    class and the top allocation sites of the heap profiler (when it is
+    enabled). Each of these is a table, stored column by column as lists of
+    plain values with a `shard` column, in a gzipped JSON file. Structures
+    which can't be walked on a shard, e.g. because this Scylla version doesn't
+    have them, are skipped and listed in the `errors` of the digest.
+
+    The digest can be queried without gdb, with scripts/scylla-digest.py, or
+    loaded into pandas directly:
+
+        digest = json.load(gzip.open('core.digest'))
+        sstables = pandas.DataFrame(digest['tables']['sstables'])
+
+    This way triage queries don't walk the core again, and the digests of
+    many cores can be compared.
+
+    Example:
+    (gdb) scylla digest -o /tmp/core.digest
+    Walked 2 shards in 12.3s
+    Wrote /tmp/core.digest: tables=412, sstables=1523, memtables=824, lsa_regions=830, task_queues=28, reader_permits=9, size_classes=76, alloc_sites=0
+    """
+    format = 'scylla-digest'
+    version = 1
+
+    def __init__(self):
+        gdb.Command.__init__(self, 'scylla digest', gdb.COMMAND_USER, gdb.COMPLETE_FILENAME)
+
+    @staticmethod
+    def _table_columns():
+        return {
+            'tables': ('shard', 'address', 'keyspace', 'table', 'memtables', 'sstables'),
+            'sstables': ('shard', 'address', 'keyspace', 'table', 'filename', 'local', 'data_file_size', 'in_memory'),
+            'memtables': ('shard', 'address', 'keyspace', 'table', 'total', 'used', 'free', 'flushed'),
+            'lsa_regions': ('shard', 'id', 'address', 'reclaimable', 'evictable', 'non_lsa', 'closed_lsa', 'unused'),
+            'task_queues': ('shard', 'id', 'name', 'shares', 'tasks', 'active', 'current'),
+            'reader_permits': ('shard', 'semaphore', 'table', 'description', 'state', 'permits', 'count', 'memory'),
+            'size_classes': ('shard', 'object_size', 'live', 'free', 'memory'),
+            'alloc_sites': ('shard', 'size', 'count', 'backtrace', 'symbols'),
+        }
+
+    @staticmethod
+    def _tables(shard):
+        region_ptr_type = gdb.lookup_type('logalloc::region').pointer()
+        for table in for_each_table():
+            schema = schema_ptr(table['_schema'])
+            ks, cf = str(schema.ks_name)[1:-1], str(schema.cf_name)[1:-1]
+            memtables = list(scylla_memtables.memtables(table))
+            sstables = std_unordered_set(seastar_lw_shared_ptr(seastar_lw_shared_ptr(table['_sstables']).get()['_all']).get().dereference())
+            yield 'tables', (shard, int(table.address), ks, cf, len(memtables), len(sstables))
+            for mt in memtables:
+                reg = lsa_region(mt.cast(region_ptr_type))
+                yield 'memtables', (shard, int(mt), ks, cf, reg.total(), reg.used(), reg.free(), int(mt['_flushed_memory']))
+
+    @staticmethod
+    def _sstables(shard):
+        for sst in find_sstables():
+            if not scylla_sstables.is_open(sst):
+                continue
+            schema = schema_ptr(sst['_schema'])
+            yield 'sstables', (shard, int(sst), str(schema.ks_name)[1:-1], str(schema.cf_name)[1:-1],
+                               scylla_sstables.filename(sst), int(sst['_components']['_cpu']) == shard,
+                               int(sst['_data_file_size']), int(scylla_sstables.memory_footprint(sst)[0]))
+
+    @staticmethod
+    def _lsa_regions(shard):
+        for region in lsa_regions():
+            yield 'lsa_regions', (shard, int(region['_id']), int(region.dereference()), bool(region['_reclaiming_enabled']),
+                                  bool(region['_evictable']), int(region['_non_lsa_occupancy']['_total_space']),
+                                  int(region['_closed_occupancy']['_total_space']), int(region['_closed_occupancy']['_free_space']))
+
+    @staticmethod
+    def _task_queues(shard):
+        for tq in get_local_task_queues():
+            yield 'task_queues', (shard, int(tq['_id']), str(tq['_name'])[1:-1], float(tq['_shares']),
+                                  len(circular_buffer(tq['_q'])), bool(tq['_active']), bool(tq['_current']))
+
+    @staticmethod
+    def _reader_permits(shard):
+        for semaphore in scylla_read_stats.local_semaphores():
+            # (table, description, state) -> stats, like `scylla read-stats`
+            summaries = defaultdict(permit_stats)
+            for table, description, state, count, memory in scylla_read_stats.permits(semaphore):
+                summaries[(table, description, state)].add(permit_stats(count, memory))
+            name = str(semaphore['_name'])[1:-1]
+            for (table, description, state), stats in summaries.items():
+                yield 'reader_permits', (shard, name, table, description, state,
+                                         stats.permits, stats.resource_count, stats.resource_memory)
+
+    @staticmethod
+    def _size_classes(shard):
+        result = analyze_shard(shard_regions(('small-objects',)), gdb.selected_inferior())
+        for object_size, (live, free, memory) in sorted(result['size_classes'].items()):
+            yield 'size_classes', (shard, object_size, live, free, memory)
+
+    @staticmethod
+    def _alloc_sites(shard, top):
+        sites = sorted(alloc_sites(), key=lambda site: site[0], reverse=True)[:top]
+        names = resolve_many({addr for size, count, addresses in sites for addr in addresses})
+        for size, count, addresses in sites:
+            yield 'alloc_sites', (shard, size, count, ['0x{:x}'.format(addr) for addr in addresses],
+                                  [(names[addr] or '0x{:x}'.format(addr)).strip() for addr in addresses])
+
+    def invoke(self, arg, from_tty):
+        parser = argparse.ArgumentParser(description="scylla digest")
+        parser.add_argument("-o", "--output", action="store", default="scylla.digest",
+                help="The file to write the digest to. Defaults to scylla.digest.")
+        parser.add_argument("--top-sites", action="store", type=int, default=100,
+                help="The number of the largest allocation sites to include, per shard. Defaults to 100.")
+        try:
+            args = parser.parse_args(arg.split())
+        except SystemExit:
+            return
+
+        columns = self._table_columns()
+        tables = {name: {column: [] for column in names} for name, names in columns.items()}
+        errors = []
+        walks = [('tables', self._tables), ('sstables', self._sstables), ('lsa_regions', self._lsa_regions),
+                 ('task_queues', self._task_queues), ('reader_permits', self._reader_permits),
+                 ('size_classes', self._size_classes), ('alloc_sites', lambda shard: self._alloc_sites(shard, args.top_sites))]
+
+        start = time.time()
+        shards = 0
+        for r in reactors():
+            shard = int(r['_id'])
+            shards += 1
+            for walk_name, walk in walks:
+                # Only keep complete walks, a half-walked structure is misleading
+                rows = []
+                try:
+                    rows = list(walk(shard))
+                except gdb.error as e:
+                    errors.append({'shard': shard, 'walk': walk_name, 'error': str(e)})
+                for name, row in rows:
+                    for column, value in zip(columns[name], row):
+                        tables[name][column].append(value)
+        gdb.write('Walked {} shards in {:.1f}s\n'.format(shards, time.time() - start))
+
+        digest = {
+            'format': self.format,
+            'version': self.version,
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'core': core_file_path(),
+            'executable': gdb.current_progspace().filename,
+            'shards': shards,
+            'errors': errors,
+            'tables': tables,
+        }
+        with gzip.open(args.output, 'wt') as f:
+            json.dump(digest, f, separators=(',', ':'))
+
+        gdb.write('Wrote {}: {}\n'.format(args.output, ', '.join('{}={}'.format(name, len(table['shard'])) for name, table in tables.items())))
+        for error in errors:
+            gdb.write('Skipped {walk} on shard {shard}: {error}\n'.format(**error))
+
 
 def escape_html(s):
     return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
@@ -5378,12 +6852,9 @@ class scylla_read_stats(gdb.Command):
         gdb.Command.__init__(self, 'scylla read-stats', gdb.COMMAND_USER, gdb.COMPLETE_COMMAND)
 
     @staticmethod
-    def dump_reads_from_semaphore(semaphore):
-        try:
-            permit_list = semaphore['_permit_list']
-        except gdb.error:
-            gdb.write("Scylla version doesn't seem to have the permits linked yet, cannot list reads.")
-            raise
+    def permits(semaphore):
+        """Yields (table, description, state, count, memory) of the permits of the semaphore"""
+        permit_list = semaphore['_permit_list']
 
         if not permit_list.type.strip_typedefs().name.startswith('boost::intrusive::list'):
             # 4.5 compatibility
@@ -5391,10 +6862,6 @@ class scylla_read_stats(gdb.Command):
 
         state_prefix_len = len('reader_permit::state::')
 
-        # (table, description, state) -> stats
-        permit_summaries = defaultdict(permit_stats)
-        total = permit_stats()
-
         for permit in intrusive_list(permit_list):
             try:
                 schema = permit['_schema']['_p']
@@ -5410,7 +6877,22 @@ class scylla_read_stats(gdb.Command):
 
             description = str(permit['_op_name_view'])[1:-1]
             state = str(permit['_state'])[state_prefix_len:]
-            summary = permit_stats(int(permit['_resources']['count']), int(permit['_resources']['memory']))
+            yield schema_name, description, state, int(permit['_resources']['count']), int(permit['_resources']['memory'])
+
+    @staticmethod
+    def dump_reads_from_semaphore(semaphore):
+        try:
+            semaphore['_permit_list']
+        except gdb.error:
+            gdb.write("Scylla version doesn't seem to have the permits linked yet, cannot list reads.")
+            raise
+
+        # (table, description, state) -> stats
+        permit_summaries = defaultdict(permit_stats)
+        total = permit_stats()
+
+        for schema_name, description, state, count, memory in scylla_read_stats.permits(semaphore):
+            summary = permit_stats(count, memory)
 
             permit_summaries[(schema_name, description, state)].add(summary)
             total.add(summary)
@@ -5449,17 +6931,23 @@ class scylla_read_stats(gdb.Command):
 
         gdb.write("{:10} {:5} {:12} Total\n".format(total.permits, total.resource_count, total.resource_memory))
 
+    @staticmethod
+    def local_semaphores():
+        """The reader concurrency semaphores of the local database instance"""
+        db = find_db()
+        semaphores = [db["_read_concurrency_sem"], db["_streaming_concurrency_sem"], db["_system_read_concurrency_sem"]]
+        try:
+            semaphores.append(db["_compaction_concurrency_sem"])
+        except gdb.error:
+            # 2020.1 compatibility
+            pass
+        return semaphores
+
     def invoke(self, args, from_tty):
         if args:
             semaphores = [gdb.parse_and_eval(arg) for arg in args.split(' ')]
         else:
-            db = find_db()
-            semaphores = [db["_read_concurrency_sem"], db["_streaming_concurrency_sem"], db["_system_read_concurrency_sem"]]
-            try:
-                semaphores.append(db["_compaction_concurrency_sem"])
-            except gdb.error:
-                # 2020.1 compatibility
-                pass
+            semaphores = scylla_read_stats.local_semaphores()
 
         for semaphore in semaphores:
             scylla_read_stats.dump_reads_from_semaphore(semaphore)
@@ -5844,6 +7332,7 @@ scylla_fiber()
 scylla_find()
 scylla_task_histogram()
 scylla_active_sstables()
+scylla_heap_index()
 scylla_netw()
 scylla_gms()
 scylla_cache()
@@ -5851,6 +7340,8 @@ scylla_sstable_summary()
 scylla_sstable_index_cache()
 scylla_sstables()
 scylla_memtables()
+scylla_all_shards()
+scylla_digest()
 scylla_generate_object_graph()
 scylla_smp_queues()
 scylla_features()
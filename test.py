@@ -9,11 +9,13 @@
 import argparse
 import asyncio
 import collections
+import copy
 import colorama
 import difflib
 import filecmp
 import glob
 import itertools
+import json
 import logging
 import multiprocessing
 import os
@@ -34,14 +36,21 @@ from abc import ABC, abstractmethod
 from io import StringIO
 from scripts import coverage    # type: ignore
 from test.pylib.artifact_registry import ArtifactRegistry
+from test.pylib.boost_case_cache import BoostCaseCache, list_cases
+from test.pylib.duration_history import DurationHistory, longest_first, schedule_summary, ideal_makespan
 from test.pylib.host_registry import HostRegistry
-from test.pylib.pool import Pool
+from test.pylib.pool import Pool, PoolBudget
+from test.pylib.xml_report import StreamingXmlReport
+from test.pylib.cpu_slots import SlotPool, parse_cpu_list
+from test.pylib.coverage_stream import IncrementalCoverage, run_profile_dir
+from test.pylib.impact_map import ImpactMap, changed_lines, impact_key, select_tests
+from test.pylib.resource_usage import ChildProcess, MemoryHistory, ResourceUsage, estimate_test_memory
 from test.pylib.util import LogPrefixAdapter
 from test.pylib.scylla_cluster import ScyllaServer, ScyllaCluster, get_cluster_manager, merge_cmdline_options
 from test.pylib.minio_server import MinioServer
-from typing import Dict, List, Callable, Any, Iterable, Optional, Awaitable, Union
+from typing import Dict, List, Callable, Any, Iterable, Optional, Awaitable, Set, Union
 import logging
-from test.pylib import coverage_utils
+from test.pylib import coverage_utils, lcov_utils
 import humanfriendly
 import treelib
 
@@ -49,6 +58,13 @@ launch_time = time.monotonic()
 
 output_is_a_tty = sys.stdout.isatty()
 
+# Peak memory usage of tests, in {tmpdir}, used by --jobs=auto
+PEAK_MEMORY_HISTORY = "test_peak_memory.json"
+# Source lines covered by each test, in {tmpdir}, used by --changed-since
+IMPACT_MAP = "test_impact_map.json"
+# Types and build ids of binaries and profiles, in {tmpdir}, used by --coverage
+BINARY_INFO_CACHE = "coverage_binary_cache.json"
+
 all_modes = {'debug': 'Debug',
              'release': 'RelWithDebInfo',
              'dev': 'Dev',
@@ -111,6 +127,16 @@ class TestSuite(ABC):
     suites: Dict[str, 'TestSuite'] = dict()
     artifacts = ArtifactRegistry()
     hosts = HostRegistry()
+    # Limits Scylla servers started ahead of demand by all cluster pools
+    cluster_pool_budget: Optional[PoolBudget] = None
+    # CPU slots for test processes and Scylla servers, with --cpu-slots
+    slots: Optional[SlotPool] = None
+    # With --changed-since, the coverage of tests in previous runs and
+    # the keys of the tests (or suites) which cover the changes
+    impact_map: Optional[ImpactMap] = None
+    # With --coverage-incremental, processes the coverage of tests as they finish
+    coverage_stream: Optional[IncrementalCoverage] = None
+    impacted: Set[str] = set()
     FLAKY_RETRIES = 5
     _next_id = collections.defaultdict(int) # (test_key -> id)
 
@@ -238,15 +264,20 @@ class TestSuite(ABC):
             self.pending_test_count -= 1
             self.n_failed += int(not test.success)
             if self.pending_test_count == 0:
+                await self.finish()
                 await TestSuite.artifacts.cleanup_after_suite(self, self.n_failed > 0)
         return test
 
-    def junit_tests(self):
-        """Tests which participate in a consolidated junit report"""
-        return self.tests
+    async def finish(self) -> None:
+        """Called after the last test of the suite, before the suite
+        artifacts are cleaned up. Stops the work the suite does in
+        the background, which could otherwise register artifacts
+        after they are cleaned up."""
+        pass
 
-    def boost_tests(self):
-        return []
+    def add_to_report(self, test: 'Test', report: 'TestReport') -> None:
+        """Add a finished test to the consolidated junit report"""
+        report.add_junit(test)
 
     def build_test_list(self) -> List[str]:
         return [os.path.splitext(t.relative_to(self.suite_path))[0] for t in
@@ -269,6 +300,8 @@ class TestSuite(ABC):
             patterns = options.name if options.name else [t]
             if options.skip_pattern and options.skip_pattern in t:
                 continue
+            if options.changed_since and not self.is_impacted(shortname):
+                continue
 
             async def add_test(shortname) -> None:
                 # Add variants of the same test sequentially
@@ -289,6 +322,13 @@ class TestSuite(ABC):
                 task.cancel()
             await asyncio.gather(*pending, return_exceptions=True)
             raise
+    def is_impacted(self, shortname: str) -> bool:
+        """With --changed-since, whether the test may be affected by the changes.
+        Tests which never ran with --coverage-test-map are always run."""
+        if not TestSuite.impact_map.is_known(self.name, shortname):
+            return True
+        return impact_key(self.name, shortname) in TestSuite.impacted or self.name in TestSuite.impacted
+
     def need_coverage(self):
         return self.options.coverage and (self.mode in self.options.coverage_modes) and bool(self.cfg.get("coverage",True))
 
@@ -334,9 +374,28 @@ class BoostTestSuite(UnitTestSuite):
     # A cache of individual test cases, for which we have called
     # --list_content. Static to share across all modes.
     _case_cache: Dict[str, List[str]] = dict()
+    # Case lists from previous test.py runs
+    _persistent_case_cache: Optional[BoostCaseCache] = None
+    # Limits the number of concurrent --list_content runs
+    _list_semaphore: Optional[asyncio.Semaphore] = None
 
     def __init__(self, path, cfg: dict, options: argparse.Namespace, mode) -> None:
         super().__init__(path, cfg, options, mode)
+        if BoostTestSuite._persistent_case_cache is None:
+            BoostTestSuite._persistent_case_cache = BoostCaseCache(
+                pathlib.Path(options.tmpdir) / "boost_test_cases.json")
+            BoostTestSuite._list_semaphore = asyncio.Semaphore(multiprocessing.cpu_count())
+
+    @staticmethod
+    def save_case_cache() -> None:
+        if BoostTestSuite._persistent_case_cache is not None:
+            try:
+                BoostTestSuite._persistent_case_cache.save()
+            except OSError as e:
+                logging.warning("Failed to save Boost test case cache: %s", e)
+
+    async def list_cases(self, exe: str) -> List[str]:
+        return await list_cases(exe, self._persistent_case_cache, self._list_semaphore, self.options.timeout)
 
     async def create_test(self, shortname: str, suite, args) -> None:
         exe = path_to(suite.mode, "test", suite.name, shortname)
@@ -348,18 +407,7 @@ class BoostTestSuite(UnitTestSuite):
         if options.parallel_cases and (shortname not in self.no_parallel_cases):
             fqname = os.path.join(self.mode, self.name, shortname)
             if fqname not in self._case_cache:
-                process = await asyncio.create_subprocess_exec(
-                    exe, *['--list_content'],
-                    stderr=asyncio.subprocess.PIPE,
-                    stdout=asyncio.subprocess.PIPE,
-                    env=dict(os.environ,
-                             **{"ASAN_OPTIONS": "halt_on_error=0"}),
-                    preexec_fn=os.setsid,
-                )
-                _, stderr = await asyncio.wait_for(process.communicate(), options.timeout)
-
-                case_list = [case[:-1] for case in stderr.decode().splitlines() if case.endswith('*')]
-                self._case_cache[fqname] = case_list
+                self._case_cache[fqname] = await self.list_cases(exe)
 
             case_list = self._case_cache[fqname]
             if len(case_list) == 1:
@@ -373,12 +421,9 @@ class BoostTestSuite(UnitTestSuite):
             test = BoostTest(self.next_id((shortname, self.suite_key)), shortname, suite, args, None, allows_compaction_groups)
             self.tests.append(test)
 
-    def junit_tests(self) -> Iterable['Test']:
+    def add_to_report(self, test: 'Test', report: 'TestReport') -> None:
         """Boost tests produce an own XML output, so are not included in a junit report"""
-        return []
-
-    def boost_tests(self) -> Iterable['Tests']:
-        return self.tests
+        report.add_boost(test)
 
 class PythonTestSuite(TestSuite):
     """A collection of Python pytests against a single Scylla instance"""
@@ -406,7 +451,22 @@ class PythonTestSuite(TestSuite):
             await cluster.stop()
             await cluster.release_ips()
 
-        self.clusters = Pool(pool_size, self.create_cluster, recycle_cluster)
+        if TestSuite.cluster_pool_budget is None:
+            TestSuite.cluster_pool_budget = PoolBudget(options.cluster_pool_budget)
+        prefetch_logger = LogPrefixAdapter(logging.getLogger(self.suite_key),
+                                           {'prefix': self.suite_key + '/prefetch'})
+        # The budget is counted in clusters, so that it doesn't rule out
+        # prefetching clusters bigger than the leftover memory estimate.
+        self.clusters = Pool(pool_size, self.create_cluster, recycle_cluster,
+                             prefetch=cfg.get("cluster_pool_prefetch", options.cluster_pool_prefetch),
+                             prefetch_args=(prefetch_logger,),
+                             budget=TestSuite.cluster_pool_budget,
+                             prefetch_cost=1)
+        self.artifacts.add_exit_artifact(self, self.clusters.close)
+
+    async def finish(self) -> None:
+        # Stop prefetching clusters nobody will use and stop the prefetched ones
+        await self.clusters.close()
 
     def get_cluster_factory(self, cluster_size: int, options: argparse.Namespace) -> Callable[..., Awaitable]:
         def create_server(create_cfg: ScyllaCluster.CreateServerParams):
@@ -437,7 +497,8 @@ class PythonTestSuite(TestSuite):
                 cmdline_options=cmdline_options,
                 config_options=config_options,
                 property_file=create_cfg.property_file,
-                append_env=self.base_env)
+                append_env=self.base_env,
+                slots=TestSuite.slots)
 
             return server
 
@@ -588,8 +649,23 @@ class Test:
         # shouldn't be retried, even if it is flaky
         self.is_cancelled = False
         self.env = dict(self.suite.base_env)
+        if self.suite.need_coverage() and suite.options.coverage_incremental:
+            # A directory per test run, processed as soon as the run
+            # finishes, see IncrementalCoverage
+            self.env["LLVM_PROFILE_FILE"] = str(run_profile_dir(self) / "%m.profraw")
+        elif self.suite.need_coverage() and suite.options.coverage_test_map:
+            # A directory per test executable, so that its coverage can be told
+            # apart, see process_coverage()
+            self.env["LLVM_PROFILE_FILE"] = os.path.join(
+                suite.options.tmpdir, self.mode, "coverage", self.suite.name, "tests",
+                self.shortname.split('.')[0], "%m.profraw")
         Test._reset(self)
 
+    @property
+    def duration_key(self) -> str:
+        """Identifies the test in the duration history, stable across runs"""
+        return "{}/{}".format(self.suite.name, self.shortname)
+
     def reset(self) -> None:
         """Reset this object, including all derived state."""
         for cls in reversed(self.__class__.__mro__):
@@ -602,6 +678,14 @@ class Test:
         self.success = False
         self.time_start: float = 0
         self.time_end: float = 0
+        # CPU time, peak memory and I/O of the test process, see run_test()
+        self.rusage: Optional[ResourceUsage] = None
+
+    def add_servers_rss(self, rss: int) -> None:
+        """Account the peak memory of the Scylla servers the test used,
+        which are not descendants of the test process"""
+        if self.rusage is not None:
+            self.rusage.servers_max_rss = max(self.rusage.servers_max_rss, rss)
 
     @abstractmethod
     async def run(self, options: argparse.Namespace) -> 'Test':
@@ -679,17 +763,20 @@ class BoostTest(UnitTest):
         self.args = boost_args + self.args
         self.casename = casename
         BoostTest._reset(self)
-        self.__test_case_elements: list[ET.Element] = []
         self.allows_compaction_groups = allows_compaction_groups
 
     def _reset(self) -> None:
         """Reset the test before a retry, if it is retried as flaky"""
-        self.__test_case_elements = []
+        self.__test_case_elements: Optional[list[ET.Element]] = None
 
-    def get_test_cases(self) -> list[ET.Element]:
-        if not self.__test_case_elements:
+    def pop_test_cases(self) -> list[ET.Element]:
+        """Test cases of the last run, released once they are reported"""
+        if self.__test_case_elements is None:
+            # The XML output of a failed run is not parsed by check_log()
             self.__parse_logger()
-        return self.__test_case_elements
+        test_cases = self.__test_case_elements or []
+        self.__test_case_elements = []
+        return test_cases
 
     @staticmethod
     def test_path_of_element(test: ET.Element) -> TestPath:
@@ -707,14 +794,29 @@ class BoostTest(UnitTest):
             test.attrib['mode'] = self.mode
             return test
 
+        if not os.path.exists(self.xmlout):
+            self.__test_case_elements = []
+            return
         try:
-            root = ET.parse(self.xmlout).getroot()
-            # only keep the tests which actually ran, the skipped ones do not have
-            # TestingTime tag in the corresponding TestCase tag.
-            self.__test_case_elements = map(attach_path_and_mode,
-                                            root.findall(".//TestCase[TestingTime]"))
+            test_cases = []
+            # Only keep the tests which actually ran, the skipped ones do not have
+            # TestingTime tag in the corresponding TestCase tag. Parse incrementally
+            # and drop everything else, the output of a test can be large.
+            parents = []
+            for event, element in ET.iterparse(self.xmlout, events=("start", "end")):
+                if event == "start":
+                    parents.append(element)
+                    continue
+                parents.pop()
+                if element.tag == "TestCase":
+                    if element.find("TestingTime") is not None:
+                        test_cases.append(attach_path_and_mode(element))
+                    if parents:
+                        parents[-1].remove(element)
+            self.__test_case_elements = test_cases
             os.unlink(self.xmlout)
         except ET.ParseError as e:
+            self.__test_case_elements = []
             message = palette.crit(f"failed to parse XML output '{self.xmlout}': {e}")
             print(f"error: {self.name}: {message}")
 
@@ -951,6 +1053,7 @@ class PythonTest(Test):
             self.is_before_test_ok = True
             cluster.take_log_savepoint()
             status = await run_test(self, options, env=self.suite.scylla_env)
+            self.add_servers_rss(cluster.peak_rss())
             if self.shortname in self.suite.dirties_cluster:
                 cluster.is_dirty = True
             cluster.after_test(self.uname, status)
@@ -998,6 +1101,7 @@ class TopologyTest(PythonTest):
                 # Note: start manager here so cluster (and its logs) is available in case of failure
                 await manager.start()
                 self.success = await run_test(self, options)
+                self.add_servers_rss(manager.cluster.peak_rss())
             except Exception as e:
                 self.server_log = manager.cluster.read_server_log()
                 self.server_log_filename = manager.cluster.server_log_filename()
@@ -1125,7 +1229,7 @@ async def run_test(test: Test, options: argparse.Namespace, gentle_kill=False, e
             msg += "=== TEST.PY SUMMARY END ===\n"
             log.write(msg.encode(encoding="UTF-8"))
         process = None
-        stdout = None
+        slot_lease = None
         logging.info("Starting test %s: %s %s", test.uname, test.path, " ".join(test.args))
         UBSAN_OPTIONS = [
             "halt_on_error=1",
@@ -1153,13 +1257,19 @@ async def run_test(test: Test, options: argparse.Namespace, gentle_kill=False, e
 
             path = test.path
             args = test.args
-            if options.cpus:
+            if TestSuite.slots:
+                slot_lease = TestSuite.slots.lease()
+                logging.info("Running test %s in %s", test.uname, slot_lease.slot)
+                path, *args = slot_lease.wrap([test.path, *test.args])
+            elif options.cpus:
                 path = 'taskset'
                 args = ['-c', options.cpus, test.path, *test.args]
-            process = await asyncio.create_subprocess_exec(
-                path, *args,
-                stderr=log,
-                stdout=log,
+            # Not asyncio.create_subprocess_exec(), to get the resource usage
+            # of the test from wait4()
+            process = ChildProcess.spawn(
+                path, args,
+                stderr=log.fileno(),
+                stdout=log.fileno(),
                 env=dict(os.environ,
                          UBSAN_OPTIONS=":".join(filter(None, UBSAN_OPTIONS)),
                          ASAN_OPTIONS=":".join(filter(None, ASAN_OPTIONS)),
@@ -1169,10 +1279,10 @@ async def run_test(test: Test, options: argparse.Namespace, gentle_kill=False, e
                          SCYLLA_TEST_ENV='yes',
                          **env,
                          ),
-                preexec_fn=os.setsid,
             )
-            stdout, _ = await asyncio.wait_for(process.communicate(), options.timeout)
+            await asyncio.wait_for(process.wait(), options.timeout)
             test.time_end = time.time()
+            test.rusage = process.rusage
             if process.returncode not in test.valid_exit_codes:
                 report_error('Test exited with code {code}\n'.format(code=process.returncode))
                 return False
@@ -1190,7 +1300,8 @@ async def run_test(test: Test, options: argparse.Namespace, gentle_kill=False, e
                     process.terminate()
                 else:
                     process.kill()
-                stdout, _ = await process.communicate()
+                await process.wait()
+                test.rusage = process.rusage
             if isinstance(e, asyncio.TimeoutError):
                 report_error("Test timed out")
             elif isinstance(e, asyncio.CancelledError):
@@ -1198,6 +1309,9 @@ async def run_test(test: Test, options: argparse.Namespace, gentle_kill=False, e
                 report_error("Test was cancelled: the parent process is exiting")
         except Exception as e:
             report_error("Failed to run the test:\n{e}".format(e=e))
+        finally:
+            if slot_lease is not None:
+                slot_lease.release()
     return False
 
 
@@ -1216,6 +1330,12 @@ def setup_signal_handlers(loop, signaled) -> None:
         loop.add_signal_handler(signo, lambda: asyncio.create_task(shutdown(loop, signo, signaled)))
 
 
+def jobs_arg(value: str) -> Union[int, str]:
+    if value == "auto":
+        return value
+    return int(value)
+
+
 def parse_cmd_line() -> argparse.Namespace:
     """ Print usage and process command line options. """
 
@@ -1246,8 +1366,9 @@ def parse_cmd_line() -> argparse.Namespace:
                         help="timeout value for test execution")
     parser.add_argument('--verbose', '-v', action='store_true', default=False,
                         help='Verbose reporting')
-    parser.add_argument('--jobs', '-j', action="store", type=int,
-                        help="Number of jobs to use for running the tests")
+    parser.add_argument('--jobs', '-j', action="store", type=jobs_arg,
+                        help="Number of jobs to use for running the tests, or 'auto' to derive it "
+                        "from the peak memory usage of the tests measured in previous runs")
     parser.add_argument('--save-log-on-success', "-s", default=False,
                         dest="save_log_on_success", action="store_true",
                         help="Save test log output on success.")
@@ -1258,9 +1379,30 @@ def parse_cmd_line() -> argparse.Namespace:
                         help="Skip tests which match the provided pattern")
     parser.add_argument('--no-parallel-cases', dest="parallel_cases", action="store_false", default=True,
                         help="Do not run individual test cases in parallel")
+    parser.add_argument('--schedule', choices=["duration", "suite"], default="duration",
+                        help="Order in which tests are started. 'duration' starts the tests which "
+                        "took longest in previous runs first (see {tmpdir}/test_durations.json), "
+                        "keeping the tests of each suite together; "
+                        "'suite' runs them in the order they are found. Default: duration")
+    parser.add_argument('--cluster-pool-prefetch', action="store", type=int, default=0,
+                        help="Number of Scylla clusters each Python and topology suite keeps started "
+                        "ahead of demand, so tests don't wait for a cluster to boot. A suite can override "
+                        "it with cluster_pool_prefetch in its suite.yaml. Default: 0")
+    parser.add_argument('--cluster-pool-budget', action="store", type=int,
+                        help="Maximum number of Scylla clusters started ahead of demand across all "
+                        "suites. Default: the number of idle 3-node clusters which fit in the memory "
+                        "not used by --jobs, at least 1")
     parser.add_argument('--cpus', action="store",
                         help="Run the tests on those CPUs only (in taskset"
                         " acceptable format). Consider using --jobs too")
+    parser.add_argument('--cpu-slots', action="store", type=int, default=0, metavar='CPUS_PER_SLOT',
+                        help="Split the CPUs (all, or those given with --cpus) into slots of "
+                        "CPUS_PER_SLOT CPUs, and run each test and each Scylla server in the least "
+                        "loaded slot, with Scylla's --smp matching the slot. Uses cgroup v2 cpusets "
+                        "if a cgroup is delegated to test.py, taskset otherwise. Default: 0 (disabled)")
+    parser.add_argument('--slot-memory', action="store", type=humanfriendly.parse_size,
+                        help="With --cpu-slots, limit the memory of each process in a slot to this "
+                        "size (e.g. 4G) with cgroup memory.max, and give Scylla servers -m matching it")
     parser.add_argument('--log-level', action="store",
                         help="Log level for Python logging module. The log "
                         "is in {tmpdir}/test.py.log. Default: INFO",
@@ -1281,6 +1423,18 @@ def parse_cmd_line() -> argparse.Namespace:
                              "The lcov files can eventually be used for generating coverage reports")
     parser.add_argument("--coverage-mode",action = 'append', type = str, dest = "coverage_modes",
                         help = "Collect and process coverage only for the modes specified. implies: --coverage, default: All built modes")
+    parser.add_argument("--coverage-test-map", action='store_true',
+                        help="Record which source lines each test covers, for --changed-since. "
+                             "Keeps the coverage of each test executable separately, which needs "
+                             "more storage. Implies --coverage")
+    parser.add_argument("--coverage-incremental", action='store_true',
+                        help="Process the coverage of each test executable while the tests run, "
+                             "as soon as all its runs finished, instead of all of it at the end. "
+                             "Implies --coverage")
+    parser.add_argument("--changed-since", action="store", metavar="GIT_REV",
+                        help="Run only the tests which covered a line changed since GIT_REV "
+                             "(in the working tree) when they last ran with --coverage-test-map. "
+                             "Tests which never ran with --coverage-test-map are run too")
     parser.add_argument("--coverage-keep-raw",action = 'store_true',
                         help = "Do not delete llvm raw profiles when processing coverage reports.")
     parser.add_argument("--coverage-keep-indexed",action = 'store_true',
@@ -1297,19 +1451,39 @@ def parse_cmd_line() -> argparse.Namespace:
 
     args = parser.parse_args()
 
-    if not args.jobs:
-        if not args.cpus:
-            nr_cpus = multiprocessing.cpu_count()
+    if not args.cpus:
+        nr_cpus = multiprocessing.cpu_count()
+    else:
+        nr_cpus = int(subprocess.check_output(
+            ['taskset', '-c', args.cpus, 'python3', '-c',
+             'import os; print(len(os.sched_getaffinity(0)))']))
+    sysmem = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    testmem = 6e9 if os.sysconf('SC_PAGE_SIZE') > 4096 else 2e9
+
+    if args.jobs == "auto":
+        args.jobs = None
+        peak_memory = MemoryHistory(pathlib.Path(args.tmpdir) / PEAK_MEMORY_HISTORY)
+        measured = estimate_test_memory(peak_memory.peaks(args.modes or []))
+        if measured is not None:
+            testmem = measured
+            print("Reserving {} of memory per test job, measured in previous runs".format(
+                humanfriendly.format_size(testmem)))
         else:
-            nr_cpus = int(subprocess.check_output(
-                ['taskset', '-c', args.cpus, 'python3', '-c',
-                 'import os; print(len(os.sched_getaffinity(0)))']))
+            print("No test memory usage measured yet, using the default number of jobs")
 
-        cpus_per_test_job = 1
-        sysmem = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
-        testmem = 6e9 if os.sysconf('SC_PAGE_SIZE') > 4096 else 2e9
+    if not args.jobs:
+        cpus_per_test_job = args.cpu_slots or 1
         default_num_jobs_mem = ((sysmem - 4e9) // testmem)
-        args.jobs = min(default_num_jobs_mem, nr_cpus // cpus_per_test_job)
+        args.jobs = max(1, min(default_num_jobs_mem, nr_cpus // cpus_per_test_job))
+
+    if args.cluster_pool_budget is None:
+        # An idle prefetched server is started with -m 1G and --overprovisioned,
+        # so it's the memory left over by the test jobs that limits their number.
+        # Budget for clusters of 3 servers, the most common size, but allow at
+        # least one cluster even if the test jobs take up all the memory.
+        clustermem = 3e9
+        args.cluster_pool_budget = int(max(1, min((sysmem - 2e9 - args.jobs * testmem) // clustermem,
+                                                  nr_cpus)))
 
     if not output_is_a_tty:
         args.verbose = True
@@ -1325,6 +1499,9 @@ def parse_cmd_line() -> argparse.Namespace:
             print(palette.fail("Failed to read output of `ninja mode_list`: please run ./configure.py first"))
             raise
 
+    if args.coverage_test_map or args.coverage_incremental:
+        args.coverage = True
+
     if not args.coverage_modes and args.coverage:
         args.coverage_modes = list(args.modes)
         if "coverage" in args.coverage_modes:
@@ -1365,13 +1542,51 @@ def parse_cmd_line() -> argparse.Namespace:
     return args
 
 
+async def select_impacted_tests(options: argparse.Namespace) -> None:
+    """Find the tests which cover the changes since --changed-since"""
+    TestSuite.impact_map = ImpactMap(pathlib.Path(options.tmpdir) / IMPACT_MAP)
+    if not TestSuite.impact_map:
+        print(palette.warn("No test coverage recorded yet (see --coverage-test-map), "
+                           "running all tests"))
+        options.changed_since = None
+        return
+    patch_file = pathlib.Path(options.tmpdir) / "changed_since.patch"
+    with patch_file.open("w") as f:
+        process = await asyncio.create_subprocess_exec(
+            "git", "diff", "--no-color", "--no-ext-diff", "-M", options.changed_since,
+            stdout=f)
+        await process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"git diff {options.changed_since} failed")
+    changes = changed_lines(patch_file)
+    suites = [os.path.basename(os.path.dirname(f)) for f in glob.glob(os.path.join("test", "*", "suite.yaml"))]
+    impacted = select_tests(TestSuite.impact_map, changes, suites)
+    if impacted is None:
+        print(palette.warn("Changes since {} aren't covered by the recorded test coverage or affect "
+                           "the test infrastructure, running all tests".format(options.changed_since)))
+        options.changed_since = None
+        return
+    TestSuite.impacted = impacted
+    logging.info("%d files changed since %s, tests and suites covering them: %s",
+                 len(changes), options.changed_since, sorted(TestSuite.impacted))
+    print("{} files changed since {}, running the tests covering them.".format(
+        len(changes), options.changed_since))
+
+
 async def find_tests(options: argparse.Namespace) -> None:
 
+    if options.changed_since:
+        await select_impacted_tests(options)
+
+    suites = []
     for f in glob.glob(os.path.join("test", "*")):
         if os.path.isdir(f) and os.path.isfile(os.path.join(f, "suite.yaml")):
             for mode in options.modes:
-                suite = TestSuite.opt_create(f, options, mode)
-                await suite.add_test_list()
+                suites.append(TestSuite.opt_create(f, options, mode))
+    # Discover tests of all suites concurrently: listing Boost test
+    # cases runs a process per executable
+    await asyncio.gather(*(suite.add_test_list() for suite in suites))
+    BoostTestSuite.save_case_cache()
 
     if not TestSuite.test_count():
         if len(options.name):
@@ -1407,15 +1622,49 @@ async def run_all_tests(signaled: asyncio.Event, options: argparse.Namespace) ->
             if isinstance(result, bool):
                 continue    # skip signaled task result
             console.print_progress(result)
+            report.add(result)
+            if TestSuite.coverage_stream is not None:
+                TestSuite.coverage_stream.test_done(result)
 
     ms = MinioServer(options.tmpdir, '127.0.0.1', LogPrefixAdapter(logging.getLogger('minio'), {'prefix': 'minio'}))
     await ms.start()
     TestSuite.artifacts.add_exit_artifact(None, ms.stop)
 
+    history = DurationHistory(pathlib.Path(options.tmpdir) / "test_durations.json")
+    tests = list(TestSuite.all_tests())
+    jobs = max(int(options.jobs), 1)
+    if options.schedule == "duration":
+        estimates = {test: history.estimate(test.mode, test.duration_key, test.suite.name)
+                     for test in tests}
+        tests = longest_first(tests, estimates, group=lambda t: t.suite)
+        predicted, ideal = schedule_summary([estimates[t] for t in tests], jobs)
+        finish = time.strftime("%H:%M:%S", time.localtime(time.time() + predicted))
+        print("Predicted run time: {} (finish at {}), ideal: {}".format(
+            humanfriendly.format_timespan(predicted), finish, humanfriendly.format_timespan(ideal)))
+        logging.info("Predicted run time %.1fs, ideal %.1fs, with %d jobs", predicted, ideal, jobs)
+
+    if options.cpu_slots:
+        cpus = parse_cpu_list(options.cpus) if options.cpus else sorted(os.sched_getaffinity(0))
+        TestSuite.slots = SlotPool(cpus, options.cpu_slots, options.slot_memory,
+                                   LogPrefixAdapter(logging.getLogger('slots'), {'prefix': 'slots'}))
+
+    if options.coverage and options.coverage_incremental:
+        # Leave most of the CPUs to the tests which are still running
+        TestSuite.coverage_stream = IncrementalCoverage(
+            tests, coverage_id_search_paths(options.coverage_modes), coverage_excludes(),
+            binary_cache=coverage_utils.BinaryInfoCache(pathlib.Path(options.tmpdir) / BINARY_INFO_CACHE),
+            impact_map=ImpactMap(pathlib.Path(options.tmpdir) / IMPACT_MAP) if options.coverage_test_map else None,
+            keep_raw=options.coverage_keep_raw, keep_indexed=options.coverage_keep_indexed,
+            keep_lcovs=options.coverage_keep_lcovs,
+            concurrency=max(1, multiprocessing.cpu_count() // 4),
+            logger=LogPrefixAdapter(logging.getLogger("coverage"), {'prefix': 'coverage'}))
+
+    report = TestReport(options.tmpdir, options.modes)
     console.print_start_blurb()
+    run_start = time.time()
     try:
         TestSuite.artifacts.add_exit_artifact(None, TestSuite.hosts.cleanup)
-        for test in TestSuite.all_tests():
+        for test in tests:
             # +1 for 'signaled' event
             if len(pending) > options.jobs:
                 # Wait for some task to finish
@@ -1431,10 +1680,71 @@ async def run_all_tests(signaled: asyncio.Event, options: argparse.Namespace) ->
     except asyncio.CancelledError:
         return
     finally:
+        report.close()
         await TestSuite.artifacts.cleanup_before_exit()
+        if TestSuite.slots:
+            # After all servers are stopped
+            TestSuite.slots.cleanup()
 
     console.print_end_blurb()
 
+    makespan = time.time() - run_start
+    durations = []
+    for test in tests:
+        if test.time_end > test.time_start > 0:
+            durations.append(test.time_end - test.time_start)
+            history.record(test.mode, test.duration_key, test.time_end - test.time_start)
+    try:
+        history.save()
+    except OSError as e:
+        logging.warning("Failed to save test duration history: %s", e)
+    write_resource_usage(tests, options.tmpdir)
+    ideal = ideal_makespan(durations, jobs)
+    if ideal > 0:
+        print("Run time: {}, ideal: {} ({:+.1f}%)".format(
+            humanfriendly.format_timespan(makespan), humanfriendly.format_timespan(ideal),
+            (makespan - ideal) / ideal * 100))
+
+    if ScyllaServer.boot_stats.count:
+        logging.info("Average Scylla boot timeline over %d boots: %s",
+                     ScyllaServer.boot_stats.count, ScyllaServer.boot_stats)
+
+    for suite in TestSuite.suites.values():
+        if not isinstance(suite, PythonTestSuite):
+            continue
+        stats = suite.clusters.stats
+        if stats.hits + stats.misses == 0:
+            continue
+        logging.info("Cluster pool of %s: %s", suite.suite_key, stats)
+        if suite.clusters.prefetch:
+            print("Cluster pool of {}: {}".format(suite.suite_key, stats))
+
+
+def write_resource_usage(tests: List['Test'], tmpdir: str) -> None:
+    """Save the resource usage of all tests which ran into
+    {tmpdir}/test_resource_usage.json, and their peak memory usage into
+    the history used by --jobs=auto"""
+    peak_memory = MemoryHistory(pathlib.Path(tmpdir) / PEAK_MEMORY_HISTORY)
+    summary = []
+    for test in tests:
+        if test.rusage is None:
+            continue
+        summary.append(dict(name=test.uname, mode=test.mode, success=test.success,
+                            time=test.time_end - test.time_start, **test.rusage.as_dict()))
+        peak_memory.record(test.mode, test.duration_key, test.rusage.peak_memory)
+    if not summary:
+        return
+    try:
+        with open(os.path.join(tmpdir, "test_resource_usage.json"), "w") as f:
+            json.dump(summary, f, indent=1)
+        peak_memory.save()
+    except OSError as e:
+        logging.warning("Failed to save test resource usage: %s", e)
+    by_rss = max(summary, key=lambda t: t["max_rss"] + t["servers_max_rss"])
+    logging.info("Tests used %.1fs of user and %.1fs of system CPU time, the biggest was %s with %s",
+                 sum(t["user_time"] for t in summary), sum(t["sys_time"] for t in summary),
+                 by_rss["name"], humanfriendly.format_size(by_rss["max_rss"] + by_rss["servers_max_rss"]))
+
 
 def read_log(log_filename: pathlib.Path) -> str:
     """Intelligently read test log output"""
@@ -1490,41 +1800,21 @@ def format_unidiff(fromfile: str, tofile: str) -> str:
         return buf.getvalue()
 
 
-def write_junit_report(tmpdir: str, mode: str) -> None:
-    junit_filename = os.path.join(tmpdir, mode, "xml", "junit.xml")
-    total = 0
-    failed = 0
-    xml_results = ET.Element("testsuite", name="non-boost tests", errors="0")
-    for suite in TestSuite.suites.values():
-        for test in suite.junit_tests():
-            if test.mode != mode:
-                continue
-            total += 1
-            # add the suite name to disambiguate tests named "run"
-            xml_res = ET.SubElement(xml_results, 'testcase',
-                                    name="{}.{}.{}.{}".format(test.suite.name, test.shortname, mode, test.id))
-            if test.success is True:
-                continue
-            failed += 1
-            test.write_junit_failure_report(xml_res)
-    if total == 0:
-        return
-    xml_results.set("tests", str(total))
-    xml_results.set("failures", str(failed))
-    with open(junit_filename, "w") as f:
-        ET.ElementTree(xml_results).write(f, encoding="unicode")
-
-
-def summarize_tests(tests):
-    # in case we run a certain test multiple times
-    # - if any of the runs failed, the test is considered failed, and
-    #   the last failed run is returned.
-    # - otherwise, the last successful run is returned
-    failed_test = None
-    passed_test = None
-    num_failed_tests = collections.defaultdict(int)
-    num_passed_tests = collections.defaultdict(int)
-    for test in tests:
+class BoostCaseSummary:
+    """All runs of a Boost test case, in all modes.
+
+    If a test case ran multiple times, it is reported once:
+    - if any of the runs failed, the test is considered failed, and
+      the last failed run is reported.
+    - otherwise, the last successful run is reported."""
+
+    def __init__(self) -> None:
+        self.failed_test: Optional[ET.Element] = None
+        self.passed_test: Optional[ET.Element] = None
+        self.num_failed_tests: Dict[str, int] = collections.defaultdict(int)
+        self.num_passed_tests: Dict[str, int] = collections.defaultdict(int)
+
+    def add(self, test: ET.Element) -> None:
         error = None
         for tag in ['Error', 'FatalError', 'Exception']:
             error = test.find(tag)
@@ -1532,87 +1822,144 @@ def summarize_tests(tests):
                 break
         mode = test.attrib['mode']
         if error is None:
-            passed_test = test
-            num_passed_tests[mode] += 1
+            self.passed_test = test
+            self.num_passed_tests[mode] += 1
         else:
-            failed_test = test
-            num_failed_tests[mode] += 1
+            self.failed_test = test
+            self.num_failed_tests[mode] += 1
+
+    def element(self) -> ET.Element:
+        """The TestCase element to report"""
+        test = copy.deepcopy(self.failed_test if self.failed_test is not None else self.passed_test)
+        test.attrib.pop('path')
+        test.attrib.pop('mode')
+
+        num_failed = sum(self.num_failed_tests.values())
+        num_passed = sum(self.num_passed_tests.values())
+        num_total = num_failed + num_passed
+        if num_total == 1:
+            return test
+        if num_failed == 0:
+            return test
+        # we repeated this test for multiple times.
+        #
+        # Boost::test's XML logger schema does not allow us to put text directly in a
+        # TestCase tag, so create a dummy Message tag in the TestCase for carrying the
+        # summary. and the schema requires that the tags should be listed in following order:
+        # 1. TestSuite
+        # 2. Info
+        # 3. Error
+        # 3. FatalError
+        # 4. Message
+        # 5. Exception
+        # 6. Warning
+        # and both "file" and "line" are required in an "Info" tag, so appease it. assuming
+        # there is no TestSuite under tag TestCase, we always add Info as the first subelements
+        if num_passed == 0:
+            message = ET.Element('Info', file=test.attrib['file'], line=test.attrib['line'])
+            message.text = f'The test failed {num_failed}/{num_total} times'
+            test.insert(0, message)
+        else:
+            message = ET.Element('Info', file=test.attrib['file'], line=test.attrib['line'])
+            modes = ', '.join(f'{mode}={n}' for mode, n in self.num_failed_tests.items())
+            message.text = f'failed: {modes}'
+            test.insert(0, message)
+
+            message = ET.Element('Info', file=test.attrib['file'], line=test.attrib['line'])
+            modes = ', '.join(f'{mode}={n}' for mode, n in self.num_passed_tests.items())
+            message.text = f'passed: {modes}'
+            test.insert(0, message)
+
+            message = ET.Element('Info', file=test.attrib['file'], line=test.attrib['line'])
+            message.text = f'{num_failed} out of {num_total} times failed.'
+            test.insert(0, message)
+        return test
 
-    if failed_test is not None:
-        test = failed_test
-    else:
-        test = passed_test
 
-    num_failed = sum(num_failed_tests.values())
-    num_passed = sum(num_passed_tests.values())
-    num_total = num_failed + num_passed
-    if num_total == 1:
-        return test
-    if num_failed == 0:
-        return test
-    # we repeated this test for multiple times.
-    #
-    # Boost::test's XML logger schema does not allow us to put text directly in a
-    # TestCase tag, so create a dummy Message tag in the TestCase for carrying the
-    # summary. and the schema requires that the tags should be listed in following order:
-    # 1. TestSuite
-    # 2. Info
-    # 3. Error
-    # 3. FatalError
-    # 4. Message
-    # 5. Exception
-    # 6. Warning
-    # and both "file" and "line" are required in an "Info" tag, so appease it. assuming
-    # there is no TestSuite under tag TestCase, we always add Info as the first subelements
-    if num_passed == 0:
-        message = ET.Element('Info', file=test.attrib['file'], line=test.attrib['line'])
-        message.text = f'The test failed {num_failed}/{num_total} times'
-        test.insert(0, message)
-    else:
-        message = ET.Element('Info', file=test.attrib['file'], line=test.attrib['line'])
-        modes = ', '.join(f'{mode}={n}' for mode, n in num_failed_tests.items())
-        message.text = f'failed: {modes}'
-        test.insert(0, message)
-
-        message = ET.Element('Info', file=test.attrib['file'], line=test.attrib['line'])
-        modes = ', '.join(f'{mode}={n}' for mode, n in num_passed_tests.items())
-        message.text = f'passed: {modes}'
-        test.insert(0, message)
-
-        message = ET.Element('Info', file=test.attrib['file'], line=test.attrib['line'])
-        message.text = f'{num_failed} out of {num_total} times failed.'
-        test.insert(0, message)
-    return test
-
-
-def write_consolidated_boost_junit_xml(tmpdir: str, mode: str) -> None:
-    # collects all boost tests sorted by their full names
-    boost_tests = itertools.chain.from_iterable(suite.boost_tests()
-                                                for suite in TestSuite.suites.values())
-    test_cases = itertools.chain.from_iterable(test.get_test_cases()
-                                               for test in boost_tests)
-    test_cases = sorted(test_cases, key=BoostTest.test_path_of_element)
-
-    xml = ET.Element("TestLog")
-    for full_path, tests in itertools.groupby(
-            test_cases,
-            key=BoostTest.test_path_of_element):
-        # dedup the tests with the same name, so only the representative one is
-        # preserved
-        test_case = summarize_tests(tests)
-        test_case.attrib.pop('path')
-        test_case.attrib.pop('mode')
-
-        suite_name, test_name, _ = full_path
-        suite = xml.find(f"./TestSuite[@name='{suite_name}']")
-        if suite is None:
-            suite = ET.SubElement(xml, 'TestSuite', name=suite_name)
-        test = suite.find(f"./TestSuite[@name='{test_name}']")
-        if test is None:
+class TestReport:
+    """Consolidated XML reports, updated as soon as a test finishes,
+    so that they are valid at any time during the run and nothing is
+    left to do at the end of it:
+    - {tmpdir}/{mode}/xml/junit.xml: all non-boost tests of the mode
+    - {tmpdir}/{mode}/xml/boost.xunit.xml: test cases of Boost tests of
+      all modes, each test case reported once (see BoostCaseSummary),
+      grouped by suite and test. A suite is added once all its tests
+      finished in all modes."""
+
+    def __init__(self, tmpdir: str, modes: List[str]) -> None:
+        self.tmpdir = tmpdir
+        self.modes = modes
+        self.junit: Dict[str, StreamingXmlReport] = {}
+        self.junit_total: Dict[str, int] = collections.defaultdict(int)
+        self.junit_failed: Dict[str, int] = collections.defaultdict(int)
+        self.boost: List[StreamingXmlReport] = []
+        # Suite name -> summaries of the test cases of the suite not reported yet
+        self.boost_cases: Dict[str, Dict[TestPath, BoostCaseSummary]] = collections.defaultdict(dict)
+        # Suite name -> the number of tests of the suite, in all modes, not reported yet
+        self.boost_pending: Dict[str, int] = {}
+
+    def add(self, test: 'Test') -> None:
+        test.suite.add_to_report(test, self)
+
+    def add_junit(self, test: 'Test') -> None:
+        mode = test.mode
+        if mode not in self.junit:
+            self.junit[mode] = StreamingXmlReport(
+                pathlib.Path(self.tmpdir, mode, "xml", "junit.xml"),
+                "testsuite", name="non-boost tests", errors="0")
+        # add the suite name to disambiguate tests named "run"
+        xml_res = ET.Element('testcase',
+                             name="{}.{}.{}.{}".format(test.suite.name, test.shortname, mode, test.id))
+        if test.time_end > test.time_start > 0:
+            xml_res.set('time', "{:.3f}".format(test.time_end - test.time_start))
+        if test.rusage is not None:
+            properties = ET.SubElement(xml_res, 'properties')
+            for name, value in test.rusage.as_dict().items():
+                ET.SubElement(properties, 'property', name=name, value=str(value))
+        self.junit_total[mode] += 1
+        if test.success is not True:
+            self.junit_failed[mode] += 1
+            test.write_junit_failure_report(xml_res)
+        report = self.junit[mode]
+        report.append(xml_res)
+        report.set_attrib(tests=str(self.junit_total[mode]), failures=str(self.junit_failed[mode]))
+
+    def add_boost(self, test: 'BoostTest') -> None:
+        name = test.suite.name
+        if name not in self.boost_pending:
+            self.boost_pending[name] = sum(len(suite.tests) for suite in TestSuite.suites.values()
+                                           if isinstance(suite, BoostTestSuite) and suite.name == name)
+        self.boost_pending[name] -= 1
+        for test_case in test.pop_test_cases():
+            full_path = BoostTest.test_path_of_element(test_case)
+            self.boost_cases[full_path.suite_name].setdefault(full_path, BoostCaseSummary()).add(test_case)
+        if self.boost_pending[name] <= 0:
+            self.write_boost_suite(name)
+
+    def write_boost_suite(self, name: str) -> None:
+        """Add the test cases of a suite to the Boost reports, grouped by test as
+        <TestSuite name=suite><TestSuite name=test><TestCase>..., sorted by name"""
+        cases = self.boost_cases.pop(name, None)
+        if not cases:
+            return
+        if not self.boost:
+            self.boost = [StreamingXmlReport(pathlib.Path(self.tmpdir, mode, "xml", "boost.xunit.xml"),
+                                             "TestLog")
+                          for mode in self.modes]
+        suite = ET.Element('TestSuite', name=name)
+        for test_name, paths in itertools.groupby(sorted(cases), key=lambda path: path.test_name):
             test = ET.SubElement(suite, 'TestSuite', name=test_name)
-        test.append(test_case)
-    et = ET.ElementTree(xml)
-    et.write(f'{tmpdir}/{mode}/xml/boost.xunit.xml', encoding='unicode')
+            for full_path in paths:
+                test.append(cases[full_path].element())
+        for report in self.boost:
+            report.append(suite)
+
+    def close(self) -> None:
+        # Suites with tests which didn't finish, e.g. if the run was interrupted
+        for name in sorted(self.boost_cases):
+            self.write_boost_suite(name)
+        for report in itertools.chain(self.junit.values(), self.boost):
+            report.close()
 
 
 def open_log(tmpdir: str, log_file_name: str, log_level: str) -> None:
@@ -1656,10 +2003,6 @@ async def main() -> int:
 
     print_summary(failed_tests, options)
 
-    for mode in options.modes:
-        write_junit_report(options.tmpdir, mode)
-        write_consolidated_boost_junit_xml(options.tmpdir, mode)
-
     if 'coverage' in options.modes:
         coverage.generate_coverage_report(path_to("coverage", "tests"))
 
@@ -1670,6 +2013,16 @@ async def main() -> int:
     #       to cooperate with git bisect's expectations
     return 0 if not failed_tests else 1
 
+def coverage_id_search_paths(modes: List[str]) -> List[pathlib.Path]:
+    """Where to look for the binaries which produced the profiles"""
+    build_paths = [pathlib.Path(f"build/{mode}") for mode in modes]
+    return [bp / p for bp, p in itertools.product(build_paths, ["scylla", "test", "seastar"])]
+
+
+def coverage_excludes() -> List[str]:
+    return [line for line in open("coverage_excludes.txt", 'r').read().split('\n') if line and not line.startswith('#')]
+
+
 async def process_coverage(options):
     total_processing_time = time.time()
     logger = LogPrefixAdapter(logging.getLogger("coverage"), {'prefix' : 'coverage'})
@@ -1678,19 +2031,33 @@ async def process_coverage(options):
     concurrency = max(int(multiprocessing.cpu_count() * 0.75), 1)
     logger.info(f"Processing coverage information for modes: {modes_for_coverage}, using {concurrency} cpus")
     semaphore = asyncio.Semaphore(concurrency)
-    build_paths = [pathlib.Path(f"build/{mode}") for mode in modes_for_coverage]
-    paths_for_id_search = [bp / p for bp, p in itertools.product(build_paths, ["scylla", "test", "seastar"])]
-    logger.info("Getting binary ids for coverage conversion...")
-    files_to_ids_map = await coverage_utils.get_binary_ids_map(paths = paths_for_id_search,
-                                                               filter = coverage_utils.PROFILED_ELF_TYPES,
-                                                               semaphore = semaphore,
-                                                               logger = logger)
+    stream = TestSuite.coverage_stream
+    if stream is not None:
+        logger.info("Waiting for the coverage processing of finished tests...")
+        start_time = time.time()
+        await stream.drain()
+        logger.info(f"Done waiting for the coverage processing of finished tests - "
+                    f"{humanfriendly.format_timespan(time.time() - start_time)}.")
+        binary_cache = stream.binary_cache
+        files_to_ids_map = await stream.known_ids()
+    else:
+        logger.info("Getting binary ids for coverage conversion...")
+        binary_cache = coverage_utils.BinaryInfoCache(pathlib.Path(options.tmpdir) / BINARY_INFO_CACHE)
+        files_to_ids_map = await coverage_utils.get_binary_ids_map(paths = coverage_id_search_paths(modes_for_coverage),
+                                                                   filter = coverage_utils.PROFILED_ELF_TYPES,
+                                                                   cache = binary_cache,
+                                                                   semaphore = semaphore,
+                                                                   logger = logger)
     logger.debug(f"Binary ids map is: {files_to_ids_map}")
     logger.info("Done getting binary ids for coverage conversion")
     # get the suits that have actually been ran
     suits_to_exclude = ["pylib_test", "nodetool"]
-    sources_to_exclude = [line for line in open("coverage_excludes.txt", 'r').read().split('\n') if line and not line.startswith('#')]
+    sources_to_exclude = coverage_excludes()
     ran_suites = list({test.suite for test in TestSuite.all_tests() if test.suite.need_coverage()})
+    if stream is not None:
+        impact_map = stream.impact_map
+    else:
+        impact_map = ImpactMap(pathlib.Path(options.tmpdir) / IMPACT_MAP) if options.coverage_test_map else None
 
     def suite_coverage_path(suite) -> pathlib.Path:
         return pathlib.Path(suite.options.tmpdir) / suite.mode / 'coverage' / suite.name
@@ -1748,7 +2115,12 @@ async def process_coverage(options):
 
         # 1. Transform every suite raw profiles into indexed profiles
         raw_profiles = list(coverage_path.glob("*.profraw"))
-        if len(raw_profiles) == 0:
+        # With --coverage-test-map, every test executable has its own profiles directory.
+        # With --coverage-incremental, those are already in the running trace of the suite.
+        stream_traces = stream.suite_traces(suite) if stream is not None else []
+        test_profile_dirs = [] if stream is not None else \
+            [d for d in (coverage_path / "tests").glob("*") if d.is_dir()]
+        if len(raw_profiles) == 0 and len(test_profile_dirs) == 0 and len(stream_traces) == 0:
             logger.warning(f"Couldn't find any raw profiles for suite '{suite.name}' in mode '{suite.mode}' ({coverage_path}):\n\t"
                 "1. The binaries are killed instead of terminating which bypasses profile dump.\n\t"
                 "2. The suite tempres with the LLVM_PROFILE_FILE which causes the profile to be dumped\n\t"
@@ -1781,6 +2153,7 @@ async def process_coverage(options):
         merge_result = await coverage_utils.merge_profiles(profiles = raw_profiles,
                                             path_for_merged = coverage_path,
                                             clear_on_success = (not options.coverage_keep_raw),
+                                            cache = binary_cache,
                                             semaphore = semaphore,
                                             logger = logger)
         indexed_stats_node = stats.get_node(mode_stats.identifier +INDEXED_PROFILE_STATS)
@@ -1812,6 +2185,7 @@ async def process_coverage(options):
                                               excludes = sources_to_exclude,
                                               known_file_ids = files_to_ids_map,
                                               clear_on_success = (not options.coverage_keep_indexed),
+                                              cache = binary_cache,
                                               semaphore = semaphore,
                                               logger = logger
                                               )
@@ -1831,20 +2205,64 @@ async def process_coverage(options):
 
         logger.info(f"{suite.name}: Done converting indexed profiles into lcov trace files - {humanfriendly.format_timespan(stat.data.time)}.")
 
+        # 2b. With --coverage-test-map, convert the profiles of every test executable
+        #     separately and record the lines each of them covered. The profiles at
+        #     the top of the suite directory come from processes shared by the tests
+        #     of the suite (e.g. Scylla servers), so they are recorded for the suite.
+        if impact_map is not None:
+            logger.info(f"{suite.name}: Recording the coverage of each test.")
+            start_time = time.time()
+            suite_traces = list(coverage_path.glob("*.info"))
+            if suite_traces:
+                impact_map.record(suite.name, [lcov_utils.LcovFile(f) for f in suite_traces])
+            else:
+                impact_map.tests.pop(suite.name, None)
+
+            async def record_test_coverage(test_dir: pathlib.Path) -> None:
+                merge_result = await coverage_utils.merge_profiles(profiles = list(test_dir.glob("*.profraw")),
+                                                                   path_for_merged = test_dir,
+                                                                   clear_on_success = (not options.coverage_keep_raw),
+                                                                   cache = binary_cache,
+                                                                   semaphore = semaphore,
+                                                                   logger = logger)
+                if len(merge_result.errors) > 0:
+                    raise RuntimeError(merge_result.errors)
+                await coverage_utils.profdata_to_lcov(profiles = merge_result.generated_profiles,
+                                                      excludes = sources_to_exclude,
+                                                      known_file_ids = files_to_ids_map,
+                                                      clear_on_success = (not options.coverage_keep_indexed),
+                                                      cache = binary_cache,
+                                                      semaphore = semaphore,
+                                                      logger = logger)
+                impact_map.record(impact_key(suite.name, test_dir.name),
+                                  [lcov_utils.LcovFile(f) for f in test_dir.glob("*.info")])
+
+            await asyncio.gather(*(record_test_coverage(d) for d in test_profile_dirs))
+            logger.info(f"{suite.name}: Done recording the coverage of {len(test_profile_dirs)} tests - "
+                        f"{humanfriendly.format_timespan(time.time() - start_time)}.")
+
         # 3. combine all tracefiles
         logger.info(f"{suite.name} in mode {suite.mode}: Combinig lcov trace files.")
         start_time = time.time()
-        trace_files = list(coverage_path.glob("**/*.info"))
+        if stream is not None:
+            # Traces kept with --coverage-keep-lcovs are already in the running trace
+            trace_files = list(coverage_path.glob("*.info")) + stream_traces
+        else:
+            trace_files = list(coverage_path.glob("**/*.info"))
         target_trace_file = coverage_path / (suite.name + ".info")
+        # A binary dump of the suite trace, which is much faster to merge into the mode trace
+        target_binary_file = coverage_path / (suite.name + ".lcovbin")
         if len(trace_files) == 0: # No coverage data, can skip
             logger.warning(f"{suite.name} in mode  {suite.mode}: No coverage tracefiles found")
-        elif len(trace_files) == 1: # No need to merge, we can just rename the file
+        elif len(trace_files) == 1 and trace_files[0].suffix == ".info": # No need to merge, we can just rename the file
             trace_files[0].rename(str(target_trace_file))
         else:
             await coverage_utils.lcov_combine_traces(lcovs = trace_files,
                                                      output_lcov = target_trace_file,
+                                                     output_binary = target_binary_file,
                                                      clear_on_success = (not options.coverage_keep_lcovs),
                                                      files_per_chunk = 10,
+                                                     processes = True,
                                                      semaphore = semaphore,
                                                      logger = logger)
         lcov_merge_stats_node = stats.get_node(mode_stats.identifier + LCOV_SUITES_MEREGE_STATS)
@@ -1861,20 +2279,29 @@ async def process_coverage(options):
         mode_stats.data.time += stat.data.time
         mode_stats.data.size = max(mode_stats.data.size, lcov_merge_stats_node.data.size)
 
-        suits_trace_files.setdefault(suite.mode, {})[suite.name] = target_trace_file
+        suits_trace_files.setdefault(suite.mode, {})[suite.name] = \
+            target_binary_file if target_binary_file.exists() else target_trace_file
         logger.info(f"{suite.name}: Done combinig lcov trace files - {humanfriendly.format_timespan(stat.data.time)}")
 
+    binary_cache.save()
+    if impact_map is not None:
+        impact_map.save()
+        logger.info(f"Saved the coverage of each test to {impact_map.path}")
+
     #4. combine the suite lcovs into per mode trace files
     modes_trace_files  = {}
     for mode, suite_traces in suits_trace_files.items():
 
         target_trace_file = pathlib.Path(options.tmpdir) / mode / "coverage" / f"{mode}_coverage.info"
+        target_binary_file = target_trace_file.with_suffix(".lcovbin")
         start_time = time.time()
         logger.info(f"Consolidating trace files for mode {mode}.")
         await coverage_utils.lcov_combine_traces(lcovs = suite_traces.values(),
                                                  output_lcov = target_trace_file,
+                                                 output_binary = target_binary_file,
                                                  clear_on_success = False,
                                                  files_per_chunk = 10,
+                                                 processes = True,
                                                  semaphore = semaphore,
                                                  logger = logger)
         mode_stats = stats[mode]
@@ -1884,7 +2311,10 @@ async def process_coverage(options):
                                  data = Stats(LCOV_MODES_MERGE_STATS, None, time.time() - start_time))
         mode_stats.data.time += stat.data.time
         ROOT_NODE.data.size += mode_stats.data.size
-        modes_trace_files[mode] = target_trace_file
+        modes_trace_files[mode] = target_binary_file
+        for trace_file in suite_traces.values():
+            if trace_file.suffix == ".lcovbin":
+                trace_file.unlink()
         logger.info(f"Done consolidating trace files for mode {mode} - time: {humanfriendly.format_timespan(stat.data.time)}.")
     #5. create one consolidated file with all trace information
     logger.info(f"Consolidating all trace files for this run.")
@@ -1894,12 +2324,15 @@ async def process_coverage(options):
                                              output_lcov = target_trace_file,
                                              clear_on_success = False,
                                              files_per_chunk = 10,
+                                             processes = True,
                                              semaphore = semaphore,
                                              logger = logger)
     stats.create_node(tag = time.time(),
                       identifier = LCOV_MERGE_ALL_STATS,
                       parent = ROOT_NODE,
                       data = Stats(LCOV_MERGE_ALL_STATS, None, time.time() - start_time))
+    for trace_file in modes_trace_files.values():
+        trace_file.unlink()
     logger.info(f"Done consolidating all trace files for this run - time: {humanfriendly.format_timespan(time.time() - start_time)}.")
 
     logger.info(f"Creating textual report.")
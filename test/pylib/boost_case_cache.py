@@ -0,0 +1,85 @@
+#
+# Copyright (C) 2024-present ScyllaDB
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+"""Test case lists of Boost test executables, as printed by --list_content,
+   cached across test.py invocations.
+"""
+import asyncio
+import json
+import logging
+import os
+import pathlib
+from typing import Any, Dict, List, Optional
+
+from test.pylib.elf_utils import get_build_id
+
+
+class BoostCaseCache:
+    """On-disk cache of test case lists of Boost test executables, so that
+    an unchanged executable isn't run with --list_content on every test.py
+    invocation. An entry is valid as long as the executable has the same
+    size, modification time and build id."""
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        self.dirty = False
+        try:
+            with self.path.open("r") as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                self.entries = entries
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring unreadable Boost test case cache %s: %s", self.path, e)
+
+    @staticmethod
+    def _key(exe: str) -> Dict[str, Any]:
+        st = os.stat(exe)
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "build_id": get_build_id(exe)}
+
+    def get(self, exe: str) -> Optional[List[str]]:
+        entry = self.entries.get(os.path.realpath(exe))
+        if not isinstance(entry, dict) or entry.get("key") != self._key(exe):
+            return None
+        return entry.get("cases")
+
+    def put(self, exe: str, cases: List[str]) -> None:
+        self.entries[os.path.realpath(exe)] = {"key": self._key(exe), "cases": cases}
+        self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        tmp = self.path.with_suffix(".tmp")
+        with tmp.open("w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+async def list_cases(exe: str, cache: BoostCaseCache, semaphore: asyncio.Semaphore,
+                     timeout: float) -> List[str]:
+    """The test cases of a Boost test executable, from the cache or
+       from its --list_content output"""
+    case_list = cache.get(exe)
+    if case_list is not None:
+        return case_list
+    async with semaphore:
+        process = await asyncio.create_subprocess_exec(
+            exe, *['--list_content'],
+            stderr=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env=dict(os.environ,
+                     **{"ASAN_OPTIONS": "halt_on_error=0"}),
+            preexec_fn=os.setsid,
+        )
+        _, stderr = await asyncio.wait_for(process.communicate(), timeout)
+
+    case_list = [case[:-1] for case in stderr.decode().splitlines() if case.endswith('*')]
+    if process.returncode == 0:
+        cache.put(exe, case_list)
+    return case_list
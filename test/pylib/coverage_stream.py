@@ -0,0 +1,227 @@
+#
+# Copyright (C) 2024-present ScyllaDB
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+"""Coverage processing while tests run (test.py --coverage-incremental).
+   Every test run writes its LLVM profiles to a directory of its own. The
+   raw profiles of every BATCH_RUNS finished runs of an executable are
+   merged into an indexed profile of their own, and when the last run of
+   the executable finishes, these are merged together and converted to
+   lcov. When all executables of a suite are converted, their traces are
+   folded into a running trace of the suite. Only the profiles of processes
+   shared by the tests of a suite, e.g. Scylla servers, are left for the
+   end of the run.
+
+   Each profile and trace is read a bounded number of times: nothing is
+   merged into a growing accumulated profile or trace again and again.
+   Converting to lcov is by far the most expensive step, so it is done once
+   per executable rather than once per run (e.g. per Boost test case).
+"""
+import asyncio
+import collections
+import itertools
+import logging
+import os
+import pathlib
+import shutil
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from test.pylib import coverage_utils, lcov_utils
+from test.pylib.impact_map import ImpactMap, impact_key
+
+# The running trace of a suite, in its coverage directory
+RUNNING_TRACE = "running.lcovbin"
+# The number of finished runs of an executable whose raw profiles are merged together
+BATCH_RUNS = 16
+
+
+def suite_coverage_dir(suite) -> pathlib.Path:
+    return pathlib.Path(suite.options.tmpdir) / suite.mode / "coverage" / suite.name
+
+
+def run_profile_dir(test) -> pathlib.Path:
+    """Where a test run writes its profiles"""
+    return suite_coverage_dir(test.suite) / "runs" / test.uname
+
+
+def executable_name(shortname: str) -> str:
+    # All test cases of a Boost test run the same executable
+    return shortname.split('.')[0]
+
+
+class IncrementalCoverage:
+    def __init__(self, tests: Iterable, id_search_paths: List[pathlib.Path], excludes: List[str],
+                 binary_cache: coverage_utils.BinaryInfoCache, impact_map: Optional[ImpactMap],
+                 keep_raw: bool, keep_indexed: bool, keep_lcovs: bool, concurrency: int,
+                 logger: Union[logging.Logger, logging.LoggerAdapter]) -> None:
+        self.id_search_paths = id_search_paths
+        self.excludes = excludes
+        self.binary_cache = binary_cache
+        self.impact_map = impact_map
+        self.keep_raw = keep_raw
+        self.keep_indexed = keep_indexed
+        self.keep_lcovs = keep_lcovs
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.logger = logger
+        # Runs still to finish, by (suite coverage dir, executable)
+        self.remaining: Dict[Tuple[pathlib.Path, str], int] = collections.Counter()
+        # Executables still to convert, by suite coverage dir
+        self.suite_remaining: Dict[pathlib.Path, int] = collections.Counter()
+        self.suites = {}
+        for test in tests:
+            if test.suite.need_coverage():
+                key = (suite_coverage_dir(test.suite), executable_name(test.shortname))
+                if key not in self.remaining:
+                    self.suite_remaining[key[0]] += 1
+                self.remaining[key] += 1
+                self.suites[key[0]] = test.suite
+        # Profile directories of finished runs which are not merged yet
+        self.unmerged: Dict[Tuple[pathlib.Path, str], List[pathlib.Path]] = collections.defaultdict(list)
+        # Converted traces of executables which are not folded into the suite trace yet
+        self.unfolded: Dict[pathlib.Path, List[pathlib.Path]] = collections.defaultdict(list)
+        self.batch_ids = itertools.count()
+        self.executable_locks: Dict[Tuple[pathlib.Path, str], asyncio.Lock] = collections.defaultdict(asyncio.Lock)
+        self.suite_locks: Dict[pathlib.Path, asyncio.Lock] = collections.defaultdict(asyncio.Lock)
+        self.tasks: List[asyncio.Task] = []
+        self._known_ids: Optional[Dict[pathlib.Path, str]] = None
+        self._known_ids_lock = asyncio.Lock()
+
+    async def known_ids(self) -> Dict[pathlib.Path, str]:
+        """Build ids of the profiled binaries, looked up once"""
+        async with self._known_ids_lock:
+            if self._known_ids is None:
+                self._known_ids = await coverage_utils.get_binary_ids_map(
+                    paths=self.id_search_paths, filter=coverage_utils.PROFILED_ELF_TYPES,
+                    cache=self.binary_cache, semaphore=self.semaphore, logger=self.logger)
+        return self._known_ids
+
+    def test_done(self, test) -> None:
+        """Process the profiles of a finished test run in the background"""
+        if test.suite.need_coverage():
+            self.tasks.append(asyncio.create_task(self._process_run(test)))
+
+    async def _process_run(self, test) -> None:
+        suite_dir = suite_coverage_dir(test.suite)
+        executable = executable_name(test.shortname)
+        key = (suite_dir, executable)
+        executable_dir = suite_dir / "tests" / executable
+        async with self.executable_locks[key]:
+            self.unmerged[key].append(run_profile_dir(test))
+            self.remaining[key] -= 1
+            last = self.remaining[key] == 0
+            try:
+                if last or len(self.unmerged[key]) >= BATCH_RUNS:
+                    await self._merge_runs(key, executable_dir)
+            finally:
+                if last:
+                    await self._convert(test.suite, executable, executable_dir)
+
+    async def _merge_runs(self, key: Tuple[pathlib.Path, str], executable_dir: pathlib.Path) -> None:
+        """Merge the raw profiles of the finished runs of an executable into a new indexed profile"""
+        run_dirs = self.unmerged.pop(key, [])
+        try:
+            raw_profiles = [profile for run_dir in run_dirs for profile in run_dir.glob("*.profraw")]
+            if not raw_profiles:
+                return
+            batch_dir = executable_dir / "batches" / str(next(self.batch_ids))
+            batch_dir.mkdir(parents=True)
+            result = await coverage_utils.merge_profiles(profiles=raw_profiles,
+                                                         path_for_merged=batch_dir,
+                                                         cache=self.binary_cache,
+                                                         semaphore=self.semaphore,
+                                                         logger=self.logger)
+            if result.errors:
+                raise RuntimeError(result.errors)
+        finally:
+            if not self.keep_raw:
+                for run_dir in run_dirs:
+                    shutil.rmtree(run_dir, ignore_errors=True)
+
+    async def _convert(self, suite, executable: str, executable_dir: pathlib.Path) -> None:
+        """Merge the indexed profiles of an executable, convert them to lcov and
+           fold all traces of the suite into its running trace once the suite is done"""
+        suite_dir = suite_coverage_dir(suite)
+        try:
+            batches = list(executable_dir.glob("batches/*/*.profdata"))
+            if not batches:
+                return
+            if len(batches) == 1:
+                profiles = [executable_dir / batches[0].name]
+                os.replace(batches[0], profiles[0])
+            else:
+                result = await coverage_utils.merge_profiles(profiles=batches,
+                                                             path_for_merged=executable_dir,
+                                                             clear_on_success=True,
+                                                             cache=self.binary_cache,
+                                                             semaphore=self.semaphore,
+                                                             logger=self.logger)
+                if result.errors:
+                    raise RuntimeError(result.errors)
+                profiles = result.generated_profiles
+            shutil.rmtree(executable_dir / "batches", ignore_errors=True)
+            await coverage_utils.profdata_to_lcov(profiles=profiles,
+                                                  excludes=self.excludes,
+                                                  known_file_ids=await self.known_ids(),
+                                                  clear_on_success=not self.keep_indexed,
+                                                  cache=self.binary_cache,
+                                                  semaphore=self.semaphore,
+                                                  logger=self.logger)
+            traces = [profile.with_suffix(".info") for profile in profiles]
+            if self.impact_map is not None:
+                await asyncio.to_thread(self.impact_map.record, impact_key(suite.name, executable),
+                                        [lcov_utils.LcovFile(trace) for trace in traces])
+            self.unfolded[suite_dir].extend(traces)
+            self.logger.debug("%s/%s: coverage converted", suite.name, executable)
+        finally:
+            self.suite_remaining[suite_dir] -= 1
+            if self.suite_remaining[suite_dir] == 0:
+                await self._fold(suite_dir)
+
+    async def _fold(self, suite_dir: pathlib.Path) -> None:
+        """Fold the converted traces of a suite into its running trace"""
+        async with self.suite_locks[suite_dir]:
+            traces = self.unfolded.pop(suite_dir, [])
+            if not traces:
+                return
+            running = suite_dir / RUNNING_TRACE
+            folded = running.with_suffix(".tmp")
+            await coverage_utils.lcov_combine_traces(lcovs=traces + ([running] if running.exists() else []),
+                                                     output_binary=folded,
+                                                     processes=True,
+                                                     semaphore=self.semaphore,
+                                                     logger=self.logger)
+            os.replace(folded, running)
+        if not self.keep_lcovs:
+            for trace in traces:
+                trace.unlink()
+
+    async def drain(self) -> None:
+        """Wait for all background processing, and convert the executables
+           whose runs didn't all finish (e.g. because the run was stopped).
+           A failure to process some of the coverage is logged, and the
+           rest is processed regardless."""
+        results = await asyncio.gather(*self.tasks, return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        for (suite_dir, executable), remaining in self.remaining.items():
+            if remaining > 0:
+                key = (suite_dir, executable)
+                executable_dir = suite_dir / "tests" / executable
+                async with self.executable_locks[key]:
+                    for step in (lambda: self._merge_runs(key, executable_dir),
+                                 lambda: self._convert(self.suites[suite_dir], executable, executable_dir)):
+                        try:
+                            await step()
+                        except Exception as exc:
+                            errors.append(exc)
+        for suite_dir in list(self.unfolded):
+            try:
+                await self._fold(suite_dir)
+            except Exception as exc:
+                errors.append(exc)
+        for error in errors:
+            self.logger.error("Failed to process coverage: %s", error)
+
+    def suite_traces(self, suite) -> List[pathlib.Path]:
+        running = suite_coverage_dir(suite) / RUNNING_TRACE
+        return [running] if running.exists() else []
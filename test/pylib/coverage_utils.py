@@ -8,6 +8,7 @@
 #
 import argparse
 import asyncio
+import json
 import multiprocessing
 from pathlib import Path, PurePath
 from typing import (
@@ -29,7 +30,7 @@ from asyncio import Semaphore
 from collections.abc import Iterable as IterableType
 import os
 from collections import namedtuple
-from itertools import repeat
+from itertools import count, repeat
 from functools import wraps, partial
 import logging
 import sys
@@ -38,9 +39,11 @@ import inspect
 # So the module can be imported outside of this directory
 sys.path.insert(0, os.path.dirname(__file__))
 import lcov_utils
+import elf_utils
 
 del sys.path[0]
 import concurrent.futures
+import tempfile
 from urllib.parse import quote, unquote
 
 # NOTE: A lot of the functions in this file uses the form: func(*, param1, param2....)
@@ -350,32 +353,21 @@ async def gather_limited_concurrency(
     finally:
         [coro.cancel() for coro in coros]
 
-GET_BIN_ID_SHELL_CMD = "eu-readelf -n  {} | grep 'Build ID:' | head -1"
 @traced_func
 async def get_binary_id(
     *, path: PathLike, logger: LoggerType = COVERAGE_TOOLS_LOGGER
 ) -> str:
-    """A function to get the binary id of an ELF file
+    """A function to get the binary id of an ELF file, the same id `eu-readelf -n` shows,
+    read directly from the ELF notes rather than by running readelf.
 
     Args:
         path (PathLike): A path to the file who's id to extract
         logger (LoggerType, optional): The logger to which log information. Defaults to COVERAGE_TOOLS_LOGGER.
 
-    Raises:
-        RuntimeError: If the readelf command fails for some reason
-
     Returns:
         str: The found id if it exists else None
     """
-    cmd = GET_BIN_ID_SHELL_CMD.format(path)
-    proc = await create_subprocess_shell(cmd, stdout = PIPE, stderr = PIPE)
-    stdout, stderr = await proc.communicate()
-    if proc.returncode != 0:
-        raise RuntimeError(f"could not read {path} build id: {stderr.decode()}")
-    id_fields = stdout.decode().splitlines()
-    if len(id_fields) == 0:
-        return None
-    return id_fields[-1].strip().split(" ")[-1]
+    return await asyncio.to_thread(elf_utils.get_build_id, path)
 
 @traced_func
 async def get_binary_ids_map(
@@ -383,6 +375,7 @@ async def get_binary_ids_map(
     paths: Iterable[PathLike],
     filter: Optional[Iterable[FileType]] = None,
     with_types : bool = False,
+    cache: Optional["BinaryInfoCache"] = None,
     semaphore: Semaphore = Semaphore(1),
     logger: LoggerType = COVERAGE_TOOLS_LOGGER,
 ) -> Union[Mapping[Path, str], Mapping[Path, tuple[str, FileType]]]:
@@ -394,6 +387,7 @@ async def get_binary_ids_map(
             1. if it is a file, then it's id will be be mapped
             2. if it is a directory, the directory will be scanned recursively, for elf files
                and their ids will be mapped
+        cache (BinaryInfoCache, optional): A cache of file types and ids from previous calls. Defaults to None.
         semaphore (Semaphore, optional): A concurrency limiter of the operation. Defaults to Semaphore(1) (no concurrency).
         logger (LoggerType, optional): The logger into which the log information. Defaults to COVERAGE_TOOLS_LOGGER.
     Raises:
@@ -416,12 +410,15 @@ async def get_binary_ids_map(
     files_per_dir = [[f for f in dir.rglob("*") if f.is_file() and os.access(f, os.X_OK)] for dir in dirs]
     files.update({f for dirfiles in files_per_dir for f in dirfiles})
     files = list(files)
-    types = await gather_limited_concurrency(*(FileType.get_file_type(f) for f in files), semaphore = semaphore, logger = logger)
+    cache = cache if cache is not None else BinaryInfoCache()
+    types = await gather_limited_concurrency(*(cache.file_type(f) for f in files), semaphore = semaphore, logger = logger)
     if filter:
         filter = list(filter)
-        files = [f for f,ft in zip(files, types) if ft in filter]
+        kept = [i for i, ft in enumerate(types) if ft in filter]
+        files = [files[i] for i in kept]
+        types = [types[i] for i in kept]
     build_ids = await gather_limited_concurrency(
-        *(get_binary_id(path = f, logger = logger) for f in files),
+        *(cache.build_id(f, logger = logger) for f in files),
         semaphore = semaphore,
         logger = logger,
     )
@@ -476,6 +473,101 @@ async def get_profiled_binary_ids(
     return info
 
 
+class BinaryInfoCache:
+    """A persistent cache of what the functions above find out by running external tools:
+    the type and build id of binaries and the ids of the binaries profiled in llvm profiles,
+    keyed by path, size and modification time. Repeated coverage processing on the same build
+    then only needs to run tools for new files. Entries of files which were removed or changed
+    since are dropped on save. Without a path, the cache lives only in memory.
+    """
+    VERSION = 2
+    # Profiles are mostly unique to one run, so the oldest are dropped beyond this number
+    MAX_PROFILES = 100000
+
+    def __init__(self, path: Optional[PathLike] = None):
+        self.path = Path(path) if path is not None else None
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.profiles: Dict[str, Dict[str, Any]] = {}
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                self.files = data["files"]
+                self.profiles = data["profiles"]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            COVERAGE_TOOLS_LOGGER.warning(f"Ignoring unreadable binary info cache {self.path}: {e}")
+
+    @staticmethod
+    def _is_current(key: str, entry: Dict[str, Any]) -> bool:
+        try:
+            st = os.stat(key)
+        except OSError:
+            return False
+        return entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns
+
+    def prune(self):
+        """Drop the entries of files which no longer exist or changed since"""
+        self.files = {key: entry for key, entry in self.files.items() if self._is_current(key, entry)}
+        self.profiles = {key: entry for key, entry in self.profiles.items() if self._is_current(key, entry)}
+        while len(self.profiles) > self.MAX_PROFILES:
+            del self.profiles[next(iter(self.profiles))]
+
+    def save(self):
+        if self.path is None:
+            return
+        self.prune()
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"version": self.VERSION, "files": self.files, "profiles": self.profiles}, f)
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def _entry(entries: Dict[str, Dict[str, Any]], f: Path) -> Dict[str, Any]:
+        st = f.stat()
+        key = str(f.resolve())
+        entry = entries.get(key)
+        if entry is None or entry["size"] != st.st_size or entry["mtime_ns"] != st.st_mtime_ns:
+            entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+            entries[key] = entry
+        return entry
+
+    def _file_entry(self, f: Path) -> Dict[str, Any]:
+        return self._entry(self.files, f)
+
+    async def file_type(self, f: PathLike) -> FileType:
+        entry = self._file_entry(Path(f))
+        if "type" not in entry:
+            entry["type"] = (await FileType.get_file_type(f)).name
+        return FileType[entry["type"]]
+
+    async def build_id(self, f: PathLike, logger: LoggerType = COVERAGE_TOOLS_LOGGER) -> Optional[str]:
+        entry = self._file_entry(Path(f))
+        if "build_id" not in entry:
+            entry["build_id"] = await get_binary_id(path = f, logger = logger)
+        return entry["build_id"]
+
+    def _profile_entry(self, f: Path) -> Dict[str, Any]:
+        entry = self._entry(self.profiles, f)
+        # Reinsert, to keep the profiles in the order of use
+        key = str(f.resolve())
+        self.profiles[key] = self.profiles.pop(key)
+        return entry
+
+    async def profiled_binary_ids(self, f: PathLike, logger: LoggerType = COVERAGE_TOOLS_LOGGER) -> List[str]:
+        entry = self._profile_entry(Path(f))
+        if "ids" not in entry:
+            entry["ids"] = await get_profiled_binary_ids(path = f, logger = logger)
+        return list(entry["ids"])
+
+    async def add_profile(self, f: PathLike, ids: Iterable[str]):
+        """Remember the binary ids of a profile which are already known, e.g. of a merged profile"""
+        self._profile_entry(Path(f))["ids"] = list(ids)
+
+
 # The best way to merge profiles is by the file build id that they map, somewhen in the future,
 # it might also be desirable to merge profiles from different binaries, but lcov format does it better
 # as it is source dependant so for now we will stick to it.
@@ -494,6 +586,7 @@ async def merge_profiles(
     path_for_merged: PathLike = Path(),
     sparse: bool = True,
     clear_on_success: bool = False,
+    cache: Optional[BinaryInfoCache] = None,
     semaphore: Semaphore = Semaphore(1),
     logger: Union[logging.Logger, logging.LoggerAdapter] = COVERAGE_TOOLS_LOGGER,
 ) -> MergeProfilesResult:
@@ -506,6 +599,8 @@ async def merge_profiles(
         profiles (Iterable[PathLike]): A list of profiles to merge
         path_for_merged (PathLike, optional): A path to a directory for the merged files. Defaults to Path().
         clear_on_success (bool, optional): Remove the original profiles on success. Defaults to False.
+        cache (BinaryInfoCache, optional): A cache of the profiled binary ids of profiles, which also learns the ids of
+            the merged profiles. Defaults to None.
         semaphore (ConcurrencyParam, optional): concurrency limitation for the operation. Defaults to Semaphore(1) (no concurrency).
         logger (Union[logging.Logger, logging.LoggerAdapter], optional): The logger to which log information. Defaults to COVERAGE_TOOLS_LOGGER.
 
@@ -516,8 +611,9 @@ async def merge_profiles(
     """
     profiles = [Path(p) for p in profiles]
     path_for_merged = Path(path_for_merged)
+    cache = cache if cache is not None else BinaryInfoCache()
     profile_ids = await gather_limited_concurrency(
-        *(get_profiled_binary_ids(path = profile, logger = logger) for profile in profiles),
+        *(cache.profiled_binary_ids(profile, logger = logger) for profile in profiles),
         semaphore = semaphore,
         logger = logger,
     )
@@ -554,6 +650,7 @@ async def merge_profiles(
             )
         if clear_on_success:
             [profile.unlink() for profile in profiles]
+        await cache.add_profile(destination_profile, ids)
         return MergeProfilesResult([destination_profile], [], [])
 
     merging_tasks = [
@@ -577,6 +674,7 @@ async def profdata_to_lcov(
     id_search_paths: Iterable[PathLike] = [],
     clear_on_success: bool = False,
     update_known_ids: bool = True,
+    cache: Optional[BinaryInfoCache] = None,
     semaphore: Semaphore = Semaphore(1),
     logger: LoggerType = COVERAGE_TOOLS_LOGGER,
 ):
@@ -597,6 +695,7 @@ async def profdata_to_lcov(
         Defaults to False.
         update_known_ids (bool, optional): Whether to update the known ids map given in `known_file_ids` by
         the user. Defaults to True.
+        cache (BinaryInfoCache, optional): A cache of file types and ids from previous calls. Defaults to None.
         semaphore (Semaphore, optional): Concurrency limitation for the operation. Defaults to Semaphore(1) (no concurrency).
         logger (LoggerType, optional): logger to which log information. Defaults to COVERAGE_TOOLS_LOGGER.
 
@@ -605,8 +704,9 @@ async def profdata_to_lcov(
         weren't contained in any of `id_search_paths`), or, if the conversion itself failed for some reason.
 
     """
+    cache = cache if cache is not None else BinaryInfoCache()
     found_ids = await get_binary_ids_map(
-        paths = id_search_paths, filter = PROFILED_ELF_TYPES, semaphore = semaphore, logger = logger
+        paths = id_search_paths, filter = PROFILED_ELF_TYPES, cache = cache, semaphore = semaphore, logger = logger
     )
     if not update_known_ids:
         known_file_ids = dict(known_file_ids)
@@ -617,7 +717,7 @@ async def profdata_to_lcov(
     profiles = [Path(p) for p in profiles]
     # logger.debug(f"going to convert {profiles}")
     per_profile_ids = await gather_limited_concurrency(
-        *(get_profiled_binary_ids(path = profile, logger = logger) for profile in profiles),
+        *(cache.profiled_binary_ids(profile, logger = logger) for profile in profiles),
         semaphore = semaphore,
         logger = logger,
     )
@@ -668,14 +768,83 @@ LCOV_TAG_WITH_TEST_SHELL_CMD = (
     "sed 's/^TN:.*/TN:{test_name}/g' {input_lcov} > {output_lcov}"
 )
 
+def merge_lcov_chunk(
+    lcovs: List[Path],
+    output_lcov: Optional[Path],
+    output_binary: Optional[Path],
+    test_tag: Optional[str],
+):
+    """Merges lcov trace files (or binary dumps of them) into output_lcov and/or output_binary.
+    This is the unit of work of lcov_combine_traces in worker processes, so it only takes
+    and returns picklable values.
+    """
+    result = lcov_utils.LcovFile()
+    for lcov in lcovs:
+        lcov_obj = lcov_utils.LcovFile(lcov)
+        if test_tag:
+            lcov_obj.tag_with_test(test_tag)
+        # The loaded records are not used anywhere else, so they don't need to be copied.
+        for record in lcov_obj.records.values():
+            result._add_record(record)
+    if output_lcov:
+        result.write(output_lcov)
+    if output_binary:
+        result.dump(output_binary)
+
+
+async def _combine_traces_in_processes(
+    *,
+    lcovs: List[Path],
+    output_lcov: Optional[Path],
+    output_binary: Optional[Path],
+    test_tag: Optional[str],
+    files_per_chunk: int,
+    concurrency: int,
+) -> Optional[lcov_utils.LcovFile]:
+    loop = asyncio.get_running_loop()
+    output_dir = Path(output_lcov or output_binary).parent if (output_lcov or output_binary) else None
+    with tempfile.TemporaryDirectory(prefix = "lcov_combine_", dir = output_dir) as tmpdir, \
+         concurrent.futures.ProcessPoolExecutor(concurrency) as executor:
+        next_id = count()
+        files_to_merge = lcovs
+        while len(files_to_merge) > files_per_chunk:
+            chunks = [
+                files_to_merge[i : i + files_per_chunk]
+                for i in range(0, len(files_to_merge), files_per_chunk)
+            ]
+            # Intermediate results are passed between the workers as binary dumps,
+            # which are much cheaper to write and parse than lcov traces.
+            files_to_merge = [Path(tmpdir) / f"{next(next_id)}.lcovbin" for _ in chunks]
+            await asyncio.gather(
+                *(
+                    loop.run_in_executor(executor, merge_lcov_chunk, chunk, None, output, test_tag)
+                    for chunk, output in zip(chunks, files_to_merge)
+                )
+            )
+            # Already tagged
+            test_tag = None
+        # Without any output, the result is returned
+        want_result = output_lcov is None and output_binary is None
+        if want_result:
+            output_binary = Path(tmpdir) / "result.lcovbin"
+        await loop.run_in_executor(
+            executor, merge_lcov_chunk, files_to_merge, output_lcov, output_binary, test_tag
+        )
+        if want_result:
+            return lcov_utils.LcovFile(output_binary)
+    return None
+
+
 @traced_func
 async def lcov_combine_traces(
     *,
     lcovs: Iterable[PathLike],
     output_lcov: Optional[PathLike] = None,
+    output_binary: Optional[PathLike] = None,
     test_tag: Optional[str] = None,
     clear_on_success: bool = False,
     files_per_chunk: Union[int, None] = None,
+    processes: bool = False,
     semaphore: Semaphore = Semaphore(1),
     logger: LoggerType = COVERAGE_TOOLS_LOGGER,
 ):
@@ -684,10 +853,14 @@ async def lcov_combine_traces(
     merged.
 
     Args:
-        lcovs (Iterable[PathLike]): A list of source lcov trace files to merge
+        lcovs (Iterable[PathLike]): A list of source lcov trace files (or binary dumps) to merge
         output_lcov (PathLike): the final output lcov file
+        output_binary (PathLike, optional): A binary dump of the result (see: LcovFile.dump), to be merged
+            further. Defaults to None.
         branch_coverage (bool, optional): Wether to include branch coverage data or not (if exists). Defaults to True.
         files_per_chunk (Union[int, None], optional): How many files to combine per parallel task. Defaults to None.
+        processes (bool, optional): Merge in worker processes rather than threads. Merging is CPU bound
+            Python code, so with threads it can't use more than one core. Defaults to False.
         concurrency (ConcurrencyParam, optional): A concurrency limiting parameter for the execution. Defaults to None.
         logger (LoggerType, optional): A logger to which log information. Defaults to COVERAGE_TOOLS_LOGGER.
 
@@ -700,6 +873,8 @@ async def lcov_combine_traces(
 
     if files_per_chunk is None or files_per_chunk > len(lcovs):
         files_per_chunk = len(lcovs)
+    # A chunk of one file would never reduce the number of files to merge
+    files_per_chunk = max(files_per_chunk, 2)
 
     def merge_lcovs(lcov_spec: List[Union[lcov_utils.LcovFile, Path]]):
         lcov_objs: List[lcov_utils.LcovFile] = []
@@ -719,12 +894,26 @@ async def lcov_combine_traces(
         return lcov_result
 
     files_to_merge = lcovs
-    # Consume all of the available concurrency in the semaphore
-    concurrency = 0
+    # Consume all of the available concurrency in the semaphore, but at least one unit of it
+    await semaphore.acquire()
+    concurrency = 1
     while not semaphore.locked():
         await semaphore.acquire()
         concurrency += 1
     try:
+        if processes:
+            result = await _combine_traces_in_processes(
+                lcovs = lcovs,
+                output_lcov = Path(output_lcov) if output_lcov else None,
+                output_binary = Path(output_binary) if output_binary else None,
+                test_tag = test_tag,
+                files_per_chunk = files_per_chunk,
+                concurrency = concurrency,
+            )
+            if output_lcov and clear_on_success:
+                for lcov in lcovs:
+                    lcov.unlink()
+            return result
         with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
             while len(files_to_merge) > 1:
                 files_to_merge = [
@@ -739,6 +928,8 @@ async def lcov_combine_traces(
             result: List[lcov_utils.LcovFile] = await loop.run_in_executor(
                 executor, partial(merge_lcovs, files_to_merge)
             )
+            if output_binary:
+                result.dump(output_binary)
             if output_lcov:
                 result.write(output_lcov)
                 if clear_on_success:
@@ -831,6 +1022,7 @@ async def merge_lcov_files_cmd(args):
         test_tag = args.testname,
         clear_on_success = args.clear_on_success,
         files_per_chunk = args.files_per_chunk,
+        processes = args.processes,
         semaphore = args.concurrency,
         logger = COVERAGE_TOOLS_LOGGER,
     )
@@ -1262,6 +1454,12 @@ async def main():
         default = 4,
         help = "The maximal number of files to merge at once (for performance tweaking)",
     )
+    merge_lcov_files_parser.add_argument(
+        "--processes",
+        action = "store_true",
+        default = False,
+        help = "Merge in worker processes rather than threads, to use more than one core",
+    )
     merge_lcov_files_parser.add_argument(
         "--filter",
         "-f",
@@ -0,0 +1,200 @@
+#
+# Copyright (C) 2024-present ScyllaDB
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+"""CPU slots: placement of concurrently running tests and Scylla servers.
+   The available CPUs are split into slots of a few CPUs each, and each
+   test process and Scylla server runs in the least loaded slot, so that
+   concurrent processes don't all compete for the same cores.
+
+   Where a cgroup v2 hierarchy is delegated to us, each slot is a cgroup
+   with a cpuset, and each process gets a leaf cgroup below it, with a
+   memory limit if a memory budget per slot is given. Otherwise processes
+   are pinned to the CPUs of their slot with taskset(1) and memory is not
+   limited.
+"""
+import itertools
+import logging
+import os
+import pathlib
+from typing import Iterable, List, Optional, Union
+
+CGROUP_ROOT = pathlib.Path("/sys/fs/cgroup")
+
+
+def parse_cpu_list(cpu_list: str) -> List[int]:
+    """Parse a CPU list in the format of taskset -c and cpuset.cpus, e.g. "0-3,8".
+       Raises ValueError if the list is malformed."""
+    cpus: List[int] = []
+    for part in cpu_list.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            if int(first) > int(last):
+                raise ValueError(f"invalid CPU range {part}")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpu_list(cpus: Iterable[int]) -> str:
+    """The reverse of parse_cpu_list()"""
+    ranges = []
+    for _, group in itertools.groupby(enumerate(sorted(cpus)), lambda x: x[1] - x[0]):
+        group = list(group)
+        first, last = group[0][1], group[-1][1]
+        ranges.append(str(first) if first == last else f"{first}-{last}")
+    return ",".join(ranges)
+
+
+def _own_cgroup() -> Optional[pathlib.Path]:
+    """The cgroup v2 directory of this process, if it is on a unified hierarchy"""
+    try:
+        with open("/proc/self/cgroup") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    return CGROUP_ROOT / line[3:].strip().lstrip("/")
+    except OSError:
+        pass
+    return None
+
+
+class Slot:
+    def __init__(self, index: int, cpus: List[int], memory: Optional[int],
+                 cgroup: Optional[pathlib.Path]) -> None:
+        self.index = index
+        self.cpus = cpus
+        self.cpuset = format_cpu_list(cpus)
+        # Memory budget of each process in the slot, in bytes
+        self.memory = memory
+        self.cgroup = cgroup
+        self.users = 0
+
+    def __str__(self) -> str:
+        return f"slot {self.index} (cpus {self.cpuset})"
+
+
+class SlotLease:
+    """A place in a slot for one process, returned by SlotPool.lease()"""
+    _next_id = itertools.count().__next__
+
+    def __init__(self, slot: Slot) -> None:
+        self.slot = slot
+        self.released = False
+        self.cgroup: Optional[pathlib.Path] = None
+        if slot.cgroup is not None:
+            cgroup = slot.cgroup / f"proc-{os.getpid()}-{self._next_id()}"
+            try:
+                cgroup.mkdir()
+                if slot.memory is not None:
+                    (cgroup / "memory.max").write_text(str(slot.memory))
+                    try:
+                        (cgroup / "memory.swap.max").write_text("0")
+                    except OSError:
+                        # No swap accounting
+                        pass
+                self.cgroup = cgroup
+            except OSError as exc:
+                logging.warning("Failed to create cgroup %s, using taskset: %s", cgroup, exc)
+                _rmdir(cgroup)
+        slot.users += 1
+
+    def wrap(self, cmd: List[str]) -> List[str]:
+        """Command line which runs cmd in the slot. Every wrapper execs
+           the next command, so the pid stays the same."""
+        if self.cgroup is not None:
+            # Writing 0 to cgroup.procs moves the writing process
+            return ["sh", "-c", 'echo 0 > "$0/cgroup.procs" && exec "$@"', str(self.cgroup), *cmd]
+        return ["taskset", "-c", self.slot.cpuset, *cmd]
+
+    def release(self) -> None:
+        """Give the place back. The process must have exited."""
+        if self.released:
+            return
+        self.released = True
+        self.slot.users -= 1
+        if self.cgroup is not None:
+            _rmdir(self.cgroup)
+            self.cgroup = None
+
+
+def _rmdir(path: pathlib.Path) -> None:
+    try:
+        path.rmdir()
+    except OSError:
+        pass
+
+
+class SlotPool:
+    """Splits cpus into slots of cpus_per_slot CPUs each (the remainder is
+       not used), and hands out places in the least loaded slot."""
+
+    def __init__(self, cpus: List[int], cpus_per_slot: int, memory_per_slot: Optional[int],
+                 logger: Union[logging.Logger, logging.LoggerAdapter]) -> None:
+        assert cpus_per_slot > 0
+        self.logger = logger
+        self.controllers: List[str] = []
+        self.base_cgroup = self._setup_cgroups(memory_per_slot is not None)
+        nr_slots = max(1, len(cpus) // cpus_per_slot)
+        self.slots: List[Slot] = []
+        for i in range(nr_slots):
+            slot_cpus = cpus[i * cpus_per_slot:(i + 1) * cpus_per_slot] or cpus
+            self.slots.append(Slot(i, slot_cpus, memory_per_slot, self._slot_cgroup(i, slot_cpus)))
+        self.logger.info("Running tests in %d CPU slots%s: %s", len(self.slots),
+                         " using cgroups" if self.base_cgroup else "",
+                         ", ".join(slot.cpuset for slot in self.slots))
+
+    def _setup_cgroups(self, need_memory: bool) -> Optional[pathlib.Path]:
+        """Prepare our cgroup for slot cgroups, if cgroup v2 is delegated to us.
+           Controllers can only be enabled for the children of a cgroup without
+           processes, so test.py moves itself into a "test.py" leaf first."""
+        base = _own_cgroup()
+        if base is None or not os.access(base / "cgroup.subtree_control", os.W_OK):
+            self.logger.info("cgroup v2 is not delegated, pinning tests to CPU slots with taskset")
+            return None
+        controllers = ["cpuset"] + (["memory"] if need_memory else [])
+        try:
+            available = (base / "cgroup.controllers").read_text().split()
+            missing = [c for c in controllers if c not in available]
+            if missing:
+                raise OSError(f"controllers {missing} are not available in {base}")
+            leaf = base / "test.py"
+            leaf.mkdir(exist_ok=True)
+            (leaf / "cgroup.procs").write_text("0")
+            (base / "cgroup.subtree_control").write_text(" ".join("+" + c for c in controllers))
+        except OSError as exc:
+            self.logger.warning("Can't use cgroups for CPU slots, using taskset: %s", exc)
+            return None
+        self.controllers = controllers
+        return base
+
+    def _slot_cgroup(self, index: int, cpus: List[int]) -> Optional[pathlib.Path]:
+        if self.base_cgroup is None:
+            return None
+        cgroup = self.base_cgroup / f"test.py-slot-{index}"
+        try:
+            cgroup.mkdir(exist_ok=True)
+            (cgroup / "cpuset.cpus").write_text(format_cpu_list(cpus))
+            if "memory" in self.controllers:
+                (cgroup / "cgroup.subtree_control").write_text("+memory")
+            return cgroup
+        except OSError as exc:
+            self.logger.warning("Failed to set up cgroup %s, using taskset: %s", cgroup, exc)
+            return None
+
+    def lease(self) -> SlotLease:
+        """A place in the least loaded slot. Never blocks: if there are
+           more processes than slots, some slots are shared."""
+        return SlotLease(min(self.slots, key=lambda slot: slot.users))
+
+    def cleanup(self) -> None:
+        """Remove the cgroups of the slots, once all processes are gone"""
+        for slot in self.slots:
+            if slot.cgroup is not None:
+                for leaf in slot.cgroup.glob("proc-*"):
+                    _rmdir(leaf)
+                _rmdir(slot.cgroup)
@@ -0,0 +1,134 @@
+#
+# Copyright (C) 2024-present ScyllaDB
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+"""Test duration history and longest-first scheduling for test.py.
+   test.py remembers how long each test took in previous runs (per build
+   mode) and uses this to start the longest tests first, so that a few
+   long tests starting at the very end of the run don't stretch the
+   wall-clock time of the whole run.
+"""
+import heapq
+import json
+import logging
+import os
+import pathlib
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar('T')
+
+# Used for tests which never ran before, and there is nothing
+# known about other tests in their suite either.
+DEFAULT_DURATION = 10.0
+
+
+class MetricHistory:
+    """Persistent map of mode -> test key -> a metric of the test measured
+       in previous runs, e.g. its duration. The value is an exponential
+       moving average of the measurements, so that it follows real changes
+       without jumping around because of a single unusual run.
+    """
+
+    # Weight of the most recent measurement in the moving average
+    ALPHA = 0.5
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self.values: Dict[str, Dict[str, float]] = {}
+        try:
+            with self.path.open("r") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self.values = data
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring unreadable test history %s: %s", self.path, e)
+
+    def record(self, mode: str, key: str, value: float) -> None:
+        if value <= 0:
+            return
+        mode_values = self.values.setdefault(mode, {})
+        old = mode_values.get(key)
+        if old is None:
+            mode_values[key] = value
+        else:
+            mode_values[key] = self.ALPHA * value + (1 - self.ALPHA) * old
+
+    def get(self, mode: str, key: str) -> float | None:
+        return self.values.get(mode, {}).get(key)
+
+    def save(self) -> None:
+        # Write to a temporary file and rename it, so that a test.py
+        # interrupted in the middle doesn't leave a truncated history.
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with tmp.open("w") as f:
+            json.dump(self.values, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+class DurationHistory(MetricHistory):
+    """Expected test durations in seconds"""
+
+    def estimate(self, mode: str, key: str, suite: str) -> float:
+        """Expected duration of a test. For a test which never ran,
+           guess the average duration of the known tests of its suite."""
+        duration = self.get(mode, key)
+        if duration is not None:
+            return duration
+        prefix = suite + "/"
+        known = [d for k, d in self.values.get(mode, {}).items() if k.startswith(prefix)]
+        if known:
+            return sum(known) / len(known)
+        return DEFAULT_DURATION
+
+
+def longest_first(items: Iterable[T], durations: Dict[T, float],
+                  group: Optional[Callable[[T], Hashable]] = None) -> List[T]:
+    """Order items by decreasing expected duration (LPT order).
+       Starting each next item in this order on the first job slot
+       that frees up is the classic longest-processing-time-first
+       greedy bin packing, which is within 4/3 of the optimal makespan.
+
+       With `group`, the items of each group (e.g. each test suite) are
+       kept together, longest first within the group, and the groups
+       are ordered by their longest item. A global order would
+       interleave the suites, so none of them would finish - and
+       release its clusters and other per-suite resources - until the
+       very end of the run."""
+    if group is None:
+        return sorted(items, key=lambda item: durations[item], reverse=True)
+    groups: Dict[Hashable, List[T]] = {}
+    for item in items:
+        groups.setdefault(group(item), []).append(item)
+    ordered = [sorted(members, key=lambda item: durations[item], reverse=True)
+               for members in groups.values()]
+    ordered.sort(key=lambda members: durations[members[0]], reverse=True)
+    return [item for members in ordered for item in members]
+
+
+def predict_makespan(durations: Sequence[float], jobs: int) -> float:
+    """Simulate running durations in the given order on `jobs` slots,
+       each next duration starting on the least loaded slot."""
+    if not durations:
+        return 0.0
+    slots = [0.0] * max(min(jobs, len(durations)), 1)
+    for d in durations:
+        heapq.heappush(slots, heapq.heappop(slots) + d)
+    return max(slots)
+
+
+def ideal_makespan(durations: Sequence[float], jobs: int) -> float:
+    """A lower bound on the makespan of any schedule: either the
+       total work spread evenly across all slots, or the single
+       longest item, whichever is larger."""
+    if not durations:
+        return 0.0
+    return max(sum(durations) / max(jobs, 1), max(durations))
+
+
+def schedule_summary(durations: Sequence[float], jobs: int) -> Tuple[float, float]:
+    """Return (predicted, ideal) makespan of durations in the given order"""
+    return predict_makespan(durations, jobs), ideal_makespan(durations, jobs)
@@ -0,0 +1,88 @@
+#
+# Copyright (C) 2024-present ScyllaDB
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+"""Minimal ELF parsing helpers which don't need external tools.
+"""
+import struct
+from pathlib import Path
+from typing import BinaryIO, Optional, Union
+
+PT_NOTE = 4
+SHT_NOTE = 7
+NT_GNU_BUILD_ID = 3
+
+
+def _align4(n: int) -> int:
+    return (n + 3) & ~3
+
+
+def _find_build_id_note(f: BinaryIO, endian: str, offset: int, size: int) -> Optional[str]:
+    f.seek(offset)
+    notes = f.read(size)
+    pos = 0
+    while pos + 12 <= len(notes):
+        namesz, descsz, note_type = struct.unpack_from(endian + "III", notes, pos)
+        pos += 12
+        name = notes[pos:pos + namesz]
+        pos += _align4(namesz)
+        desc = notes[pos:pos + descsz]
+        pos += _align4(descsz)
+        if note_type == NT_GNU_BUILD_ID and name.rstrip(b"\0") == b"GNU":
+            return desc.hex()
+    return None
+
+
+def get_build_id(path: Union[str, Path]) -> Optional[str]:
+    """Return the GNU build id of an ELF file as a hex string, same as
+       `eu-readelf -n` prints it, or None if the file is not an ELF
+       file or has no build id note.
+       Looks for the note in the program headers first, which are at the
+       beginning of the file, and then in the section headers, for files
+       without program headers (e.g. separate debug info files)."""
+    try:
+        with open(path, "rb") as f:
+            ident = f.read(16)
+            if len(ident) < 16 or ident[:4] != b"\x7fELF":
+                return None
+            is64 = ident[4] == 2
+            endian = "<" if ident[5] == 1 else ">"
+            if is64:
+                header = f.read(48)
+                (_, _, _, _, phoff, shoff, _, _, phentsize, phnum, shentsize, shnum, _) = \
+                    struct.unpack(endian + "HHIQQQIHHHHHH", header)
+                phdr_fmt, shdr_fmt = endian + "IIQQQQQQ", endian + "IIQQQQIIQQ"
+            else:
+                header = f.read(36)
+                (_, _, _, _, phoff, shoff, _, _, phentsize, phnum, shentsize, shnum, _) = \
+                    struct.unpack(endian + "HHIIIIIHHHHHH", header)
+                phdr_fmt, shdr_fmt = endian + "IIIIIIII", endian + "IIIIIIIIII"
+
+            if phoff and phnum:
+                f.seek(phoff)
+                phdrs = f.read(phentsize * phnum)
+                for i in range(phnum):
+                    fields = struct.unpack_from(phdr_fmt, phdrs, i * phentsize)
+                    if is64:
+                        p_type, p_offset, p_filesz = fields[0], fields[2], fields[5]
+                    else:
+                        p_type, p_offset, p_filesz = fields[0], fields[1], fields[4]
+                    if p_type == PT_NOTE:
+                        build_id = _find_build_id_note(f, endian, p_offset, p_filesz)
+                        if build_id:
+                            return build_id
+
+            if shoff and shnum:
+                f.seek(shoff)
+                shdrs = f.read(shentsize * shnum)
+                for i in range(shnum):
+                    fields = struct.unpack_from(shdr_fmt, shdrs, i * shentsize)
+                    sh_type, sh_offset, sh_size = fields[1], fields[4], fields[5]
+                    if sh_type == SHT_NOTE:
+                        build_id = _find_build_id_note(f, endian, sh_offset, sh_size)
+                        if build_id:
+                            return build_id
+    except (OSError, struct.error):
+        return None
+    return None
@@ -0,0 +1,158 @@
+#
+# Copyright (C) 2024-present ScyllaDB
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+"""Cache of "golden" Scylla working directories.
+   A golden workdir is the data directory of a server which booted once
+   with a given executable and configuration and was stopped cleanly,
+   with everything identifying the node or its cluster removed. A new
+   server forming a new cluster can start from a copy of it instead of
+   from an empty directory.
+
+   test.py doesn't use it yet: it is to be enabled together with a
+   topology test which boots a cluster from a golden workdir and checks
+   that the nodes join it cleanly.
+"""
+import asyncio
+import errno
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import shutil
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+
+# Config options which differ between servers and are not part of the cache key
+PER_NODE_CONFIG_OPTIONS = frozenset([
+    'cluster_name', 'workdir', 'seed_provider',
+    'listen_address', 'rpc_address', 'api_address',
+    'prometheus_address', 'alternator_address',
+])
+
+# Parts of a stopped server's workdir which are specific to the node or
+# its cluster: the replicated system keyspaces, which record host ids and
+# the cluster's roles, and node state which should not survive a restart
+# on another node.
+NODE_IDENTITY_PATHS = [
+    'data/system_distributed',
+    'data/system_distributed_everywhere',
+    'data/system_auth',
+    'commitlog',
+    'hints',
+    'view_hints',
+    'saved_caches',
+    'conf',
+]
+
+# Tables of the node-local "system" keyspace which keep the host id,
+# cluster name, peers, raft group 0 and the state it manages. The other
+# tables of the keyspace, and the schema in system_schema, are the same
+# on every freshly booted node and are kept.
+NODE_IDENTITY_SYSTEM_TABLES = frozenset([
+    'local', 'peers', 'peer_events', 'scylla_local', 'truncated',
+    'raft', 'raft_snapshots', 'raft_snapshot_config', 'discovery', 'group0_history',
+    'topology', 'topology_requests', 'cdc_generations_v3', 'cdc_local', 'tablets',
+    'service_levels_v2', 'roles', 'role_members', 'role_attributes', 'role_permissions',
+    'sstables', 'commitlog_cleanups', 'view_build_status_v2', 'built_views',
+    'views_builds_in_progress', 'scylla_views_builds_in_progress',
+])
+
+COMPLETE_MARKER = '.complete'
+
+
+def golden_key(exe: pathlib.Path, config: Dict[str, Any], cmdline_options: List[str],
+               property_file: Optional[Dict[str, Any]]) -> str:
+    """Hash of everything that affects the contents of a freshly booted workdir.
+       The executable is identified by its size and modification time, so
+       a rebuild invalidates the cache."""
+    st = exe.stat()
+    node_independent = {k: v for k, v in config.items() if k not in PER_NODE_CONFIG_OPTIONS}
+    h = hashlib.sha256()
+    h.update(json.dumps([str(exe), st.st_size, st.st_mtime_ns, node_independent,
+                         cmdline_options, property_file],
+                        sort_keys=True, default=str).encode())
+    return h.hexdigest()[:16]
+
+
+def reset_node_identity(workdir: pathlib.Path) -> None:
+    """Remove everything identifying the node from a stopped server's workdir"""
+    for path in NODE_IDENTITY_PATHS:
+        shutil.rmtree(workdir / path, ignore_errors=True)
+    system = workdir / 'data' / 'system'
+    if system.is_dir():
+        # Table directories are named <table>-<table id>
+        for table_dir in system.iterdir():
+            if table_dir.name.rpartition('-')[0] in NODE_IDENTITY_SYSTEM_TABLES:
+                shutil.rmtree(table_dir, ignore_errors=True)
+
+
+def link_or_copy(src: str, dst: str) -> None:
+    """Hard link a file, falling back to a copy across file systems.
+       Scylla never modifies sstables in place, so sharing them between
+       a golden workdir and servers started from it is safe."""
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(src, dst)
+
+
+class GoldenWorkdirCache:
+    """Golden workdirs of one build mode, kept in base_dir across test.py runs,
+       one per key (see golden_key()). A golden workdir is built on first use
+       by booting and cleanly stopping a throwaway server."""
+
+    def __init__(self, base_dir: pathlib.Path,
+                 logger: Union[logging.Logger, logging.LoggerAdapter]) -> None:
+        self.base_dir = base_dir
+        self.logger = logger
+        self.locks: Dict[str, asyncio.Lock] = {}
+        # Keys for which building failed in this run, not retried
+        self.failed: set[str] = set()
+
+    def path(self, key: str) -> pathlib.Path:
+        return self.base_dir / key
+
+    async def get(self, key: str,
+                  build: Callable[[], Awaitable[pathlib.Path]]) -> Optional[pathlib.Path]:
+        """Return the golden workdir for the key, building it if necessary.
+           `build` must boot a server, stop it cleanly and return its workdir,
+           which is then moved into the cache. Returns None if the golden
+           workdir can't be built, in which case the caller should boot
+           from an empty workdir as usual."""
+        golden = self.path(key)
+        if (golden / COMPLETE_MARKER).exists():
+            return golden
+        if key in self.failed:
+            return None
+        async with self.locks.setdefault(key, asyncio.Lock()):
+            if (golden / COMPLETE_MARKER).exists():
+                return golden
+            if key in self.failed:
+                return None
+            self.logger.info("Building golden workdir %s", golden)
+            try:
+                workdir = await build()
+                reset_node_identity(workdir)
+                shutil.rmtree(golden, ignore_errors=True)
+                golden.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(workdir, golden)
+                (golden / COMPLETE_MARKER).touch()
+            except Exception as exc:
+                self.logger.warning("Failed to build golden workdir %s, booting servers "
+                                    "from scratch: %s", golden, exc)
+                self.failed.add(key)
+                shutil.rmtree(golden, ignore_errors=True)
+                return None
+            self.logger.info("Built golden workdir %s", golden)
+            return golden
+
+    @staticmethod
+    def populate(golden: pathlib.Path, workdir: pathlib.Path) -> None:
+        """Fill an empty server workdir from a golden workdir"""
+        shutil.copytree(golden, workdir, copy_function=link_or_copy, dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns(COMPLETE_MARKER))
@@ -0,0 +1,184 @@
+#
+# Copyright (C) 2024-present ScyllaDB
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+"""Test impact selection from coverage data.
+   An ImpactMap remembers which source lines each test covered in the
+   last coverage run in which it took part (test.py --coverage-test-map).
+   With it, test.py --changed-since=<rev> runs only the tests which cover
+   a line changed since <rev>.
+
+   Tests are identified by "suite/test" keys. Coverage which can't be
+   attributed to a single test, e.g. of Scylla servers shared by the
+   tests of a Python suite, is recorded under the suite name and selects
+   all tests of the suite.
+
+   Changes the map can't account for select more: a change of a suite's
+   configuration or helpers selects the whole suite, and a change of the
+   test runner or of any file no test covered selects all tests.
+"""
+import bisect
+import json
+import logging
+import os
+import pathlib
+from typing import Dict, Iterable, List, Optional, Set
+
+from test.pylib.lcov_utils import LcovFile, prepare_patches_for_lcov
+
+# Changed lines of a file, None if the whole file is affected
+Changes = Dict[str, Optional[Set[int]]]
+
+
+def impact_key(suite: str, shortname: str) -> str:
+    """Key of a test in the impact map. All test cases of a Boost test
+       run the same executable, so they share the key."""
+    return "{}/{}".format(suite, shortname.split('.')[0])
+
+
+def line_ranges(lines: Iterable[int]) -> List[List[int]]:
+    """Compress line numbers into sorted [first, last] ranges"""
+    ranges: List[List[int]] = []
+    for line in sorted(lines):
+        if ranges and ranges[-1][1] + 1 >= line:
+            ranges[-1][1] = max(ranges[-1][1], line)
+        else:
+            ranges.append([line, line])
+    return ranges
+
+
+def ranges_intersect(ranges: List[List[int]], lines: Optional[Set[int]]) -> bool:
+    if lines is None:
+        return bool(ranges)
+    starts = [first for first, _ in ranges]
+    for line in lines:
+        i = bisect.bisect_right(starts, line) - 1
+        if i >= 0 and ranges[i][1] >= line:
+            return True
+    return False
+
+
+def normalize_source_path(path: pathlib.Path) -> str:
+    """Source files relative to the repository root, like in a git diff"""
+    if path.is_absolute():
+        try:
+            return str(path.relative_to(os.getcwd()))
+        except ValueError:
+            pass
+    return str(path)
+
+
+class ImpactMap:
+    """Persistent map of test key -> source file -> covered line ranges"""
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self.tests: Dict[str, Dict[str, List[List[int]]]] = {}
+        try:
+            with self.path.open("r") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self.tests = data
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning("Ignoring unreadable test impact map %s: %s", self.path, e)
+
+    def __bool__(self) -> bool:
+        return bool(self.tests)
+
+    def record(self, key: str, lcov_files: Iterable[LcovFile]) -> None:
+        """Replace the coverage of a test with the lines hit in lcov_files"""
+        covered: Dict[str, Set[int]] = {}
+        for lcov in lcov_files:
+            for (_, source_file), record in lcov.records.items():
+                lines = [line for line, hits in record.line_hits.items() if hits]
+                if lines:
+                    covered.setdefault(normalize_source_path(pathlib.Path(source_file)), set()).update(lines)
+        self.tests[key] = {source: line_ranges(lines) for source, lines in covered.items()}
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with tmp.open("w") as f:
+            json.dump(self.tests, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+    def impacted(self, changes: Changes) -> Set[str]:
+        """Keys of the tests (or suites) which cover any of the changes"""
+        return {key for key, files in self.tests.items()
+                if any(ranges_intersect(files[source], lines)
+                       for source, lines in changes.items() if source in files)}
+
+    def covered_files(self) -> Set[str]:
+        return {source for files in self.tests.values() for source in files}
+
+    def is_known(self, suite: str, shortname: str) -> bool:
+        return impact_key(suite, shortname) in self.tests or suite in self.tests
+
+
+def changed_lines(patch_file: pathlib.Path) -> Changes:
+    """Lines of the files changed by a patch, in the numbering of the
+       patched files. A removed line is represented by the lines around
+       the place where it was."""
+    patch = prepare_patches_for_lcov([patch_file])[0]
+    changes: Changes = {}
+    for patched_file in patch.removed_files:
+        changes[patched_file.path] = None
+    for patched_file in patch.added_files:
+        changes[patched_file.path] = None
+    for patched_file in patch.modified_files:
+        if patched_file.is_rename:
+            source = patched_file.source_file
+            changes[source[2:] if source.startswith("a/") else source] = None
+        lines: Set[int] = set()
+        for hunk in patched_file:
+            last_target_line = hunk.target_start - 1
+            for line in hunk:
+                if line.target_line_no is not None:
+                    last_target_line = line.target_line_no
+                if line.is_added:
+                    lines.add(line.target_line_no)
+                elif line.is_removed:
+                    lines.update((last_target_line, last_target_line + 1))
+        changes[patched_file.path] = lines
+    return changes
+
+
+# Changes of these run all tests: the test runner, its libraries and
+# the configuration shared by all suites
+INFRASTRUCTURE = ("test.py", "test/pylib/")
+# Files of a suite which affect all its tests
+SUITE_FILES = ("suite.yaml", "conftest.py")
+
+
+def is_test_file(path: pathlib.PurePath) -> bool:
+    """Whether a file in a suite directory is a test of its own,
+       e.g. test_foo.py, foo_test.cc, foo_test.cql or foo_test.result"""
+    return path.stem.startswith("test_") or path.stem.endswith("test") or path.name == "run"
+
+
+def select_tests(impact_map: ImpactMap, changes: Changes, suites: Iterable[str]) -> Optional[Set[str]]:
+    """Keys of the tests and suites to run for the changes, None if all
+       tests must run. Besides the tests covering the changes, selects
+       the tests whose own files changed, and the whole suite if other
+       files of the suite changed. All tests must run if the test runner
+       or shared test code changed, or any other file which no test
+       covered in the map, e.g. a new source file or a build script."""
+    suites = set(suites)
+    covered = impact_map.covered_files()
+    selected = impact_map.impacted(changes)
+    for path in changes:
+        if path.startswith(INFRASTRUCTURE):
+            return None
+        parts = pathlib.PurePath(path).parts
+        if len(parts) >= 3 and parts[0] == "test" and parts[1] in suites:
+            suite, name = parts[1], pathlib.PurePath(*parts[2:])
+            if name.name not in SUITE_FILES and is_test_file(name):
+                selected.add(impact_key(suite, str(name.with_suffix(""))))
+            else:
+                selected.add(suite)
+        elif path not in covered:
+            return None
+    return selected
@@ -7,6 +7,9 @@
 #
 import unidiff
 from typing import (
+    Any,
+    Iterable,
+    Iterator,
     List,
     OrderedDict as OrderedDictType,
     Tuple,
@@ -17,13 +20,20 @@ from typing import (
     Optional,
     Mapping,
 )
+from array import array
+from bisect import bisect_left
 from collections import OrderedDict
+from collections.abc import MutableMapping
 from pathlib import Path
 import unidiff.patch
 from unidiff import PatchSet, PatchedFile
 from unidiff.patch import Hunk, Line
 import copy
-from itertools import repeat, accumulate
+import marshal
+import mmap
+import os
+import re
+from itertools import repeat, accumulate, compress, pairwise
 
 # TN: test name
 # SF: source file path
@@ -58,6 +68,336 @@ class MakeLcovRouter(type):
         return super().__new__(cls, name, bases, dct)
 
 
+# Hit count of a branch which was never evaluated ("-" in BRDA)
+NO_HITS = -1
+
+
+class HitArray(MutableMapping):
+    """A mapping of line numbers to hit counts, stored in columns: an array of the
+    sorted keys and an array of their hit counts. It takes a fraction of the memory
+    of a dict, and since traces of the same binary have the same keys for a source
+    file, merging them is usually a single pass over the hit counts.
+    Entries are appended by add() while a trace is parsed and sorted into the
+    columns on first use.
+    """
+
+    __slots__ = ("_keys", "_hits", "_pending_keys", "_pending_hits")
+    # Whether keys and hits are stored as they are, which saves the conversions in bulk operations
+    _PLAIN = True
+
+    def __init__(self, items: Iterable[Tuple[Any, Optional[int]]] = ()) -> None:
+        self._keys = array("q")
+        self._hits = array("q")
+        self._pending_keys = array("q")
+        self._pending_hits = array("q")
+        for key, hits in items:
+            self.add(key, hits)
+
+    # Conversions of the keys and hits of the mapping to and from the stored integers
+    @staticmethod
+    def _encode_key(key: Any) -> int:
+        return key
+
+    @staticmethod
+    def _decode_key(key: int) -> Any:
+        return key
+
+    @staticmethod
+    def _encode_hits(hits: Optional[int]) -> int:
+        return hits
+
+    @staticmethod
+    def _decode_hits(hits: int) -> Optional[int]:
+        return hits
+
+    @staticmethod
+    def _combine_hits(a: int, b: int) -> int:
+        return a + b
+
+    def add(self, key: Any, hits: Optional[int]):
+        """Adds an entry unless the key is already there, like dict.setdefault()"""
+        if self._PLAIN:
+            self._pending_keys.append(key)
+            self._pending_hits.append(hits)
+        else:
+            self._pending_keys.append(self._encode_key(key))
+            self._pending_hits.append(self._encode_hits(hits))
+
+    def extend(self, keys: Iterable[Any], hits: Iterable[Optional[int]]):
+        """add() for many entries"""
+        if self._PLAIN:
+            self._pending_keys.extend(keys)
+            self._pending_hits.extend(hits)
+        else:
+            self._pending_keys.extend(map(self._encode_key, keys))
+            self._pending_hits.extend(map(self._encode_hits, hits))
+        if len(self._pending_keys) != len(self._pending_hits):
+            raise ValueError("Different numbers of keys and hits")
+
+    def _settle(self):
+        if not self._pending_keys:
+            return
+        keys, hits = self._pending_keys, self._pending_hits
+        self._pending_keys, self._pending_hits = array("q"), array("q")
+        # Traces list the lines of a file in order, so this is the common case
+        if (not self._keys or keys[0] > self._keys[-1]) and all(
+            a < b for a, b in pairwise(keys)
+        ):
+            self._keys.extend(keys)
+            self._hits.extend(hits)
+            return
+        merged = dict(zip(self._keys, self._hits))
+        for key, hit in zip(keys, hits):
+            merged.setdefault(key, hit)
+        self._assign(sorted(merged.items()))
+
+    def _assign(self, items: List[Tuple[int, int]]):
+        """Replace the content with sorted, unique (encoded key, encoded hits) pairs"""
+        self._keys = array("q", [key for key, _ in items])
+        self._hits = array("q", [hits for _, hits in items])
+
+    def _index(self, key: Any) -> int:
+        self._settle()
+        encoded = self._encode_key(key)
+        i = bisect_left(self._keys, encoded)
+        if i < len(self._keys) and self._keys[i] == encoded:
+            return i
+        return -1
+
+    def __len__(self) -> int:
+        self._settle()
+        return len(self._keys)
+
+    def __iter__(self):
+        self._settle()
+        if self._PLAIN:
+            return iter(self._keys)
+        return map(self._decode_key, self._keys)
+
+    def __contains__(self, key: Any) -> bool:
+        return self._index(key) >= 0
+
+    def __getitem__(self, key: Any) -> Optional[int]:
+        i = self._index(key)
+        if i < 0:
+            raise KeyError(key)
+        return self._decode_hits(self._hits[i])
+
+    def __setitem__(self, key: Any, hits: Optional[int]):
+        self._settle()
+        encoded = self._encode_key(key)
+        i = bisect_left(self._keys, encoded)
+        if i < len(self._keys) and self._keys[i] == encoded:
+            self._hits[i] = self._encode_hits(hits)
+        else:
+            self._keys.insert(i, encoded)
+            self._hits.insert(i, self._encode_hits(hits))
+
+    def __delitem__(self, key: Any):
+        i = self._index(key)
+        if i < 0:
+            raise KeyError(key)
+        del self._keys[i]
+        del self._hits[i]
+
+    # Unlike dict views, these are lists, which is enough for iterating and
+    # much faster than the generic Mapping views.
+    def keys(self) -> List[Any]:
+        return list(iter(self))
+
+    def values(self) -> List[Optional[int]]:
+        self._settle()
+        if self._PLAIN:
+            return self._hits.tolist()
+        return list(map(self._decode_hits, self._hits))
+
+    def items(self) -> List[Tuple[Any, Optional[int]]]:
+        self._settle()
+        if self._PLAIN:
+            return list(zip(self._keys, self._hits))
+        return list(
+            zip(map(self._decode_key, self._keys), map(self._decode_hits, self._hits))
+        )
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, HitArray):
+            self._settle()
+            other._settle()
+            return self._keys == other._keys and self._hits == other._hits
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.items()!r})"
+
+    def copy(self) -> Self:
+        self._settle()
+        result = type(self)()
+        result._keys = array("q", self._keys)
+        result._hits = array("q", self._hits)
+        return result
+
+    def __deepcopy__(self, memo) -> Self:
+        return self.copy()
+
+    def count_hit(self) -> int:
+        """The number of entries with hits"""
+        self._settle()
+        return sum(1 for hits in self._hits if hits > 0)
+
+    def covered(self) -> set:
+        """The keys of the entries with hits"""
+        self._settle()
+        covered = compress(self._keys, map((0).__lt__, self._hits))
+        if self._PLAIN:
+            return set(covered)
+        return set(map(self._decode_key, covered))
+
+    def keep(self, predicate: Callable[[Any], bool]):
+        """Removes the entries whose key doesn't satisfy predicate"""
+        self._settle()
+        mask = [predicate(key) for key in map(self._decode_key, self._keys)]
+        self._keys = array("q", compress(self._keys, mask))
+        self._hits = array("q", compress(self._hits, mask))
+
+    def remove(self, keys: Iterable[Any]):
+        encoded = set(keys) if self._PLAIN else set(map(self._encode_key, keys))
+        if not encoded:
+            return
+        self._settle()
+        mask = [key not in encoded for key in self._keys]
+        self._keys = array("q", compress(self._keys, mask))
+        self._hits = array("q", compress(self._hits, mask))
+
+    def transform(self, transform: Callable[[Optional[int]], Optional[int]]):
+        self._settle()
+        self._hits = array(
+            "q",
+            [self._encode_hits(transform(self._decode_hits(hits))) for hits in self._hits],
+        )
+
+    def union(self, other: Self) -> Self:
+        """Adds the hits of other, in place"""
+        self._settle()
+        other._settle()
+        if self._keys == other._keys:
+            self._hits = array("q", map(self._combine_hits, self._hits, other._hits))
+            return self
+        merged = dict(zip(self._keys, self._hits))
+        for key, hits in zip(other._keys, other._hits):
+            merged[key] = self._combine_hits(merged[key], hits) if key in merged else hits
+        self._assign(sorted(merged.items()))
+        return self
+
+    def join(self, other: Self) -> Iterator[Tuple[Any, Optional[int], Optional[int]]]:
+        """(key, hits, other hits) of the keys present in both"""
+        self._settle()
+        other._settle()
+        if self._keys == other._keys:
+            pairs = zip(self._keys, self._hits, other._hits)
+        else:
+            other_hits = dict(zip(other._keys, other._hits))
+            pairs = (
+                (key, hits, other_hits[key])
+                for key, hits in zip(self._keys, self._hits)
+                if key in other_hits
+            )
+        return (
+            (self._decode_key(key), self._decode_hits(a), self._decode_hits(b))
+            for key, a, b in pairs
+        )
+
+    def to_bytes(self) -> Tuple[bytes, bytes]:
+        self._settle()
+        return self._keys.tobytes(), self._hits.tobytes()
+
+    @classmethod
+    def from_bytes(cls, keys: bytes, hits: bytes) -> Self:
+        result = cls()
+        result._keys.frombytes(keys)
+        result._hits.frombytes(hits)
+        return result
+
+
+class BranchHits(HitArray):
+    """A HitArray of (line, block, branch) keys, packed into one integer in the
+    order of the tuples, with NO_HITS standing for a branch that was never evaluated.
+    """
+
+    __slots__ = ()
+    _PLAIN = False
+
+    FIELD_BITS = 20
+    FIELD_MASK = (1 << FIELD_BITS) - 1
+    LINE_SHIFT = 2 * FIELD_BITS
+    MAX_LINE = (1 << (63 - LINE_SHIFT)) - 1
+
+    @staticmethod
+    def _encode_key(key: Tuple[int, int, int]) -> int:
+        line, block, branch = key
+        if not (0 <= line <= BranchHits.MAX_LINE and 0 <= block <= BranchHits.FIELD_MASK
+                and 0 <= branch <= BranchHits.FIELD_MASK):
+            raise ValueError(f"Branch {key} is out of range")
+        return (line << BranchHits.LINE_SHIFT) | (block << BranchHits.FIELD_BITS) | branch
+
+    @staticmethod
+    def _decode_key(key: int) -> Tuple[int, int, int]:
+        return (
+            key >> BranchHits.LINE_SHIFT,
+            (key >> BranchHits.FIELD_BITS) & BranchHits.FIELD_MASK,
+            key & BranchHits.FIELD_MASK,
+        )
+
+    @staticmethod
+    def _encode_hits(hits: Optional[int]) -> int:
+        return NO_HITS if hits is None else hits
+
+    @staticmethod
+    def _decode_hits(hits: int) -> Optional[int]:
+        return None if hits == NO_HITS else hits
+
+    @staticmethod
+    def _combine_hits(a: int, b: int) -> int:
+        if a == NO_HITS:
+            return b
+        if b == NO_HITS:
+            return a
+        return a + b
+
+    def lines(self) -> set:
+        self._settle()
+        return {key >> BranchHits.LINE_SHIFT for key in self._keys}
+
+    def remove_lines(self, lines: Iterable[int]):
+        lines = set(lines)
+        if not lines:
+            return
+        self._settle()
+        mask = [(key >> BranchHits.LINE_SHIFT) not in lines for key in self._keys]
+        self._keys = array("q", compress(self._keys, mask))
+        self._hits = array("q", compress(self._hits, mask))
+
+    def hits_per_line(self) -> dict:
+        """The total hits of the evaluated branches of each line"""
+        self._settle()
+        result = dict()
+        for key, hits in zip(self._keys, self._hits):
+            line = key >> BranchHits.LINE_SHIFT
+            result.setdefault(line, 0)
+            if hits != NO_HITS:
+                result[line] += hits
+        return result
+
+
+# The lines of a trace file which are parsed in bulk, and all the others
+LCOV_DA_RE = re.compile(rb"^DA:([^,\n]*),([^,\n]*)", re.M)
+LCOV_BRDA_RE = re.compile(rb"^BRDA:([^,\n]*),([^,\n]*),([^,\n]*),([^,\n]*)", re.M)
+LCOV_OTHER_LINE_RE = re.compile(rb"^(?!DA:|BRDA:)([^\n]*\S[^\n]*)$", re.M)
+# The lines which delimit and identify the records of a trace file
+LCOV_INDEX_RE = re.compile(rb"^(TN:|SF:|end_of_record)([^\n]*)", re.M)
+
+
 class LcovRecord(metaclass = MakeLcovRouter):
     routes = [
         "TN",
@@ -78,11 +418,11 @@ class LcovRecord(metaclass = MakeLcovRouter):
     def __init__(self) -> None:
         self._test_name: Optional[str] = None
         self.source_file: Optional[Path] = None
-        self.line_hits: dict[int, int] = dict()
+        self.line_hits: HitArray = HitArray()
 
         self.function_hits: dict[Tuple(int, str), int] = dict()
         self.functions_to_lines: dict[str, int] = dict()
-        self.branch_hits: dict[Tuple[int, int, int], Optional[int]] = dict()
+        self.branch_hits: BranchHits = BranchHits()
         self.sealed: bool = False
         self.FNF = None
         self.FNH = None
@@ -114,7 +454,7 @@ class LcovRecord(metaclass = MakeLcovRouter):
 
     @property
     def branches_hit(self):
-        return sum([int(bool(hits and hits > 0)) for hits in self.branch_hits.values()])
+        return self.branch_hits.count_hit()
 
     @property
     def lines_found(self):
@@ -122,7 +462,7 @@ class LcovRecord(metaclass = MakeLcovRouter):
 
     @property
     def lines_hit(self):
-        return sum([int(hits and hits > 0) for hits in self.line_hits.values()])
+        return self.line_hits.count_hit()
 
     def add(self, type_str: str, fields: List[str]):
         assert not self.sealed
@@ -167,7 +507,7 @@ class LcovRecord(metaclass = MakeLcovRouter):
         block = int(block)
         branch = int(branch)
         count = int(count) if count != "-" else None
-        self.branch_hits.setdefault((line, block, branch), count)
+        self.branch_hits.add((line, block, branch), count)
         return False
 
     def add_BRF(self, fields: List[str]) -> bool:
@@ -182,7 +522,7 @@ class LcovRecord(metaclass = MakeLcovRouter):
         line, hits = fields
         line = int(line)
         hits = int(hits)
-        self.line_hits.setdefault(line, hits)
+        self.line_hits.add(line, hits)
         return False
 
     def add_LF(self, fields: List[str]) -> bool:
@@ -201,9 +541,8 @@ class LcovRecord(metaclass = MakeLcovRouter):
 
     def remove_lines(self, line_numbers: List[int]):
         self.validate_integrity()
-        for line_number in line_numbers:
-            if line_number in self.line_hits:
-                del self.line_hits[line_number]
+        line_numbers = set(line_numbers)
+        self.line_hits.remove(line_numbers)
         functions_to_remove = list(
             {
                 (line, func_name)
@@ -214,40 +553,25 @@ class LcovRecord(metaclass = MakeLcovRouter):
         for key in functions_to_remove:
             del self.function_hits[key]
             del self.functions_to_lines[key[1]]
-        branches_to_remove = [
-            branch for branch in self.branch_hits if branch[0] in line_numbers
-        ]
-        for branch in branches_to_remove:
-            del self.branch_hits[branch]
+        self.branch_hits.remove_lines(line_numbers)
         self.validate_integrity()
 
     def remove_line(self, line_number: int):
         self.remove_lines([line_number])
 
     def remove_branches(self, branch_line_numbers: List[int]):
-        branch_keys_to_remove = {
-            key for key in self.branch_hits.keys() if key[0] in branch_line_numbers
-        }
-        for branch_to_remove in branch_keys_to_remove:
-            del self.branch_hits[branch_to_remove]
+        self.branch_hits.remove_lines(branch_line_numbers)
 
     def remove_branch(self, branch_line):
         self.remove_branches([branch_line])
 
     def validate_integrity(self):
-        assert (
-            len(set(self.functions_to_lines.values()) - set(self.line_hits.keys())) == 0
-        )
-        assert (
-            len(
-                set([x[0] for x in self.branch_hits.keys()])
-                - set(self.line_hits.keys())
-            )
-            == 0
-        )
+        lines = self.get_lines()
+        assert set(self.functions_to_lines.values()) <= lines
+        assert self.branch_hits.lines() <= lines
 
     def get_lines(self) -> set[int]:
-        return set(self.line_hits.keys())
+        return set(self.line_hits)
 
     def filter_lines(self, lines: List[int]):
         self.remove_lines(self.get_lines().difference(set(lines)))
@@ -259,33 +583,28 @@ class LcovRecord(metaclass = MakeLcovRouter):
         # First filter all the None mapped lines
         lines_to_keep = self.get_lines().intersection(set(lines_mapping.keys()))
         self.filter_lines(lines_to_keep)
-        line_hits = self.line_hits
-        self.line_hits = dict()
-        for line, hits in line_hits.items():
-            new_line = lines_mapping[line]
-            self.line_hits[new_line] = hits
+        self.line_hits = HitArray(
+            (lines_mapping[line], hits) for line, hits in self.line_hits.items()
+        )
         function_hits = self.function_hits
         self.function_hits = dict()
         for (line, func_name), hits in function_hits.items():
             new_key = (lines_mapping[line], func_name)
             self.function_hits[new_key] = hits
-        branch_hits = self.branch_hits
-        self.branch_hits = dict()
-        for (line, block, branch), count in branch_hits.items():
-            new_key = (lines_mapping[line], block, branch)
-            self.branch_hits[new_key] = count
+        self.branch_hits = BranchHits(
+            ((lines_mapping[line], block, branch), count)
+            for (line, block, branch), count in self.branch_hits.items()
+        )
 
     def transform_line_hitrates(self, transform: Callable[[Optional[int]], int]):
-        for line in self.line_hits.keys():
-            self.line_hits[line] = transform(self.line_hits[line])
+        self.line_hits.transform(transform)
 
     def transform_function_hitrates(self, transform: Callable[[Optional[int]], int]):
         for key in self.function_hits.keys():
             self.function_hits[key] = transform(self.function_hits[key])
 
     def transform_branch_hitrates(self, transform: Callable[[Optional[int]], int]):
-        for key in self.branch_hits.keys():
-            self.branch_hits[key] = transform(self.branch_hits[key])
+        self.branch_hits.transform(transform)
 
     def transform_hitrates(self, transform: Callable[[Optional[int]], int]):
         self.transform_line_hitrates(transform)
@@ -293,12 +612,7 @@ class LcovRecord(metaclass = MakeLcovRouter):
         self.transform_branch_hitrates(transform)
 
     def _get_branches_line_hitrate(self) -> Mapping[int, int]:
-        this_branch_line_hits = dict()
-        for key in self.branch_hits.keys():
-            this_branch_line_hits.setdefault(key[0], 0)
-            if self.branch_hits[key] is not None:
-                this_branch_line_hits[key[0]] += self.branch_hits[key]
-        return this_branch_line_hits
+        return self.branch_hits.hits_per_line()
 
     def _refresh_functions_to_lines(self):
         self.functions_to_lines = {
@@ -312,22 +626,14 @@ class LcovRecord(metaclass = MakeLcovRouter):
         Arguments:
             other {Self} -- the other component to union with
         """
-        for line in other.line_hits.keys():
-            if line not in self.line_hits:
-                self.line_hits[line] = other.line_hits[line]
-            else:
-                self.line_hits[line] += other.line_hits[line]
+        self.line_hits.union(other.line_hits)
         for key in other.function_hits.keys():
             if key not in self.function_hits:
                 self.function_hits[key] = other.function_hits[key]
             else:
                 self.function_hits[key] += other.function_hits[key]
         self._refresh_functions_to_lines()
-        for key in other.branch_hits.keys():
-            if key not in self.branch_hits or self.branch_hits[key] is None:
-                self.branch_hits[key] = other.branch_hits[key]
-            elif other.branch_hits[key] is not None:
-                self.branch_hits[key] += other.branch_hits[key]
+        self.branch_hits.union(other.branch_hits)
         return self
 
     def intersection(self, other: Self) -> Self:
@@ -343,20 +649,12 @@ class LcovRecord(metaclass = MakeLcovRouter):
         Arguments:
             other {Self} -- the other component to intersect with
         """
-        covered_lines = dict()
-        lines_to_merge = self.get_lines().intersection(other.get_lines())
-        lines_to_merge = [
-            line
-            for line in lines_to_merge
-            if self.line_hits[line] > 0 and other.line_hits[line] > 0
-        ]
-        if other == self:
-            for line in lines_to_merge:
-                covered_lines[line] = self.line_hits[line]
-        else:
-            for line in lines_to_merge:
-                covered_lines[line] = self.line_hits[line] + other.line_hits[line]
-        self.line_hits = covered_lines
+        same = other == self
+        self.line_hits = HitArray(
+            (line, hits if same else hits + other_hits)
+            for line, hits, other_hits in self.line_hits.join(other.line_hits)
+            if hits > 0 and other_hits > 0
+        )
         covered_functions = dict()
         functions_to_merge = set(self.function_hits.keys()).intersection(
             set(other.function_hits.keys())
@@ -367,7 +665,7 @@ class LcovRecord(metaclass = MakeLcovRouter):
             if self.function_hits[(line, func_name)] > 0
             and other.function_hits[(line, func_name)] > 0
         ]
-        if other == self:
+        if same:
             for key in functions_to_merge:
                 covered_functions[key] = self.function_hits[key]
         else:
@@ -377,44 +675,29 @@ class LcovRecord(metaclass = MakeLcovRouter):
                 )
         self.function_hits = covered_functions
         self._refresh_functions_to_lines()
-        covered_branches = dict()
+        covered_branches = BranchHits()
         # for branches, count hits per line
-        this_branch_line_hits = dict()
-        for key in self.branch_hits.keys():
-            if self.branch_hits[key] is not None:
-                this_branch_line_hits.setdefault(key[0], 0)
-                this_branch_line_hits[key[0]] += self.branch_hits[key]
-        other_branch_line_hits = dict()
-        for key in other.branch_hits.keys():
-            if other.branch_hits[key] is not None:
-                other_branch_line_hits.setdefault(key[0], 0)
-                other_branch_line_hits[key[0]] += other.branch_hits[key]
         this_branch_line_hits = {
-            key
-            for key in this_branch_line_hits.keys()
-            if this_branch_line_hits[key] > 0
+            line for line, hits in self.branch_hits.hits_per_line().items() if hits > 0
         }
         other_branch_line_hits = {
-            key
-            for key in other_branch_line_hits.keys()
-            if other_branch_line_hits[key] > 0
+            line for line, hits in other.branch_hits.hits_per_line().items() if hits > 0
         }
         branches_lines_to_merge = this_branch_line_hits.intersection(
             other_branch_line_hits
         )
-        for key in self.branch_hits.keys():
+        for key, this_hits in self.branch_hits.items():
             if key[0] not in branches_lines_to_merge:
                 continue
-            this_hits = self.branch_hits[key]
-            other_hits = other.branch_hits[key]
+            other_hits = other.branch_hits.get(key)
             if this_hits is None and other_hits is None:
-                covered_branches[key] = None
+                covered_branches.add(key, None)
             elif this_hits is None:
-                covered_branches[key] = other_hits
+                covered_branches.add(key, other_hits)
             elif other_hits is None:
-                covered_branches[key] = this_hits
+                covered_branches.add(key, this_hits)
             else:
-                covered_branches[key] = this_hits + other_hits
+                covered_branches.add(key, this_hits + other_hits)
         self.branch_hits = covered_branches
         return self
 
@@ -434,14 +717,7 @@ class LcovRecord(metaclass = MakeLcovRouter):
         # first remove every line that is not covered by self (at all)
         self.remove_lines([line for line, hits in self.line_hits.items() if hits <= 0])
         # remove every line that is covered by both
-        this_covered_lines = {
-            key for key in self.line_hits.keys() if self.line_hits[key] > 0
-        }
-        other_covered_lines = {
-            key for key in other.line_hits.keys() if other.line_hits[key] > 0
-        }
-        lines_to_remove = this_covered_lines.intersection(other_covered_lines)
-        self.remove_lines(lines_to_remove)
+        self.remove_lines(self.line_hits.covered() & other.line_hits.covered())
         self._refresh_functions_to_lines()
         # first remove every function that is not covered by self (at all)
         for key in list(self.function_hits.keys()):
@@ -460,29 +736,22 @@ class LcovRecord(metaclass = MakeLcovRouter):
         for key in functions_to_remove:
             del self.function_hits[key]
         self._refresh_functions_to_lines()
-        # first remove every line that is not hit at all
-        branch_line_hits = self._get_branches_line_hitrate()
-        branches_lines_with_hits = {
-            line for key, line in branch_line_hits.items() if branch_line_hits[key] > 0
-        }
-        for key in list(self.branch_hits.keys()):
-            if key[0] not in branch_line_hits:
-                del self.branch_hits[key]
-        for key, hits in list(self.branch_hits.items()):
-            covered_by_this = bool(self.branch_hits[key])
-            covered_by_other = (
-                bool(other.branch_hits[key]) if key in other.branch_hits else False
-            )
+        other_covered_branches = other.branch_hits.covered()
+        branch_hits = BranchHits()
+        for key, hits in self.branch_hits.items():
+            covered_by_this = bool(hits)
+            covered_by_other = key in other_covered_branches
             covered_by_both = covered_by_this and covered_by_other
             # covered by both
             if covered_by_both:
-                self.branch_hits[key] = None
+                branch_hits.add(key, None)
             elif covered_by_this:  # Only covered by this
-                pass
+                branch_hits.add(key, hits)
             elif covered_by_other:
-                self.branch_hits[key] = 0
+                branch_hits.add(key, 0)
             else:  # covered by neither
-                self.branch_hits[key] = None
+                branch_hits.add(key, None)
+        self.branch_hits = branch_hits
         return self
 
     def symmetric_difference(self, other: Self) -> Self:
@@ -533,19 +802,16 @@ class LcovRecord(metaclass = MakeLcovRouter):
         f.write(f"FNH:{self.functions_hit}\n")
         # branches
         if self.branches_found > 0:
-            sorted_branches = list(self.branch_hits.keys())
-            sorted_branches.sort()
-            for key in sorted_branches:
-                line, block, branch = key
-                count = self.branch_hits[key]
-                f.write(
-                    f"BRDA:{line},{block},{branch},{count if count is not None else '-'}\n"
-                )
+            # Branches are kept sorted
+            f.writelines(
+                f"BRDA:{line},{block},{branch},{count if count is not None else '-'}\n"
+                for (line, block, branch), count in self.branch_hits.items()
+            )
             f.write(f"BRF:{self.branches_found}\n")
             f.write(f"BRH:{self.branches_hit}\n")
         # lines
         if self.lines_found > 0:
-            [f.write(f"DA:{line},{count}\n") for line, count in self.line_hits.items()]
+            f.writelines(f"DA:{line},{count}\n" for line, count in self.line_hits.items())
             f.write(f"LF:{self.lines_found}\n")
             f.write(f"LH:{self.lines_hit}\n")
         f.write("end_of_record\n")
@@ -563,6 +829,29 @@ class LcovRecord(metaclass = MakeLcovRouter):
         type_str, fields = self.get_type_and_fields(line)
         return self.add(type_str, fields)
 
+    @classmethod
+    def parse(cls, data: bytes) -> Self:
+        """Parses one record of a trace file, up to its end_of_record line.
+        The DA and BRDA lines, which are the bulk of a record, are extracted with
+        a regex in one go rather than routed line by line.
+        """
+        record = cls()
+        for line in LCOV_OTHER_LINE_RE.findall(data):
+            type_str, fields = cls.get_type_and_fields(line.decode())
+            if type_str != "end_of_record":
+                record.add(type_str, fields)
+        line_hits = LCOV_DA_RE.findall(data)
+        record.line_hits.extend(
+            (int(line) for line, _ in line_hits), (int(hits) for _, hits in line_hits)
+        )
+        for line, block, branch, count in LCOV_BRDA_RE.findall(data):
+            record.branch_hits.add(
+                (int(line), int(block), int(branch)),
+                None if count.strip() == b"-" else int(count),
+            )
+        record.add_end_of_record([])
+        return record
+
     def __eq__(self, other: Self):
         if isinstance(other, type(self)):
             if self.test_name != other.test_name:
@@ -581,7 +870,43 @@ class LcovRecord(metaclass = MakeLcovRouter):
             return False
 
 
+class _UnparsedRecord:
+    """The spans of a memory mapped trace file which hold the records of one
+    (test name, source file) key, to be parsed when the record is first needed.
+    """
+
+    __slots__ = ("trace", "path", "spans")
+
+    def __init__(self, trace: Union[mmap.mmap, bytes], path: Path):
+        self.trace = trace
+        self.path = path
+        self.spans: List[Tuple[int, int]] = []
+
+    def parse(self) -> LcovRecord:
+        record = None
+        for start, end in self.spans:
+            try:
+                span_record = LcovRecord.parse(self.trace[start:end])
+            except AssertionError as e:
+                raise RuntimeError(f"assertion in loading {self.path} at offset {start}", e)
+            record = span_record if record is None else record.union(span_record)
+        return record
+
+    def write(self, f: TextIO):
+        """Writes the record as it is in the trace file"""
+        for start, end in self.spans:
+            f.write(self.trace[start:end].lstrip(b"\n").decode() + "\n")
+
+
 class LcovFile:
+    """The records of lcov trace files, by (test name, source file).
+    Trace files are loaded lazily: load() only indexes the records of the file,
+    and each record is parsed when it is first used. Operations on some of the
+    files only (filter_files(), filter_lines(), remap_to_patches()) don't parse
+    the records of the other files at all, and write() copies the records which
+    were never parsed from the trace as they are. Accessing `records` parses them all.
+    """
+
     LCOV_EXCL_LINE_DEFAULT = "LCOV_EXCL_LINE"
     LCOV_EXCL_START_DEFAULT = "LCOV_EXCL_START"
     LCOV_EXCL_STOP_DEFAULT = "LCOV_EXCL_STOP"
@@ -589,6 +914,8 @@ class LcovFile:
     LCOV_EXCL_BR_START_DEFAULT = "LCOV_EXCL_BR_START"
     LCOV_EXCL_BR_STOP_DEFAULT = "LCOV_EXCL_BR_STOP"
     EMPTY_LCOV_PSEUDO_FILE = Path("this_lcov_is_empty")
+    # The first bytes of a file written by dump()
+    BINARY_MAGIC = b"LCOVBIN2"
 
     def __init__(
         self,
@@ -601,7 +928,11 @@ class LcovFile:
         LCOV_EXCL_BR_START = LCOV_EXCL_BR_START_DEFAULT,
         LCOV_EXCL_BR_STOP = LCOV_EXCL_BR_STOP_DEFAULT,
     ):
-        self.records: OrderedDictType[Tuple[str, Path], LcovRecord] = OrderedDict()
+        self._records: OrderedDictType[
+            Tuple[str, Path], Union[LcovRecord, _UnparsedRecord]
+        ] = OrderedDict()
+        # Keys of the records which are not parsed yet
+        self._unparsed: set[Tuple[str, Path]] = set()
         self.filter_by_tags = filter_by_tags
         self.LCOV_EXCL_LINE = LCOV_EXCL_LINE
         self.LCOV_EXCL_START = LCOV_EXCL_START
@@ -618,27 +949,101 @@ class LcovFile:
         else:
             return False
 
+    @property
+    def records(self) -> OrderedDictType[Tuple[str, Path], LcovRecord]:
+        if self._unparsed:
+            for key in [key for key in self._records if key in self._unparsed]:
+                self._parse(key)
+        return self._records
+
+    @records.setter
+    def records(self, records: OrderedDictType[Tuple[str, Path], LcovRecord]):
+        self._records = records
+        self._unparsed = set()
+
+    def _parse(self, key: Tuple[str, Path]) -> Optional[LcovRecord]:
+        record = self._records[key].parse()
+        self._unparsed.discard(key)
+        if record.empty():
+            del self._records[key]
+            return None
+        self._records[key] = record
+        return record
+
+    def _get_record(self, key: Tuple[str, Path]) -> Optional[LcovRecord]:
+        if key in self._unparsed:
+            return self._parse(key)
+        return self._records.get(key)
+
+    def __deepcopy__(self, memo):
+        # Records which are not parsed yet refer to a memory mapped file, which can't be copied
+        self.records
+        result = copy.copy(self)
+        memo[id(self)] = result
+        result.__dict__.update(
+            {name: copy.deepcopy(value, memo) for name, value in self.__dict__.items()}
+        )
+        return result
+
+    @staticmethod
+    def is_dump(coverage_file: Path) -> bool:
+        with open(coverage_file, "rb") as f:
+            return f.read(len(LcovFile.BINARY_MAGIC)) == LcovFile.BINARY_MAGIC
+
     def load(self, coverage_file: Path):
-        with open(coverage_file, "r") as f:
-            current_record = None
-            while l := f.readline():
-                if not l.strip():
-                    continue
-                if current_record is None:
-                    current_record = LcovRecord()
-                try:
-                    if current_record.add_line(l):
-                        if (
-                            current_record.source_file
-                            != LcovFile.EMPTY_LCOV_PSEUDO_FILE
-                        ):
-                            self._add_record(current_record)
-                        current_record = None
-                except AssertionError as e:
-                    raise RuntimeError(
-                        f"assertion in loading {coverage_file}, {current_record.source_file}",
-                        e,
-                    )
+        """Loads an lcov trace file, or a file written by dump()"""
+        if LcovFile.is_dump(coverage_file):
+            return self.load_dump(coverage_file)
+        with open(coverage_file, "rb") as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                trace = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            else:
+                trace = b""
+        # Index the records: a record spans from the end of the previous one to its end_of_record line
+        unparsed = _UnparsedRecord(trace, coverage_file)
+        start = 0
+        test_name = ""
+        source_file = None
+        for match in LCOV_INDEX_RE.finditer(trace):
+            tag, value = match.groups()
+            if tag == b"TN:":
+                test_name = value.decode().strip()
+            elif tag == b"SF:":
+                source_file = Path(value.decode().strip())
+            else:
+                if source_file is None:
+                    raise RuntimeError(f"{coverage_file}: a record without SF: at offset {start}")
+                if source_file != LcovFile.EMPTY_LCOV_PSEUDO_FILE:
+                    self._add_span((test_name, source_file), unparsed, start, match.end())
+                start = match.end()
+                test_name = ""
+                source_file = None
+        if self.filter_by_tags:
+            self.filter_by_source_tags(
+                self.LCOV_EXCL_LINE,
+                self.LCOV_EXCL_START,
+                self.LCOV_EXCL_STOP,
+                self.LCOV_EXCL_BR_LINE,
+                self.LCOV_EXCL_BR_START,
+                self.LCOV_EXCL_BR_STOP,
+            )
+        return self
+
+    def load_dump(self, dump_file: Path):
+        with open(dump_file, "rb") as f:
+            if f.read(len(LcovFile.BINARY_MAGIC)) != LcovFile.BINARY_MAGIC:
+                raise RuntimeError(f"{dump_file} was not written by LcovFile.dump()")
+            data = marshal.load(f)
+        for test_name, source_file, line_hits, function_hits, branch_hits in data:
+            record = LcovRecord()
+            record._test_name = test_name
+            record.source_file = Path(source_file)
+            record.line_hits = HitArray.from_bytes(*line_hits)
+            record.function_hits = function_hits
+            record.branch_hits = BranchHits.from_bytes(*branch_hits)
+            record.sealed = True
+            record._refresh_functions_to_lines()
+            self._add_record(record)
         if self.filter_by_tags:
             self.filter_by_source_tags(
                 self.LCOV_EXCL_LINE,
@@ -650,6 +1055,41 @@ class LcovFile:
             )
         return self
 
+    def dump(self, target_file: Path):
+        """Writes the content of this object in a compact binary format, which is
+        much faster to write and to load back than an lcov trace. This is meant
+        for intermediate results: the format is not understood by lcov tools and
+        can change between Python versions (see: the marshal module).
+        """
+        self.prune()
+        data = [
+            (
+                record._test_name,
+                str(record.source_file),
+                record.line_hits.to_bytes(),
+                record.function_hits,
+                record.branch_hits.to_bytes(),
+            )
+            for record in self.records.values()
+        ]
+        with open(target_file, "wb") as f:
+            f.write(LcovFile.BINARY_MAGIC)
+            marshal.dump(data, f)
+
+    def _add_span(self, key: Tuple[str, Path], unparsed: _UnparsedRecord, start: int, end: int):
+        current = self._records.get(key)
+        if current is None:
+            current = _UnparsedRecord(unparsed.trace, unparsed.path)
+            self._records[key] = current
+            self._unparsed.add(key)
+        elif not isinstance(current, _UnparsedRecord) or current.trace is not unparsed.trace:
+            # Loaded from another file before, merge right away
+            span = _UnparsedRecord(unparsed.trace, unparsed.path)
+            span.spans.append((start, end))
+            self._add_record(span.parse())
+            return
+        current.spans.append((start, end))
+
     # This copy of the function is to avoid deep copy
     # when we know that the record is going not to be
     # used anywhere else after this call.
@@ -657,19 +1097,21 @@ class LcovFile:
         if record.empty():
             return
         key = (record.test_name, record.source_file)
-        if key in self.records:
-            self.records[key].union(record)
+        current = self._get_record(key)
+        if current is not None:
+            current.union(record)
         else:
-            self.records[key] = record
+            self._records[key] = record
 
     def add_record(self, record: LcovRecord):
         if record.empty():
             return
         key = (record.test_name, record.source_file)
-        if key in self.records:
-            self.records[key].union(record)
+        current = self._get_record(key)
+        if current is not None:
+            current.union(record)
         else:
-            self.records[key] = copy.deepcopy(record)
+            self._records[key] = copy.deepcopy(record)
 
     @staticmethod
     def write_empty(target_file: Path, as_covered = False):
@@ -707,20 +1149,23 @@ class LcovFile:
         if generate_empty and (not incompatible_empty) and self.empty():
             LcovFile.write_empty(target_file = target_file, as_covered = as_covered)
         else:
+            # Records which were never parsed are written as they were loaded
             with open(target_file, "w") as f:
-                [record.write(f) for record in self.records.values()]
+                [record.write(f) for record in self._records.values()]
 
     def filter_files(self, files_to_keep: List[Path]):
+        files_to_keep = set(files_to_keep)
         for key_to_remove in [
-            key for key in self.records.keys() if key[1] not in files_to_keep
+            key for key in self._records.keys() if key[1] not in files_to_keep
         ]:
-            del self.records[key_to_remove]
+            del self._records[key_to_remove]
+            self._unparsed.discard(key_to_remove)
 
     def filter_lines(self, file: Path, lines_to_keep: List[int]):
-        for record in [
-            record for key, record in self.records.items() if key[1] == file
-        ]:
-            record.filter_lines(lines_to_keep)
+        for key in [key for key in self._records.keys() if key[1] == file]:
+            record = self._get_record(key)
+            if record is not None:
+                record.filter_lines(lines_to_keep)
 
     def _remap_to_patch(
         self, patch_file: Union[Path, unidiff.PatchSet], patch_fn: Path
@@ -761,6 +1206,14 @@ class LcovFile:
 
     def remap_to_patches(self, patch_files: List[Path]):
         patches = prepare_patches_for_lcov(patch_files)
+        # Only records of patched files are remapped, so the others needn't be parsed (or copied)
+        self.filter_files(
+            [
+                Path(pf.target_file).relative_to("b/")
+                for patch in patches
+                for pf in patch.added_files + patch.modified_files
+            ]
+        )
         prototype = copy.deepcopy(self)
         self.records.clear()
         for patch, patch_fn in zip(patches, patch_files):
@@ -921,9 +1374,9 @@ class LcovFile:
         common_records = set(self.records.keys()).intersection(
             set(other.records.keys())
         )
-        old_records = self.records()
+        old_records = self.records
         self.records = OrderedDict()
-        for key in common_records():
+        for key in common_records:
             self.records[key] = old_records[key].intersection(other.records[key])
         self.prune()
         return self
@@ -976,23 +1429,22 @@ class LcovFile:
         return new_component
 
     def prune(self):
-        keys_to_prune = [key for key, val in self.records.items() if val.empty()]
+        """Removes the empty records. Records which are not parsed yet are
+        left alone, they are removed when parsed if they turn out empty."""
+        keys_to_prune = [
+            key for key, val in self._records.items()
+            if key not in self._unparsed and val.empty()
+        ]
         for key in keys_to_prune:
-            del self.records[key]
+            del self._records[key]
 
     def empty(self):
-        if len(self.records) == 0:
-            return True
-        else:
-            if not next(iter(self.records.values())).empty():
+        # Parses records only until a non empty one is found
+        for key in list(self._records):
+            record = self._get_record(key)
+            if record is not None and not record.empty():
                 return False
-            else:
-                # this is a little bit dangerous because of the recursion,
-                # if prune() doesn't clear every empty record due to a bug
-                # we might get into an infinite recursion.
-                # However, this is the cleanest way to code it.
-                self.prune()
-                return self.empty()
+        return True
 
     def tag_with_test(self, test_name: str, from_test: Optional[str] = None):
         # TODO: we should probably error out or normalize the string in order to preserve
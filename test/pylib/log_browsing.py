@@ -3,16 +3,231 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 
 import asyncio
+from array import array
+import bisect
+import collections
 from concurrent.futures import ThreadPoolExecutor
+import io
+import itertools
 import logging
-from typing import Optional
+import mmap
+import operator
+import threading
+from typing import Iterable, List, Optional, Tuple
 import pytest
 import os
+import pathlib
 import re
 
+from test.pylib.log_watcher import LogWatcher
 
 logger = logging.getLogger(__name__)
 
+
+class LogTailer:
+    """
+    State of a log file which is being searched by tests.
+    Keeps an index of line offsets of the part of the file read so far,
+    reading the new part in large chunks, and searches it line by line
+    in large mmap'd chunks. All waiters for new lines in the file are
+    served by a single task which reads every new chunk once.
+    Every ScyllaLogFile has a LogTailer of its own, which goes away with it.
+    """
+    READ_CHUNK_SIZE = 4 * 1024 * 1024
+    SCAN_CHUNK_SIZE = 16 * 1024 * 1024
+    # The number of searches whose results are kept
+    GREP_CACHE_SIZE = 16
+
+    def __init__(self, path: str):
+        self.path = path
+        # Offsets of the beginnings of all complete lines read so far,
+        # and the offset right after the last complete line
+        self.line_starts = array('q')
+        self.indexed_end = 0
+        # The file indexed, to notice when the log is rotated
+        self.inode: Optional[int] = None
+        # Serializes changes of the index and of the waiter list, which
+        # happen in executor threads
+        self.lock = threading.Lock()
+        # (pattern source, flags, filter source, flags) -> (first offset, end offset, offsets of the matching lines),
+        # least recently used first
+        self.grep_cache: collections.OrderedDict[tuple, Tuple[int, int, array]] = collections.OrderedDict()
+        # Waiters for new lines: [pattern, first offset to search from, future, loop]
+        self.waiters: List[list] = []
+        self.pump: Optional[LogTailerPump] = None
+
+    def refresh(self) -> None:
+        """Index the complete lines appended since the last refresh.
+           Precondition: self.lock is held."""
+        st = os.stat(self.path)
+        if st.st_size < self.indexed_end or st.st_ino != self.inode:
+            # The file was truncated or rotated, start over
+            self.line_starts = array('q')
+            self.indexed_end = 0
+            self.inode = st.st_ino
+            self.grep_cache.clear()
+        with open(self.path, 'rb') as f:
+            f.seek(self.indexed_end)
+            pending = b''
+            while data := f.read(self.READ_CHUNK_SIZE):
+                # pending is an incomplete line left from the previous chunk
+                data = pending + data
+                complete = data.rfind(b'\n') + 1
+                pending = data[complete:]
+                if not complete:
+                    continue
+                lines = data[:complete].split(b'\n')[:-1]
+                # Start offsets of all lines of the chunk, computed without a Python loop
+                self.line_starts.extend(itertools.islice(
+                    itertools.accumulate(map(operator.add, map(len, lines), itertools.repeat(1)),
+                                         initial=self.indexed_end),
+                    len(lines)))
+                self.indexed_end += complete
+
+    def line_start(self, offset: int) -> int:
+        """Offset of the beginning of the indexed line containing offset"""
+        i = bisect.bisect_right(self.line_starts, offset) - 1
+        return self.line_starts[i] if i >= 0 else 0
+
+    def is_line_boundary(self, offset: int) -> bool:
+        return offset == self.indexed_end or self.line_start(offset) == offset
+
+    def scan(self, pattern: re.Pattern, start: int, end: int,
+             first_only: bool = False) -> List[Tuple[int, str]]:
+        """Return (offset, line) for every line in [start, end) which
+           pattern.search() matches. A line starting before `start` is
+           searched from `start` only, like a file read from that offset.
+           `end` must be at a line boundary."""
+        if start >= end:
+            return []
+        matches = []
+        with open(self.path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            chunk_start = start
+            while chunk_start < end:
+                chunk_end = min(end, chunk_start + self.SCAN_CHUNK_SIZE)
+                if chunk_end < end:
+                    # Align the chunk at a line boundary
+                    aligned = self.line_start(chunk_end)
+                    if aligned > chunk_start:
+                        chunk_end = aligned
+                    else:
+                        chunk_end = mm.find(b'\n', chunk_end, end) + 1 or end
+                # surrogateescape makes decoding reversible, so the byte
+                # length of any line is known even if the log is not valid UTF-8
+                text = mm[chunk_start:chunk_end].decode(errors='surrogateescape')
+                ascii = text.isascii()
+                byte_pos = chunk_start
+                # Splits at '\n' only, keeping it, like reading the file line by line
+                for line in io.StringIO(text, newline='\n'):
+                    if pattern.search(line):
+                        matches.append((byte_pos, line))
+                        if first_only:
+                            return matches
+                    byte_pos += len(line) if ascii else len(line.encode(errors='surrogateescape'))
+                chunk_start = chunk_end
+        return matches
+
+    def read_lines(self, offsets: Iterable[int]) -> List[Tuple[int, str]]:
+        """(offset, line) of the lines starting at offsets"""
+        lines = []
+        if not offsets:
+            return lines
+        with open(self.path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for offset in offsets:
+                end = mm.find(b'\n', offset, self.indexed_end) + 1 or self.indexed_end
+                lines.append((offset, mm[offset:end].decode(errors='surrogateescape')))
+        return lines
+
+    def grep(self, pattern: re.Pattern, filter_pattern: Optional[re.Pattern],
+             from_mark: int) -> List[Tuple[int, str]]:
+        """Lines matching pattern and not matching filter_pattern from
+           from_mark until the end of the indexed part of the file.
+           Results are cached, so a repeated search only scans lines
+           appended since the previous one."""
+        with self.lock:
+            self.refresh()
+            key = (pattern.pattern, pattern.flags,
+                   filter_pattern.pattern if filter_pattern else None,
+                   filter_pattern.flags if filter_pattern else 0)
+            cached = self.grep_cache.pop(key, None)
+            # Reuse the cached result if it covers from_mark. If from_mark
+            # is in the middle of a line, the line is searched from from_mark
+            # only, so it can't be answered from the cache.
+            if cached and cached[0] <= from_mark <= cached[1] and self.is_line_boundary(from_mark):
+                first, scanned_end, offsets = cached
+            else:
+                first, scanned_end, offsets = from_mark, from_mark, array('q')
+            new = self.scan(pattern, scanned_end, self.indexed_end)
+            if filter_pattern:
+                new = [(offset, line) for offset, line in new if not filter_pattern.search(line)]
+            offsets.extend(offset for offset, _ in new)
+            if self.is_line_boundary(first):
+                self.grep_cache[key] = (first, self.indexed_end, offsets)
+                while len(self.grep_cache) > self.GREP_CACHE_SIZE:
+                    self.grep_cache.popitem(last=False)
+            cached_offsets = offsets[bisect.bisect_left(offsets, from_mark):len(offsets) - len(new)]
+            return self.read_lines(cached_offsets) + new
+
+    def add_waiter(self, pattern: re.Pattern, from_mark: int,
+                   future: asyncio.Future, loop: asyncio.AbstractEventLoop) -> Optional[str]:
+        """Search the already indexed part of the file from from_mark,
+           and if there is no match, register the future to be resolved
+           by the pump with the first matching line appended later.
+           Runs in an executor thread."""
+        with self.lock:
+            self.refresh()
+            found = self.scan(pattern, from_mark, self.indexed_end, first_only=True)
+            if found:
+                return found[0][1]
+            self.waiters.append([pattern, max(from_mark, self.indexed_end), future, loop])
+            return None
+
+    def pump_once(self) -> bool:
+        """Index new lines and search them for all waiters at once.
+           Returns False if there are no waiters left.
+           Runs in an executor thread."""
+        with self.lock:
+            self.refresh()
+            self.waiters = [w for w in self.waiters if not w[2].done()]
+            if not self.waiters:
+                return False
+            start = min(w[1] for w in self.waiters)
+            if start < self.indexed_end:
+                remaining = []
+                for waiter in self.waiters:
+                    pattern, waiter_start, future, loop = waiter
+                    found = self.scan(pattern, waiter_start, self.indexed_end, first_only=True)
+                    if found:
+                        loop.call_soon_threadsafe(
+                            lambda f=future, line=found[0][1]: f.done() or f.set_result(line))
+                    else:
+                        waiter[1] = self.indexed_end
+                        remaining.append(waiter)
+                self.waiters = remaining
+            return bool(self.waiters)
+
+    def ensure_pump(self, thread_pool: ThreadPoolExecutor) -> None:
+        if self.pump is None or self.pump.task is None or self.pump.task.done():
+            self.pump = LogTailerPump(self, thread_pool)
+            self.pump.start()
+
+
+class LogTailerPump(LogWatcher):
+    """Follows the file of a LogTailer while it has waiters, serving
+       all of them from an executor thread whenever the file changes"""
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, tailer: LogTailer, thread_pool: ThreadPoolExecutor):
+        super().__init__(pathlib.Path(tailer.path))
+        self.tailer = tailer
+        self.thread_pool = thread_pool
+
+    async def poll(self) -> bool:
+        return await asyncio.get_running_loop().run_in_executor(self.thread_pool, self.tailer.pump_once)
+
+
 class ScyllaLogFile():
     """
     Class for browsing a Scylla log file.
@@ -23,6 +238,7 @@ class ScyllaLogFile():
         self.file = logfile_path
         if not os.path.isfile(self.file):
             pytest.fail("Log file {} does not exist".format(self.file))
+        self.tailer = LogTailer(self.file)
 
     async def _run_in_executor(self, func, *args, loop=None):
         if loop is None:
@@ -35,9 +251,7 @@ class ScyllaLogFile():
         This is for use with the from_mark parameter of watch_log_for method,
         allowing to watch the log from the position when this method was called.
         """
-        with open(self.file, 'r') as f:
-            await self._run_in_executor(f.seek, 0, os.SEEK_END)
-            return await self._run_in_executor(f.tell)
+        return await self._run_in_executor(os.path.getsize, self.file)
 
     async def wait_for(self, pattern: str | re.Pattern, from_mark: Optional[int] = None, timeout: int = 600) -> None:
         """
@@ -54,25 +268,21 @@ class ScyllaLogFile():
         """
         prog = re.compile(pattern)
         loop = asyncio.get_running_loop()
-        line = ""
-
-        with open(self.file, 'r') as f:
-            if from_mark is not None:
-                await self._run_in_executor(f.seek, from_mark, loop=loop)
-
-            async with asyncio.timeout(timeout):
-                logger.debug("Waiting for log message: %s", pattern)
-                while True:
-                    line += await self._run_in_executor(f.readline, loop=loop)
-                    if line:
-                        if prog.search(line):
-                            logger.debug("Found log message: %s", line)
-                            return
-                        elif line[-1] != '\n':
-                            continue
-                        line = ""
-                    else:
-                        await asyncio.sleep(0.01)
+        future = loop.create_future()
+
+        async with asyncio.timeout(timeout):
+            logger.debug("Waiting for log message: %s", pattern)
+            try:
+                line = await self._run_in_executor(self.tailer.add_waiter, prog, from_mark or 0,
+                                                   future, loop, loop=loop)
+                if line is None:
+                    self.tailer.ensure_pump(self.thread_pool)
+                    line = await future
+            finally:
+                # The pump drops waiters with cancelled futures
+                if not future.done():
+                    future.cancel()
+            logger.debug("Found log message: %s", line)
 
     async def grep(self, expr: str | re.Pattern, filter_expr: Optional[str | re.Pattern] = None,
              from_mark: Optional[int] = None) -> list[tuple[str, re.Match[str]]]:
@@ -85,18 +295,7 @@ class ScyllaLogFile():
         If from_mark is given, the log is searched from that position, otherwise
         from the beginning.
         """
-        matchings = []
         pattern = re.compile(expr)
         filter_pattern = re.compile(filter_expr) if filter_expr else None
-        loop = asyncio.get_running_loop()
-
-        with open(self.file) as f:
-            if from_mark:
-                await self._run_in_executor(f.seek, from_mark, loop=loop)
-            line = await self._run_in_executor(f.readline, loop=loop)
-            while line:
-                m = pattern.search(line)
-                if m and not (filter_pattern and re.search(filter_pattern, line)):
-                    matchings.append((line, m))
-                line = await self._run_in_executor(f.readline, loop=loop)
-        return matchings
+        lines = await self._run_in_executor(self.tailer.grep, pattern, filter_pattern, from_mark or 0)
+        return [(line, pattern.search(line)) for _, line in lines]
@@ -0,0 +1,232 @@
+#
+# Copyright (C) 2024-present ScyllaDB
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+"""Event-driven tailing of log files.
+   Instead of polling a log with readline() until a message shows up,
+   a LogWatcher follows the file as it grows, reading new data in large
+   chunks only when the file changes (using inotify where available),
+   and wakes up everybody waiting for a line matching their pattern.
+"""
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import pathlib
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class Inotify:
+    """Minimal inotify(7) binding which sets an asyncio.Event whenever
+       a watched file is modified. Not available on all platforms:
+       check Inotify.supported() before use."""
+    IN_MODIFY = 0x00000002
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = os.O_CLOEXEC
+
+    _libc: Optional[ctypes.CDLL] = None
+
+    @classmethod
+    def _get_libc(cls) -> Optional[ctypes.CDLL]:
+        if cls._libc is None:
+            name = ctypes.util.find_library('c')
+            if not name:
+                return None
+            libc = ctypes.CDLL(name, use_errno=True)
+            if not hasattr(libc, 'inotify_init1'):
+                return None
+            cls._libc = libc
+        return cls._libc
+
+    @classmethod
+    def supported(cls) -> bool:
+        try:
+            return cls._get_libc() is not None
+        except OSError:
+            return False
+
+    def __init__(self, path: pathlib.Path, changed: asyncio.Event) -> None:
+        libc = self._get_libc()
+        assert libc is not None
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, str(path).encode(), self.IN_MODIFY) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch({path}) failed")
+        self.changed = changed
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.fd, self._on_readable)
+
+    def _on_readable(self) -> None:
+        # Drain the queued events, we only care that something happened
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        self.changed.set()
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            self.loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = -1
+
+
+class LogWatcher:
+    """Follows a log file from a given offset and resolves waiters
+       registered with wait_for() when a matching line is appended.
+       Only complete lines are matched. Subclasses can override poll()
+       to process the changes of the file in another way.
+
+       Usage:
+           watcher = LogWatcher(path, offset)
+           watcher.start()
+           try:
+               line = await watcher.wait_for(re.compile("serving"))
+           finally:
+               await watcher.stop()
+    """
+    CHUNK_SIZE = 1024 * 1024
+    # Used when inotify is not available and as a safety net with inotify:
+    # just reading the end of a file is much cheaper than polling a service.
+    POLL_INTERVAL = 0.05
+    INOTIFY_POLL_INTERVAL = 1
+
+    def __init__(self, path: pathlib.Path, offset: int = 0) -> None:
+        self.path = path
+        self.offset = offset
+        self.partial = b""
+        self.waiters: List[Tuple[re.Pattern, asyncio.Future]] = []
+        self.changed = asyncio.Event()
+        self.inotify: Optional[Inotify] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if Inotify.supported():
+            try:
+                self.inotify = Inotify(self.path, self.changed)
+            except OSError as exc:
+                logger.debug("inotify is not available for %s: %s", self.path, exc)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+        for _, future in self.waiters:
+            future.cancel()
+        self.waiters = []
+
+    def wait_for(self, pattern: re.Pattern) -> asyncio.Future:
+        """Return a future resolved with the first line matching pattern
+           appended to the log after the watcher's current position"""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((pattern, future))
+        return future
+
+    def read_new_data(self) -> bytes:
+        """Read everything appended to the file since the last call"""
+        chunks = []
+        with self.path.open("rb") as f:
+            f.seek(self.offset)
+            while data := f.read(self.CHUNK_SIZE):
+                chunks.append(data)
+                self.offset += len(data)
+        return b"".join(chunks)
+
+    def _process(self, data: bytes) -> None:
+        data = self.partial + data
+        end = data.rfind(b"\n") + 1
+        self.partial = data[end:]
+        if not end or not self.waiters:
+            return
+        text = data[:end].decode(errors="replace")
+        for line in text.splitlines():
+            remaining = []
+            for pattern, future in self.waiters:
+                if future.done():
+                    continue
+                if pattern.search(line):
+                    future.set_result(line)
+                else:
+                    remaining.append((pattern, future))
+            self.waiters = remaining
+            if not self.waiters:
+                break
+
+    async def poll(self) -> bool:
+        """Called whenever the file may have changed.
+           Returns False to stop following the file."""
+        self._process(self.read_new_data())
+        return True
+
+    async def _run(self) -> None:
+        interval = self.INOTIFY_POLL_INTERVAL if self.inotify else self.POLL_INTERVAL
+        try:
+            while True:
+                self.changed.clear()
+                try:
+                    if not await self.poll():
+                        return
+                except FileNotFoundError:
+                    pass
+                try:
+                    await asyncio.wait_for(self.changed.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if self.inotify:
+                self.inotify.close()
+                self.inotify = None
+
+
+class BootTimeline:
+    """Records when each phase of a server boot was reached,
+       relative to the start of the boot"""
+
+    def __init__(self, clock: Callable[[], float]) -> None:
+        self.clock = clock
+        self.start = clock()
+        self.phases: List[Tuple[str, float]] = []
+
+    def mark(self, phase: str) -> None:
+        if not self.reached(phase):
+            self.phases.append((phase, self.clock() - self.start))
+
+    def reached(self, phase: str) -> bool:
+        return any(p == phase for p, _ in self.phases)
+
+    def __str__(self) -> str:
+        return ", ".join(f"{phase} {t:.2f}s" for phase, t in self.phases)
+
+
+class BootTimelineStats:
+    """Average time to reach each boot phase over many boots. Keeps only
+       running totals, not the timelines, so it doesn't grow with the
+       number of boots in a long run."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.totals: Dict[str, Tuple[int, float]] = {}
+
+    def add(self, timeline: BootTimeline) -> None:
+        self.count += 1
+        for phase, t in timeline.phases:
+            n, total = self.totals.get(phase, (0, 0.0))
+            self.totals[phase] = (n + 1, total + t)
+
+    def __str__(self) -> str:
+        return ", ".join(f"{phase} {total / n:.2f}s" for phase, (n, total) in self.totals.items())
@@ -1,9 +1,58 @@
 import asyncio
+import logging
+import time
 from typing import Generic, Callable, Awaitable, TypeVar, AsyncContextManager, Final, Optional
 
 T = TypeVar('T')
 
 
+class PoolBudget:
+    """A limit on resources held by objects prefetched ahead of demand,
+    shared by several pools. The unit is up to the user, e.g. the number
+    of clusters for pools of Scylla clusters. Only objects which are built
+    or waiting in a pool for a user count against the budget, leased
+    objects don't."""
+    def __init__(self, limit: int):
+        assert(limit >= 0)
+        self.limit: Final[int] = limit
+        self.used: int = 0
+
+    def try_acquire(self, units: int) -> bool:
+        if self.used + units > self.limit:
+            return False
+        self.used += units
+        return True
+
+    def release(self, units: int) -> None:
+        self.used -= units
+        assert(self.used >= 0)
+
+
+class PoolStats:
+    """Statistics of a pool: how often a user got an object right away (hit)
+    and how often it had to wait for an object to be built or returned (miss)"""
+    def __init__(self) -> None:
+        self.hits: int = 0
+        self.misses: int = 0
+        self.prefetched: int = 0
+        self.wait_time: float = 0
+        self.max_wait_time: float = 0
+
+    def record_wait(self, hit: bool, wait_time: float) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def __str__(self) -> str:
+        total = self.hits + self.misses
+        avg = self.wait_time / total if total else 0
+        return (f"hits: {self.hits}, misses: {self.misses}, prefetched: {self.prefetched}, "
+                f"wait time: total {self.wait_time:.1f}s, avg {avg:.1f}s, max {self.max_wait_time:.1f}s")
+
+
 class Pool(Generic[T]):
     """Asynchronous object pool.
     You need a pool of up to N objects, but objects should be created
@@ -64,17 +113,125 @@ class Pool(Generic[T]):
         finally:
             if server:
                 await pool.put(is_dirty=dirty)
+
+
+    Prefetching mode: if `prefetch` > 0, the pool builds up to `prefetch`
+    objects in the background ahead of demand, passing `prefetch_args` to
+    the build function, so that `get` and `replace_dirty` can return a
+    ready object instead of waiting for one to be built. Each prefetched
+    object holds `prefetch_cost` units of the optional shared `budget`
+    while it is being built or waits in the pool. In this mode dirty
+    objects are destroyed in the background, off the critical path of
+    `put` and `replace_dirty`, so the number of existing objects can
+    exceed `max_size` by the number of objects being destroyed.
+    Prefetching starts with the first `get`. Call `close` as soon as no
+    more objects will be needed, to stop it, wait for the background work
+    and destroy the prefetched objects nobody got.
     """
     def __init__(self, max_size: int,
                  build: Callable[..., Awaitable[T]],
-                 destroy: Callable[[T], Awaitable[None]]):
+                 destroy: Callable[[T], Awaitable[None]],
+                 prefetch: int = 0,
+                 prefetch_args: tuple = (),
+                 budget: Optional[PoolBudget] = None,
+                 prefetch_cost: int = 1):
         assert(max_size >= 0)
+        assert(prefetch >= 0)
         self.max_size: Final[int] = max_size
         self.build: Final[Callable[..., Awaitable[T]]] = build
         self.destroy: Final[Callable[[T], Awaitable]] = destroy
         self.cond: Final[asyncio.Condition] = asyncio.Condition()
         self.pool: list[T] = []
-        self.total: int = 0 # len(self.pool) + leased objects
+        self.total: int = 0 # len(self.pool) + leased objects + objects being built
+        self.prefetch: Final[int] = min(prefetch, max_size)
+        self.prefetch_args: Final[tuple] = prefetch_args
+        self.budget: Final[Optional[PoolBudget]] = budget
+        self.prefetch_cost: Final[int] = prefetch_cost
+        # Prefetched objects waiting in self.pool, which hold budget units
+        self.prefetched: list[T] = []
+        self.prefetching: int = 0 # objects being built in the background
+        self.background: set[asyncio.Task] = set()
+        self.prefetch_tasks: set[asyncio.Task] = set()
+        self.closed: bool = False
+        self.stats: Final[PoolStats] = PoolStats()
+
+    def _take(self) -> T:
+        """Pop an object from the pool, returning its budget if it was prefetched"""
+        obj = self.pool.pop()
+        for i, p in enumerate(self.prefetched):
+            if p is obj:
+                del self.prefetched[i]
+                if self.budget:
+                    self.budget.release(self.prefetch_cost)
+                break
+        return obj
+
+    def _start_prefetch(self) -> None:
+        """Start building objects in the background until there are `prefetch`
+           ready or pending ones, there is space in the pool and budget allows.
+           Precondition: self.cond is locked."""
+        while (not self.closed and len(self.pool) + self.prefetching < self.prefetch
+               and self.total < self.max_size
+               and (self.budget is None or self.budget.try_acquire(self.prefetch_cost))):
+            self.total += 1
+            self.prefetching += 1
+            self.prefetch_tasks.add(self._run_in_background(self._prefetch_one()))
+
+    def _run_in_background(self, coro: Awaitable) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
+        task.add_done_callback(self.prefetch_tasks.discard)
+        return task
+
+    async def _prefetch_one(self) -> None:
+        """Precondition: space and budget for the object are allocated"""
+        try:
+            obj = await self.build(*self.prefetch_args)
+        except BaseException as exc:
+            async with self.cond:
+                self.total -= 1
+                self.prefetching -= 1
+                if self.budget:
+                    self.budget.release(self.prefetch_cost)
+                self.cond.notify()
+            if not isinstance(exc, asyncio.CancelledError):
+                logging.warning("Failed to prefetch a pool object: %s", exc)
+            return
+        async with self.cond:
+            self.prefetching -= 1
+            self.stats.prefetched += 1
+            self.pool.append(obj)
+            self.prefetched.append(obj)
+            self.cond.notify()
+
+    async def _destroy_in_background(self, obj: T) -> None:
+        try:
+            await self.destroy(obj)
+        except Exception as exc:
+            logging.warning("Failed to destroy a pool object: %s", exc)
+
+    async def close(self) -> None:
+        """Stop prefetching, wait for the background builds and destroys
+           to finish and destroy the prefetched objects which were never
+           used. Other objects left in the pool are not destroyed.
+           Can be called more than once."""
+        self.closed = True
+        # Let the prefetch tasks which didn't run yet enter _prefetch_one(),
+        # otherwise cancelling them would skip releasing their space and budget.
+        await asyncio.sleep(0)
+        for task in self.prefetch_tasks:
+            task.cancel()
+        await asyncio.gather(*self.background, return_exceptions=True)
+        async with self.cond:
+            unused = self.prefetched
+            self.prefetched = []
+            self.pool = [obj for obj in self.pool if not any(obj is p for p in unused)]
+            self.total -= len(unused)
+            if self.budget:
+                self.budget.release(self.prefetch_cost * len(unused))
+        for obj in unused:
+            await self._destroy_in_background(obj)
 
     async def get(self, *args, **kwargs) -> T:
         """Borrow an object from the pool.
@@ -85,15 +242,23 @@ class Pool(Generic[T]):
            is no guarantee whether a new object will be built
            or an existing one will be borrowed.
         """
+        start = time.monotonic()
         async with self.cond:
+            hit = bool(self.pool)
             await self.cond.wait_for(lambda: self.pool or self.total < self.max_size)
             if self.pool:
-                return self.pool.pop()
+                obj = self._take()
+                self._start_prefetch()
+                self.stats.record_wait(hit, time.monotonic() - start)
+                return obj
 
             # No object in pool, but total < max_size so we can construct one
             self.total += 1
+            self._start_prefetch()
 
-        return await self._build_and_get(*args, **kwargs)
+        obj = await self._build_and_get(*args, **kwargs)
+        self.stats.record_wait(False, time.monotonic() - start)
+        return obj
 
     async def put(self, obj: T, is_dirty: bool):
         """Return a previously borrowed object to the pool
@@ -101,11 +266,15 @@ class Pool(Generic[T]):
            and free up space in the pool.
         """
         if is_dirty:
-            await self.destroy(obj)
+            if self.prefetch:
+                self._run_in_background(self._destroy_in_background(obj))
+            else:
+                await self.destroy(obj)
 
         async with self.cond:
             if is_dirty:
                 self.total -= 1
+                self._start_prefetch()
             else:
                 self.pool.append(obj)
             self.cond.notify()
@@ -120,17 +289,26 @@ class Pool(Generic[T]):
            be built right now, as in `get`.
            *args and **kwargs are used as in `get`.
         """
-        await self.destroy(obj)
+        start = time.monotonic()
+        if self.prefetch:
+            self._run_in_background(self._destroy_in_background(obj))
+        else:
+            await self.destroy(obj)
 
         async with self.cond:
             if self.pool:
                 self.total -= 1
-                return self.pool.pop()
+                obj = self._take()
+                self._start_prefetch()
+                self.stats.record_wait(True, time.monotonic() - start)
+                return obj
 
             # Need to construct a new object.
             # The space for this object is already accounted for in self.total.
 
-        return await self._build_and_get(*args, **kwargs)
+        obj = await self._build_and_get(*args, **kwargs)
+        self.stats.record_wait(False, time.monotonic() - start)
+        return obj
 
     def instance(self, dirty_on_exception: bool, *args, **kwargs) -> AsyncContextManager[T]:
         class Instance:
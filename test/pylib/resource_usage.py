@@ -0,0 +1,156 @@
+#
+# Copyright (C) 2024-present ScyllaDB
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+"""Resource usage accounting of test processes.
+   asyncio reaps its child processes with waitpid(), which throws their
+   resource usage away, so test processes are started with posix_spawn()
+   and reaped with wait4() instead, which reports the CPU time, peak
+   memory and block I/O of the process and all its descendants it waited for.
+   Scylla servers are not descendants of the tests which use them, their
+   memory is added separately (see process_peak_rss()).
+"""
+import asyncio
+import os
+import signal
+import threading
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, List, Optional
+
+from test.pylib.duration_history import MetricHistory
+
+# Block I/O counters of rusage are in 512-byte blocks
+BLOCK_SIZE = 512
+
+
+@dataclass
+class ResourceUsage:
+    user_time: float    # seconds
+    sys_time: float     # seconds
+    max_rss: int        # bytes
+    read_bytes: int
+    write_bytes: int
+    # Peak RSS of the Scylla servers used by the test, in bytes
+    servers_max_rss: int = 0
+
+    @property
+    def peak_memory(self) -> int:
+        """Peak memory used by the test and the Scylla servers it used"""
+        return self.max_rss + self.servers_max_rss
+
+    @classmethod
+    def from_rusage(cls, ru: 'os.struct_rusage') -> 'ResourceUsage':
+        return cls(user_time=ru.ru_utime, sys_time=ru.ru_stime,
+                   # ru_maxrss is in kilobytes on Linux
+                   max_rss=ru.ru_maxrss * 1024,
+                   read_bytes=ru.ru_inblock * BLOCK_SIZE,
+                   write_bytes=ru.ru_oublock * BLOCK_SIZE)
+
+    def as_dict(self) -> Dict[str, float]:
+        return asdict(self)
+
+
+class ChildProcess:
+    """A child process reaped with wait4(2), to get its resource usage.
+       The interface follows asyncio.subprocess.Process: the process
+       is waited for in a dedicated thread, like asyncio's own
+       ThreadedChildWatcher does, and wait() can be awaited."""
+
+    def __init__(self, pid: int) -> None:
+        self.pid = pid
+        self.returncode: Optional[int] = None
+        self.rusage: Optional[ResourceUsage] = None
+        self.loop = asyncio.get_running_loop()
+        self.exited = self.loop.create_future()
+        threading.Thread(target=self._wait4, name=f"wait4-{pid}", daemon=True).start()
+
+    @classmethod
+    def spawn(cls, path: str, args: List[str], env: Dict[str, str],
+              stdout: int, stderr: int) -> 'ChildProcess':
+        """Start path (looked up in PATH) in a new session, like
+           asyncio.create_subprocess_exec(..., preexec_fn=os.setsid),
+           with stdout and stderr redirected to the given descriptors."""
+        pid = os.posix_spawnp(path, [path, *args], env,
+                              file_actions=[(os.POSIX_SPAWN_DUP2, stdout, 1),
+                                            (os.POSIX_SPAWN_DUP2, stderr, 2)],
+                              setsid=True)
+        return cls(pid)
+
+    def _wait4(self) -> None:
+        _, status, ru = os.wait4(self.pid, 0)
+        try:
+            self.loop.call_soon_threadsafe(self._set_exited, os.waitstatus_to_exitcode(status),
+                                           ResourceUsage.from_rusage(ru))
+        except RuntimeError:
+            # The event loop is closed, nobody is waiting any more
+            pass
+
+    def _set_exited(self, returncode: int, rusage: ResourceUsage) -> None:
+        self.returncode = returncode
+        self.rusage = rusage
+        if not self.exited.done():
+            self.exited.set_result(returncode)
+
+    def send_signal(self, sig: int) -> None:
+        if self.returncode is not None:
+            return
+        try:
+            os.kill(self.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        self.send_signal(signal.SIGKILL)
+
+    async def wait(self) -> int:
+        # Shielded, so that a timeout of one waiter doesn't prevent
+        # waiting for the process again after killing it
+        return await asyncio.shield(self.exited)
+
+
+def process_peak_rss(pid: int) -> int:
+    """Peak resident set size of a running process in bytes, 0 if unknown"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    # VmHWM:   123456 kB
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+class MemoryHistory(MetricHistory):
+    """Peak memory used by each test in previous runs, in bytes,
+       including the Scylla servers it used"""
+
+    def peaks(self, modes: Iterable[str]) -> List[float]:
+        """Peak memory of all known tests of the modes, of all modes if empty"""
+        modes = set(modes)
+        return [peak for mode, tests in self.values.items() if not modes or mode in modes
+                for peak in tests.values()]
+
+
+def quantile(values: Iterable[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def estimate_test_memory(peak_rss: Iterable[float], q: float = 0.9,
+                         min_test_memory: float = 256e6) -> Optional[float]:
+    """Memory to reserve for each concurrently running test, given the
+       peak memory usage of tests measured in previous runs. Most tests
+       are much smaller than the biggest ones, and the biggest ones rarely
+       run at the same time, so a high quantile of peak memory is used
+       rather than the maximum. Returns None if nothing was measured yet."""
+    peak_rss = list(peak_rss)
+    if not peak_rss:
+        return None
+    return max(quantile(peak_rss, q), min_test_memory)
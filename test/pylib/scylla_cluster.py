@@ -14,6 +14,7 @@ import itertools
 import logging
 import os
 import pathlib
+import re
 import shutil
 import tempfile
 import time
@@ -23,7 +24,10 @@ import uuid
 from enum import Enum
 from io import BufferedWriter
 from test.pylib.host_registry import Host, HostRegistry
+from test.pylib.cpu_slots import Slot, SlotLease, SlotPool
+from test.pylib.log_watcher import LogWatcher, BootTimeline, BootTimelineStats
 from test.pylib.pool import Pool
+from test.pylib.resource_usage import process_peak_rss
 from test.pylib.rest_client import ScyllaRESTAPIClient, HTTPError
 from test.pylib.util import LogPrefixAdapter, read_last_line
 from test.pylib.internal_types import ServerNum, IPAddress, HostID, ServerInfo
@@ -203,6 +207,16 @@ class ScyllaServer:
 
     # in seconds, used for topology operations such as bootstrap or decommission
     TOPOLOGY_TIMEOUT = 1000
+    # Logged by Scylla when it's done booting, also in maintenance mode
+    INITIALIZED_MARKER = re.compile(r"initialization completed")
+    # How often to check REST and CQL while the marker is not in the log yet,
+    # in case it's missed, e.g. because of a custom log format.
+    READINESS_CHECK_INTERVAL = 1
+    # Share of the memory budget of a CPU slot given to Scylla with -m,
+    # the rest is for memory allocated outside of the Seastar allocator
+    SLOT_MEMORY_SHARE = 0.8
+    # Average timeline of all successful boots in this run
+    boot_stats = BootTimelineStats()
     start_time: float
     sleep_interval: float
     log_file: BufferedWriter
@@ -215,13 +229,19 @@ class ScyllaServer:
                  cmdline_options: List[str],
                  config_options: Dict[str, Any],
                  property_file: Dict[str, Any],
-                 append_env: Dict[str,Any]) -> None:
+                 append_env: Dict[str,Any],
+                 slots: Optional[SlotPool] = None) -> None:
         # pylint: disable=too-many-arguments
         self.server_id = ServerNum(ScyllaServer.newid())
         self.exe = pathlib.Path(exe).resolve()
         self.vardir = pathlib.Path(vardir)
         self.logger = logger
         self.cmdline_options = merge_cmdline_options(SCYLLA_CMDLINE_OPTIONS, cmdline_options)
+        # Options set by the suite or the test, which the CPU slot doesn't override
+        self.explicit_cmdline_options = cmdline_options
+        # If set, the server runs in a CPU slot leased on each start
+        self.slots = slots
+        self.slot_lease: Optional[SlotLease] = None
         self.cluster_name = cluster_name
         self.ip_addr = IPAddress(ip_addr)
         self.seeds = seeds
@@ -243,6 +263,8 @@ class ScyllaServer:
             | config_options
         self.property_file = property_file
         self.append_env = append_env
+        # Timeline of the last successful boot
+        self.boot_timeline: Optional[BootTimeline] = None
 
     def change_ip(self, ip_addr: IPAddress) -> None:
         """Change IP address of the current server. Pre: the server is
@@ -438,14 +460,19 @@ class ScyllaServer:
             caslog.setLevel(oldlevel)
         # Any other exception may indicate a problem, and is passed to the caller.
 
-    async def get_host_id(self, api: ScyllaRESTAPIClient) -> bool:
+    async def get_host_id(self, api: ScyllaRESTAPIClient, timeline: Optional[BootTimeline] = None) -> bool:
         """Try to get the host id (also tests Scylla REST API is serving)"""
         try:
             self.host_id = await api.get_host_id(self.ip_addr)
+            if timeline:
+                timeline.mark("REST up")
+                timeline.mark("host id")
             return True
         except (aiohttp.ClientConnectionError, HTTPError) as exc:
             if isinstance(exc, HTTPError) and exc.code >= 500:
                 raise exc
+            if isinstance(exc, HTTPError) and timeline:
+                timeline.mark("REST up")
             return False
         # Any other exception may indicate a problem, and is passed to the caller.
 
@@ -455,17 +482,28 @@ class ScyllaServer:
         env = os.environ.copy()
         env.clear()     # pass empty env to make user user's SCYLLA_HOME has no impact
         env.update(self.append_env)
-        self.cmd = await asyncio.create_subprocess_exec(
-            self.exe,
-            *self.cmdline_options,
-            cwd=self.workdir,
-            stderr=self.log_file,
-            stdout=self.log_file,
-            env=env,
-            preexec_fn=os.setsid,
-        )
+        log_offset = self.log_file.tell()
+        cmd = [str(self.exe), *self.cmdline_options]
+        if self.slots is not None:
+            self.slot_lease = self.slots.lease()
+            self.logger.info("starting %s in %s", self, self.slot_lease.slot)
+            cmd = self.slot_lease.wrap([str(self.exe), *self._slot_cmdline_options(self.slot_lease.slot)])
+        try:
+            self.cmd = await asyncio.create_subprocess_exec(
+                *cmd,
+                cwd=self.workdir,
+                stderr=self.log_file,
+                stdout=self.log_file,
+                env=env,
+                preexec_fn=os.setsid,
+            )
+        except:
+            self._release_slot()
+            raise
 
         self.start_time = time.time()
+        timeline = BootTimeline(time.time)
+        timeline.mark("spawned")
         sleep_interval = 0.1
         cql_up_state = CqlUpState.NOT_CONNECTED
 
@@ -486,27 +524,54 @@ class ScyllaServer:
                                          f"{logpath}\n"
                                          f"{self.log_filename}")
 
-        while time.time() < self.start_time + self.TOPOLOGY_TIMEOUT:
-            assert self.cmd is not None
-            if self.cmd.returncode:
-                self.cmd = None
-                if expected_error is not None:
-                    with self.log_filename.open('r') as log_file:
-                        for line in log_file:
-                            if expected_error in line:
-                                return
-                        report_error("the node startup failed, but the log file doesn't contain the expected error")
-                report_error("failed to start the node")
-
-            if hasattr(self, "host_id") or await self.get_host_id(api):
-                cql_up_state = await self.cql_is_up()
-                if cql_up_state == CqlUpState.QUERIED:
+        # Instead of polling REST and CQL until they respond, wait until
+        # the node logs that it's initialized (or exits), and only then
+        # check that it's serving.
+        watcher = LogWatcher(self.log_filename, log_offset)
+        initialized = watcher.wait_for(self.INITIALIZED_MARKER)
+        watcher.start()
+        exited = asyncio.ensure_future(self.cmd.wait())
+        try:
+            while time.time() < self.start_time + self.TOPOLOGY_TIMEOUT:
+                assert self.cmd is not None
+                if self.cmd.returncode is not None:
+                    self.cmd = None
+                    self._release_slot()
                     if expected_error is not None:
-                        report_error("the node started, but was expected to fail with the expected error")
-                    return
-
-            # Sleep and retry
-            await asyncio.sleep(sleep_interval)
+                        with self.log_filename.open('r') as log_file:
+                            for line in log_file:
+                                if expected_error in line:
+                                    return
+                            report_error("the node startup failed, but the log file doesn't contain the expected error")
+                    report_error("failed to start the node")
+
+                if not initialized.done():
+                    done, _ = await asyncio.wait([initialized, exited],
+                                                 timeout=self.READINESS_CHECK_INTERVAL)
+                    if exited in done:
+                        continue
+                    if initialized in done:
+                        timeline.mark("initialized")
+
+                if hasattr(self, "host_id") or await self.get_host_id(api, timeline):
+                    cql_up_state = await self.cql_is_up()
+                    if cql_up_state != CqlUpState.NOT_CONNECTED:
+                        timeline.mark("CQL connected")
+                    if cql_up_state == CqlUpState.QUERIED:
+                        if expected_error is not None:
+                            report_error("the node started, but was expected to fail with the expected error")
+                        timeline.mark("CQL queried")
+                        self.boot_timeline = timeline
+                        ScyllaServer.boot_stats.add(timeline)
+                        self.logger.info("%s boot timeline: %s", self, timeline)
+                        return
+
+                if initialized.done():
+                    # The node is up, but not serving yet. Sleep and retry.
+                    await asyncio.sleep(sleep_interval)
+        finally:
+            exited.cancel()
+            await watcher.stop()
 
         report_error('failed to start the node, timeout reached')
 
@@ -564,6 +629,7 @@ class ScyllaServer:
             if self.cmd:
                 self.logger.info("stopped %s in %s", self, self.workdir.name)
             self.cmd = None
+            self._release_slot()
 
     async def stop_gracefully(self) -> None:
         """Stop a running server. No-op if not running. Uses SIGTERM to
@@ -593,6 +659,25 @@ class ScyllaServer:
             if self.cmd:
                 self.logger.info("gracefully stopped %s", self)
             self.cmd = None
+            self._release_slot()
+
+    def _slot_cmdline_options(self, slot: Slot) -> List[str]:
+        """Command line options with --smp and -m matching the CPU slot,
+        unless the suite or the test chose them"""
+        explicit = {name.partition('=')[0] for name in self.explicit_cmdline_options
+                    if name.startswith('-')}
+        override = []
+        if not explicit & {'--smp', '-c'}:
+            override += ['--smp', str(len(slot.cpus))]
+        if slot.memory is not None and not explicit & {'--memory', '-m'}:
+            memory = int(slot.memory * self.SLOT_MEMORY_SHARE) // 2**20
+            override += ['-m', f'{memory}M']
+        return merge_cmdline_options(self.cmdline_options, override)
+
+    def _release_slot(self) -> None:
+        if self.slot_lease is not None:
+            self.slot_lease.release()
+            self.slot_lease = None
 
     def pause(self) -> None:
         """Pause a running server."""
@@ -616,6 +701,10 @@ class ScyllaServer:
             pass
         self.log_filename.unlink(missing_ok=True)
 
+    def peak_rss(self) -> int:
+        """Peak resident memory of the running server process, 0 if it isn't running"""
+        return process_peak_rss(self.cmd.pid) if self.cmd else 0
+
     def write_log_marker(self, msg) -> None:
         """Write a message to the server's log file (e.g. separator/marker)"""
         self.log_file.seek(0, 2)  # seek to file end
@@ -851,6 +940,11 @@ class ScyllaCluster:
         for server in self.running.values():
             server.take_log_savepoint()
 
+    def peak_rss(self) -> int:
+        """Sum of the peak resident memory of the running servers. A server
+        from the pool may have reached its peak in an earlier test."""
+        return sum(server.peak_rss() for server in self.running.values())
+
     def read_server_log(self) -> str:
         """Read log data of failed server"""
         # FIXME: pick failed server
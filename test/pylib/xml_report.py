@@ -0,0 +1,74 @@
+#
+# Copyright (C) 2024-present ScyllaDB
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+#
+"""XML reports written incrementally while tests run.
+   A StreamingXmlReport keeps the document on disk valid at all times:
+   every new element is written before the closing tag of the root, and
+   elements can be superseded by later versions without rewriting the
+   file, so neither the report nor the results it collects have to be
+   kept in memory until the end of the run.
+"""
+import pathlib
+import xml.etree.ElementTree as ET
+from typing import Dict, Optional, Tuple
+
+
+class StreamingXmlReport:
+    """An XML document with a root element and a flat list of children,
+       appended one at a time.
+
+       Attributes of the root can be updated in place: the opening tag
+       is followed by enough padding for the attribute values to grow.
+       A child added with a key replaces the previous child with the same
+       key, which is turned into an XML comment of the same length."""
+    HEADER_RESERVE = 128
+
+    def __init__(self, path: pathlib.Path, root_tag: str, **attrib: str) -> None:
+        self.path = path
+        self.root_tag = root_tag
+        self.attrib = attrib
+        self.footer = f"</{root_tag}>\n".encode()
+        self.header_size = len(self._header()) + self.HEADER_RESERVE
+        # Keyed children: key -> (offset, length) of the current version
+        self.keyed: Dict[object, Tuple[int, int]] = {}
+        self.file = open(path, "wb")
+        self.file.write(self._header().ljust(self.header_size - 1) + b">" + self.footer)
+        self.file.flush()
+        self.end = self.header_size
+
+    def _header(self) -> bytes:
+        element = ET.Element(self.root_tag, self.attrib)
+        # Serialize an empty element and strip " />" to get "<tag attr=...".
+        return ET.tostring(element, encoding="unicode", short_empty_elements=True)[:-3].encode()
+
+    def set_attrib(self, **attrib: str) -> None:
+        """Update attributes of the root element"""
+        self.attrib.update(attrib)
+        header = self._header()
+        if len(header) >= self.header_size:
+            raise ValueError(f"{self.path}: attributes of <{self.root_tag}> don't fit the reserved space")
+        self.file.seek(0)
+        self.file.write(header.ljust(self.header_size - 1))
+        self.file.flush()
+
+    def append(self, element: ET.Element, key: Optional[object] = None) -> None:
+        """Add a child element at the end of the document. If key is given
+           and a child with the same key was added before, it is removed."""
+        data = ET.tostring(element, encoding="unicode").encode()
+        if key is not None and key in self.keyed:
+            offset, length = self.keyed[key]
+            assert length >= 7
+            # Comments can't contain "--", so fill with spaces
+            self.file.seek(offset)
+            self.file.write(b"<!--" + b" " * (length - 7) + b"-->")
+        self.file.seek(self.end)
+        self.file.write(data + self.footer)
+        self.file.flush()
+        if key is not None:
+            self.keyed[key] = (self.end, len(data))
+        self.end += len(data)
+
+    def close(self) -> None:
+        self.file.close()
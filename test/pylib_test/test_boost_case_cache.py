@@ -0,0 +1,79 @@
+import asyncio
+import os
+import pathlib
+import tempfile
+from test.pylib.boost_case_cache import BoostCaseCache, list_cases
+
+# A stand-in for a Boost test executable, counting how often its cases are listed
+FAKE_TEST = """\
+#!/bin/sh
+echo run >> "$0.runs"
+echo "case_a*" >&2
+echo "case_b*" >&2
+echo "disabled_case" >&2
+"""
+
+
+def make_test(d: pathlib.Path) -> pathlib.Path:
+    exe = d / "fake_test"
+    exe.write_text(FAKE_TEST)
+    exe.chmod(0o755)
+    return exe
+
+
+def listing_runs(exe: pathlib.Path) -> int:
+    runs = exe.with_name(exe.name + ".runs")
+    return len(runs.read_text().splitlines()) if runs.exists() else 0
+
+
+def list_with_cache(exe: pathlib.Path, cache_path: pathlib.Path) -> list:
+    cache = BoostCaseCache(cache_path)
+    cases = asyncio.run(list_cases(str(exe), cache, asyncio.Semaphore(1), 60))
+    cache.save()
+    return cases
+
+
+def test_cached_cases():
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        d = pathlib.Path(d)
+        exe = make_test(d)
+        cache_path = d / "cases.json"
+        assert list_with_cache(exe, cache_path) == ["case_a", "case_b"]
+        assert list_with_cache(exe, cache_path) == ["case_a", "case_b"]
+        assert listing_runs(exe) == 1
+
+
+def test_changed_executable_invalidates_cache():
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        d = pathlib.Path(d)
+        exe = make_test(d)
+        cache_path = d / "cases.json"
+        list_with_cache(exe, cache_path)
+        st = exe.stat()
+        os.utime(exe, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        assert list_with_cache(exe, cache_path) == ["case_a", "case_b"]
+        assert listing_runs(exe) == 2
+        # Same modification time, different size
+        st = exe.stat()
+        with exe.open("a") as f:
+            f.write("\n")
+        os.utime(exe, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert list_with_cache(exe, cache_path) == ["case_a", "case_b"]
+        assert listing_runs(exe) == 3
+        assert list_with_cache(exe, cache_path) == ["case_a", "case_b"]
+        assert listing_runs(exe) == 3
+
+
+def test_corrupt_cache_is_ignored(caplog):
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        d = pathlib.Path(d)
+        exe = make_test(d)
+        cache_path = d / "cases.json"
+        list_with_cache(exe, cache_path)
+        cache_path.write_text(cache_path.read_text()[:-5])
+        assert list_with_cache(exe, cache_path) == ["case_a", "case_b"]
+        assert listing_runs(exe) == 2
+        assert "Ignoring unreadable Boost test case cache" in caplog.text
+        # The rewritten cache is used again
+        assert list_with_cache(exe, cache_path) == ["case_a", "case_b"]
+        assert listing_runs(exe) == 2
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+import pathlib
+import tempfile
+from types import SimpleNamespace
+from test.pylib import coverage_stream, coverage_utils
+from test.pylib.coverage_stream import IncrementalCoverage, RUNNING_TRACE, run_profile_dir, suite_coverage_dir
+
+
+class FakeTools:
+    """coverage_utils tools working on text "profiles" with a line per profiled run"""
+    def __init__(self, monkeypatch, failing: str = None) -> None:
+        self.merged = []
+        self.folds = 0
+        self.failing = failing
+        monkeypatch.setattr(coverage_utils, "merge_profiles", self.merge_profiles)
+        monkeypatch.setattr(coverage_utils, "profdata_to_lcov", self.profdata_to_lcov)
+        monkeypatch.setattr(coverage_utils, "lcov_combine_traces", self.lcov_combine_traces)
+        monkeypatch.setattr(coverage_utils, "get_binary_ids_map", self.get_binary_ids_map)
+
+    @staticmethod
+    def concat(paths) -> str:
+        return "".join(pathlib.Path(p).read_text() for p in paths)
+
+    async def merge_profiles(self, *, profiles, path_for_merged, clear_on_success=False, **kwargs):
+        names = [pathlib.Path(p).name for p in profiles]
+        if self.failing in names:
+            raise RuntimeError("corrupt profile " + self.failing)
+        self.merged.extend(name for name in names if name.endswith(".profraw"))
+        merged = pathlib.Path(path_for_merged) / "id.profdata"
+        merged.write_text(self.concat(profiles))
+        if clear_on_success:
+            for profile in profiles:
+                pathlib.Path(profile).unlink()
+        return coverage_utils.MergeProfilesResult([merged], [], [])
+
+    async def profdata_to_lcov(self, *, profiles, clear_on_success=False, **kwargs):
+        for profile in profiles:
+            profile.with_suffix(".info").write_text(profile.read_text())
+            if clear_on_success:
+                profile.unlink()
+
+    async def lcov_combine_traces(self, *, lcovs, output_binary, **kwargs):
+        self.folds += 1
+        pathlib.Path(output_binary).write_text(self.concat(lcovs))
+
+    async def get_binary_ids_map(self, **kwargs):
+        return {}
+
+
+def make_tests(tmpdir: str, runs: dict) -> list:
+    suite = SimpleNamespace(options=SimpleNamespace(tmpdir=tmpdir), mode="dev", name="suite",
+                            need_coverage=lambda: True)
+    return [SimpleNamespace(suite=suite, shortname=f"{executable}.case{i}", uname=f"{executable}.{i}")
+            for executable, count in runs.items() for i in range(count)]
+
+
+def write_profile(test) -> None:
+    run_dir = run_profile_dir(test)
+    run_dir.mkdir(parents=True)
+    (run_dir / f"{test.uname}.profraw").write_text(test.uname + "\n")
+
+
+def coverage(tests, logger) -> IncrementalCoverage:
+    return IncrementalCoverage(tests, [], [], None, None, keep_raw=False, keep_indexed=False,
+                               keep_lcovs=False, concurrency=2, logger=logger)
+
+
+def covered_runs(tests) -> list:
+    return sorted((suite_coverage_dir(tests[0].suite) / RUNNING_TRACE).read_text().split())
+
+
+def test_incremental_coverage(monkeypatch):
+    monkeypatch.setattr(coverage_stream, "BATCH_RUNS", 2)
+    tools = FakeTools(monkeypatch)
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        tests = make_tests(d, {"a": 5, "b": 1})
+
+        async def run():
+            stream = coverage(tests, logging.getLogger("coverage"))
+            for test in tests:
+                write_profile(test)
+                stream.test_done(test)
+            await stream.drain()
+
+        asyncio.run(run())
+        assert covered_runs(tests) == sorted(test.uname for test in tests)
+        # Every raw profile is merged once, and the suite trace is written once
+        assert sorted(tools.merged) == sorted(f"{test.uname}.profraw" for test in tests)
+        assert tools.folds == 1
+        suite_dir = suite_coverage_dir(tests[0].suite)
+        assert sorted(p.name for p in suite_dir.rglob("*") if p.is_file()) == [RUNNING_TRACE]
+
+
+def test_incremental_coverage_errors(monkeypatch, caplog):
+    tools = FakeTools(monkeypatch, failing="a.0.profraw")
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        tests = make_tests(d, {"a": 1, "b": 2, "c": 2})
+
+        async def run():
+            stream = coverage(tests, logging.getLogger("coverage"))
+            # The last run of c never finishes, e.g. because test.py was stopped
+            for test in tests[:-1]:
+                write_profile(test)
+                stream.test_done(test)
+            await stream.drain()
+
+        asyncio.run(run())
+        # The coverage of a is lost, but not that of the other executables
+        assert covered_runs(tests) == ["b.0", "b.1", "c.0"]
+        assert "corrupt profile a.0.profraw" in caplog.text
+        assert tools.folds == 1
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import pathlib
+import tempfile
+from test.pylib import coverage_utils
+from test.pylib.coverage_utils import BinaryInfoCache
+from test.pylib.lcov_utils import LcovFile
+
+
+def test_binary_info_cache(monkeypatch):
+    lookups = []
+
+    async def get_profiled_binary_ids(path, logger):
+        lookups.append(pathlib.Path(path).name)
+        return ["id-" + pathlib.Path(path).name]
+
+    monkeypatch.setattr(coverage_utils, "get_profiled_binary_ids", get_profiled_binary_ids)
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        d = pathlib.Path(d).resolve()
+        profiles = [d / f"{i}.profraw" for i in range(3)]
+        for profile in profiles:
+            profile.write_bytes(b"profile")
+        cache = BinaryInfoCache(d / "cache.json")
+        assert asyncio.run(cache.profiled_binary_ids(profiles[0])) == ["id-0.profraw"]
+        asyncio.run(cache.add_profile(profiles[1], ["merged"]))
+        asyncio.run(cache.profiled_binary_ids(profiles[2]))
+        cache.save()
+
+        # Profiles are identified by their path, size and modification time, not read
+        cache = BinaryInfoCache(d / "cache.json")
+        assert asyncio.run(cache.profiled_binary_ids(profiles[0])) == ["id-0.profraw"]
+        assert asyncio.run(cache.profiled_binary_ids(profiles[1])) == ["merged"]
+        assert lookups == ["0.profraw", "2.profraw"]
+
+        # The entries of changed and removed files are dropped on save
+        cache.files[str(profiles[2])] = {"size": 7, "mtime_ns": profiles[2].stat().st_mtime_ns, "type": "PROFILE"}
+        profiles[0].write_bytes(b"changed profile")
+        profiles[2].unlink()
+        cache.save()
+        cache = BinaryInfoCache(d / "cache.json")
+        assert list(cache.profiles) == [str(profiles[1])]
+        assert not cache.files
+        assert asyncio.run(cache.profiled_binary_ids(profiles[0])) == ["id-0.profraw"]
+        assert lookups == ["0.profraw", "2.profraw", "0.profraw"]
+
+
+def test_lcov_combine_traces_in_processes():
+    traces = [
+        "TN:\nSF:/src/a.cc\nFN:1,f\nFNDA:1,f\nDA:1,1\nDA:2,0\nend_of_record\n"
+        "TN:\nSF:/src/b.cc\nBRDA:3,0,0,1\nBRDA:3,0,1,-\nDA:3,1\nend_of_record\n",
+        "TN:\nSF:/src/a.cc\nFN:1,f\nFNDA:2,f\nDA:1,2\nDA:2,5\nend_of_record\n",
+        "TN:\nSF:/src/b.cc\nBRDA:3,0,0,0\nBRDA:3,0,1,4\nDA:3,4\nend_of_record\n"
+        "TN:\nSF:/src/c.cc\nDA:7,0\nend_of_record\n",
+    ]
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        d = pathlib.Path(d)
+        lcovs = []
+        for i, trace in enumerate(traces):
+            lcovs.append(d / f"{i}.info")
+            lcovs[-1].write_text(trace)
+
+        def combine(output: pathlib.Path, processes: bool) -> str:
+            # Two files per chunk, so the processes merge through an intermediate dump
+            asyncio.run(coverage_utils.lcov_combine_traces(lcovs=lcovs, output_lcov=output, test_tag="t",
+                                                           files_per_chunk=2, processes=processes))
+            return output.read_text()
+
+        merged = combine(d / "processes.info", processes=True)
+        assert merged == combine(d / "threads.info", processes=False)
+        assert "TN:t\nSF:/src/a.cc\n" in merged and "DA:2,5\n" in merged and "BRDA:3,0,1,4\n" in merged
+        assert "SF:/src/c.cc\n" in merged
+
+        asyncio.run(coverage_utils.lcov_combine_traces(lcovs=lcovs, output_binary=d / "merged.lcovbin",
+                                                       test_tag="t", files_per_chunk=2, processes=True))
+        assert LcovFile.is_dump(d / "merged.lcovbin")
+        assert LcovFile(d / "merged.lcovbin") == LcovFile(d / "threads.info")
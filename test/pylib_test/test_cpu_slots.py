@@ -0,0 +1,82 @@
+import logging
+import os
+import pathlib
+import tempfile
+import pytest
+from test.pylib import cpu_slots
+from test.pylib.cpu_slots import Slot, SlotPool, format_cpu_list, parse_cpu_list
+from test.pylib.scylla_cluster import ScyllaServer
+
+
+def test_parse_and_format_cpu_list():
+    assert parse_cpu_list("0-3,8") == [0, 1, 2, 3, 8]
+    assert parse_cpu_list(" 5 , 1-2,") == [5, 1, 2]
+    assert parse_cpu_list("7") == [7]
+    assert parse_cpu_list("") == []
+    assert format_cpu_list([8, 0, 2, 1, 3]) == "0-3,8"
+    assert format_cpu_list([4, 6]) == "4,6"
+    assert format_cpu_list([]) == ""
+    for cpus in ("0-3,8", "1,3,5-7"):
+        assert format_cpu_list(parse_cpu_list(cpus)) == cpus
+    for malformed in ("a", "1-", "-1", "3-1", "0-2-4", "1;2"):
+        with pytest.raises(ValueError):
+            parse_cpu_list(malformed)
+
+
+def test_slot_pool_taskset_fallback(monkeypatch):
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        cgroup = pathlib.Path(d)
+        monkeypatch.setattr(cpu_slots, "_own_cgroup", lambda: cgroup)
+        # Without a writable cgroup.subtree_control, cgroup v2 is not delegated
+        pool = SlotPool(list(range(5)), 2, 2**30, logging.getLogger("slots"))
+        assert pool.base_cgroup is None
+        assert [slot.cpuset for slot in pool.slots] == ["0-1", "2-3"]
+        first = pool.lease()
+        second = pool.lease()
+        assert {first.slot.index, second.slot.index} == {0, 1}
+        assert first.wrap(["scylla", "--smp", "2"]) == ["taskset", "-c", first.slot.cpuset, "scylla", "--smp", "2"]
+        first.release()
+        first.release()
+        # The least loaded slot is leased
+        assert pool.lease().slot is first.slot
+
+        # Delegated, but without the controllers slots need
+        (cgroup / "cgroup.subtree_control").write_text("")
+        (cgroup / "cgroup.controllers").write_text("memory pids")
+        pool = SlotPool([0, 1], 2, None, logging.getLogger("slots"))
+        assert pool.base_cgroup is None
+        assert pool.lease().wrap(["scylla"]) == ["taskset", "-c", "0-1", "scylla"]
+        assert not (cgroup / "test.py").exists()
+
+
+def make_server(vardir: str, cmdline_options) -> ScyllaServer:
+    return ScyllaServer(exe="scylla", vardir=vardir, logger=logging.getLogger("server"),
+                        cluster_name="test", ip_addr="127.0.0.1", seeds=["127.0.0.1"],
+                        cmdline_options=cmdline_options, config_options={}, property_file={},
+                        append_env={})
+
+
+def options(cmdline) -> dict:
+    """The values of --smp and -m/--memory in a command line"""
+    result = {}
+    for i, name in enumerate(cmdline):
+        name, _, value = name.partition('=')
+        if name in ('--smp', '-m', '--memory'):
+            result[name] = value or cmdline[i + 1]
+    return result
+
+
+def test_slot_cmdline_options():
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        slot = Slot(0, [4, 5, 6], 2**30, None)
+        slot_memory = f'{int(2**30 * ScyllaServer.SLOT_MEMORY_SHARE) // 2**20}M'
+        assert options(make_server(d, [])._slot_cmdline_options(slot)) == {'--smp': '3', '-m': slot_memory}
+        # Without a memory budget, the default -m stays
+        assert options(make_server(d, [])._slot_cmdline_options(Slot(0, [4], None, None))) == \
+            {'--smp': '1', '-m': '1G'}
+        # Options chosen by the suite or the test are kept, in either spelling
+        assert options(make_server(d, ['--smp', '1', '-m', '2G'])._slot_cmdline_options(slot)) == \
+            {'--smp': '1', '-m': '2G'}
+        cmdline = make_server(d, ['-c', '2', '--memory=512M'])._slot_cmdline_options(slot)
+        assert options(cmdline)['--memory'] == '512M' and slot_memory not in cmdline
+        assert options(cmdline)['--smp'] != '3'
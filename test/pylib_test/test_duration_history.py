@@ -0,0 +1,42 @@
+import os
+import pathlib
+import tempfile
+from test.pylib.duration_history import DurationHistory, DEFAULT_DURATION, longest_first, \
+        predict_makespan, ideal_makespan
+
+
+def test_duration_history_roundtrip():
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        path = pathlib.Path(d) / "durations.json"
+        history = DurationHistory(path)
+        assert history.estimate("dev", "boost/a", "boost") == DEFAULT_DURATION
+        history.record("dev", "boost/a", 10)
+        history.record("dev", "boost/a", 20)
+        history.record("dev", "boost/b", 30)
+        history.save()
+
+        history = DurationHistory(path)
+        assert history.get("dev", "boost/a") == 15
+        assert history.get("debug", "boost/a") is None
+        # Unknown tests get the average of their suite
+        assert history.estimate("dev", "boost/c", "boost") == 22.5
+        assert history.estimate("dev", "cql/c", "cql") == DEFAULT_DURATION
+
+
+def test_longest_first_schedule():
+    durations = {"a": 1, "b": 5, "c": 3, "d": 3}
+    order = longest_first(durations.keys(), durations)
+    assert order == ["b", "c", "d", "a"]
+    assert predict_makespan([durations[t] for t in order], 2) == 6
+    # Starting the longest test last is worse
+    assert predict_makespan([1, 3, 3, 5], 2) == 8
+    assert ideal_makespan([1, 3, 3, 5], 2) == 6
+    assert ideal_makespan([1, 10], 4) == 10
+    assert predict_makespan([], 4) == 0
+
+
+def test_longest_first_grouped():
+    durations = {"a1": 1, "a2": 9, "b1": 5, "b2": 7, "c1": 2}
+    order = longest_first(durations.keys(), durations, group=lambda t: t[0])
+    # Suites stay together, the suite with the longest test goes first
+    assert order == ["a2", "a1", "b2", "b1", "c1"]
@@ -0,0 +1,114 @@
+import logging
+import os
+import pathlib
+import tempfile
+from test.pylib.golden_workdir import GoldenWorkdirCache, COMPLETE_MARKER, golden_key, reset_node_identity
+
+HOST_ID = "6f2d6c1e-2b5a-4f43-9c1e-0c6a3f1b7d11"
+CLUSTER_NAME = "test-cluster-1"
+
+
+def make_workdir(workdir: pathlib.Path) -> None:
+    """A stopped server's workdir, with the host id and cluster name
+       in the node-local system tables which keep them"""
+    files = {
+        "data/system/local-7ad54392bcdd35a684174e047860b377/me-1-big-Data.db": HOST_ID + CLUSTER_NAME,
+        "data/system/peers-37f71aca7dc2383ba70672528af04d4f/me-1-big-Data.db": HOST_ID,
+        "data/system/scylla_local-2972ec7ffb2038ddaac1d876f2e3fcbd/me-1-big-Data.db": CLUSTER_NAME,
+        "data/system/raft-3e17774c57f539939625327cb1f4e2c2/me-1-big-Data.db": CLUSTER_NAME,
+        "data/system/compaction_history-b4dbb7b4dc493fb5b3bfce6e434832ca/me-1-big-Data.db": "",
+        "data/system_schema/tables-afddfb9dbc1e30688056eed6c302ba09/me-1-big-Data.db": "schema",
+        "data/system_distributed/view_build_status-5582b59f8e4e35e1b9133acada51eb04/me-1-big-Data.db": HOST_ID,
+        "commitlog/CommitLog-2-1.log": HOST_ID,
+        "conf/scylla.yaml": "cluster_name: " + CLUSTER_NAME,
+    }
+    for name, content in files.items():
+        path = workdir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+
+def contents(workdir: pathlib.Path) -> str:
+    return "".join(p.read_text() for p in workdir.rglob("*") if p.is_file())
+
+
+def test_golden_key():
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        exe = pathlib.Path(d) / "scylla"
+        exe.write_text("build 1")
+        config = {"authenticator": "PasswordAuthenticator", "cluster_name": "a",
+                  "listen_address": "127.0.0.1"}
+        key = golden_key(exe, config, ["--smp", "2"], None)
+        # Per-node options don't matter, so all clusters share the workdir
+        assert golden_key(exe, config | {"cluster_name": "b", "listen_address": "127.0.0.2"},
+                          ["--smp", "2"], None) == key
+        assert golden_key(exe, config | {"authenticator": "AllowAllAuthenticator"},
+                          ["--smp", "2"], None) != key
+        assert golden_key(exe, config, ["--smp", "1"], None) != key
+        assert golden_key(exe, config, ["--smp", "2"], {"dc": "dc1"}) != key
+        # A rebuild of the executable invalidates the workdir
+        exe.write_text("build 22")
+        assert golden_key(exe, config, ["--smp", "2"], None) != key
+
+
+def test_reset_node_identity():
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        workdir = pathlib.Path(d)
+        make_workdir(workdir)
+        reset_node_identity(workdir)
+        remaining = contents(workdir)
+        assert HOST_ID not in remaining
+        assert CLUSTER_NAME not in remaining
+        # Node independent state is kept
+        assert remaining == "schema"
+        assert (workdir / "data/system/compaction_history-b4dbb7b4dc493fb5b3bfce6e434832ca").is_dir()
+        assert not (workdir / "data/system/local-7ad54392bcdd35a684174e047860b377").exists()
+        assert not (workdir / "commitlog").exists()
+        # Resetting an already reset or missing workdir is fine
+        reset_node_identity(workdir)
+        reset_node_identity(workdir / "missing")
+
+
+def test_populate():
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        golden = pathlib.Path(d) / "golden"
+        make_workdir(golden)
+        reset_node_identity(golden)
+        (golden / COMPLETE_MARKER).touch()
+        workdir = pathlib.Path(d) / "server"
+        workdir.mkdir()
+        GoldenWorkdirCache.populate(golden, workdir)
+        assert not (workdir / COMPLETE_MARKER).exists()
+        schema = "data/system_schema/tables-afddfb9dbc1e30688056eed6c302ba09/me-1-big-Data.db"
+        assert (workdir / schema).read_text() == "schema"
+        # The sstables are shared with the golden workdir, not copied
+        assert os.path.samefile(workdir / schema, golden / schema)
+        assert HOST_ID not in contents(workdir)
+
+
+async def test_golden_workdir_cache():
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        cache = GoldenWorkdirCache(pathlib.Path(d) / "golden", logging.getLogger("golden"))
+        builds = 0
+
+        async def build() -> pathlib.Path:
+            nonlocal builds
+            builds += 1
+            workdir = pathlib.Path(d) / "builder"
+            make_workdir(workdir)
+            return workdir
+
+        golden = await cache.get("key", build)
+        assert golden == cache.path("key")
+        assert (golden / COMPLETE_MARKER).exists()
+        assert HOST_ID not in contents(golden) and CLUSTER_NAME not in contents(golden)
+        assert await cache.get("key", build) == golden
+        assert builds == 1
+
+        async def fail() -> pathlib.Path:
+            raise RuntimeError("boot failed")
+
+        # A failed build isn't retried and leaves nothing behind
+        assert await cache.get("other", fail) is None
+        assert await cache.get("other", build) is None
+        assert not cache.path("other").exists()
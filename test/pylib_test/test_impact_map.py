@@ -0,0 +1,51 @@
+import pathlib
+import tempfile
+from test.pylib.impact_map import ImpactMap, line_ranges, ranges_intersect, select_tests
+
+
+def test_line_ranges():
+    ranges = line_ranges([7, 1, 2, 3, 10, 8])
+    assert ranges == [[1, 3], [7, 8], [10, 10]]
+    assert ranges_intersect(ranges, {8})
+    assert not ranges_intersect(ranges, {4, 9, 11})
+    assert ranges_intersect(ranges, None)
+    assert not ranges_intersect([], None)
+
+
+def test_impact_map():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = pathlib.Path(tmpdir) / "map.json"
+        impact_map = ImpactMap(path)
+        assert not impact_map
+        impact_map.tests = {"boost/a_test": {"db/a.cc": [[10, 20]]},
+                            "topology": {"db/b.cc": [[1, 5]]}}
+        impact_map.save()
+
+        impact_map = ImpactMap(path)
+        assert impact_map.impacted({"db/a.cc": {15}}) == {"boost/a_test"}
+        assert impact_map.impacted({"db/a.cc": {21}, "db/b.cc": None}) == {"topology"}
+        assert impact_map.is_known("boost", "a_test.1")
+        assert impact_map.is_known("topology", "test_new")
+        assert not impact_map.is_known("boost", "b_test")
+
+
+def test_select_tests():
+    impact_map = ImpactMap(pathlib.Path("/nonexistent/map.json"))
+    impact_map.tests = {"boost/a_test": {"db/a.cc": [[10, 20]], "test/lib/env.cc": [[1, 9]]},
+                        "topology": {"db/b.cc": [[1, 5]]}}
+    suites = ["boost", "topology"]
+    assert select_tests(impact_map, {"db/a.cc": {15}, "db/b.cc": {8}}, suites) == {"boost/a_test"}
+    assert select_tests(impact_map, {"test/lib/env.cc": {3}}, suites) == {"boost/a_test"}
+    # Tests whose own files changed, including new tests
+    assert select_tests(impact_map, {"test/boost/b_test.cc": None, "db/a.cc": {1},
+                                     "test/topology/test_foo.py": {3}}, suites) == {"boost/b_test", "topology/test_foo"}
+    # Other files of a suite select the whole suite
+    assert select_tests(impact_map, {"test/topology/suite.yaml": {1}}, suites) == {"topology"}
+    assert select_tests(impact_map, {"test/topology/conftest.py": {1}}, suites) == {"topology"}
+    assert select_tests(impact_map, {"test/topology/util.py": {1}}, suites) == {"topology"}
+    # Test infrastructure, and files no test covered, select all tests
+    assert select_tests(impact_map, {"test.py": {1}, "db/a.cc": {15}}, suites) is None
+    assert select_tests(impact_map, {"test/pylib/pool.py": {1}}, suites) is None
+    assert select_tests(impact_map, {"test/conftest.py": {1}}, suites) is None
+    assert select_tests(impact_map, {"db/new.cc": None}, suites) is None
+    assert select_tests(impact_map, {"configure.py": {1}}, suites) is None
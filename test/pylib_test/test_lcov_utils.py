@@ -0,0 +1,250 @@
+import os
+import pathlib
+import tempfile
+from test.pylib.lcov_utils import BranchHits, HitArray, LcovFile
+
+TRACE_A = """\
+TN:
+SF:/src/a.cc
+FN:3,f
+FN:10,g
+FNDA:2,f
+FNDA:0,g
+FNF:2
+FNH:1
+BRDA:4,0,0,1
+BRDA:4,0,1,0
+BRDA:11,0,0,-
+BRDA:11,0,1,-
+BRF:4
+BRH:1
+DA:3,2
+DA:4,2
+DA:5,0
+DA:10,0
+DA:11,0
+LF:5
+LH:2
+end_of_record
+TN:
+SF:/src/b.cc
+FN:1,h
+FNDA:1,h
+FNF:1
+FNH:1
+DA:1,1
+DA:2,1
+LF:2
+LH:2
+end_of_record
+"""
+
+TRACE_B = """\
+TN:
+SF:/src/a.cc
+FN:3,f
+FN:10,g
+FNDA:1,f
+FNDA:3,g
+FNF:2
+FNH:2
+BRDA:4,0,0,0
+BRDA:4,0,1,5
+BRDA:11,0,0,3
+BRDA:11,0,1,0
+BRF:4
+BRH:2
+DA:3,1
+DA:4,5
+DA:5,0
+DA:10,3
+DA:11,3
+LF:5
+LH:4
+end_of_record
+TN:
+SF:/src/c.cc
+DA:7,4
+DA:8,0
+LF:2
+LH:1
+end_of_record
+"""
+
+RECORD_B = """\
+TN:
+SF:/src/b.cc
+FN:1,h
+FNDA:1,h
+FNF:1
+FNH:1
+DA:1,1
+DA:2,1
+LF:2
+LH:2
+end_of_record
+"""
+
+RECORD_C = """\
+TN:
+SF:/src/c.cc
+FNF:0
+FNH:0
+DA:7,4
+DA:8,0
+LF:2
+LH:1
+end_of_record
+"""
+
+# The results of the dict-based LcovRecord, which kept line and branch hits
+# in dicts before HitArray replaced them. & and ^ of whole files are
+# computed record by record, as these used to fail on LcovFile.
+EXPECTED = {
+    "|": """\
+TN:
+SF:/src/a.cc
+FN:3,f
+FN:10,g
+FNDA:3,f
+FNDA:3,g
+FNF:2
+FNH:2
+BRDA:4,0,0,1
+BRDA:4,0,1,5
+BRDA:11,0,0,3
+BRDA:11,0,1,0
+BRF:4
+BRH:3
+DA:3,3
+DA:4,7
+DA:5,0
+DA:10,3
+DA:11,3
+LF:5
+LH:4
+end_of_record
+""" + RECORD_B + RECORD_C,
+    "&": """\
+TN:
+SF:/src/a.cc
+FN:3,f
+FNDA:3,f
+FNF:1
+FNH:1
+BRDA:4,0,0,1
+BRDA:4,0,1,5
+BRF:2
+BRH:2
+DA:3,3
+DA:4,7
+LF:2
+LH:2
+end_of_record
+""",
+    "-": RECORD_B,
+    "^": RECORD_B + """\
+TN:
+SF:/src/a.cc
+FN:10,g
+FNDA:3,g
+FNF:1
+FNH:1
+BRDA:11,0,0,3
+BRDA:11,0,1,-
+BRF:2
+BRH:1
+DA:10,3
+DA:11,3
+LF:2
+LH:2
+end_of_record
+""" + RECORD_C,
+}
+
+
+def load(d: pathlib.Path, name: str, trace: str) -> LcovFile:
+    path = d / name
+    path.write_text(trace)
+    return LcovFile(path)
+
+
+def written(d: pathlib.Path, lcov: LcovFile) -> str:
+    lcov.write(d / "out.info")
+    return (d / "out.info").read_text()
+
+
+def test_hit_arrays():
+    lines = HitArray([(5, 0), (1, 2)])
+    lines.add(3, 1)
+    lines[5] += 4
+    assert dict(lines) == {1: 2, 3: 1, 5: 4}
+    assert lines.covered() == {1, 3, 5}
+    del lines[3]
+    assert list(lines.join(HitArray([(1, 1), (7, 1)]))) == [(1, 2, 1)]
+    branches = BranchHits([((4, 0, 1), None), ((4, 0, 0), 3), ((2, 1, 0), 0)])
+    assert list(branches.items()) == [((2, 1, 0), 0), ((4, 0, 0), 3), ((4, 0, 1), None)]
+    assert branches.hits_per_line() == {2: 0, 4: 3}
+    assert branches.count_hit() == 1
+
+
+def test_operations_match_dict_implementation():
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        d = pathlib.Path(d)
+        for op, expected in EXPECTED.items():
+            a = load(d, "a.info", TRACE_A)
+            b = load(d, "b.info", TRACE_B)
+            if op == "|":
+                result = a | b
+            elif op == "&":
+                result = a & b
+            elif op == "-":
+                result = a - b
+            else:
+                result = a ^ b
+            assert written(d, result) == expected, op
+
+
+def test_parse_and_dump_round_trip():
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        d = pathlib.Path(d)
+        trace = load(d, "a.info", TRACE_A)
+        assert written(d, trace) == TRACE_A
+        trace.dump(d / "a.lcovbin")
+        assert LcovFile.is_dump(d / "a.lcovbin")
+        dumped = LcovFile(d / "a.lcovbin")
+        assert dumped == load(d, "a.info", TRACE_A)
+        assert written(d, dumped) == TRACE_A
+
+
+# A record as lcov tools may write it, which LcovRecord.write() would write differently
+UNSORTED_RECORD = """\
+TN:
+SF:/src/d.cc
+DA:9,1
+DA:2,0
+LF:2
+LH:1
+end_of_record
+"""
+
+
+def test_unparsed_records_are_written_as_loaded():
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        d = pathlib.Path(d)
+        trace = load(d, "a.info", TRACE_A + UNSORTED_RECORD)
+        trace.filter_lines(pathlib.Path("/src/a.cc"), [3, 4])
+        # Only the record of a.cc was parsed
+        assert trace._unparsed == {("", pathlib.Path("/src/b.cc")), ("", pathlib.Path("/src/d.cc"))}
+        text = written(d, trace)
+        assert "DA:5,0\n" not in text
+        assert text.endswith(RECORD_B + UNSORTED_RECORD)
+
+
+def test_filter_files():
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        d = pathlib.Path(d)
+        trace = load(d, "a.info", TRACE_A + UNSORTED_RECORD + RECORD_B.replace("TN:\n", "TN:other\n"))
+        trace.filter_files([pathlib.Path("/src/b.cc"), pathlib.Path("/src/missing.cc")])
+        assert list(trace.records) == [("", pathlib.Path("/src/b.cc")), ("other", pathlib.Path("/src/b.cc"))]
+        assert written(d, trace) == RECORD_B + RECORD_B.replace("TN:\n", "TN:other\n")
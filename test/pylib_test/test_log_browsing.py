@@ -0,0 +1,82 @@
+import asyncio
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from test.pylib.log_browsing import LogTailer, ScyllaLogFile
+
+
+def grep_line_by_line(path, expr, filter_expr=None, from_mark=None):
+    with open(path, errors='surrogateescape') as f:
+        if from_mark:
+            f.seek(from_mark)
+        return [line for line in f
+                if re.search(expr, line) and not (filter_expr and re.search(filter_expr, line))]
+
+
+async def test_grep_and_wait_for():
+    with tempfile.NamedTemporaryFile(mode='w', dir=os.getenv('TMPDIR', '/tmp')) as f:
+        for i in range(10000):
+            f.write(f"INFO [shard {i % 4}] raft_topology - {'start cleanup' if i % 97 == 0 else 'idle'} {i} ž\n")
+        f.flush()
+        log = ScyllaLogFile(ThreadPoolExecutor(), f.name)
+
+        for expr, filter_expr in [("start cleanup", None), (r"^INFO.*shard 1\]", "idle"), (r"9 ž$", None)]:
+            lines = [line for line, _ in await log.grep(expr, filter_expr)]
+            assert lines == grep_line_by_line(f.name, expr, filter_expr)
+
+        mark = await log.mark()
+        f.write("something start cleanup\nincomplete")
+        f.flush()
+        matches = await log.grep("start cleanup", from_mark=mark)
+        assert [line for line, _ in matches] == ["something start cleanup\n"]
+        assert matches[0][1].group(0) == "start cleanup"
+        # Answered from the cache plus the new line
+        assert len(await log.grep("start cleanup")) == len(grep_line_by_line(f.name, "start cleanup"))
+
+        async def complete_line():
+            await asyncio.sleep(0.1)
+            f.write(" line\n")
+            f.flush()
+        task = asyncio.create_task(complete_line())
+        await log.wait_for("incomplete line", from_mark=mark, timeout=10)
+        await task
+        # Already in the log
+        await log.wait_for("shard 3", timeout=10)
+
+
+def test_scan_matches_line_by_line():
+    with tempfile.NamedTemporaryFile(mode='w', dir=os.getenv('TMPDIR', '/tmp')) as f:
+        f.write("first\n\nINFO  x\n  \nlast ž\n")
+        f.flush()
+        tailer = LogTailer(f.name)
+        # Exercise the chunk boundaries too
+        tailer.SCAN_CHUNK_SIZE = 7
+        # Every line is searched on its own, so patterns which depend on the
+        # whole line or match the empty string find the same lines too
+        for expr, flags in [("^$", 0), (".*", 0), ("x?", 0), ("^$", re.MULTILINE), (r"\Alast", 0),
+                            (r"\n\Z", 0), (r"\s+$", 0), (r"(?<!x)$", 0), (r"\B", 0)]:
+            pattern = re.compile(expr, flags)
+            lines = [line for _, line in tailer.grep(pattern, None, 0)]
+            assert lines == grep_line_by_line(f.name, pattern), expr
+
+
+def test_grep_cache_and_rotation():
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        path = os.path.join(d, "scylla.log")
+        with open(path, 'w') as f:
+            f.write("a 1\nb 2\na 3\n")
+        tailer = LogTailer(path)
+        tailer.GREP_CACHE_SIZE = 2
+        for expr in ["a", "b", "a", "3"]:
+            tailer.grep(re.compile(expr), None, 0)
+        # The least recently used searches are dropped, and only offsets are kept
+        assert [key[0] for key in tailer.grep_cache] == ["a", "3"]
+        assert list(tailer.grep_cache[("a", re.compile("a").flags, None, 0)][2]) == [0, 8]
+        assert [line for _, line in tailer.grep(re.compile("a"), None, 0)] == ["a 1\n", "a 3\n"]
+
+        # A rotated log is indexed from scratch
+        os.rename(path, path + ".1")
+        with open(path, 'w') as f:
+            f.write("a 4\n")
+        assert tailer.grep(re.compile("a"), None, 0) == [(0, "a 4\n")]
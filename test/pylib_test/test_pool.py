@@ -0,0 +1,88 @@
+import asyncio
+from test.pylib.pool import Pool, PoolBudget
+
+
+async def test_pool_prefetch():
+    built = 0
+    destroyed = []
+
+    async def build(name: str) -> int:
+        nonlocal built
+        built += 1
+        obj = built
+        await asyncio.sleep(0.01)
+        return obj
+
+    async def destroy(obj: int) -> None:
+        await asyncio.sleep(0.01)
+        destroyed.append(obj)
+
+    budget = PoolBudget(2)
+    pool = Pool(4, build, destroy, prefetch=2, prefetch_args=("prefetch",), budget=budget)
+    first = await pool.get("test")
+    # The first get() starts prefetching, the following ones find ready objects
+    await asyncio.sleep(0.05)
+    assert len(pool.pool) == 2
+    assert budget.used == 2
+    second = await pool.get("test")
+    assert budget.used <= 2
+    assert pool.stats.hits == 1 and pool.stats.misses == 1
+
+    # A dirty object is destroyed in the background and replaced
+    # by a prefetched one.
+    third = await pool.replace_dirty(first, "test")
+    assert third not in (first, second)
+    await pool.put(second, is_dirty=True)
+    await pool.put(third, is_dirty=False)
+    await pool.close()
+    assert sorted(destroyed) == sorted([first, second])
+    assert pool.total <= pool.max_size
+    assert budget.used == len(pool.prefetched)
+
+
+async def test_pool_budget_limits_prefetch():
+    async def build() -> object:
+        return object()
+
+    async def destroy(obj: object) -> None:
+        pass
+
+    budget = PoolBudget(1)
+    pool1 = Pool(4, build, destroy, prefetch=2, budget=budget, prefetch_cost=1)
+    pool2 = Pool(4, build, destroy, prefetch=2, budget=budget, prefetch_cost=1)
+    await pool1.get()
+    await pool2.get()
+    await asyncio.sleep(0.01)
+    assert len(pool1.pool) + len(pool2.pool) == 1
+    await pool1.close()
+    await pool2.close()
+
+
+async def test_pool_close_destroys_prefetched():
+    destroyed = []
+
+    async def build() -> object:
+        await asyncio.sleep(0.01)
+        return object()
+
+    async def destroy(obj: object) -> None:
+        destroyed.append(obj)
+
+    budget = PoolBudget(2)
+    pool = Pool(4, build, destroy, prefetch=2, budget=budget)
+    leased = await pool.get()
+    await asyncio.sleep(0.05)
+    prefetched = list(pool.prefetched)
+    assert len(prefetched) == 2
+    await pool.put(leased, is_dirty=False)
+    await pool.close()
+    # Only the prefetched objects nobody got are destroyed
+    assert destroyed == prefetched
+    assert pool.pool == [leased]
+    assert pool.total == 1
+    assert budget.used == 0
+    # Closing twice is fine, and a closed pool doesn't prefetch any more
+    await pool.close()
+    assert await pool.get() is leased
+    await asyncio.sleep(0.05)
+    assert not pool.pool and not pool.prefetched
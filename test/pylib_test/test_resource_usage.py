@@ -0,0 +1,27 @@
+import os
+import pathlib
+import tempfile
+from test.pylib.resource_usage import MemoryHistory, ResourceUsage, estimate_test_memory, process_peak_rss
+
+
+def test_peak_memory_history():
+    with tempfile.TemporaryDirectory(dir=os.getenv('TMPDIR', '/tmp')) as d:
+        path = pathlib.Path(d) / "peak_memory.json"
+        usage = ResourceUsage(user_time=1, sys_time=1, max_rss=100_000_000, read_bytes=0, write_bytes=0,
+                              servers_max_rss=900_000_000)
+        # The Scylla servers used by a test count towards its memory
+        assert usage.peak_memory == 1_000_000_000
+        history = MemoryHistory(path)
+        history.record("dev", "topology/test_a", usage.peak_memory)
+        history.record("debug", "topology/test_a", 3e9)
+        history.save()
+
+        history = MemoryHistory(path)
+        assert history.peaks(["dev"]) == [1e9]
+        assert sorted(history.peaks([])) == [1e9, 3e9]
+        assert estimate_test_memory(history.peaks(["release"])) is None
+
+
+def test_process_peak_rss():
+    assert process_peak_rss(os.getpid()) > 0
+    assert process_peak_rss(-1) == 0
@@ -0,0 +1,24 @@
+import pathlib
+import tempfile
+import xml.etree.ElementTree as ET
+from test.pylib.xml_report import StreamingXmlReport
+
+
+def test_streaming_xml_report():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = pathlib.Path(tmpdir) / "report.xml"
+        report = StreamingXmlReport(path, "testsuite", name="tests")
+        assert ET.parse(path).getroot().attrib == {"name": "tests"}
+
+        for i in range(3):
+            report.append(ET.Element("testcase", name=f"case{i}"), key=i % 2)
+            report.set_attrib(tests=str(i + 1))
+            # Valid after every change
+            root = ET.parse(path).getroot()
+            assert root.attrib == {"name": "tests", "tests": str(i + 1)}
+
+        report.append(ET.Element("testcase", name="ž"))
+        report.close()
+        root = ET.parse(path).getroot()
+        # case0 was replaced by case2, which has the same key
+        assert [e.attrib["name"] for e in root] == ["case1", "case2", "ž"]
@@ -42,9 +42,19 @@ def test_keyspaces(gdb):
 def test_active_sstables(gdb):
     scylla(gdb, 'active-sstables')
 
+def test_heap_index(gdb):
+    scylla(gdb, 'heap-index --types 10')
+
 def test_sstables(gdb):
     scylla(gdb, 'sstables')
 
+def test_all_shards(gdb):
+    scylla(gdb, 'all-shards')
+
+def test_digest(gdb, request):
+    tmpdir = request.config.getoption('scylla_tmp_dir')
+    scylla(gdb, f'digest -o {tmpdir}/core.digest')
+
 def test_memtables(gdb):
     scylla(gdb, 'memtables')
 
@@ -57,6 +67,10 @@ def test_gms(gdb):
 def test_heapprof(gdb):
     scylla(gdb, 'heapprof')
 
+def test_heapprof_export(gdb, request):
+    tmpdir = request.config.getoption('scylla_tmp_dir')
+    scylla(gdb, f'heapprof --folded {tmpdir}/heapprof.folded --pprof {tmpdir}/heapprof.pb.gz')
+
 def test_io_queues(gdb):
     scylla(gdb, 'io-queues')
 
@@ -137,6 +151,18 @@ def test_find(gdb, schema):
 def test_ptr(gdb, schema):
     scylla(gdb, f'ptr {schema}')
 
+def test_find_value_range(gdb, schema):
+    scylla(gdb, f'find --value-range 64 -a {schema}')
+
+# resolve() looks symbols up in the ELF symbol table, check that it agrees
+# with gdb on some vtable pointers.
+def test_resolve(gdb, scylla_gdb):
+    vptrs = list(scylla_gdb.heap_index.get().vtable_counts())[:100]
+    for vptr in vptrs:
+        infosym = gdb.execute(f'info symbol {vptr:#x}', False, True)
+        expected = None if infosym.startswith('No symbol') else infosym[:infosym.find('in section')]
+        assert scylla_gdb.resolve(vptr, cache=False) == expected
+
 def test_generate_object_graph(gdb, schema, request):
     tmpdir = request.config.getoption('scylla_tmp_dir')
     scylla(gdb, f'generate-object-graph -o {tmpdir}/og.dot -d 2 -t 10 {schema}')
@@ -0,0 +1,182 @@
+import fnmatch
+
+# The node a series was scraped from, as a label which can be grouped by
+NODE_LABEL = 'node'
+
+
+def histogramQuantile(q, buckets):
+    """The q quantile of a histogram, from (upper bound, cumulative count)
+    buckets sorted by bound, interpolating linearly inside the bucket like
+    Prometheus' histogram_quantile()"""
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    rank = q * buckets[-1][1]
+    lowerBound = 0.0
+    lowerCount = 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float('inf'):
+                return lowerBound
+            if count == lowerCount:
+                return bound
+            return lowerBound + (bound - lowerBound) * (rank - lowerCount) / (count - lowerCount)
+        lowerBound = bound
+        lowerCount = count
+    return lowerBound
+
+
+def _cumulative(bucketRates):
+    buckets = []
+    running = 0.0
+    for bound in sorted(bucketRates):
+        # Buckets of members which weren't seen in both scrapes can break monotonicity
+        running = max(running, bucketRates[bound])
+        buckets.append((bound, running))
+    return buckets
+
+
+class _Member(object):
+    def __init__(self, label):
+        self.label = label
+        self.value = None
+        self.buckets = {}
+
+
+class Group(object):
+    """Series of one metric with equal grouped-by labels. Values are rates
+    per second for counters and current values otherwise. Histograms are
+    grouped by their buckets, and summarized by quantiles."""
+
+    def __init__(self, label, kind):
+        self.label = label
+        self.kind = kind
+        self._members = {}
+
+    def _member(self, label):
+        member = self._members.get(label)
+        if member is None:
+            member = _Member(label)
+            self._members[label] = member
+        return member
+
+    def add(self, memberLabel, value):
+        self._member(memberLabel).value = value
+
+    def addBucket(self, memberLabel, bound, rate):
+        self._member(memberLabel).buckets[bound] = rate
+
+    @property
+    def size(self):
+        return len(self._members)
+
+    @property
+    def isHistogram(self):
+        return self.kind == 'histogram'
+
+    def values(self):
+        return [m.value for m in self._members.values() if m.value is not None]
+
+    def total(self):
+        return sum(self.values())
+
+    def mean(self):
+        values = self.values()
+        if not values:
+            return None
+        return sum(values) / len(values)
+
+    def hottest(self):
+        """The member with the highest value, or the highest p99 of a histogram"""
+        if self.isHistogram:
+            candidates = [(histogramQuantile(0.99, _cumulative(m.buckets)), m) for m in self._members.values()]
+        else:
+            candidates = [(m.value, m) for m in self._members.values()]
+        candidates = [(value, m) for value, m in candidates if value is not None]
+        if not candidates:
+            return None, None
+        value, member = max(candidates, key=lambda candidate: candidate[0])
+        return value, member.label
+
+    def merged(self):
+        bucketRates = {}
+        for member in self._members.values():
+            for bound, rate in member.buckets.items():
+                bucketRates[bound] = bucketRates.get(bound, 0.0) + rate
+        return _cumulative(bucketRates)
+
+    def quantile(self, q):
+        return histogramQuantile(q, self.merged())
+
+    def rate(self):
+        """Observations per second of a histogram"""
+        merged = self.merged()
+        return merged[-1][1] if merged else None
+
+
+class ClusterStats(object):
+    """Aggregates series across shards and nodes. groupBy are globs of the
+    label names to keep, e.g. 'node' or 'scheduling_group*', all other
+    labels are aggregated over."""
+
+    def __init__(self, table, history, groupBy):
+        self._table = table
+        self._history = history
+        self._groupBy = groupBy
+        # (label set id, node id) -> (grouped-by labels, other labels, bucket bound)
+        self._split = {}
+
+    def _splitLabels(self, series):
+        key = (self._table.labelsOf[series], self._table.nodeOf[series])
+        split = self._split.get(key)
+        if split is None:
+            labels = dict(self._table.labels(series))
+            labels[NODE_LABEL] = self._table.nodes[self._table.nodeOf[series]]
+            bound = labels.pop('le', None)
+            kept = []
+            aggregated = []
+            for name, value in sorted(labels.items()):
+                pair = '{}="{}"'.format(name, value)
+                if any(fnmatch.fnmatch(name, pattern) for pattern in self._groupBy):
+                    kept.append(pair)
+                else:
+                    aggregated.append(pair)
+            split = (','.join(kept), ','.join(aggregated), float(bound) if bound is not None else None)
+            self._split[key] = split
+        return split
+
+    def _kind(self, name):
+        kind = self._table.types.get(name)
+        if kind is not None:
+            return kind
+        # The _sum and _count series of a histogram are declared by the type
+        # of its base name, they are cumulative like counters
+        for suffix in ('_sum', '_count'):
+            if name.endswith(suffix) and self._table.types.get(name[:-len(suffix)]) in ('histogram', 'summary'):
+                return 'counter'
+        return 'untyped'
+
+    def groups(self, seriesIds):
+        table = self._table
+        groups = {}
+        for series in seriesIds:
+            name = table.name(series)
+            kept, member, bound = self._splitLabels(series)
+            if bound is not None and name.endswith('_bucket'):
+                name = name[:-len('_bucket')]
+                kind = 'histogram'
+            else:
+                kind = self._kind(name)
+            label = '{}{{{}}}'.format(name, kept) if kept else name
+            group = groups.get(label)
+            if group is None:
+                group = Group(label, kind)
+                groups[label] = group
+            if kind == 'histogram':
+                rate = self._history.rate(series)
+                if rate is not None:
+                    group.addBucket(member, bound, rate)
+            elif kind == 'counter':
+                group.add(member, self._history.rate(series))
+            else:
+                group.add(member, table.values[series])
+        return sorted(groups.values(), key=lambda group: group.label)
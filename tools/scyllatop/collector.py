@@ -0,0 +1,322 @@
+import asyncio
+import json
+import logging
+import time
+import urllib.parse
+import urllib.request
+import livedata
+import metric
+import parseexception
+import seriestable
+
+_READ_SIZE = 64 * 1024
+
+
+class NodeConnection(object):
+    """A persistent HTTP/1.1 connection to the Prometheus end-point of a node"""
+
+    def __init__(self, url):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise parseexception.ParseException('unsupported prometheus address: {}'.format(url))
+        self._host = parts.hostname
+        self._ssl = parts.scheme == 'https'
+        self._port = parts.port or (443 if self._ssl else 80)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        self._request = ('GET {} HTTP/1.1\r\n'
+                         'Host: {}\r\n'
+                         'Accept-Encoding: identity\r\n'
+                         'Connection: keep-alive\r\n\r\n').format(path, parts.netloc).encode('ascii')
+        self._reader = None
+        self._writer = None
+        self.name = '{}:{}'.format(self._host, self._port)
+
+    def __repr__(self):
+        return self.name
+
+    async def get(self, parser):
+        reused = self._writer is not None
+        try:
+            await self._get(parser)
+        except (OSError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+            # The node may have closed the idle connection, retry on a new one
+            parser.reset()
+            await self._get(parser)
+
+    async def _get(self, parser):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self._host, self._port, ssl=self._ssl or None)
+        reader = self._reader
+        self._writer.write(self._request)
+        await self._writer.drain()
+        status = await reader.readline()
+        if not status:
+            raise ConnectionResetError('{} closed the connection'.format(self.name))
+        version, code = (status.split(None, 2) + [b''])[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.partition(b':')
+            headers[key.strip().lower()] = value.strip().lower()
+        keepAlive = version == b'HTTP/1.1' and headers.get(b'connection') != b'close'
+        if headers.get(b'transfer-encoding') == b'chunked':
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                await self._readBody(parser, size)
+                await reader.readexactly(2)
+        elif b'content-length' in headers:
+            await self._readBody(parser, int(headers[b'content-length']))
+        else:
+            keepAlive = False
+            while True:
+                chunk = await reader.read(_READ_SIZE)
+                if not chunk:
+                    break
+                parser.feed(chunk)
+        if not keepAlive:
+            self.close()
+        if code != b'200':
+            raise parseexception.ParseException('{} responded with: {}'.format(self.name, status.decode('latin-1').strip()))
+        parser.finish()
+
+    async def _readBody(self, parser, size):
+        while size:
+            chunk = await self._reader.read(min(size, _READ_SIZE))
+            if not chunk:
+                raise asyncio.IncompleteReadError(b'', size)
+            parser.feed(chunk)
+            size -= len(chunk)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+
+
+class Collector(object):
+    """Scrapes the Prometheus end-points of one or more nodes concurrently
+    into a SeriesTable. It owns an event loop, which may be run by any
+    single thread."""
+
+    def __init__(self, urls, timeout):
+        self.loop = asyncio.new_event_loop()
+        self.table = seriestable.SeriesTable()
+        self._nodes = [NodeConnection(url) for url in urls]
+        for node in self._nodes:
+            self.table.addNode(node.name)
+        self._timeout = timeout
+        self.generation = 0
+        # When the last scrape started, and when each node was last scraped
+        self.time = 0.0
+        self.times = [0.0] * len(self._nodes)
+        # Set by sources which run out of data
+        self.finished = False
+
+    def __repr__(self):
+        return 'prometheus({})'.format(', '.join(node.name for node in self._nodes))
+
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    async def scrape(self):
+        """Scrape all nodes, return the errors of the nodes which failed"""
+        self.generation += 1
+        self.time = time.time()
+        results = await asyncio.gather(*(self._scrapeNode(nodeId, node) for nodeId, node in enumerate(self._nodes)),
+                                       return_exceptions=True)
+        errors = []
+        for node, result in zip(self._nodes, results):
+            if isinstance(result, Exception):
+                logging.warning('could not scrape {}: {!r}'.format(node, result))
+                errors.append(result)
+        return errors
+
+    async def _scrapeNode(self, nodeId, node):
+        parser = seriestable.ExpositionParser(self.table, nodeId, self.generation)
+        started = time.time()
+        try:
+            await asyncio.wait_for(node.get(parser), self._timeout)
+        except asyncio.TimeoutError:
+            node.close()
+            raise
+        self.times[nodeId] = started
+        logging.debug('scraped {} samples from {}'.format(parser.samples, node))
+
+    @property
+    def nodes(self):
+        return len(self.table.nodes)
+
+    def symbol(self, series):
+        if len(self.table.nodes) == 1:
+            return self.table.key(series)
+        return '{}/{}'.format(self.table.nodes[self.table.nodeOf[series]], self.table.key(series))
+
+    def close(self):
+        for node in self._nodes:
+            node.close()
+
+
+class SeriesMetric(metric.Metric):
+    """A Metric whose value lives in the series table of a Collector"""
+
+    def __init__(self, symbol, table, series):
+        metric.Metric.__init__(self, symbol, None, table.help.get(table.name(series), ''))
+        self._table = table
+        self._series = series
+
+    @property
+    def series(self):
+        return self._series
+
+    @property
+    def status(self):
+        if self._absent:
+            return {self._symbol: 'not available'}
+        return {self._symbol: self._table.values[self._series]}
+
+    def markPresent(self):
+        self._absent = False
+        self._expiration = None
+
+    def update(self):
+        pass
+
+
+class CollectorLiveData(livedata.LiveData):
+    """LiveData fed by a Collector. Only series which appeared since the
+    previous scrape are matched against the metric patterns, and the views
+    are updated at a fixed rate, however long the scrape took."""
+
+    def __init__(self, metricPatterns, interval, collector, ttl=None, history=10):
+        self._collector = collector
+        self.history = seriestable.History(collector.table, history)
+        # Series id -> SeriesMetric, of the series matching the patterns
+        self._metrics = {}
+        self._matched = 0
+        livedata.LiveData.__init__(self, metricPatterns, interval, collector, ttl)
+
+    def _discoverMetrics(self):
+        errors = self._collector.run(self._collector.scrape())
+        if errors and len(errors) == self._collector.nodes:
+            raise errors[0]
+        if self._collector.finished:
+            raise parseexception.ParseException('no data from {}'.format(self._collector))
+        self.history.record(self._collector.generation, self._collector.times)
+        self._matchNewSeries()
+        return dict((m.symbol, m) for m in self._metrics.values())
+
+    def _matchNewSeries(self):
+        table = self._collector.table
+        for series in range(self._matched, len(table)):
+            symbol = self._collector.symbol(series)
+            if self._matches(symbol, self._metricPatterns):
+                self._metrics[series] = SeriesMetric(symbol, table, series)
+        logging.debug('_matchNewSeries: {} new series, {} matched in total'.format(len(table) - self._matched, len(self._metrics)))
+        self._matched = len(table)
+
+    def _refresh(self):
+        now = self._collector.time
+        expiration = now + self._ttl if self._ttl else None
+        generation = self._collector.generation
+        seen = self._collector.table.generation
+        results = {}
+        num_updated = 0
+        num_absent = 0
+        num_expired = 0
+        for series, metric_obj in self._metrics.items():
+            if seen[series] == generation:
+                metric_obj.markPresent()
+                num_updated += 1
+            elif not metric_obj.is_absent:
+                metric_obj.markAbsent(expiration)
+                num_absent += 1
+            elif metric_obj.expiration and now >= metric_obj.expiration:
+                num_expired += 1
+                continue
+            else:
+                num_absent += 1
+            results[metric_obj.symbol] = metric_obj
+        self._results = results
+        logging.debug('go: updated {} measurements, {} absent, {} expired'.format(num_updated, num_absent, num_expired))
+
+    @property
+    def table(self):
+        return self._collector.table
+
+    @property
+    def time(self):
+        return self._collector.time
+
+    def matchedSeries(self):
+        return list(self._metrics)
+
+    def presentSeries(self):
+        return [m.series for m in self._results.values() if not m.is_absent]
+
+    def go(self, mainLoop):
+        try:
+            self._collector.run(self._go(mainLoop))
+        finally:
+            self._collector.close()
+
+    async def _go(self, mainLoop):
+        loop = asyncio.get_running_loop()
+        nextTick = loop.time()
+        self._refresh()
+        while not self._stop:
+            for view in self._views:
+                logging.debug('go: updating view {}'.format(view))
+                view.update(self)
+            logging.debug('go: drawing screen...')
+            mainLoop.draw_screen()
+            if self._stop:
+                break
+            nextTick += self._interval
+            delay = nextTick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                logging.debug('go: {:.3f} seconds behind schedule'.format(-delay))
+                nextTick = loop.time()
+            await self._collector.scrape()
+            if self._collector.finished:
+                break
+            self.history.record(self._collector.generation, self._collector.times)
+            self._matchNewSeries()
+            self._refresh()
+
+
+def makeLiveData(metricPatterns, interval, metric_source, ttl=None, history=10):
+    if isinstance(metric_source, Collector):
+        return CollectorLiveData(metricPatterns, interval, metric_source, ttl, history)
+    return livedata.LiveData(metricPatterns, interval, metric_source, ttl)
+
+
+def clusterAddresses(url, apiPort):
+    """The prometheus end-points of all live nodes of the cluster of the
+    node at url, as listed by the REST API of that node"""
+    parts = urllib.parse.urlsplit(url)
+    api = 'http://{}:{}/gossiper/endpoint/live/'.format(_hostForUrl(parts.hostname), apiPort)
+    logging.info('discovering the nodes of the cluster: {}'.format(api))
+    live = json.loads(urllib.request.urlopen(api).read().decode('utf-8'))
+    netloc = '{}:{}'.format('{}', parts.port) if parts.port else '{}'
+    return [urllib.parse.urlunsplit(parts._replace(netloc=netloc.format(_hostForUrl(address))))
+            for address in sorted(live)]
+
+
+def _hostForUrl(address):
+    if ':' in address:
+        return '[{}]'.format(address)
+    return address
@@ -1,4 +1,5 @@
-import livedata
+import collector
+import recording
 import views.stdout
 import logging
 
@@ -18,10 +19,23 @@ class _FakeLoop:
             self._liveData.stop()
 
 
-def dumpToStdout(metricPatterns, interval, collectd, iterations, ttl=None):
-    stdout = views.stdout.Stdout()
-    liveData = livedata.LiveData(metricPatterns, interval, collectd, ttl)
+def dumpToStdout(metricPatterns, interval, collectd, iterations, ttl=None, timestamps=False):
+    stdout = views.stdout.Stdout(timestamps)
+    liveData = collector.makeLiveData(metricPatterns, interval, collectd, ttl)
     liveData.addView(stdout)
 
     loop = _FakeLoop(liveData, iterations)
     liveData.go(loop)
+
+
+def recordToFile(path, metricPatterns, interval, metric_source, iterations, ttl=None):
+    liveData = collector.makeLiveData(metricPatterns, interval, metric_source, ttl)
+    recorder = recording.Recorder(path, metric_source)
+    liveData.addView(recorder)
+    logging.info('recording {} series to {}'.format(len(liveData.matchedSeries()), path))
+    loop = _FakeLoop(liveData, iterations)
+    try:
+        liveData.go(loop)
+    finally:
+        recorder.close()
+        logging.info('recorded {} frames to {}'.format(recorder.frames, path))
@@ -36,6 +36,10 @@ class LiveData(object):
     def measurements(self):
         return self._results.values()
 
+    @property
+    def time(self):
+        return time.time()
+
     def _discoverMetrics(self):
         results = metric.Metric.discover(self._metric_source)
         logging.debug('_discoverMetrics: {} results discovered'.format(len(results)))
@@ -0,0 +1,192 @@
+import array
+import json
+import logging
+import struct
+import zlib
+import collector
+import parseexception
+
+# A recording is this line followed by a zlib stream of records: a kind
+# byte, a payload length and the payload. Definitions records (b'D') name
+# the recorded series, in the order of their columns. Frame records (b'F')
+# hold one scrape: the values and scrape generations of all recorded series
+# so far, each XORed with the previous frame and split into byte planes,
+# so that unchanged values and high bytes compress to almost nothing.
+MAGIC = b'scyllatop recording 1\n'
+_RECORD_HEADER = struct.Struct('<cI')
+_FRAME_HEADER = struct.Struct('<dqI')
+_WORD = 8
+_READ_SIZE = 64 * 1024
+
+
+def _xor(data, previous):
+    if len(previous) < len(data):
+        previous += bytes(len(data) - len(previous))
+    elif len(previous) > len(data):
+        previous = previous[:len(data)]
+    value = int.from_bytes(data, 'little') ^ int.from_bytes(previous, 'little')
+    return value.to_bytes(len(data), 'little')
+
+
+def _shuffle(data):
+    return b''.join(data[i::_WORD] for i in range(_WORD))
+
+
+def _unshuffle(data):
+    result = bytearray(len(data))
+    size = len(data) // _WORD
+    for i in range(_WORD):
+        result[i::_WORD] = data[i * size:(i + 1) * size]
+    return bytes(result)
+
+
+class Recorder(object):
+    """A view which appends every scrape of the matched series of a
+    CollectorLiveData to a recording"""
+
+    def __init__(self, path, metric_source):
+        self._collector = metric_source
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._compressor = zlib.compressobj()
+        self._series = []
+        self._names = set()
+        self._values = b''
+        self._generations = b''
+        self.frames = 0
+
+    def _write(self, kind, payload):
+        self._file.write(self._compressor.compress(_RECORD_HEADER.pack(kind, len(payload)) + payload))
+
+    def _define(self, table, series):
+        definitions = {'series': [[table.nodeOf[s], table.key(s)] for s in series]}
+        if not self._series:
+            definitions['nodes'] = table.nodes
+        names = set(table.name(s) for s in series) - self._names
+        definitions['types'] = dict((name, table.types[name]) for name in names if name in table.types)
+        definitions['help'] = dict((name, table.help[name]) for name in names if name in table.help)
+        self._names.update(names)
+        self._series.extend(series)
+        self._write(b'D', json.dumps(definitions).encode('utf-8'))
+
+    def update(self, liveData):
+        table = liveData.table
+        matched = liveData.matchedSeries()
+        if len(matched) > len(self._series) or not self._series:
+            self._define(table, matched[len(self._series):])
+        values = array.array('d', map(table.values.__getitem__, self._series)).tobytes()
+        generations = array.array('q', map(table.generation.__getitem__, self._series)).tobytes()
+        self._write(b'F', _FRAME_HEADER.pack(self._collector.time, self._collector.generation, len(self._series)) +
+                    array.array('d', self._collector.times).tobytes() +
+                    _shuffle(_xor(values, self._values)) +
+                    _shuffle(_xor(generations, self._generations)))
+        self._values = values
+        self._generations = generations
+        # A recording cut short, e.g. by a crash, is readable up to here
+        self._file.write(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        self._file.flush()
+        self.frames += 1
+        logging.debug('recorded frame {} of {} series'.format(self.frames, len(self._series)))
+
+    def close(self):
+        self._file.write(self._compressor.flush())
+        self._file.close()
+
+
+class Replay(collector.Collector):
+    """Plays a recording back, a frame per scrape, so that it can be shown
+    by the views of a live collector. start and end are offsets in seconds
+    from the first frame."""
+
+    def __init__(self, path, start=None, end=None):
+        collector.Collector.__init__(self, [], timeout=None)
+        self._path = path
+        self._file = open(path, 'rb')
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise parseexception.ParseException('{} is not a scyllatop recording'.format(path))
+        self._decompressor = zlib.decompressobj()
+        self._pending = b''
+        self._start = start
+        self._end = end
+        self._firstTime = None
+        self._values = b''
+        self._generations = b''
+
+    def __repr__(self):
+        return 'recording({})'.format(self._path)
+
+    def _read(self, size):
+        while len(self._pending) < size:
+            compressed = self._file.read(_READ_SIZE)
+            if not compressed:
+                data = self._decompressor.flush()
+                if not data:
+                    return None
+            else:
+                data = self._decompressor.decompress(compressed)
+            self._pending += data
+        data = self._pending[:size]
+        self._pending = self._pending[size:]
+        return data
+
+    def _nextRecord(self):
+        header = self._read(_RECORD_HEADER.size)
+        if header is None:
+            return None, None
+        kind, size = _RECORD_HEADER.unpack(header)
+        payload = self._read(size)
+        if payload is None:
+            logging.warning('{} is truncated'.format(self._path))
+            return None, None
+        return kind, payload
+
+    def _define(self, payload):
+        definitions = json.loads(payload.decode('utf-8'))
+        for node in definitions.get('nodes', []):
+            self.table.addNode(node)
+            self.times.append(0.0)
+        for nodeId, key in definitions['series']:
+            self.table.add(nodeId, key)
+        self.table.types.update(definitions['types'])
+        self.table.help.update(definitions['help'])
+
+    def _frame(self, payload):
+        frameTime, generation, count = _FRAME_HEADER.unpack_from(payload)
+        offset = _FRAME_HEADER.size
+        times = array.array('d')
+        times.frombytes(payload[offset:offset + _WORD * self.nodes])
+        offset += _WORD * self.nodes
+        size = _WORD * count
+        self._values = _xor(_unshuffle(payload[offset:offset + size]), self._values)
+        self._generations = _xor(_unshuffle(payload[offset + size:offset + 2 * size]), self._generations)
+        return frameTime, generation, list(times)
+
+    async def scrape(self):
+        while True:
+            kind, payload = self._nextRecord()
+            if kind is None:
+                self.finished = True
+                return []
+            if kind == b'D':
+                self._define(payload)
+                continue
+            if kind != b'F':
+                raise parseexception.ParseException('unknown record {!r} in {}'.format(kind, self._path))
+            frameTime, generation, times = self._frame(payload)
+            if self._firstTime is None:
+                self._firstTime = frameTime
+            offset = frameTime - self._firstTime
+            if self._start is not None and offset < self._start:
+                continue
+            if self._end is not None and offset > self._end:
+                self.finished = True
+                return []
+            self.table.values = array.array('d', self._values)
+            self.table.generation = array.array(self.table.generation.typecode, self._generations)
+            self.time = frameTime
+            self.times = times
+            self.generation = generation
+            return []
+
+    def close(self):
+        self._file.close()
@@ -8,11 +8,13 @@ import pprint
 import logging
 import collectd
 import prometheus
+import collector
+import recording
 import metric
 import fake
-import livedata
 import views.simple
 import views.aggregate
+import views.cluster
 import userinput
 import dumptostdout
 import urwid
@@ -26,20 +28,22 @@ def shell():
         logging.error('shell mode requires IPython to be installed')
 
 
-def fancyUserInterface(metricPatterns, interval, metric_source, ttl):
+def fancyUserInterface(metricPatterns, interval, metric_source, ttl, groupBy, history):
     aggregateView = views.aggregate.Aggregate()
     simpleView = views.simple.Simple()
+    clusterView = views.cluster.Cluster(groupBy)
     userInput = userinput.UserInput()
     loop = urwid.MainLoop(aggregateView.widget(), unhandled_input=userInput)
     userInput.setLoop(loop)
-    userInput.setMap(M=aggregateView, S=simpleView)
+    userInput.setMap(M=aggregateView, S=simpleView, C=clusterView)
     try:
-        liveData = livedata.LiveData(metricPatterns, interval, metric_source, ttl)
+        liveData = collector.makeLiveData(metricPatterns, interval, metric_source, ttl, history)
     except Exception as inst:
         print("scyllatop failed connecting to Scylla With an error: {error}".format(error=inst))
         sys.exit(1)
     liveData.addView(simpleView)
     liveData.addView(aggregateView)
+    liveData.addView(clusterView)
     liveDataThread = threading.Thread(target=lambda: liveData.go(loop))
     liveDataThread.daemon = True
     liveDataThread.start()
@@ -51,7 +55,8 @@ def fancyUserInterface(metricPatterns, interval, metric_source, ttl):
 
 if __name__ == '__main__':
     description = '\n'.join(['A top-like tool for scylladb collectd/prometheus metrics.',
-                             'Keyboard shortcuts: S - simple view, M - aggregate over multiple cores, Q -quits',
+                             'Keyboard shortcuts: S - simple view, M - aggregate over multiple cores,',
+                             'C - rates and latency percentiles aggregated over shards and nodes, Q -quits',
                              '',
                              'By default it would work with the Prometheus API and does not require configuration.',
                              'For collectd, you need to configure the unix-sock plugin for collectd'
@@ -67,7 +72,16 @@ if __name__ == '__main__':
     parser.add_argument(dest='metricPattern', nargs='*', default=[], help='metrics to query, separated by spaces. You can use shell globs (e.g. *cpu*nice*) here to efficiently specify metrics')
     parser.add_argument('-i', '--interval', help="time resolution in seconds, default: 1", type=float, default=1)
     parser.add_argument('-s', '--socket', default='/var/run/collectd-unixsock', help="unixsock plugin to connect to, default: /var/run/collectd-unixsock")
-    parser.add_argument('-p', '--prometheus-address', default='http://localhost:9180/metrics', help="The prometheus end-point")
+    parser.add_argument('-p', '--prometheus-address', action='append', default=[],
+                        help="The prometheus end-point, default: http://localhost:9180/metrics. Can be given more than once, to watch several nodes")
+    parser.add_argument('-C', '--cluster', action='store_true',
+                        help="Watch all live nodes of the cluster of the prometheus end-point, as listed by its REST API")
+    parser.add_argument('--api-port', type=int, default=10000, help="The port of the REST API of the nodes, default: 10000")
+    parser.add_argument('-g', '--group-by', action='append', default=[],
+                        help="In the cluster view, aggregate over all labels but these, e.g. -g node -g 'scheduling_group*'. "
+                             "Shell globs can be used. The node a series comes from is the 'node' label")
+    parser.add_argument('-H', '--history', type=int, default=10,
+                        help="Number of scrapes to keep for computing rates, default: 10")
     parser.add_argument('--print-config', action='store_true',
                         help="print out a configuration to put in your collectd.conf (you can use -s here to define the socket path)")
     parser.add_argument('-l', '--list', action='store_true',
@@ -80,6 +94,15 @@ if __name__ == '__main__':
     parser.add_argument('-F', '--fake', action='store_true', help="fake metric updates - this is for developers only")
     parser.add_argument('-n', '--iterations', type=int, default=None, help="Exit after a given number of iterations. This is only relevant if output is redirected")
     parser.add_argument('-b', '--batch', action='store_true', help="batch mode - dump metrics to stdout instead of using an interactive user session")
+    parser.add_argument('-r', '--record', metavar='FILE',
+                        help="Record the metrics to FILE every interval, without a user interface, until interrupted or for --iterations")
+    parser.add_argument('-R', '--replay', metavar='FILE',
+                        help="Show the metrics recorded with --record, a recorded interval per interval. "
+                             "With --batch, dump all the recorded intervals to stdout")
+    parser.add_argument('--start', type=float, default=None,
+                        help="With --replay, skip the first START seconds of the recording")
+    parser.add_argument('--end', type=float, default=None,
+                        help="With --replay, stop END seconds after the start of the recording")
     parser.add_argument('-t', '--ttl', type=int, default=60, help="Keep absent metrics for ttl seconds (default=60)")
     arguments = parser.parse_args()
     stream_log = logging.StreamHandler()
@@ -101,12 +124,28 @@ if __name__ == '__main__':
         print(collectd.COLLECTD_EXAMPLE_CONFIGURATION.format(socket=arguments.socket))
         quit()
 
+    if not arguments.prometheus_address:
+        arguments.prometheus_address = ['http://localhost:9180/metrics']
+    if arguments.cluster:
+        try:
+            arguments.prometheus_address = collector.clusterAddresses(arguments.prometheus_address[0], arguments.api_port)
+        except Exception as inst:
+            print("scyllatop failed listing the nodes of the cluster With an error: {error}".format(error=inst))
+            sys.exit(1)
     if arguments.fake:
         fake.fake()
-    if arguments.collectd:
+    if arguments.replay:
+        try:
+            metric_source = recording.Replay(arguments.replay, arguments.start, arguments.end)
+        except Exception as inst:
+            print("scyllatop failed opening recording: '{file}' With an error: {error}".format(file=arguments.replay, error=inst))
+            sys.exit(1)
+    elif arguments.collectd:
         metric_source = collectd.Collectd(arguments.socket)
+    elif arguments.fake or arguments.list or arguments.shell:
+        metric_source = prometheus.Prometheus(arguments.prometheus_address[0])
     else:
-        metric_source = prometheus.Prometheus(arguments.prometheus_address)
+        metric_source = collector.Collector(arguments.prometheus_address, timeout=max(2 * arguments.interval, 5))
     if arguments.shell:
         shell()
         quit()
@@ -115,10 +154,18 @@ if __name__ == '__main__':
         quit()
 
     logging.debug('arguments={} isatty={}'.format(arguments, sys.stdout.isatty()))
+    if arguments.record and not isinstance(metric_source, collector.Collector):
+        print("scyllatop can only record metrics of prometheus end-points")
+        sys.exit(1)
     try:
-        if not sys.stdout.isatty() or arguments.batch:
+        if arguments.record:
+            dumptostdout.recordToFile(arguments.record, arguments.metricPattern, arguments.interval, metric_source, arguments.iterations, arguments.ttl)
+        elif arguments.replay and (not sys.stdout.isatty() or arguments.batch):
+            dumptostdout.dumpToStdout(arguments.metricPattern, 0, metric_source, arguments.iterations, arguments.ttl, timestamps=True)
+        elif not sys.stdout.isatty() or arguments.batch:
             dumptostdout.dumpToStdout(arguments.metricPattern, arguments.interval, metric_source, arguments.iterations, arguments.ttl)
         else:
-            fancyUserInterface(arguments.metricPattern, arguments.interval, metric_source, arguments.ttl)
+            fancyUserInterface(arguments.metricPattern, arguments.interval, metric_source, arguments.ttl,
+                               arguments.group_by, max(arguments.history, 2))
     except KeyboardInterrupt:
         pass
@@ -0,0 +1,194 @@
+import array
+import collections
+import logging
+import re
+
+
+class SeriesTable(object):
+    """Values of all series scraped from all nodes. A series is a metric
+    name and a label set, both interned, so the per series state is a
+    handful of array entries."""
+    _LABEL_PATTERN = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+    def __init__(self):
+        self.nodes = []
+        self.names = []
+        self.labelSets = []
+        self.help = {}
+        # Metric name -> counter, gauge, histogram...
+        self.types = {}
+        self.nameOf = array.array('l')
+        self.labelsOf = array.array('l')
+        self.nodeOf = array.array('l')
+        self.values = array.array('d')
+        # The scrape in which each series was last seen
+        self.generation = array.array('l')
+        self._nameIds = {}
+        self._labelSetIds = {}
+        self._parsedLabels = {}
+        # Per node: 'name{labels}' -> series id
+        self._index = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def addNode(self, node):
+        self.nodes.append(node)
+        self._index.append({})
+        return len(self.nodes) - 1
+
+    def index(self, nodeId):
+        return self._index[nodeId]
+
+    def add(self, nodeId, key):
+        name, _, labels = key.partition('{')
+        labels = labels.rstrip('}')
+        series = len(self.values)
+        self.nameOf.append(self._intern(name, self.names, self._nameIds))
+        self.labelsOf.append(self._intern(labels, self.labelSets, self._labelSetIds))
+        self.nodeOf.append(nodeId)
+        self.values.append(float('nan'))
+        self.generation.append(0)
+        self._index[nodeId][key] = series
+        return series
+
+    def _intern(self, value, values, ids):
+        valueId = ids.get(value)
+        if valueId is None:
+            valueId = len(values)
+            values.append(value)
+            ids[value] = valueId
+        return valueId
+
+    def name(self, series):
+        return self.names[self.nameOf[series]]
+
+    def key(self, series):
+        labels = self.labelSets[self.labelsOf[series]]
+        if labels:
+            return '{}{{{}}}'.format(self.name(series), labels)
+        return self.name(series)
+
+    def labels(self, series):
+        labelSetId = self.labelsOf[series]
+        parsed = self._parsedLabels.get(labelSetId)
+        if parsed is None:
+            parsed = dict(self._LABEL_PATTERN.findall(self.labelSets[labelSetId]))
+            self._parsedLabels[labelSetId] = parsed
+        return parsed
+
+
+class ExpositionParser(object):
+    """Parses the Prometheus text exposition format of one node into a
+    SeriesTable, chunk by chunk, as the response arrives. Series seen in
+    previous scrapes are looked up by the text before their value, so a
+    sample line costs a dictionary lookup and a float()."""
+
+    def __init__(self, table, nodeId, generation):
+        self._table = table
+        self._nodeId = nodeId
+        self._generation = generation
+        self._pending = b''
+        self.samples = 0
+
+    def reset(self):
+        self._pending = b''
+
+    def feed(self, chunk):
+        data = self._pending + chunk
+        end = data.rfind(b'\n') + 1
+        self._pending = data[end:]
+        if end:
+            self._parse(data[:end].decode('utf-8', 'replace').split('\n'))
+
+    def finish(self):
+        if self._pending:
+            self._parse([self._pending.decode('utf-8', 'replace')])
+            self._pending = b''
+
+    def _parse(self, lines):
+        table = self._table
+        index = table.index(self._nodeId)
+        values = table.values
+        seen = table.generation
+        generation = self._generation
+        samples = 0
+        for line in lines:
+            if not line:
+                continue
+            if line[0] == '#':
+                if line.startswith('# HELP '):
+                    name, _, hlp = line[7:].partition(' ')
+                    if name not in table.help:
+                        table.help[name] = ' ' + hlp
+                elif line.startswith('# TYPE '):
+                    name, _, kind = line[7:].partition(' ')
+                    if name not in table.types:
+                        table.types[name] = kind.strip()
+                continue
+            key, _, value = line.rpartition(' ')
+            series = index.get(key)
+            if series is None:
+                if key.rfind(' ') > key.rfind('}'):
+                    # The sample has a timestamp
+                    key, _, value = key.rpartition(' ')
+                if not key:
+                    continue
+                series = index.get(key)
+                if series is None:
+                    series = table.add(self._nodeId, key)
+            try:
+                values[series] = float(value)
+            except ValueError:
+                logging.debug('could not parse sample: {}'.format(line))
+                continue
+            seen[series] = generation
+            samples += 1
+        self.samples += samples
+
+
+class _Snapshot(object):
+    def __init__(self, table, generation, times):
+        self.generation = generation
+        self.times = list(times)
+        self.values = array.array('d', table.values)
+        self.seen = array.array('l', table.generation)
+
+    def has(self, series):
+        return series < len(self.seen) and self.seen[series] == self.generation
+
+
+class History(object):
+    """A ring buffer of the last depth scrapes of a SeriesTable, in column
+    layout: a snapshot of all values per scrape"""
+
+    def __init__(self, table, depth):
+        assert depth >= 2
+        self._table = table
+        self._snapshots = collections.deque(maxlen=depth)
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def record(self, generation, times):
+        """Remember the values of the scrape, times are the scrape times by node"""
+        self._snapshots.append(_Snapshot(self._table, generation, times))
+
+    def rate(self, series, span=1):
+        """Increase of a counter per second over the last span scrapes,
+        None if the series wasn't seen in both"""
+        if len(self._snapshots) < 2:
+            return None
+        newest = self._snapshots[-1]
+        oldest = self._snapshots[-1 - min(span, len(self._snapshots) - 1)]
+        if not newest.has(series) or not oldest.has(series):
+            return None
+        node = self._table.nodeOf[series]
+        elapsed = newest.times[node] - oldest.times[node]
+        if elapsed <= 0:
+            return None
+        increase = newest.values[series] - oldest.values[series]
+        if increase < 0:
+            # The counter was reset, e.g. by a restart of the node
+            increase = newest.values[series]
+        return increase / elapsed
@@ -7,7 +7,7 @@ from . import helpers
 class Aggregate(base.Base):
     def update(self, liveData):
         self.clearScreen()
-        self.writeStatusLine(liveData.measurements)
+        self.writeStatusLine(liveData.measurements, liveData.time)
         metricGroups = groups.Groups(liveData.measurements)
         visible = metricGroups.all()
         tableForm = self._prepareTable(visible)
@@ -11,8 +11,8 @@ class Base(object):
     def widget(self):
         return self._box
 
-    def writeStatusLine(self, measurements):
-        line = '*** time: {0}| {1} measurements ***'.format(time.asctime(), len(measurements))
+    def writeStatusLine(self, measurements, when=None):
+        line = '*** time: {0}| {1} measurements ***'.format(time.asctime(time.localtime(when)), len(measurements))
         self._items = [line]
 
     def refresh(self):
@@ -0,0 +1,47 @@
+from . import base
+from . import helpers
+from . import table
+import clusterstats
+
+
+class Cluster(base.Base):
+    def __init__(self, groupBy):
+        base.Base.__init__(self)
+        self._groupBy = groupBy
+        self._stats = None
+
+    def update(self, liveData):
+        self.clearScreen()
+        self.writeStatusLine(liveData.measurements, liveData.time)
+        if not hasattr(liveData, 'history'):
+            self.writeLine('the cluster view needs the prometheus end-points of the nodes')
+            self.refresh()
+            return
+        if self._stats is None:
+            self._stats = clusterstats.ClusterStats(liveData.table, liveData.history, self._groupBy)
+        tableForm = self._prepareTable(self._stats.groups(liveData.presentSeries()))
+        for row in tableForm.rows():
+            self.writeLine(row)
+        self.refresh()
+
+    def _prepareTable(self, groups):
+        result = table.Table('lrl')
+        for group in groups:
+            value, member = group.hottest()
+            hottest = 'max[{0} @ {1}]'.format(_format(value), member) if member is not None else ''
+            if group.isHistogram:
+                formatted = 'p50[{0}] p99[{1}] rate[{2}]'.format(
+                    _format(group.quantile(0.5)), _format(group.quantile(0.99)), _format(group.rate()))
+            else:
+                formatted = 'avg[{0}] tot[{1}]'.format(_format(group.mean()), _format(group.total()))
+            result.add(self._label(group), formatted, hottest)
+        return result
+
+    def _label(self, group):
+        return '{label}({size})'.format(label=group.label, size=group.size)
+
+
+def _format(value):
+    if value is None:
+        return 'not available'
+    return helpers.formatValues({'': value})
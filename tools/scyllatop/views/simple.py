@@ -6,7 +6,7 @@ from . import table
 class Simple(base.Base):
     def update(self, liveData):
         self.clearScreen()
-        self.writeStatusLine(liveData.measurements)
+        self.writeStatusLine(liveData.measurements, liveData.time)
         tableForm = self._prepareTable(liveData.measurements)
         for row in tableForm.rows():
             self.writeLine(row)
@@ -1,12 +1,19 @@
 from . import base
 from . import helpers
 import sys
+import time
 import logging
 
 
 class Stdout(base.Base):
+    def __init__(self, timestamps=False):
+        base.Base.__init__(self)
+        self._timestamps = timestamps
+
     def update(self, liveData):
         logging.debug('stdout: {} measurements'.format(len(liveData.measurements)))
+        if self._timestamps:
+            print('*** time: {0} ***'.format(time.asctime(time.localtime(liveData.time))))
         for metric in liveData.measurements:
             print('{} {}'.format(metric.symbol, helpers.formatValues(metric.status)))
         sys.stdout.flush()